@@ -2,9 +2,8 @@ from fastapi import FastAPI, HTTPException, Request, BackgroundTasks, Depends, H
 from contextlib import asynccontextmanager
 import uuid
 import os
-import shutil
 import traceback
-from typing import List, Optional
+from typing import Optional
 from pydantic import BaseModel
 
 IS_WINDOWS = os.name == "nt"
@@ -22,45 +21,44 @@ async def ping():
 
 # --- 2. DEFERRED INITIALIZATION HELPERS ---
 
+_SNAPSHOTS = None
+def get_snapshot_manager():
+    """
+    Boot-time DB restore into /tmp (see services/db_snapshot.py). Restores run in the
+    background; DB dependencies await readiness instead of boot blocking on a full copy.
+    """
+    global _SNAPSHOTS
+    if _SNAPSHOTS is None:
+        from services.db_snapshot import SnapshotManager, get_snapshot_store
+        from database import DB_PATH_APP, DB_PATH_COMPLIANCE
+        _SNAPSHOTS = SnapshotManager(
+            {"main.db": DB_PATH_APP, "compliance_vault.db": DB_PATH_COMPLIANCE},
+            store=get_snapshot_store(),
+            seed_dir=os.path.dirname(os.path.abspath(__file__))
+        )
+    return _SNAPSHOTS
+
 def sync_databases():
-    if not IS_WINDOWS:
-        try:
-            print("--- [BOOT] DATABASE SYNC START ---")
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-            dbs = ["main.db", "compliance_vault.db"]
-            for db in dbs:
-                src = os.path.join(base_dir, db)
-                dest = os.path.join("/tmp", db)
-                if os.path.exists(src):
-                    print(f"[BOOT] Copying {src} -> {dest}")
-                    shutil.copy2(src, dest)
-                else:
-                    if not os.path.exists(dest):
-                        with open(dest, "a") as f: pass
-            print("--- [BOOT] DATABASE SYNC OK ---")
-        except Exception as e:
-            print(f"[BOOT] DB SYNC FAILED: {e}")
-            traceback.print_exc()
+    if IS_WINDOWS: return None
+    try:
+        snapshots = get_snapshot_manager()
+        print(f"--- [BOOT] DATABASE RESTORE STARTED (store: {snapshots.store.describe() if snapshots.store else 'seed only'}) ---")
+        snapshots.start_restore()
+        return snapshots
+    except Exception as e:
+        print(f"[BOOT] DB RESTORE FAILED TO START: {e}")
+        traceback.print_exc()
 
-_ACTIVATION_STATUS = None
 def get_secret(secret_name: str, default: str = None) -> str:
     """
-    Unified helper to fetch secrets from Env or Secret Manager.
+    Unified helper to fetch secrets from Env or Secret Manager (TTL-cached, refreshed in the background).
     """
-    key = os.environ.get(secret_name)
-    if key: return key
-    try:
-        from firebase_functions.params import SecretParam
-        return SecretParam(secret_name).value
-    except:
-        return default
+    from services.secrets_cache import secrets_cache
+    return secrets_cache.get(secret_name, default)
 
 def get_activation_key():
-    global _ACTIVATION_STATUS
-    if _ACTIVATION_STATUS: return _ACTIVATION_STATUS
-    key = get_secret("PROTEAN_API_KEY", "PENDING_GST_APPROVAL")
-    _ACTIVATION_STATUS = key
-    return key
+    # Cached by get_secret; a key issued later is picked up within one TTL
+    return get_secret("PROTEAN_API_KEY", "PENDING_GST_APPROVAL")
 
 @app.middleware("http")
 async def activation_gatekeeper(request: Request, call_next):
@@ -106,8 +104,63 @@ async def terms_of_service():
     """
     return HTMLResponse(content=content)
 
+# --- DB DEPENDENCIES (defined before the routes that use them) ---
+_SCHEMA_READY = None
+_SCHEMA_ERRORS = {} # "main" / "compliance" -> why its schema setup failed
+async def wait_schema_ready(database: str = "main"):
+    # Set by ensure_schema() once the DB restore and migrations are done
+    global _SCHEMA_READY
+    import asyncio
+    if _SCHEMA_READY is None: _SCHEMA_READY = asyncio.Event()
+    await _SCHEMA_READY.wait()
+    if database in _SCHEMA_ERRORS:
+        # Never serve from a half-migrated schema
+        raise HTTPException(status_code=503, detail=f"{database} database unavailable: schema migration failed", headers={"Retry-After": "60"})
+
+async def get_db_async():
+    from database import get_db
+    await wait_schema_ready("main")
+    async for db in get_db(): yield db
+
+async def get_compliance_db_async():
+    from database import get_compliance_db
+    await wait_schema_ready("compliance")
+    async for db in get_compliance_db(): yield db
+
 # --- 2.1 INFRASTRUCTURE APIs (Silent) ---
 
+@app.get("/internal/metrics")
+async def internal_metrics():
+    # Operational counters from background subsystems
+    from services.audit_writer import audit_writer
+    from services.retention_sweeper import retention_sweeper
+    from services.individual_vault import vault_connections
+    from services.secrets_cache import secrets_cache
+    from services.key_rotation import reencryption_job
+    from services.subject_keys import subject_key_cache
+    from services.protean_cache import result_cache
+    from services.circuit_breaker import protean_breakers
+    from services.retry_queue import retry_queue
+    from services.hedging import protean_tail
+    from services.protean_service import protean_quota
+    from services.session_store import session_store
+    from services.keyed_dispatcher import whatsapp_dispatcher
+    return {
+        "audit_writer": audit_writer.stats,
+        "retention": retention_sweeper.metrics(),
+        "vault_connections": vault_connections.metrics(),
+        "secrets": secrets_cache.metrics(),
+        "key_rotation": reencryption_job.metrics(),
+        "subject_keys": subject_key_cache.metrics(),
+        "protean_cache": result_cache.metrics(),
+        "protean_breakers": protean_breakers.metrics(),
+        "protean_retry_queue": retry_queue.metrics(),
+        "protean_latency": protean_tail.metrics(),
+        "protean_quota": protean_quota.metrics(),
+        "whatsapp_sessions": session_store.metrics(),
+        "whatsapp_dispatch": whatsapp_dispatcher.metrics(),
+    }
+
 @app.post("/api/v1/auth/token")
 async def get_access_token():
     # OIDC Connect Stub
@@ -130,10 +183,9 @@ async def pull_document(task_id: str, db = Depends(get_db_async)):
 @app.get("/api/v1/user/details/{mobile}")
 async def get_user_details(mobile: str, db = Depends(get_db_async)):
     # SILENT API: Get verified user details
-    from models import VerifiedReport
+    from models import VerifiedReport, normalize_phone_key
     from sqlalchemy import select
-    clean_phone = mobile[-10:]
-    result = await db.execute(select(VerifiedReport).filter(VerifiedReport.mobile_number.like(f"%{clean_phone}")))
+    result = await db.execute(select(VerifiedReport).filter(VerifiedReport.phone_key == normalize_phone_key(mobile)).limit(1))
     rep = result.scalars().first()
     if not rep: raise HTTPException(status_code=404, detail="User not found")
     return {"name": rep.applicant_name, "id_type": rep.id_type, "verified_at": rep.created_at}
@@ -148,14 +200,6 @@ class LazyProxy:
             self._obj = factory_class()
         return getattr(self._obj, name)
 
-async def get_db_async():
-    from database import get_db
-    async for db in get_db(): yield db
-
-async def get_compliance_db_async():
-    from database import get_compliance_db
-    async for db in get_compliance_db(): yield db
-
 # Lazy Services
 def load_police_verifier(): from verifiers.factory import PoliceVerifier; return PoliceVerifier
 def load_pvc_engine(): from services.pvc_application import PVCApplicationEngine; return PVCApplicationEngine
@@ -176,20 +220,17 @@ finance_engine = LazyProxy(load_finance_engine)
 invoice_generator = LazyProxy(load_invoice_generator)
 
 from fastapi.middleware.cors import CORSMiddleware
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"], expose_headers=["X-Next-Cursor"])
 
 # --- 3. MODELS & SCHEMAS ---
 class VerificationRequest(BaseModel):
     name: str; id: str; mobile_number: str; image_url: str; country: Optional[str] = "IN"
 
-class VerificationResponse(BaseModel):
-    task_id: str; applicant_name: str; status: str; face_verified: Optional[bool]; face_confidence: Optional[str]; failure_reason: Optional[str]; created_at: str
-    class Config: from_attributes = True
-
 class GrievanceRequest(BaseModel): task_id: str; description: str
 class DPOUpdateRequest(BaseModel): name: str; dpo_name: str; dpo_email: str; dpo_phone: str; region: str
 class IncidentRequest(BaseModel): description: str; tenant_name: str
 class ApprovalRequest(BaseModel): action_type: str; payload: dict; requester: str
+class ErasureRequest(BaseModel): mobile_number: str; requester: str
 
 # --- 4. ROUTES ---
 
@@ -207,19 +248,20 @@ async def request_verification(request: VerificationRequest, db = Depends(get_db
     task_id = str(uuid.uuid4())
     vault_token = f"VT-{uuid.uuid4().hex[:12].upper()}"
 
-    # FAT 5.1: Tokenize ID before persistence
+    # FAT 5.1: Tokenize ID before persistence (sealed under the applicant's own data key)
     from services.security_utils import SecurityUtils
-    tokenized_id = SecurityUtils.encrypt_pii(request.id)
+    from services.subject_keys import SubjectKeyService
+    tokenized_id, = await SubjectKeyService.encrypt_many(request.mobile_number, [request.id])
 
     verification = Verification(
         task_id=task_id, tenant_id=tenant_id, mobile_number=request.mobile_number,
-        applicant_name=request.name, applicant_id=tokenized_id, image_url=request.image_url,
+        applicant_name=request.name, applicant_id=tokenized_id, applicant_id_bidx=SecurityUtils.blind_index(request.id, "applicant_id"), image_url=request.image_url,
         vault_token=vault_token, status="PROCESSING"
     )
     db.add(verification)
     await db.commit()
 
-    truth_resp = MockProviderService.verify_id("AADHAAR", request.id)
+    truth_resp = await MockProviderService.verify_id_async("AADHAAR", request.id)
     if truth_resp["status"] == "SUCCESS":
         verification.status = "COMPLETED"
         verification.face_verified = True
@@ -243,11 +285,10 @@ async def request_verification(request: VerificationRequest, db = Depends(get_db
     return {"message": "Verification processing started", "task_id": task_id}
 
 @app.post("/whatsapp/hook")
-async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks, db_compliance = Depends(get_compliance_db_async)):
-    from models import VerifiedReport
-    from sqlalchemy import select
+async def whatsapp_webhook(request: Request):
+    from models import normalize_phone_key
     from services.whatsapp_processor import WhatsAppProcessor
-    from services.interakt import send_interakt_reply, send_support_alert_email
+    from services.keyed_dispatcher import whatsapp_dispatcher
 
     payload = await request.json()
     if payload.get('type') != 'message_received': return {"status": "ignored"}
@@ -256,22 +297,21 @@ async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks,
     user_phone = data.get('customer', {}).get('channel_phone_number', '')
     message_text = data.get('message', {}).get('text', '').strip()
     image_url = data.get('message', {}).get('attachment', {}).get('url') if data.get('message', {}).get('type') == 'Image' else None
-    clean_phone = user_phone[-10:] if user_phone else ""
-
-    # Simple clash check
-    result = await db_compliance.execute(select(VerifiedReport).filter(VerifiedReport.mobile_number.like(f"%{clean_phone}")))
-    if result.scalars().first() and message_text.upper() == "NITI":
-        reply_msg = "Hello, you are already verified! For support, contact +91-9999999999"
-        background_tasks.add_task(send_interakt_reply, user_phone, reply_msg)
-        return {"status": "redirected"}
-
-    background_tasks.add_task(WhatsAppProcessor.process_interaction, user_phone, message_text, image_url)
+    phone_key = normalize_phone_key(user_phone)
+    if not phone_key: return {"status": "ignored"}
+
+    # No await between here and the queue: one phone's messages run one at a time, in the order their
+    # requests reach this line, other phones in parallel. Two requests of one phone still awaiting
+    # request.json() above can swap places; Interakt delivers a user's messages one by one.
+    if not whatsapp_dispatcher.submit(phone_key, WhatsAppProcessor.handle_message, user_phone, message_text, image_url):
+        raise HTTPException(status_code=503, detail="Too many messages in flight", headers={"Retry-After": "5"})
     return {"status": "processing"}
 
 @app.post("/razorpay/webhook")
 async def razorpay_webhook(request: Request, background_tasks: BackgroundTasks, db = Depends(get_db_async)):
-    from services.finance_service import GSTCalculator, InvoiceService
     from models import SalesRegister
+    from sqlalchemy import select
+    from sqlalchemy.exc import IntegrityError
     import json
 
     payload = await request.body()
@@ -286,22 +326,30 @@ async def razorpay_webhook(request: Request, background_tasks: BackgroundTasks,
     order_id = payment.get("order_id", "N/A")
     mobile = payment.get("contact", "")
     email = payment.get("email", "")
+
+    # Razorpay redelivers until it gets a 2xx: acknowledge a payment that is already registered
+    if (await db.execute(select(SalesRegister.id).where(SalesRegister.payment_id == payment_id).limit(1))).first():
+        return {"status": "duplicate"}
     
     # Place of Supply Detection
     customer_state_name = "Telangana" # Default
     clean_phone = mobile[-10:] if mobile else ""
-    from app import USER_SESSIONS
-    session = USER_SESSIONS.get(clean_phone)
+    from services.session_store import session_store
+    session = await session_store.get(clean_phone) if clean_phone else None
     from services.finance_engine import FinanceEngine
     from services.invoice_generator import InvoiceGenerator
 
-    if session and session.get("context", {}).get("ocr_text"):
-        customer_state_name = FinanceEngine.detect_state_from_ocr(session["context"]["ocr_text"])
+    if session and session.context.get("ocr_text"):
+        customer_state_name = FinanceEngine.detect_state_from_ocr(session.context["ocr_text"])
     
     # FAT 5.1: Tokenize PII before persistence
     from services.security_utils import SecurityUtils
-    tokenized_mobile = SecurityUtils.encrypt_pii(mobile)
-    tokenized_name = SecurityUtils.encrypt_pii(email.split("@")[0] if email else "Customer")
+    from services.subject_keys import SubjectKeyService
+    customer_name = email.split("@")[0] if email else "Customer"
+    if mobile:
+        tokenized_mobile, tokenized_name = await SubjectKeyService.encrypt_many(mobile, [mobile, customer_name])
+    else:
+        tokenized_mobile, tokenized_name = SecurityUtils.encrypt_many([mobile, customer_name])
 
     gst_data = FinanceEngine.calculate_tax_breakdown(amount, customer_state_name)
     gst_data.update({
@@ -318,7 +366,9 @@ async def razorpay_webhook(request: Request, background_tasks: BackgroundTasks,
         order_id=order_id,
         payment_id=payment_id,
         mobile_number=tokenized_mobile,
+        mobile_number_bidx=SecurityUtils.blind_index(mobile, "mobile_number"),
         customer_name=tokenized_name,
+        customer_name_bidx=SecurityUtils.blind_index(customer_name, "customer_name"),
         state_code=gst_data["state_code"],
         place_of_supply=gst_data["state_name"],
         total_amount=str(gst_data["total"]),
@@ -331,7 +381,11 @@ async def razorpay_webhook(request: Request, background_tasks: BackgroundTasks,
         pdf_path=pdf_path
     )
     db.add(register_entry)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError: # The same payment delivered twice at once (payment_id is unique)
+        await db.rollback()
+        return {"status": "duplicate"}
 
     # WhatsApp the Invoice
     from services.whatsapp_processor import WhatsAppProcessor
@@ -339,17 +393,56 @@ async def razorpay_webhook(request: Request, background_tasks: BackgroundTasks,
 
     return {"status": "success", "invoice": pdf_path}
 
-@app.get("/verifications", response_model=List[VerificationResponse])
-async def list_verifications(skip: int = 0, limit: int = 20, db = Depends(get_db_async)):
+VERIFICATION_LIST_COLUMNS = ("task_id", "applicant_name", "status", "face_verified", "face_confidence", "failure_reason", "created_at")
+
+def encode_verification_cursor(created_at, row_id) -> str:
+    import base64
+    # created_at is the stored value itself: the raw string on SQLite, a datetime elsewhere
+    created_raw = created_at if isinstance(created_at, str) else created_at.isoformat()
+    return base64.urlsafe_b64encode(f"{created_raw}|{row_id}".encode()).decode()
+
+def decode_verification_cursor(cursor: str, raw: bool = False):
+    """(created_at, id). raw=True keeps created_at as the stored string (SQLite compares text)."""
+    import base64
+    from datetime import datetime
+    try:
+        created_raw, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        created_at = datetime.fromisoformat(created_raw)
+        return (created_raw if raw else created_at), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/verifications")
+async def list_verifications(limit: int = 20, cursor: Optional[str] = None, tenant_id: int = 1, db = Depends(get_db_async)):
+    """
+    Keyset pagination over (created_at, id), served by ix_verifications_tenant_created_id.
+    The next page cursor is returned in the X-Next-Cursor header so the body stays a plain list.
+    """
     from models import Verification
-    from sqlalchemy import desc, select
-    result = await db.execute(select(Verification).order_by(desc(Verification.created_at)).offset(skip).limit(limit))
-    verifications = result.scalars().all()
-    return [{
-        "task_id": v.task_id, "applicant_name": v.applicant_name, "status": v.status,
-        "face_verified": v.face_verified, "face_confidence": v.face_confidence,
-        "failure_reason": v.failure_reason, "created_at": v.created_at.strftime("%Y-%m-%d %H:%M:%S") if v.created_at else ""
-    } for v in verifications]
+    from sqlalchemy import select, tuple_, type_coerce, String
+    from fastapi.responses import ORJSONResponse
+    limit = max(1, min(limit, 100))
+
+    # SQLite stores created_at as text ('YYYY-MM-DD HH:MM:SS' from func.now(), with microseconds
+    # when written from Python) and compares it as text. The cursor therefore carries the stored
+    # string and is bound as a string; a re-formatted datetime would not equal the boundary row.
+    # type_coerce only changes how values are bound and read, not the SQL, so the index still serves it.
+    text_dates = db.get_bind().dialect.name == "sqlite"
+    created_col = type_coerce(Verification.created_at, String) if text_dates else Verification.created_at
+    stmt = select(Verification.id, *[getattr(Verification, c) for c in VERIFICATION_LIST_COLUMNS], created_col.label("created_raw")).where(Verification.tenant_id == tenant_id)
+    if cursor:
+        after_created, after_id = decode_verification_cursor(cursor, raw=text_dates)
+        # Row-value comparison so the index serves it as a single range seek
+        stmt = stmt.where(tuple_(created_col, Verification.id) < (after_created, after_id))
+    stmt = stmt.order_by(Verification.created_at.desc(), Verification.id.desc()).limit(limit)
+
+    rows = (await db.execute(stmt)).all()
+    # Rows go straight to orjson (datetimes serialized natively as ISO-8601), no response_model re-validation
+    body = [dict(zip(VERIFICATION_LIST_COLUMNS, r[1:-1])) for r in rows]
+    headers = {}
+    if len(rows) == limit and rows[-1].created_at is not None:
+        headers["X-Next-Cursor"] = encode_verification_cursor(rows[-1].created_raw, rows[-1].id)
+    return ORJSONResponse(body, headers=headers)
 
 @app.post("/grievances")
 async def report_grievance(request: GrievanceRequest, db = Depends(get_db_async)):
@@ -374,6 +467,24 @@ async def update_dpo(request: DPOUpdateRequest, db = Depends(get_db_async)):
     await db.commit()
     return {"message": "DPO Updated"}
 
+@app.post("/api/v1/dpdp/erase")
+async def dpdp_erase(request: ErasureRequest, background_tasks: BackgroundTasks):
+    # DPDP right to erasure: destroying the principal's data key makes all their PII unreadable at once
+    from services.subject_keys import SubjectKeyService
+    from services.audit_writer import audit_writer
+    from datetime import datetime, timedelta
+    await wait_schema_ready("compliance")
+    destroyed = await SubjectKeyService.erase(request.mobile_number)
+    await audit_writer.log(
+        "AuditLog",
+        actor_token=request.requester,
+        action="DPDP_ERASURE",
+        resource_id=SubjectKeyService.subject_id(request.mobile_number),
+        retention_until=datetime.utcnow() + timedelta(days=1825)
+    )
+    background_tasks.add_task(SubjectKeyService.purge_subject, request.mobile_number)
+    return {"status": "ERASED", "key_destroyed": destroyed, "purge": "SCHEDULED"}
+
 @app.post("/incidents")
 async def report_incident(request: IncidentRequest, db = Depends(get_db_async)):
     from models import Incident
@@ -403,23 +514,50 @@ async def create_approval(request: ApprovalRequest, db = Depends(get_db_async)):
 
 @app.get("/users/search")
 async def search_users(mobile: str, db = Depends(get_db_async)):
-    from models import VerifiedReport
+    from models import VerifiedReport, normalize_phone_key
     from sqlalchemy import select
-    result = await db.execute(select(VerifiedReport).filter(VerifiedReport.mobile_number.like(f"%{mobile}%")))
+    result = await db.execute(select(VerifiedReport).filter(VerifiedReport.phone_key == normalize_phone_key(mobile)).limit(1))
     user = result.scalars().first()
     if user: return {"status": "found", "applicant_name": user.applicant_name, "verified_at": user.created_at.isoformat() if user.created_at else None, "expiry_date": user.expiry_date.isoformat() if user.expiry_date else None, "registry_id": user.id}
     return {"status": "not_found"}
 
+@app.get("/api/v1/invoices/search")
+async def search_invoices(mobile: str, db = Depends(get_db_async)):
+    # Blind-index lookup: no bulk decryption of sales_register
+    from models import SalesRegister
+    from sqlalchemy import select, desc
+    from services.security_utils import SecurityUtils
+    if not mobile.strip():
+        raise HTTPException(status_code=400, detail="mobile is required")
+    result = await db.execute(
+        select(SalesRegister.order_id, SalesRegister.payment_id, SalesRegister.total_amount, SalesRegister.invoice_type, SalesRegister.pdf_path, SalesRegister.created_at)
+        .where(SecurityUtils.blind_index_filter(SalesRegister, "mobile_number", mobile))
+        .order_by(desc(SalesRegister.created_at))
+    )
+    return [dict(r._mapping) for r in result.all()]
+
+@app.get("/api/v1/dashboard/sales-summary")
+async def sales_summary(start: Optional[str] = None, end: Optional[str] = None, db = Depends(get_db_async)):
+    # SUM / GROUP BY run in SQL over integer paise columns
+    from datetime import datetime
+    from services.finance_engine import ReportingService
+    try:
+        start_dt = datetime.fromisoformat(start) if start else None
+        end_dt = datetime.fromisoformat(end) if end else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start/end must be ISO dates")
+    return await ReportingService.sales_summary(db, start_dt, end_dt)
+
 @app.post("/niti/chat")
-async def niti_chat(request: dict, db = Depends(get_compliance_db_async)):
-    from models import AuditLog
+async def niti_chat(request: dict):
+    from services.audit_writer import audit_writer
     from datetime import datetime, timedelta
+    await wait_schema_ready("compliance") # Its audit entry needs the audit writer
     # Minimal static mock for speed
     query = request.get("query", "").lower()
     resp = {"text": "I can help with DPDP and identity verification.", "action": None}
     if "dpdp" in query: resp["text"] = "DPDP Act mandates explicit consent."; resp["action"] = "SHOW_DPDP_FORM"
-    db.add(AuditLog(actor_id=request.get("user_id", "guest"), action="NITI_QUERY", resource_id="MOCK", retention_until=datetime.utcnow() + timedelta(days=1825)))
-    await db.commit()
+    await audit_writer.log("AuditLog", actor_token=request.get("user_id", "guest"), action="NITI_QUERY", resource_id="MOCK", retention_until=datetime.utcnow() + timedelta(days=1825))
     return resp
 
 @app.post("/tools/smart-parse")
@@ -432,57 +570,171 @@ async def translate_content(request: dict):
     from services.translation_service import TranslationService
     return TranslationService.translate_text(request.get("text", ""), request.get("source_hint", "Auto"), request.get("target_language", "English"))
 
+def b2b_tier(module_id: str):
+    return "B2B_KYC" if module_id in ["vehicle_rc", "mobile_verify", "epfo_search", "forgery_check"] else "B2B_KYB"
+
 @app.post("/api/v1/b2b/verify/{module_id}")
 async def b2b_verify(module_id: str, request: dict, db = Depends(get_db_async)):
     # Determine Tier and Price
-    tier = "B2B_KYC" if module_id in ["vehicle_rc", "mobile_verify", "epfo_search", "forgery_check"] else "B2B_KYB"
-    price = finance_engine.get_price(tier)
+    price = finance_engine.get_price(b2b_tier(module_id))
     
     tenant_id = request.get("tenant_id", 1) # Default to 1 for demo
+    from services.protean_service import B2B_MODULES, run_b2b_module
+    if module_id not in B2B_MODULES:
+        raise HTTPException(status_code=400, detail="Invalid B2B module requested")
     
-    # FAT 5.1: Billing check - Billed to Corporate Wallet
-    success, res = await finance_engine.check_wallet_balance(db, tenant_id, price)
-    if not success:
-        raise HTTPException(status_code=402, detail=res)
+    # FAT 5.1: Billing - funds are held atomically on the Corporate Wallet before the upstream call
+    from services.wallet import WalletService, InsufficientFunds
+    try:
+        hold_id = await WalletService.reserve(db, tenant_id, price, reference=f"B2B_{module_id.upper()}")
+    except InsufficientFunds as e:
+        raise HTTPException(status_code=402, detail=str(e))
     
+    settled = False
     try:
-        if module_id == "vehicle_rc":
-            verification_res = protean_service.verify_vehicle_rc(request.get("id", "KA01AB1234"))
-        elif module_id == "mobile_verify":
-            verification_res = protean_service.verify_mobile_status(request.get("id", "9999999999"))
-        elif module_id == "epfo_search":
-            verification_res = protean_service.search_epfo_establishment(request.get("id", "EST123"))
-        elif module_id == "forgery_check":
-            verification_res = protean_service.run_forgery_scan(request.get("image_url", "https://example.com/id.jpg"))
-        elif module_id == "gstin_check":
-            verification_res = protean_service.verify_gstin(request.get("id", "29AAAAA0000A1Z5"))
-        elif module_id == "pull_doc":
-            verification_res = protean_service.pull_digilocker_doc(request.get("task_id", "TASK_999"))
-        else:
-            raise HTTPException(status_code=400, detail="Invalid B2B module requested")
+        # Pooled async client: concurrent B2B calls no longer block the event loop.
+        # If the grid cell's breaker is open the call is queued instead (status QUEUED)
+        verification_res = await run_b2b_module(module_id, request, queue_on_open=True, tenant_id=tenant_id)
+        if verification_res.get("status") == "THROTTLED":
+            # Over the provider or tenant quota even after queueing: nothing went upstream
+            import math
+            raise HTTPException(status_code=429, detail=verification_res["message"], headers={"Retry-After": str(math.ceil(verification_res["retry_after"]))})
         
-        # Deduct if successful
+        # Capture if successful (released in `finally` otherwise)
         if verification_res.get("status") == "SUCCESS":
-            await finance_engine.deduct_from_wallet(db, tenant_id, price)
+            settled = await WalletService.capture(db, hold_id)
             print(f"[BILLING] B2B Module {module_id} successful. ₹{price} deducted from Wallet.")
+        elif verification_res.get("status") == "QUEUED":
+            # The hold goes with the queued call: captured when its retry succeeds, released
+            # otherwise. A coalesced duplicate whose item already has a hold releases its own
+            from services.retry_queue import retry_queue
+            settled = await retry_queue.attach_hold_async(verification_res["retry_id"], hold_id)
         
-        # Log to Audit for DPDP Compliance
-        from models import AuditLog
+        # Log to Audit for DPDP Compliance (group-committed, durable before we respond)
+        from services.audit_writer import audit_writer
         from datetime import datetime, timedelta
-        async for db_compliance in get_compliance_db_async():
-            db_compliance.add(AuditLog(
-                actor_token="B2B_ADMIN", # Simple token for demo
-                action=f"B2B_VERIFY_{module_id.upper()}",
-                resource_id=request.get("id", "UNKNOWN"),
-                retention_until=datetime.utcnow() + timedelta(days=1825)
-            ))
-            await db_compliance.commit()
+        await audit_writer.log(
+            "AuditLog",
+            actor_token="B2B_ADMIN", # Simple token for demo
+            action=f"B2B_VERIFY_{module_id.upper()}",
+            resource_id=request.get("id", "UNKNOWN"),
+            retention_until=datetime.utcnow() + timedelta(days=1825)
+        )
             
         return verification_res
         
+    except HTTPException:
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"B2B verification error: {str(e)}")
+    finally:
+        if not settled:
+            await WalletService.release(db, hold_id)
+
+@app.get("/api/v1/b2b/retry/{retry_id}")
+async def b2b_retry_status(retry_id: str):
+    """Outcome of a call queued by /api/v1/b2b/verify while its grid cell was down."""
+    import asyncio
+    from services.retry_queue import retry_queue
+    item = await asyncio.to_thread(retry_queue.get, retry_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Unknown retry_id")
+    return item
+
+@app.get("/api/v1/b2b/bundles")
+async def b2b_bundles():
+    from services.kyc_bundle import describe
+    return describe()
+
+@app.post("/api/v1/b2b/bundle/{bundle_name}")
+async def b2b_verify_bundle(bundle_name: str, request: dict, db = Depends(get_db_async)):
+    """
+    Runs a named bundle of checks for one applicant (services/kyc_bundle.py).
+    Body: {"tenant_id": 1, "applicant": {"name": ..., "mobile": ..., ...}}. Billed once, when
+    the bundle COMPLETED; a PARTIAL report is free.
+    """
+    from services.kyc_bundle import KYC_BUNDLES, missing_fields, run_bundle
+    if bundle_name not in KYC_BUNDLES:
+        raise HTTPException(status_code=400, detail="Invalid bundle requested")
+    applicant = request.get("applicant") or {}
+    missing = missing_fields(bundle_name, applicant)
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Applicant is missing: {', '.join(missing)}")
+    tenant_id = request.get("tenant_id", 1)
+    price = finance_engine.get_price(KYC_BUNDLES[bundle_name]["tier"])
+
+    from services.wallet import WalletService, InsufficientFunds
+    try:
+        hold_id = await WalletService.reserve(db, tenant_id, price, reference=f"B2B_BUNDLE_{bundle_name.upper()}")
+    except InsufficientFunds as e:
+        raise HTTPException(status_code=402, detail=str(e))
+
+    settled = False
+    try:
+        report = await run_bundle(bundle_name, applicant, tenant_id=tenant_id)
+        if report["status"] == "COMPLETED":
+            settled = await WalletService.capture(db, hold_id)
+            print(f"[BILLING] B2B Bundle {bundle_name} completed. ₹{price} deducted from Wallet.")
+        report["billed"] = str(price) if settled else "0"
+
+        from services.audit_writer import audit_writer
+        from datetime import datetime, timedelta
+        await audit_writer.log(
+            "AuditLog",
+            actor_token="B2B_ADMIN",
+            action=f"B2B_BUNDLE_{bundle_name.upper()}",
+            resource_id=report["bundle_id"],
+            retention_until=datetime.utcnow() + timedelta(days=1825)
+        )
+        return report
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"B2B bundle error: {str(e)}")
+    finally:
+        if not settled:
+            await WalletService.release(db, hold_id)
+
+@app.post("/api/v1/b2b/verify-batch")
+async def b2b_verify_batch(request: Request, module_id: Optional[str] = None, tenant_id: int = 1, batch_id: Optional[str] = None, db = Depends(get_db_async)):
+    """
+    Bulk B2B verification, streamed as NDJSON (batch header, one line per item, summary).
+    Body: JSON array of items (as /api/v1/b2b/verify, or bare ids) or a multipart CSV upload
+    ("file" field, header row). ?batch_id= resumes an interrupted batch.
+    """
+    from fastapi.responses import StreamingResponse
+    from services.b2b_batch import B2BBatchService, BatchInProgress, MAX_ITEMS, parse_json_items, parse_csv_items
+    from services.wallet import InsufficientFunds
+    try:
+        if batch_id:
+            await B2BBatchService.claim(db, batch_id)
+        else:
+            from services.protean_service import B2B_MODULES
+            if module_id not in B2B_MODULES:
+                raise HTTPException(status_code=400, detail="Invalid B2B module requested")
+            try:
+                if request.headers.get("content-type", "").startswith("multipart/form-data"):
+                    upload = (await request.form()).get("file")
+                    if upload is None:
+                        raise ValueError("Missing CSV 'file' field")
+                    items = parse_csv_items(await upload.read())
+                else:
+                    items = parse_json_items(await request.json())
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if not items:
+                raise HTTPException(status_code=400, detail="Batch is empty")
+            if len(items) > MAX_ITEMS:
+                raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_ITEMS} items")
+            batch_id = await B2BBatchService.create(db, tenant_id, module_id, items, finance_engine.get_price(b2b_tier(module_id)))
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    except BatchInProgress:
+        raise HTTPException(status_code=409, detail="Batch is already running")
+    except InsufficientFunds as e:
+        raise HTTPException(status_code=402, detail=str(e))
+    # The stream uses its own sessions: the request session closes before the body is sent
+    return StreamingResponse(B2BBatchService.stream_ndjson(batch_id), media_type="application/x-ndjson", headers={"X-Batch-Id": batch_id})
 
 @app.post("/api/v1/tenant/topup")
 async def tenant_topup(request: dict, db = Depends(get_db_async)):
@@ -502,13 +754,14 @@ async def tenant_topup(request: dict, db = Depends(get_db_async)):
     if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
     
-    # Update Balance
-    tenant.wallet_balance += amount
-    
     # Generate Advance Receipt Entry
     import uuid
     transaction_id = str(uuid.uuid4())
     
+    # Credit Balance (atomic UPDATE + ledger entry, committed with the sales register row)
+    from services.wallet import WalletService
+    await WalletService.topup(db, tenant_id, str(amount), reference=f"TOPUP-{transaction_id[:8].upper()}", commit=False)
+    
     invoice_path = await invoice_generator.generate_gst_invoice(
         user_name=tenant.name,
         transaction_id=transaction_id,
@@ -518,12 +771,16 @@ async def tenant_topup(request: dict, db = Depends(get_db_async)):
     )
     
     tax_info = finance_engine.calculate_tax_breakdown(amount, "Telangana")
+    from services.security_utils import SecurityUtils
+    topup_mobile = request.get("mobile", "SYSTEM")
     
     sales_entry = SalesRegister(
         order_id=f"TOPUP-{transaction_id[:8].upper()}",
         payment_id=transaction_id,
-        mobile_number=request.get("mobile", "SYSTEM"),
+        mobile_number=topup_mobile,
+        mobile_number_bidx=SecurityUtils.blind_index(topup_mobile, "mobile_number"),
         customer_name=tenant.name,
+        customer_name_bidx=SecurityUtils.blind_index(tenant.name, "customer_name"),
         state_code=tax_info["state_code"],
         place_of_supply=tax_info["state_name"],
         total_amount=str(amount),
@@ -541,17 +798,85 @@ async def tenant_topup(request: dict, db = Depends(get_db_async)):
     db.add(sales_entry)
     await db.commit()
     
-    return {"status": "SUCCESS", "new_balance": tenant.wallet_balance, "invoice": invoice_path}
+    return {"status": "SUCCESS", "new_balance": await WalletService.balance(db, tenant_id), "invoice": invoice_path}
 
 # --- 5. INITIALIZATION RUNNER ---
 @app.on_event("startup")
 async def startup_event():
-    sync_databases()
+    snapshots = sync_databases()
+    # Schema setup waits for the restore in the background; boot itself does not
+    import asyncio
+    asyncio.create_task(ensure_schema(snapshots))
+    if snapshots and snapshots.store:
+        asyncio.create_task(snapshots.run_periodic(float(os.environ.get("SNAPSHOT_INTERVAL_SEC", "300"))))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    import sys
+    import asyncio
+    from services.audit_writer import audit_writer
+    from services.individual_vault import vault_connections
+    from services.keyed_dispatcher import whatsapp_dispatcher
+    # Queued WhatsApp messages finish first: they may still log consents
+    await whatsapp_dispatcher.drain(timeout=float(os.environ.get("WHATSAPP_DISPATCH_DRAIN_SEC", "10")))
+    await audit_writer.stop()
+    await asyncio.to_thread(vault_connections.close_all)
+    if "services.protean_service" in sys.modules:
+        await sys.modules["services.protean_service"].gateway.aclose()
+    if not IS_WINDOWS and _SNAPSHOTS and _SNAPSHOTS.store:
+        await asyncio.to_thread(_SNAPSHOTS.snapshot_all)
+
+async def ensure_schema(snapshots=None):
+    global _SCHEMA_READY
+    import asyncio
+    if _SCHEMA_READY is None: _SCHEMA_READY = asyncio.Event()
+    if snapshots:
+        await snapshots.wait_ready("main.db")
+        await snapshots.wait_ready("compliance_vault.db")
+    # DB requests wait here, including for the whole schema v2 rebuild of main.db: on a large
+    # database run migrate_schema_v2.py before deploying (see its docstring).
+    import models
+    from database import engine_app, engine_compliance, Base, BaseCompliance, add_missing_columns, existing_tables, stamp_new_tables
     try:
-        from database import engine_app, engine_compliance, Base, BaseCompliance
-        async with engine_app.begin() as conn: await conn.run_sync(Base.metadata.create_all)
-        async with engine_compliance.begin() as conn: await conn.run_sync(BaseCompliance.metadata.create_all)
-    except Exception as e: print(f"[BOOT] Migration failed: {e}")
+        async with engine_app.begin() as conn:
+            tables_before = await conn.run_sync(existing_tables)
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(stamp_new_tables, Base.metadata, tables_before, models.SCHEMA_VERSION)
+            await conn.run_sync(add_missing_columns, Base.metadata)
+        from migrate_schema_v2 import migrate_schema_v2
+        await migrate_schema_v2(engine_app)
+    except Exception as e:
+        _SCHEMA_ERRORS["main"] = str(e)
+        print(f"[BOOT] main.db migration failed, its requests get 503: {e}")
+    try:
+        async with engine_compliance.begin() as conn:
+            await conn.run_sync(BaseCompliance.metadata.create_all)
+            await conn.run_sync(add_missing_columns, BaseCompliance.metadata)
+    except Exception as e:
+        _SCHEMA_ERRORS["compliance"] = str(e)
+        print(f"[BOOT] compliance_vault.db migration failed, its requests get 503: {e}")
+    from services.audit_writer import audit_writer
+    if "compliance" not in _SCHEMA_ERRORS:
+        try:
+            # Running before requests are let in: log() refuses entries while the writer is down
+            await audit_writer.start()
+        except Exception as e:
+            _SCHEMA_ERRORS["compliance"] = f"audit writer: {e}"
+            print(f"[BOOT] Audit writer failed to start, compliance requests get 503: {e}")
+    # Wakes the waiting requests either way: they proceed, or get a 503 for a failed database
+    _SCHEMA_READY.set()
+    from services.retention_sweeper import retention_sweeper
+    from services.key_rotation import reencryption_job
+    from services.retry_queue import retry_queue
+    from services.wallet import WalletService
+    # Background jobs only run against databases whose schema is in place
+    if "compliance" not in _SCHEMA_ERRORS:
+        asyncio.create_task(retention_sweeper.run_forever(float(os.environ.get("RETENTION_SWEEP_INTERVAL_SEC", "21600"))))
+    if not _SCHEMA_ERRORS:
+        asyncio.create_task(reencryption_job.run_forever(float(os.environ.get("KEY_ROTATION_INTERVAL_SEC", "86400"))))
+    if "main" not in _SCHEMA_ERRORS:
+        asyncio.create_task(retry_queue.run_forever(float(os.environ.get("PROTEAN_RETRY_INTERVAL_SEC", "5"))))
+        asyncio.create_task(WalletService.run_stale_hold_sweeper(float(os.environ.get("WALLET_HOLD_SWEEP_INTERVAL_SEC", "900"))))
 
 @app.get("/")
 async def root(): return {"message": "ComplianceDesk API is running"}
@@ -0,0 +1,74 @@
+import asyncio
+import os
+from sqlalchemy import select, update, bindparam, or_
+from database import engine_app, Base, add_missing_columns
+from models import SalesRegister, Verification
+from services.security_utils import SecurityUtils
+from services.subject_keys import SubjectKeyService
+
+"""
+Populates the `<field>_bidx` blind-index columns for rows written before they existed.
+Each batch decrypts only its own rows once, then writes the HMACs back in a single
+executemany. Re-runnable: rows that already have every index are skipped.
+"""
+
+BATCH_SIZE = int(os.getenv("BLIND_INDEX_BATCH_SIZE", "2000"))
+
+# model -> encrypted fields that get a blind index
+BLIND_INDEXED_FIELDS = {
+    SalesRegister: ["mobile_number", "customer_name"],
+    Verification: ["applicant_id"],
+}
+
+async def _plain_values(stored_values):
+    plain = await SubjectKeyService.decrypt_many(stored_values)
+    # Top-up rows store tenant name / "SYSTEM" unencrypted; erased principals get no index
+    return [s if p == "[ENCRYPTED]" else None if p == "[ERASED]" else p for s, p in zip(stored_values, plain)]
+
+async def backfill_model(engine, model, fields, batch_size=BATCH_SIZE):
+    table = model.__table__
+    bidx_cols = [table.c[f"{f}_bidx"] for f in fields]
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values({f"{f}_bidx": bindparam(f"new_{f}") for f in fields})
+    )
+    last_id, total = 0, 0
+    while True:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(
+                select(table.c.id, *[table.c[f] for f in fields])
+                .where(table.c.id > last_id, or_(*[c.is_(None) for c in bidx_cols]))
+                .order_by(table.c.id)
+                .limit(batch_size)
+            )).all()
+        if not rows:
+            break
+
+        # Decrypt + HMAC outside the write transaction to keep the lock short
+        params = [{"row_id": r.id} for r in rows]
+        for f in fields:
+            for p, plain in zip(params, await _plain_values([getattr(r, f) for r in rows])):
+                p[f"new_{f}"] = SecurityUtils.blind_index(plain, f)
+
+        async with engine.begin() as conn:
+            await conn.execute(stmt, params)
+        last_id = rows[-1].id
+        total += len(rows)
+        print(f"[BLIND-INDEX] {table.name}: {total} rows indexed (last id {last_id})")
+    return total
+
+async def run_backfill():
+    print("--- [BLIND-INDEX] Backfill START ---")
+    async with engine_app.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns, Base.metadata)
+    for model, fields in BLIND_INDEXED_FIELDS.items():
+        await backfill_model(engine_app, model, fields)
+    await engine_app.dispose()
+    print("--- [BLIND-INDEX] Backfill COMPLETED ---")
+
+if __name__ == "__main__":
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(run_backfill())
@@ -33,3 +33,44 @@ async def get_compliance_db():
     async with SessionLocalCompliance() as session:
         yield session
 
+
+# --- LIGHTWEIGHT SCHEMA EVOLUTION ---
+# create_all() only creates missing tables. New nullable columns and indexes on
+# existing tables are added here so older main.db / compliance_vault.db files keep booting.
+def add_missing_columns(sync_conn, metadata):
+    from sqlalchemy import inspect, text
+    inspector = inspect(sync_conn)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_cols = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_cols:
+                continue
+            if not column.nullable:
+                print(f"[SCHEMA] Skipping NOT NULL column {table.name}.{column.name} (needs a data migration)")
+                continue
+            col_type = column.type.compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+            print(f"[SCHEMA] Added column {table.name}.{column.name}")
+        existing_idx = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_idx:
+                index.create(sync_conn)
+                print(f"[SCHEMA] Created index {index.name}")
+
+def existing_tables(sync_conn):
+    from sqlalchemy import inspect
+    return set(inspect(sync_conn).get_table_names())
+
+def stamp_new_tables(sync_conn, metadata, tables_before: set, version: int):
+    """Records the schema version of tables create_all() just created (so migrations skip them)."""
+    from sqlalchemy import text
+    if "schema_versions" not in metadata.tables:
+        return
+    for table in metadata.sorted_tables:
+        if table.name not in tables_before and table.name != "schema_versions":
+            sync_conn.execute(
+                text("INSERT INTO schema_versions (table_name, version) VALUES (:t, :v)"),
+                {"t": table.name, "v": version}
+            )
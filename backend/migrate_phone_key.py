@@ -0,0 +1,52 @@
+import asyncio
+import os
+from sqlalchemy import select, update, bindparam
+from database import engine_app, Base, add_missing_columns
+from models import Verification, VerifiedReport, normalize_phone_key
+
+"""
+Backfills the normalized `phone_key` column on verifications and verified_reports.
+Safe to re-run: only rows with a NULL phone_key are touched, walked in primary-key
+order so each batch is a short write transaction.
+"""
+
+BATCH_SIZE = int(os.getenv("PHONE_KEY_BATCH_SIZE", "5000"))
+
+async def backfill_phone_key(engine, model, batch_size=BATCH_SIZE):
+    table = model.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values(phone_key=bindparam("new_key"))
+    )
+    last_id, total = 0, 0
+    while True:
+        async with engine.begin() as conn:
+            rows = (await conn.execute(
+                select(table.c.id, table.c.mobile_number)
+                .where(table.c.id > last_id, table.c.phone_key.is_(None))
+                .order_by(table.c.id)
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            await conn.execute(stmt, [{"row_id": r.id, "new_key": normalize_phone_key(r.mobile_number)} for r in rows])
+        last_id = rows[-1].id
+        total += len(rows)
+        print(f"[MIGRATION] {table.name}: {total} rows backfilled (last id {last_id})")
+    return total
+
+async def migrate():
+    print("--- [MIGRATION] phone_key backfill START ---")
+    async with engine_app.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns, Base.metadata)
+    for model in (Verification, VerifiedReport):
+        await backfill_phone_key(engine_app, model)
+    await engine_app.dispose()
+    print("--- [MIGRATION] phone_key backfill OK ---")
+
+if __name__ == "__main__":
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(migrate())
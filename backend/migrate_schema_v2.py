@@ -0,0 +1,125 @@
+import asyncio
+import os
+from sqlalchemy import inspect, insert, select, text, func, MetaData, Table
+from sqlalchemy.types import TypeDecorator
+from database import engine_app, Base, existing_tables, stamp_new_tables
+from models import Tenant, SalesRegister, Verification, SchemaVersion, SCHEMA_VERSION
+
+"""
+SCHEMA V2 MIGRATION (main.db)
+- sales_register money columns: strings "99.00" -> integer paise; tax_type -> small-int code
+- tenants.wallet_balance: integer rupees -> integer paise
+- verifications.status: free text -> small-int code
+
+Tables are rebuilt in place: the v1 table is renamed to <name>__v1, the v2 table is
+created from the models, and rows are streamed across in primary-key batches (the
+models' column types do the conversion on insert). The last batch, the DROP of
+<name>__v1 and the schema_versions stamp commit together. If interrupted, the next
+run resumes from the highest id already copied. Tables stamped at version 2 are skipped.
+
+Before a table is renamed, every distinct value of its converted columns (status, money)
+is run through the v2 column type. A value it cannot convert (e.g. a status missing from
+VERIFICATION_STATUS_CODES) stops the migration with SchemaMigrationError while the table
+is still untouched: fix the data, or the code map, and boot again.
+
+It runs at boot (app.ensure_schema) and every DB request waits for it. On a large main.db
+run `python migrate_schema_v2.py` before deploying so the boot finds nothing to do.
+"""
+
+BATCH_SIZE = int(os.getenv("SCHEMA_V2_BATCH_SIZE", "5000"))
+V2_MODELS = [Tenant, SalesRegister, Verification]
+
+class SchemaMigrationError(Exception):
+    pass
+
+def _index_names(sync_conn, name):
+    """Index names of `name`, or None if the table doesn't exist."""
+    insp = inspect(sync_conn)
+    if not insp.has_table(name):
+        return None
+    return [i["name"] for i in insp.get_indexes(name) if i.get("name")]
+
+async def _stamped_version(conn, table_name):
+    row = (await conn.execute(select(SchemaVersion.version).where(SchemaVersion.table_name == table_name))).first()
+    return row[0] if row else None
+
+def _unconvertible(sync_conn, table, source_name):
+    """{column: [values]} of `source_name` that the v2 column types reject."""
+    source = Table(source_name, MetaData(), autoload_with=sync_conn)
+    bad = {}
+    for column in table.columns:
+        if not isinstance(column.type, TypeDecorator) or column.name not in source.c:
+            continue
+        for (value,) in sync_conn.execute(select(source.c[column.name]).distinct()):
+            try:
+                column.type.process_bind_param(value, sync_conn.dialect)
+            except Exception:
+                bad.setdefault(column.name, []).append(value)
+    return bad
+
+async def migrate_table(engine, model, batch_size=BATCH_SIZE):
+    table = model.__table__
+    legacy = f"{table.name}__v1"
+
+    async with engine.begin() as conn:
+        if (await _stamped_version(conn, table.name) or 0) >= SCHEMA_VERSION:
+            return 0
+        resuming = await conn.run_sync(_index_names, legacy) is not None
+        current_indexes = None if resuming else await conn.run_sync(_index_names, table.name)
+        if not resuming and current_indexes is None:
+            return 0
+        bad = await conn.run_sync(_unconvertible, table, legacy if resuming else table.name)
+        if bad:
+            where = f"copy paused, v1 rows are in {legacy}" if resuming else "table not modified"
+            raise SchemaMigrationError(f"{table.name}: values the v2 schema cannot store {bad} ({where})")
+        if not resuming:
+            # Start: park v1 under a new name (its index names would collide with v2's)
+            await conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {legacy}"))
+            for index_name in current_indexes:
+                await conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+            await conn.run_sync(table.create)
+            print(f"[SCHEMA-V2] {table.name}: rebuilding")
+
+    # Reflect v1 so values come back typed as before (datetimes, rupee strings, status text)
+    async with engine.connect() as conn:
+        legacy_table = await conn.run_sync(lambda sync_conn: Table(legacy, MetaData(), autoload_with=sync_conn))
+        last_id = (await conn.execute(select(func.coalesce(func.max(table.c.id), 0)))).scalar()
+    shared = [c for c in legacy_table.c if c.name in table.c]
+
+    copied = 0
+    while True:
+        async with engine.begin() as conn:
+            rows = (await conn.execute(
+                select(*shared).where(legacy_table.c.id > last_id).order_by(legacy_table.c.id).limit(batch_size)
+            )).mappings().all()
+            if rows:
+                await conn.execute(insert(table), [dict(r) for r in rows])
+                last_id = rows[-1]["id"]
+                copied += len(rows)
+            if len(rows) < batch_size:
+                await conn.execute(text(f"DROP TABLE {legacy}"))
+                await conn.execute(insert(SchemaVersion.__table__), {"table_name": table.name, "version": SCHEMA_VERSION})
+                break
+        print(f"[SCHEMA-V2] {table.name}: {copied} rows converted (last id {last_id})")
+
+    print(f"[SCHEMA-V2] {table.name}: done, {copied} rows converted")
+    return copied
+
+async def migrate_schema_v2(engine):
+    async with engine.begin() as conn:
+        tables_before = await conn.run_sync(existing_tables)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(stamp_new_tables, Base.metadata, tables_before, SCHEMA_VERSION)
+    for model in V2_MODELS:
+        await migrate_table(engine, model)
+
+async def migrate():
+    print("--- [SCHEMA-V2] Migration START ---")
+    await migrate_schema_v2(engine_app)
+    await engine_app.dispose()
+    print("--- [SCHEMA-V2] Migration OK ---")
+
+if __name__ == "__main__":
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(migrate())
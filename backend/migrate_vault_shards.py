@@ -0,0 +1,98 @@
+import os
+import re
+import time
+import sqlite3
+from services.individual_vault import IndividualVaultService, VAULT_DIR, VAULT_SCHEMA, DOCUMENT_COLUMNS
+
+"""
+Folds the legacy per-user vault files (user_vaults/<mobile>.db) into the hash-partitioned
+shard databases. Safe to run while the app is serving traffic:
+- each user moves in one short shard transaction (documents + profile + a row in
+  `migrated_vaults`), and the legacy file is deleted only after that commits;
+- until then the app keeps reading the legacy file as a fallback, and new saves already go
+  to the shard, so the newer profile wins;
+- re-running skips users already recorded in `migrated_vaults` and just removes any legacy
+  file left behind by an interrupted run.
+"""
+
+PAUSE_MS = int(os.getenv("VAULT_MIGRATION_PAUSE_MS", "5"))
+LEGACY_FILE = re.compile(r"^\d+\.db$")
+
+def _open_shard(path, cache):
+    conn = cache.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        for ddl in VAULT_SCHEMA:
+            conn.execute(ddl)
+        conn.commit()
+        cache[path] = conn
+    return conn
+
+def _remove_legacy(path):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def migrate_user(shard, legacy_path, vault_key):
+    """Copies one per-user vault into its shard. Returns the number of documents moved."""
+    if shard.execute("SELECT 1 FROM migrated_vaults WHERE mobile_number = ?", (vault_key,)).fetchone():
+        return 0
+
+    legacy = sqlite3.connect(f"file:{legacy_path}?mode=ro", uri=True)
+    try:
+        tables = {r[0] for r in legacy.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        docs = legacy.execute(f"SELECT {DOCUMENT_COLUMNS} FROM user_documents ORDER BY id").fetchall() if "user_documents" in tables else []
+        profiles = legacy.execute("SELECT applicant_name, last_updated FROM profile").fetchall() if "profile" in tables else []
+    finally:
+        legacy.close()
+
+    with shard:
+        shard.executemany(
+            """
+            INSERT INTO user_documents (mobile_number, doc_type, doc_path, issue_date, expiry_date, integrity_score, verdict, metadata_json, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(vault_key, *doc[1:]) for doc in docs]
+        )
+        for applicant_name, last_updated in profiles:
+            # Keep a profile the app already wrote to the shard if it is newer
+            shard.execute(
+                """
+                INSERT INTO profile (mobile_number, applicant_name, last_updated) VALUES (?, ?, ?)
+                ON CONFLICT(mobile_number) DO UPDATE SET applicant_name = excluded.applicant_name, last_updated = excluded.last_updated
+                WHERE excluded.last_updated > profile.last_updated
+                """,
+                (vault_key, applicant_name, last_updated)
+            )
+        shard.execute("INSERT INTO migrated_vaults (mobile_number, documents) VALUES (?, ?)", (vault_key, len(docs)))
+    return len(docs)
+
+def migrate(vault_dir=VAULT_DIR, pause_ms=PAUSE_MS):
+    print("--- [MIGRATION] vault shards START ---")
+    if not os.path.isdir(vault_dir):
+        print("--- [MIGRATION] no vault directory, nothing to do ---")
+        return 0, 0
+    shards, users, documents = {}, 0, 0
+    try:
+        for name in sorted(os.listdir(vault_dir)):
+            if not LEGACY_FILE.match(name):
+                continue
+            vault_key = name[:-3]
+            shard_path = os.path.join(vault_dir, f"shard_{IndividualVaultService._shard_for(vault_key):02d}.db")
+            legacy_path = os.path.join(vault_dir, name)
+            documents += migrate_user(_open_shard(shard_path, shards), legacy_path, vault_key)
+            _remove_legacy(legacy_path)
+            users += 1
+            if users % 1000 == 0:
+                print(f"[MIGRATION] vault shards: {users} users, {documents} documents moved")
+            if pause_ms:
+                time.sleep(pause_ms / 1000) # Leave the shard write locks to live traffic
+    finally:
+        for conn in shards.values():
+            conn.close()
+    print(f"--- [MIGRATION] vault shards OK: {users} users, {documents} documents ---")
+    return users, documents
+
+if __name__ == "__main__":
+    migrate()
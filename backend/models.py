@@ -1,7 +1,67 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, CheckConstraint
+import re
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import Column, Integer, SmallInteger, String, Boolean, DateTime, CheckConstraint, Index
+from sqlalchemy.orm import validates
 from sqlalchemy.sql import func
+from sqlalchemy.types import TypeDecorator
 from database import Base, BaseCompliance
 
+# --- SCHEMA V2 COLUMN TYPES ---
+class Paise(TypeDecorator):
+    """
+    Money stored as integer paise. Python code keeps working in rupees (Decimal),
+    while SUM/GROUP BY run on integers in SQL and come back as rupees.
+    """
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int((Decimal(str(value)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return (Decimal(int(value)) / 100).quantize(Decimal("0.01"))
+
+class CodedEnum(TypeDecorator):
+    """Small-integer enum column that reads and writes the existing status strings."""
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, codes: dict, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.codes = tuple(codes.items()) # Hashable, so it can take part in the statement cache key
+        self._to_code = dict(codes)
+        self._to_name = {v: k for k, v in codes.items()}
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if value not in self._to_code:
+            raise ValueError(f"Unknown enum value: {value}")
+        return self._to_code[value]
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else self._to_name[value]
+
+# Codes are persisted: append new values, never renumber
+VERIFICATION_STATUS_CODES = {"PENDING": 0, "PROCESSING": 1, "COMPLETED": 2, "FAILED": 3, "UNDER_REVIEW": 4}
+TAX_TYPE_CODES = {"Intra-State": 1, "Inter-State": 2}
+SCHEMA_VERSION = 2
+
+def normalize_phone_key(mobile_number: str):
+    """
+    Canonical lookup key for a phone number: the last 10 digits (Indian NSN).
+    "+91 98765-43210", "919876543210" and "9876543210" all map to "9876543210",
+    so lookups can be indexed equality queries instead of LIKE '%...' scans.
+    """
+    if not mobile_number:
+        return None
+    digits = re.sub(r"\D", "", mobile_number)
+    return digits[-10:] if digits else None
+
 class Verification(Base):
     __tablename__ = "verifications"
 
@@ -9,6 +69,7 @@ class Verification(Base):
     task_id = Column(String, unique=True, index=True, nullable=False)
     tenant_id = Column(Integer, index=True, nullable=True) # Link to Tenant
     mobile_number = Column(String, index=True, nullable=True) # Unified Identity Key
+    phone_key = Column(String(10), index=True, nullable=True) # Normalized last-10-digit key (see normalize_phone_key())
     
     # FAT 5.1: Vault Isolation - No naked PII in verifications table
     vault_token = Column(String, unique=True, index=True, nullable=False) 
@@ -16,10 +77,11 @@ class Verification(Base):
     # Dashboard Display Fields (Masked/Redacted in Prod, Plain for Demo)
     applicant_name = Column(String, nullable=True) 
     applicant_id = Column(String, nullable=True)
+    applicant_id_bidx = Column(String(32), index=True, nullable=True) # Blind index (SecurityUtils.blind_index)
     image_url = Column(String, nullable=True)
  
     
-    status = Column(String, default="PENDING") # PENDING, PROCESSING, COMPLETED, FAILED, UNDER_REVIEW
+    status = Column(CodedEnum(VERIFICATION_STATUS_CODES), default="PENDING") # PENDING, PROCESSING, COMPLETED, FAILED, UNDER_REVIEW
     
     # Results
     pdf_path = Column(String, nullable=True)
@@ -31,9 +93,24 @@ class Verification(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     __table_args__ = (
-        CheckConstraint("status IN ('PENDING', 'PROCESSING', 'COMPLETED', 'FAILED', 'UNDER_REVIEW')", name="valid_status"),
+        CheckConstraint(f"status IN ({', '.join(str(c) for c in VERIFICATION_STATUS_CODES.values())})", name="valid_status"),
+        # Keyset pagination for /verifications: WHERE tenant_id = ? ORDER BY created_at DESC, id DESC
+        Index("ix_verifications_tenant_created_id", "tenant_id", "created_at", "id"),
     )
 
+    @validates("mobile_number")
+    def _sync_phone_key(self, key, value):
+        self.phone_key = normalize_phone_key(value)
+        return value
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_versions"
+
+    # Per-table layout version; tables created fresh by create_all are stamped with SCHEMA_VERSION
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+    migrated_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class Grievance(Base):
     __tablename__ = "grievances"
 
@@ -54,10 +131,72 @@ class Tenant(Base):
     name = Column(String, nullable=False, unique=True)
     region = Column(String, default="asia-south1") # asia-south1 (India), africa-south1 (South Africa)
     # B2B Wallet
-    wallet_balance = Column(Integer, default=0) # Balance in INR
+    wallet_balance = Column(Paise, default=0) # Balance in INR (stored as paise)
+    wallet_shards = Column(Integer, default=1, nullable=True) # >1: balance lives in wallet_buckets (hot tenants)
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class WalletBucket(Base):
+    __tablename__ = "wallet_buckets"
+
+    # Sharded balance for high-traffic tenants: reservations hit one random bucket row
+    tenant_id = Column(Integer, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    balance = Column(Paise, nullable=False, default=0)
+
+class WalletHold(Base):
+    __tablename__ = "wallet_holds"
+
+    # Funds reserved before an upstream call; captured on success, released otherwise
+    id = Column(String, primary_key=True)
+    tenant_id = Column(Integer, index=True, nullable=False)
+    amount = Column(Paise, nullable=False)
+    bucket = Column(Integer, nullable=True) # None: held from tenants.wallet_balance
+    status = Column(String, default="HELD", index=True) # HELD, CAPTURED, RELEASED
+    reference = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class WalletLedger(Base):
+    __tablename__ = "wallet_ledger"
+
+    # Append-only: every balance movement, never updated or deleted
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(Integer, index=True, nullable=False)
+    entry_type = Column(String, nullable=False) # TOPUP, RESERVE, CAPTURE, RELEASE, REBALANCE
+    amount = Column(Paise, nullable=False) # Signed: negative leaves the available balance
+    hold_id = Column(String, index=True, nullable=True)
+    bucket = Column(Integer, nullable=True)
+    reference = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class B2BBatch(Base):
+    __tablename__ = "b2b_batches"
+
+    # /api/v1/b2b/verify-batch (services/b2b_batch.py); items live in b2b_batch_items
+    id = Column(String, primary_key=True)
+    tenant_id = Column(Integer, index=True, nullable=False)
+    module_id = Column(String, nullable=False)
+    price = Column(Paise, nullable=False) # Per successful item
+    hold_id = Column(String, nullable=True) # Wallet hold covering the batch until it completes
+    status = Column(String, default="RUNNING", index=True) # RUNNING, COMPLETED
+    total = Column(Integer, nullable=False)
+    succeeded = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    charged = Column(Paise, default=0)
+    leased_until = Column(DateTime(timezone=True), nullable=True) # Set while a stream is running it
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
+class B2BBatchItem(Base):
+    __tablename__ = "b2b_batch_items"
+
+    batch_id = Column(String, primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    request_json = Column(String, nullable=False) # Encrypted (SecurityUtils)
+    status = Column(String, default="PENDING") # PENDING, SUCCESS, FAILED
+    result_json = Column(String, nullable=True) # Encrypted (SecurityUtils)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
 class Incident(Base):
     __tablename__ = "incidents"
     
@@ -141,6 +280,7 @@ class VerifiedReport(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     mobile_number = Column(String, index=True, nullable=False)
+    phone_key = Column(String(10), index=True, nullable=True) # Normalized last-10-digit key (see normalize_phone_key())
     applicant_name = Column(String, nullable=False)
     id_type = Column(String, nullable=False) # Aadhaar, PAN, etc.
     id_number = Column(String, nullable=False)
@@ -152,6 +292,11 @@ class VerifiedReport(Base):
     # Notifications log
     last_notified_at = Column(DateTime(timezone=True), nullable=True)
 
+    @validates("mobile_number")
+    def _sync_phone_key(self, key, value):
+        self.phone_key = normalize_phone_key(value)
+        return value
+
 class SalesRegister(Base):
     __tablename__ = "sales_register"
 
@@ -159,22 +304,44 @@ class SalesRegister(Base):
     order_id = Column(String, index=True, nullable=False)
     payment_id = Column(String, unique=True, index=True, nullable=False)
     mobile_number = Column(String, index=True, nullable=False)
+    mobile_number_bidx = Column(String(32), index=True, nullable=True) # Blind index (SecurityUtils.blind_index)
     customer_name = Column(String, nullable=False)
+    customer_name_bidx = Column(String(32), index=True, nullable=True) # Blind index (SecurityUtils.blind_index)
     state_code = Column(String, index=True, nullable=False) # e.g., "36" for Telangana
     place_of_supply = Column(String, nullable=False) # e.g., "Telangana"
     
-    total_amount = Column(String, nullable=False) # Store as string "99.00"
-    base_amount = Column(String, nullable=False) # Store as string "83.90"
-    gst_amount = Column(String, nullable=False) # Store as string "15.10"
+    # Money as integer paise (schema v2); read/written as rupees Decimal
+    total_amount = Column(Paise, nullable=False) # 9900 -> 99.00
+    base_amount = Column(Paise, nullable=False) # 8390 -> 83.90
+    gst_amount = Column(Paise, nullable=False) # 1510 -> 15.10
     
-    cgst = Column(String, nullable=True) # "7.55"
-    sgst = Column(String, nullable=True) # "7.55"
-    igst = Column(String, nullable=True) # "15.10"
+    cgst = Column(Paise, nullable=True) # 755 -> 7.55
+    sgst = Column(Paise, nullable=True) # 755 -> 7.55
+    igst = Column(Paise, nullable=True) # 1510 -> 15.10
     
-    tax_type = Column(String, nullable=False) # "Intra-State" or "Inter-State"
+    tax_type = Column(CodedEnum(TAX_TYPE_CODES), nullable=False) # "Intra-State" or "Inter-State"
     invoice_type = Column(String, default="RETAIL") # "RETAIL", "ADVANCE_RECEIPT"
     b2b_gstin = Column(String, nullable=True) # GSTIN for Input Credit
     pdf_path = Column(String, nullable=True)
     
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True) # GSTR-1 range scans
+
+
+class SubjectKey(BaseCompliance):
+    __tablename__ = "subject_keys"
+
+    # DPDP crypto-shredding: one data key per data principal (services/subject_keys.py)
+    subject_id = Column(String(32), primary_key=True) # Blind index of the principal's mobile number
+    wrapped_key = Column(String, nullable=True) # Data key encrypted under the master keyring; NULL once destroyed
+    status = Column(String, default="ACTIVE", index=True) # ACTIVE, DESTROYED
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    destroyed_at = Column(DateTime(timezone=True), nullable=True)
+    purged_at = Column(DateTime(timezone=True), nullable=True) # Physical purge finished
+
+class RetentionCheckpoint(BaseCompliance):
+    __tablename__ = "retention_checkpoints"
 
+    # Progress of services/retention_sweeper.py, one row per purged table
+    table_name = Column(String, primary_key=True)
+    rows_purged_total = Column(Integer, default=0)
+    last_sweep_at = Column(DateTime(timezone=True), nullable=True)
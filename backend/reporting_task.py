@@ -1,9 +1,7 @@
 import os
 import asyncio
 from datetime import datetime, timedelta
-from sqlalchemy import select, extract
 from database import SessionLocalApp
-from models import SalesRegister
 from services.finance_engine import ReportingService
 from services.interakt import send_support_alert_email
 
@@ -13,46 +11,21 @@ async def run_monthly_report():
     """
     print("--- [REPORTING] Starting Monthly GSTR-1 Export ---")
     
-    # Calculate previous month
+    # Previous calendar month as a half-open [start, end) range on created_at (index-friendly)
     today = datetime.now()
-    first_day_this_month = today.replace(day=1)
-    last_day_prev_month = first_day_this_month - timedelta(days=1)
-    prev_month = last_day_prev_month.month
-    prev_year = last_day_prev_month.year
+    period_end = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    last_day_prev_month = period_end - timedelta(days=1)
+    period_start = last_day_prev_month.replace(day=1)
+    report_format = os.getenv("GSTR1_FORMAT", "xlsx")
 
     async with SessionLocalApp() as db:
-        # Fetch records for the previous month
-        query = select(SalesRegister).filter(
-            extract('month', SalesRegister.created_at) == prev_month,
-            extract('year', SalesRegister.created_at) == prev_year
-        )
-        result = await db.execute(query)
-        records = result.scalars().all()
+        excel_path, invoice_count, total_sales = await ReportingService.export_gstr1(db, period_start, period_end, report_format)
 
-        if not records:
-            print(f"[REPORTING] No sales records found for {prev_month}/{prev_year}.")
+        if not invoice_count:
+            print(f"[REPORTING] No sales records found for {period_start.month}/{period_start.year}.")
+            os.remove(excel_path)
             return
 
-        # Convert to list of dicts for pandas
-        data = []
-        for r in records:
-            data.append({
-                "Invoice No": f"CD-{r.created_at.strftime('%Y%m%d')}-{r.payment_id[-6:].upper()}",
-                "Invoice Date": r.created_at.strftime('%Y-%m-%d'),
-                "Payment ID": r.payment_id,
-                "Customer": r.customer_name,
-                "Mobile": r.mobile_number,
-                "POS": f"{r.place_of_supply} ({r.state_code})",
-                "Taxable Value": r.base_amount,
-                "Tax Type": r.tax_type,
-                "CGST": r.cgst or "0.00",
-                "SGST": r.sgst or "0.00",
-                "IGST": r.igst or "0.00",
-                "Total Amount": r.total_amount
-            })
-
-        # Export to Excel
-        excel_path = ReportingService.export_gstr1(data)
         print(f"[REPORTING] Report generated: {excel_path}")
 
         # Delivery
@@ -66,8 +39,8 @@ async def run_monthly_report():
         body = (
             f"Hello Team,\n\n"
             f"Please find attached the Sales Register for {last_day_prev_month.strftime('%B %Y')}.\n\n"
-            f"Total Invoices: {len(records)}\n"
-            f"Total Sales: INR {sum(float(r.total_amount) for r in records)}\n\n"
+            f"Total Invoices: {invoice_count}\n"
+            f"Total Sales: INR {total_sales}\n\n"
             f"Report Path: {excel_path}\n\n"
             f"Best Regards,\nComplianceDesk AI Billing System"
         )
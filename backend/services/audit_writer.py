@@ -0,0 +1,327 @@
+import os
+import glob
+import json
+import time
+import asyncio
+from datetime import datetime
+
+"""
+GROUP-COMMIT AUDIT WRITER (Compliance Vault)
+Request handlers used to add one AuditLog / DPDPConsent row and commit it on
+engine_compliance themselves: one SQLite fsync per request, with writers serialized.
+
+AuditWriter.log() queues the entry and returns an awaitable. One flusher task drains
+the queue into batches. It flushes when MAX_BATCH entries are waiting or
+FLUSH_INTERVAL_MS has passed. Each batch is:
+  1. appended to a local spill file and fsynced (one fsync for the whole batch),
+  2. inserted into the compliance DB in a single transaction,
+  3. dropped from the spill file once committed.
+Awaitables resolve once their entry is durable (step 1, with step 2 attempted).
+If the DB commit fails, the entries stay in the spill file and are retried on the
+next flush and replayed at boot, so a crash loses nothing. Delivery is at-least-once:
+a crash between steps 2 and 3 can replay a batch that already committed.
+A row the DB rejects (constraint, type or schema error) must not block the rest: the
+batch is bisected, the good rows commit, and rows that fail on their own move to a
+dead-letter file (<spill>.dead). Lock errors, or any error while the DB does not answer a
+SELECT 1, are not the rows' fault: nothing is bisected and the spill waits.
+log() rejects fields that are not columns of the model, and missing NOT NULL columns.
+Each process spills to its own file (<spill>.<pid>): a worker truncating a shared file
+would drop entries another worker appended after its read. At start() the writer adopts
+spill files of processes that are gone, and the single file of older builds.
+"""
+
+MAX_BATCH = int(os.getenv("AUDIT_MAX_BATCH", "256"))
+FLUSH_INTERVAL_MS = int(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "20"))
+SPILL_PATH = os.getenv("AUDIT_SPILL_PATH", "./audit_spill.jsonl" if os.name == "nt" else "/tmp/audit_spill.jsonl")
+
+def _encode(value):
+    return {"__dt__": value.isoformat()} if isinstance(value, datetime) else value
+
+def _decode(value):
+    return datetime.fromisoformat(value["__dt__"]) if isinstance(value, dict) and "__dt__" in value else value
+
+def _alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True # os.kill(pid, 0) is not a probe on Windows: never adopt another PID's file there
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class AuditWriter:
+    def __init__(self, session_factory=None, spill_path: str = SPILL_PATH, max_batch: int = MAX_BATCH, flush_interval_ms: int = FLUSH_INTERVAL_MS):
+        self._session_factory = session_factory
+        self.spill_base = spill_path
+        self.dead_letter_path = spill_path + ".dead" # Shared: only ever appended to
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue = None
+        self._task = None
+        self._columns = {}
+        self.stats = {"entries": 0, "batches": 0, "db_failures": 0, "dead_lettered": 0, "last_batch_size": 0, "last_flush_ms": 0.0}
+
+    def _models(self):
+        from models import AuditLog, DPDPConsent
+        return {"AuditLog": AuditLog, "DPDPConsent": DPDPConsent}
+
+    def _validate(self, model_name, fields):
+        if model_name not in self._columns:
+            table = self._models()[model_name].__table__
+            required = {c.name for c in table.columns if not c.nullable and not c.primary_key and c.default is None and c.server_default is None}
+            self._columns[model_name] = ({c.name for c in table.columns}, required)
+        columns, required = self._columns[model_name]
+        unknown = set(fields) - columns
+        if unknown:
+            raise ValueError(f"{model_name} has no column(s) {sorted(unknown)}")
+        missing = sorted(c for c in required if fields.get(c) is None)
+        if missing:
+            raise ValueError(f"{model_name} needs {missing}")
+
+    def _sessions(self):
+        if self._session_factory is None:
+            from database import SessionLocalCompliance
+            self._session_factory = SessionLocalCompliance
+        return self._session_factory
+
+    @property
+    def spill_path(self):
+        # Resolved per call, so workers forked after import each get their own file
+        return f"{self.spill_base}.{os.getpid()}"
+
+    # --- LIFECYCLE ---
+    async def start(self):
+        if self._task:
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        await self._replay_spill()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        task, self._task = self._task, None # log() refuses new entries from here on
+        await self._queue.put(None)
+        await task
+
+    # --- PUBLIC API ---
+    def log(self, model_name: str, **fields) -> asyncio.Future:
+        """
+        Queue one AuditLog / DPDPConsent row. Await the result to block until it is durable:
+            await audit_writer.log("AuditLog", actor_token="B2B_ADMIN", action="...", ...)
+        """
+        if model_name not in ("AuditLog", "DPDPConsent"):
+            raise ValueError(f"Unsupported audit model: {model_name}")
+        self._validate(model_name, fields)
+        if self._task is None or self._task.done():
+            # Nothing would ever flush the entry: fail now instead of handing out a future that never resolves
+            raise RuntimeError("Audit writer is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((model_name, fields, future))
+        return future
+
+    def log_many(self, model_name: str, rows: list) -> asyncio.Future:
+        """Queue several rows at once; resolves when all of them are durable."""
+        for r in rows: # All or nothing: no row is queued if one is invalid
+            self._validate(model_name, r)
+        return asyncio.gather(*[self.log(model_name, **r) for r in rows])
+
+    # --- FLUSHER ---
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # e.g. an OSError truncating the spill: fail this batch, keep serving later ones
+                print(f"[AUDIT] Flush of {len(batch)} entries failed: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _flush(self, batch):
+        start = time.perf_counter()
+        records = [{"model": m, "fields": {k: _encode(v) for k, v in f.items()}} for m, f, _ in batch]
+        try:
+            await asyncio.to_thread(self._append_spill, records)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        committed = await self._commit_spill()
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(committed)
+
+        self.stats["entries"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["last_batch_size"] = len(batch)
+        self.stats["last_flush_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    def _append_spill(self, records):
+        self._append_lines(self.spill_path, records)
+
+    def _read_spill(self):
+        return self._read_lines(self.spill_path)
+
+    def _read_lines(self, path):
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            # A torn last line (crash mid-write) was never acknowledged; skip it
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+            return records
+
+    async def _commit_spill(self) -> bool:
+        """Insert everything pending in the spill file in one transaction, then truncate it.
+        True once nothing is left in the spill (rejected rows count as handled: dead-lettered)."""
+        records = await asyncio.to_thread(self._read_spill)
+        if not records:
+            return True
+        try:
+            await self._insert(records)
+        except Exception as e:
+            self.stats["db_failures"] += 1
+            if await self._transient(e):
+                print(f"[AUDIT] Batch commit failed, {len(records)} entries kept in spill: {e}")
+                return False
+            # A bad row fails the whole transaction: commit around it
+            print(f"[AUDIT] Batch commit rejected ({e}); isolating bad entries")
+            dead, waiting = await self._insert_bisect(records, error=e)
+            if dead:
+                await asyncio.to_thread(self._append_lines, self.dead_letter_path, dead)
+                self.stats["dead_lettered"] += len(dead)
+                print(f"[AUDIT] {len(dead)} entries moved to {self.dead_letter_path}")
+            await asyncio.to_thread(self._rewrite_spill, waiting)
+            return not waiting
+        await asyncio.to_thread(self._truncate_spill)
+        return True
+
+    async def _transient(self, error) -> bool:
+        """True if the DB, not the rows, is at fault (locked, unreachable)."""
+        from sqlalchemy import text
+        from sqlalchemy.exc import OperationalError, InterfaceError, DisconnectionError
+        if isinstance(error, (InterfaceError, DisconnectionError, ConnectionError, TimeoutError)):
+            return True
+        if not isinstance(error, OperationalError):
+            return False
+        # OperationalError also covers schema mismatches ("no such column"): ask the DB
+        if "locked" in str(error).lower():
+            return True
+        try:
+            async with self._sessions()() as db:
+                await db.execute(text("SELECT 1"))
+            return False
+        except Exception:
+            return True
+
+    async def _insert(self, records):
+        models = self._models()
+        async with self._sessions()() as db:
+            db.add_all([models[r["model"]](**{k: _decode(v) for k, v in r["fields"].items()}) for r in records])
+            await db.commit()
+
+    async def _insert_bisect(self, records, error=None):
+        """Commits every insertable record. Returns (rejected records, records left for a retry)."""
+        if error is None: # `error`: these records already failed together with it
+            try:
+                await self._insert(records)
+                return [], []
+            except Exception as e:
+                if await self._transient(e):
+                    return [], records
+                error = e
+        if len(records) == 1:
+            return [dict(records[0], error=str(error).splitlines()[0])], []
+        half = len(records) // 2
+        dead_a, waiting_a = await self._insert_bisect(records[:half])
+        if waiting_a: # The DB went away: stop, keep the rest for the next flush
+            return dead_a, waiting_a + records[half:]
+        dead_b, waiting_b = await self._insert_bisect(records[half:])
+        return dead_a + dead_b, waiting_b
+
+    def _append_lines(self, path, records):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r) + "\n" for r in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite_spill(self, records):
+        tmp_path = self.spill_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r) + "\n" for r in records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.spill_path)
+
+    def _truncate_spill(self):
+        with open(self.spill_path, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _orphans(self):
+        """Spill files nobody else will replay: ours from an adoption cut short, the shared file
+        of older builds, and those of processes that are gone (and their cut-short adoptions)."""
+        claim = self.spill_path + ".adopting"
+        found = [p for p in (claim, self.spill_base) if os.path.exists(p)]
+        for path in glob.glob(glob.escape(self.spill_base) + ".*"):
+            pid, _, kind = path[len(self.spill_base) + 1:].partition(".")
+            # Skips .dead and .tmp files; a PID reused by an unrelated process waits for a later start
+            if pid.isdigit() and kind in ("", "adopting") and int(pid) != os.getpid() and not _alive(int(pid)):
+                found.append(path)
+        return found
+
+    def _adopt_orphans(self) -> int:
+        """Moves orphaned spill entries into our spill file. Returns how many were adopted."""
+        claim = self.spill_path + ".adopting"
+        adopted = 0
+        for path in self._orphans():
+            if path != claim:
+                try:
+                    os.rename(path, claim) # Only one process wins each orphan
+                except FileNotFoundError:
+                    continue
+            records = self._read_lines(claim)
+            if records:
+                self._append_spill(records)
+            os.remove(claim) # A crash before this replays them twice: at-least-once, as above
+            adopted += len(records)
+        return adopted
+
+    async def _replay_spill(self):
+        adopted = await asyncio.to_thread(self._adopt_orphans)
+        if adopted:
+            print(f"[AUDIT] Adopted {adopted} entries from spill files of stopped processes")
+        pending = await asyncio.to_thread(self._read_spill)
+        if pending:
+            print(f"[AUDIT] Replaying {len(pending)} spilled entries")
+            await self._commit_spill()
+
+audit_writer = AuditWriter()
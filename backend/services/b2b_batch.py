@@ -0,0 +1,246 @@
+import os
+import io
+import csv
+import json
+import time
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+
+"""
+B2B BATCH VERIFICATION (/api/v1/b2b/verify-batch)
+One request verifies up to B2B_BATCH_MAX_ITEMS items of one module:
+
+- Funds for the whole batch (price x items) are reserved with a single wallet hold. When the
+  batch completes, only successful items are captured and the rest goes back, in the same
+  transaction that marks the batch COMPLETED, so a batch is billed exactly once.
+- Items fan out to the Protean grid (run_b2b_module) with at most `concurrency` in flight, and
+  each result is streamed as one NDJSON line as soon as it completes.
+- Completed items are flushed to b2b_batch_items in bulk (every FLUSH_EVERY results or
+  FLUSH_INTERVAL_MS), together with their audit entries (one audit_writer batch per flush).
+  The flush also renews the batch lease.
+- A stream that dies (client gone, worker restart) leaves the batch RUNNING. Calling the
+  endpoint again with ?batch_id= replays stored results and runs only items that are still
+  PENDING. Results not yet flushed are re-verified (at-least-once upstream, billed once).
+"""
+
+MAX_ITEMS = int(os.getenv("B2B_BATCH_MAX_ITEMS", "1000"))
+CONCURRENCY = int(os.getenv("B2B_BATCH_CONCURRENCY", "20"))
+FLUSH_EVERY = int(os.getenv("B2B_BATCH_FLUSH_EVERY", "50"))
+FLUSH_INTERVAL_MS = int(os.getenv("B2B_BATCH_FLUSH_INTERVAL_MS", "1000"))
+LEASE_SEC = int(os.getenv("B2B_BATCH_LEASE_SEC", "60"))
+
+class BatchInProgress(Exception):
+    pass
+
+def parse_json_items(body) -> list:
+    """JSON array (or {"items": [...]}) of request dicts; bare strings mean {"id": value}."""
+    if isinstance(body, dict):
+        body = body.get("items")
+    if not isinstance(body, list):
+        raise ValueError("Expected a JSON array of items")
+    items = []
+    for item in body:
+        if isinstance(item, dict):
+            items.append(item)
+        elif isinstance(item, (str, int)):
+            items.append({"id": str(item)})
+        else:
+            raise ValueError(f"Unsupported item: {item!r}")
+    return items
+
+def parse_csv_items(data: bytes) -> list:
+    """CSV with a header row; columns are the same keys as /api/v1/b2b/verify (id, task_id, ...)."""
+    reader = csv.DictReader(io.StringIO(data.decode("utf-8-sig")))
+    return [
+        {k.strip(): v.strip() for k, v in row.items() if k and v and v.strip()}
+        for row in reader
+        if any(v and v.strip() for v in row.values())
+    ]
+
+class B2BBatchService:
+    _session_factory = None
+
+    @staticmethod
+    def _sessions():
+        if B2BBatchService._session_factory is None:
+            from database import SessionLocalApp
+            B2BBatchService._session_factory = SessionLocalApp
+        return B2BBatchService._session_factory
+
+    @staticmethod
+    async def create(db, tenant_id, module_id: str, items: list, price) -> str:
+        """Reserves price x len(items) and stores the batch. Raises InsufficientFunds."""
+        from sqlalchemy import insert
+        from models import B2BBatch, B2BBatchItem
+        from services.wallet import WalletService
+        from services.security_utils import SecurityUtils
+        batch_id = uuid.uuid4().hex
+        hold_id = await WalletService.reserve(db, tenant_id, WalletService._money(price) * len(items), reference=f"B2B_BATCH_{batch_id[:8].upper()}")
+        encrypted = SecurityUtils.encrypt_many([json.dumps(item) for item in items])
+        await db.execute(insert(B2BBatch).values(
+            id=batch_id, tenant_id=tenant_id, module_id=module_id, price=price, hold_id=hold_id,
+            status="RUNNING", total=len(items), leased_until=datetime.utcnow() + timedelta(seconds=LEASE_SEC)
+        ))
+        await db.execute(insert(B2BBatchItem), [{"batch_id": batch_id, "seq": i, "request_json": token} for i, token in enumerate(encrypted)])
+        await db.commit()
+        return batch_id
+
+    @staticmethod
+    async def claim(db, batch_id: str):
+        """
+        Takes the lease of an interrupted batch so one stream resumes it. Re-reserves funds if
+        its hold was released meanwhile (stale-hold sweep). Raises LookupError / BatchInProgress.
+        """
+        from sqlalchemy import select, update, or_, func
+        from models import B2BBatch, B2BBatchItem, WalletHold
+        from services.wallet import WalletService
+        now = datetime.utcnow()
+        batch = (await db.execute(select(B2BBatch).where(B2BBatch.id == batch_id))).scalar_one_or_none()
+        if batch is None:
+            raise LookupError(batch_id)
+        if batch.status == "RUNNING":
+            res = await db.execute(
+                update(B2BBatch)
+                .where(B2BBatch.id == batch_id, B2BBatch.status == "RUNNING", or_(B2BBatch.leased_until.is_(None), B2BBatch.leased_until < now))
+                .values(leased_until=now + timedelta(seconds=LEASE_SEC))
+            )
+            if res.rowcount != 1:
+                await db.rollback()
+                raise BatchInProgress(batch_id)
+            hold_status = (await db.execute(select(WalletHold.status).where(WalletHold.id == batch.hold_id))).scalar()
+            if hold_status != "HELD":
+                failed = (await db.execute(
+                    select(func.count()).select_from(B2BBatchItem).where(B2BBatchItem.batch_id == batch_id, B2BBatchItem.status == "FAILED")
+                )).scalar()
+                await db.commit()
+                try:
+                    hold_id = await WalletService.reserve(db, batch.tenant_id, batch.price * (batch.total - failed), reference=f"B2B_BATCH_{batch_id[:8].upper()}")
+                except Exception:
+                    await db.execute(update(B2BBatch).where(B2BBatch.id == batch_id).values(leased_until=None))
+                    await db.commit()
+                    raise
+                await db.execute(update(B2BBatch).where(B2BBatch.id == batch_id).values(hold_id=hold_id))
+            await db.commit()
+        return batch
+
+    @staticmethod
+    async def _flush(batch, done: list, lease: bool = True):
+        """done: [(seq, request, result, status)] -> one bulk UPDATE, one audit batch."""
+        from sqlalchemy import update, bindparam
+        from models import B2BBatch, B2BBatchItem
+        from services.security_utils import SecurityUtils
+        from services.audit_writer import audit_writer
+        now = datetime.utcnow()
+        if done:
+            items = B2BBatchItem.__table__
+            encrypted = SecurityUtils.encrypt_many([json.dumps(result) for _, _, result, _ in done])
+            statement = (
+                update(items)
+                .where(items.c.batch_id == bindparam("_batch"), items.c.seq == bindparam("_seq"))
+                .values(status=bindparam("_status"), result_json=bindparam("_result"), completed_at=bindparam("_at"))
+            )
+            params = [
+                {"_batch": batch.id, "_seq": seq, "_status": status, "_result": token, "_at": now}
+                for (seq, _, _, status), token in zip(done, encrypted)
+            ]
+        async with B2BBatchService._sessions()() as db:
+            if done:
+                await db.execute(statement, params)
+            await db.execute(update(B2BBatch).where(B2BBatch.id == batch.id).values(
+                leased_until=now + timedelta(seconds=LEASE_SEC) if lease else None
+            ))
+            await db.commit()
+        if done:
+            retention_until = now + timedelta(days=1825)
+            await audit_writer.log_many("AuditLog", [{
+                "actor_token": "B2B_ADMIN",
+                "action": f"B2B_VERIFY_{batch.module_id.upper()}",
+                "resource_id": str(request.get("id", "UNKNOWN")),
+                "retention_until": retention_until,
+            } for _, request, _, _ in done])
+
+    @staticmethod
+    async def _complete(batch):
+        """Bills successful items and closes the batch in one transaction."""
+        from sqlalchemy import select, update, func
+        from models import B2BBatch, B2BBatchItem
+        from services.wallet import WalletService
+        async with B2BBatchService._sessions()() as db:
+            counts = dict((await db.execute(
+                select(B2BBatchItem.status, func.count()).where(B2BBatchItem.batch_id == batch.id).group_by(B2BBatchItem.status)
+            )).all())
+            succeeded, failed = counts.get("SUCCESS", 0), counts.get("FAILED", 0)
+            hold_id = (await db.execute(select(B2BBatch.hold_id).where(B2BBatch.id == batch.id))).scalar()
+            charged = batch.price * succeeded
+            await WalletService.capture_partial(db, hold_id, charged, commit=False)
+            await db.execute(update(B2BBatch).where(B2BBatch.id == batch.id).values(
+                status="COMPLETED", succeeded=succeeded, failed=failed, charged=charged,
+                leased_until=None, completed_at=datetime.utcnow()
+            ))
+            await db.commit()
+        print(f"[BILLING] B2B batch {batch.id[:8]}: {succeeded} ok, {failed} failed, ₹{charged} captured.")
+        return {"type": "summary", "batch_id": batch.id, "succeeded": succeeded, "failed": failed, "charged": str(charged)}
+
+    @staticmethod
+    async def stream(batch_id: str, concurrency: int = CONCURRENCY):
+        """Async generator of result dicts (batch header, one per item, summary)."""
+        from sqlalchemy import select
+        from models import B2BBatch, B2BBatchItem
+        from services.security_utils import SecurityUtils
+        from services.protean_service import run_b2b_module
+
+        async with B2BBatchService._sessions()() as db:
+            batch = (await db.execute(select(B2BBatch).where(B2BBatch.id == batch_id))).scalar_one()
+            rows = (await db.execute(
+                select(B2BBatchItem.seq, B2BBatchItem.status, B2BBatchItem.request_json, B2BBatchItem.result_json)
+                .where(B2BBatchItem.batch_id == batch_id).order_by(B2BBatchItem.seq)
+            )).all()
+        finished = [r for r in rows if r.status != "PENDING"]
+        pending = [r for r in rows if r.status == "PENDING"]
+        yield {"type": "batch", "batch_id": batch.id, "module_id": batch.module_id, "total": batch.total, "pending": len(pending), "resumed": bool(finished)}
+        if batch.status == "COMPLETED":
+            pending = []
+        # Replay what an interrupted stream already stored
+        for row, result in zip(finished, SecurityUtils.decrypt_many([r.result_json for r in finished])):
+            yield {"type": "item", "seq": row.seq, "status": row.status, "result": json.loads(result)}
+        if batch.status == "COMPLETED":
+            yield {"type": "summary", "batch_id": batch.id, "succeeded": batch.succeeded, "failed": batch.failed, "charged": str(batch.charged)}
+            return
+
+        requests = [json.loads(r) for r in SecurityUtils.decrypt_many([r.request_json for r in pending])]
+        gate = asyncio.Semaphore(concurrency)
+        async def verify(seq, request):
+            async with gate:
+                try:
+                    result = await run_b2b_module(batch.module_id, dict(request), tenant_id=batch.tenant_id)
+                except Exception as e:
+                    result = {"status": "ERROR", "message": str(e)}
+                return seq, request, result, "SUCCESS" if result.get("status") == "SUCCESS" else "FAILED"
+
+        tasks = {asyncio.ensure_future(verify(r.seq, req)) for r, req in zip(pending, requests)}
+        buffer, last_flush = [], time.monotonic()
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=FLUSH_INTERVAL_MS / 1000, return_when=asyncio.FIRST_COMPLETED)
+                results = [task.result() for task in done]
+                buffer.extend(results) # Buffered before yielding: a disconnect mid-loop loses nothing
+                for seq, _, result, status in results:
+                    yield {"type": "item", "seq": seq, "status": status, "result": result}
+                if len(buffer) >= FLUSH_EVERY or time.monotonic() - last_flush >= FLUSH_INTERVAL_MS / 1000:
+                    await B2BBatchService._flush(batch, buffer)
+                    buffer, last_flush = [], time.monotonic()
+            await B2BBatchService._flush(batch, buffer)
+            buffer = []
+            yield await B2BBatchService._complete(batch)
+        finally:
+            if tasks or buffer:
+                # Interrupted: keep what finished and free the lease so ?batch_id= can resume now
+                for task in tasks:
+                    task.cancel()
+                await asyncio.shield(B2BBatchService._flush(batch, buffer, lease=False))
+
+    @staticmethod
+    async def stream_ndjson(batch_id: str, concurrency: int = CONCURRENCY):
+        async for line in B2BBatchService.stream(batch_id, concurrency):
+            yield json.dumps(line) + "\n"
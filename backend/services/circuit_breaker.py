@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import asyncio
+import threading
+
+"""
+PROTEAN CIRCUIT BREAKERS (one per PROTEAN_API_GRID slug)
+A failing grid cell (e.g. the RTO behind vehicle_rc) opens only its own breaker; the other
+cells keep serving.
+
+- CLOSED: upstream failures (transport errors, timeouts, 5xx/429) are counted in a sliding
+  window; `failure_threshold` of them within `failure_window_sec` open the breaker.
+- OPEN: calls are rejected without going upstream (the gateway queues them, see
+  services/retry_queue.py) until `recovery_timeout_sec` has passed.
+- HALF_OPEN: at most `half_open_probes` calls are let through at once. `close_after`
+  successful probes close the breaker; any failed probe reopens it. Probes that never
+  report back are forgotten after another recovery timeout.
+
+State lives in a pluggable store so every worker sees the same breaker:
+MemoryBreakerStore (one process) or RedisBreakerStore (PROTEAN_BREAKER_REDIS_URL, shared).
+A store only has to apply `fn(record) -> (record, result)` atomically per slug. Workers
+cache a CLOSED state for `sync_sec`, so the steady state costs no store round trips and an
+opened breaker reaches the other workers within `sync_sec`.
+The gateway's async path uses allow_async/record_async: a Redis round trip runs in a worker
+thread, never on the event loop. If the store fails, every breaker fails open (CALL) and the
+store is left alone for `sync_sec` instead of timing out on each call.
+"""
+
+FAILURE_THRESHOLD = int(os.getenv("PROTEAN_BREAKER_FAILURES", "5"))
+FAILURE_WINDOW_SEC = float(os.getenv("PROTEAN_BREAKER_WINDOW_SEC", "30"))
+RECOVERY_TIMEOUT_SEC = float(os.getenv("PROTEAN_BREAKER_RECOVERY_SEC", "30"))
+HALF_OPEN_PROBES = int(os.getenv("PROTEAN_BREAKER_PROBES", "2"))
+CLOSE_AFTER = int(os.getenv("PROTEAN_BREAKER_CLOSE_AFTER", "2"))
+SYNC_SEC = float(os.getenv("PROTEAN_BREAKER_SYNC_SEC", "1"))
+PROTEAN_BREAKER_REDIS_URL = os.getenv("PROTEAN_BREAKER_REDIS_URL")
+
+def _fresh_record():
+    return {"state": "CLOSED", "failures": 0, "window_start": 0.0, "opened_at": 0.0, "half_open_at": 0.0, "probes": 0, "probe_successes": 0}
+
+class MemoryBreakerStore:
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def update(self, slug, fn):
+        with self._lock:
+            record, result = fn(dict(self._records.get(slug) or _fresh_record()))
+            self._records[slug] = record
+            return result
+
+    async def aupdate(self, slug, fn):
+        return self.update(slug, fn) # In-process: nothing to wait for
+
+    def snapshot(self):
+        with self._lock:
+            return {slug: dict(r) for slug, r in self._records.items()}
+
+class RedisBreakerStore:
+    """Records as JSON under breaker:<slug>, updated with WATCH/MULTI (optimistic, retried on conflict)."""
+    def __init__(self, client=None, url: str = PROTEAN_BREAKER_REDIS_URL, prefix: str = "protean:breaker:"):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url, socket_timeout=0.2)
+        self.client = client
+        self.prefix = prefix
+
+    def update(self, slug, fn):
+        key = self.prefix + slug
+        def apply(pipe):
+            raw = pipe.get(key)
+            record, result = fn(json.loads(raw) if raw else _fresh_record())
+            pipe.multi()
+            pipe.set(key, json.dumps(record))
+            return result
+        return self.client.transaction(apply, key, value_from_callable=True)
+
+    async def aupdate(self, slug, fn):
+        # WATCH/MULTI round trips (up to the socket timeout each) off the event loop
+        return await asyncio.to_thread(self.update, slug, fn)
+
+    def snapshot(self):
+        keys = self.client.keys(self.prefix + "*")
+        values = self.client.mget(keys) if keys else []
+        return {k.decode()[len(self.prefix):] if isinstance(k, bytes) else k[len(self.prefix):]: json.loads(v) for k, v in zip(keys, values) if v}
+
+class CircuitBreakers:
+    def __init__(self, store=None, failure_threshold: int = FAILURE_THRESHOLD, failure_window_sec: float = FAILURE_WINDOW_SEC,
+                 recovery_timeout_sec: float = RECOVERY_TIMEOUT_SEC, half_open_probes: int = HALF_OPEN_PROBES,
+                 close_after: int = CLOSE_AFTER, sync_sec: float = SYNC_SEC):
+        if store is None:
+            store = RedisBreakerStore() if PROTEAN_BREAKER_REDIS_URL else MemoryBreakerStore()
+        self.store = store
+        self.failure_threshold = failure_threshold
+        self.failure_window_sec = failure_window_sec
+        self.recovery_timeout_sec = recovery_timeout_sec
+        self.half_open_probes = half_open_probes
+        self.close_after = close_after
+        self.sync_sec = sync_sec
+        self._closed_seen = {} # slug -> time a CLOSED state was last read from the store
+        self._store_down_until = 0.0 # monotonic; until then the store is not asked (fail open)
+        self.stats = {"rejected": 0, "probes": 0, "opened": 0, "closed": 0, "store_errors": 0}
+
+    # --- Transitions (applied atomically by the store) ---
+    def _allow(self, record, now):
+        if record["state"] == "OPEN" and now - record["opened_at"] >= self.recovery_timeout_sec:
+            record.update(state="HALF_OPEN", half_open_at=now, probes=0, probe_successes=0)
+        if record["state"] == "HALF_OPEN":
+            if record["probes"] >= self.half_open_probes and now - record["half_open_at"] >= self.recovery_timeout_sec:
+                record.update(half_open_at=now, probes=0) # Lost probes
+            if record["probes"] < self.half_open_probes:
+                record["probes"] += 1
+                return record, ("PROBE", record["state"])
+            return record, (None, record["state"])
+        return record, ("CALL" if record["state"] == "CLOSED" else None, record["state"])
+
+    def _record(self, record, now, ok, probe):
+        state = record["state"]
+        if probe and state == "HALF_OPEN":
+            record["probes"] = max(0, record["probes"] - 1)
+            if not ok:
+                record.update(state="OPEN", opened_at=now, probes=0, probe_successes=0)
+            else:
+                record["probe_successes"] += 1
+                if record["probe_successes"] >= self.close_after:
+                    record.update(_fresh_record())
+        elif state == "CLOSED" and not ok:
+            if now - record["window_start"] > self.failure_window_sec:
+                record.update(window_start=now, failures=0)
+            record["failures"] += 1
+            if record["failures"] >= self.failure_threshold:
+                record.update(state="OPEN", opened_at=now)
+        return record, (state, record["state"])
+
+    # --- Store access (fail open) ---
+    def _store_down(self):
+        return time.monotonic() < self._store_down_until
+
+    def _store_failed(self, error):
+        # The breaker must not become the outage: fail open, and don't retry the store for sync_sec
+        self.stats["store_errors"] += 1
+        self._store_down_until = time.monotonic() + self.sync_sec
+        print(f"[BREAKER] Store unavailable, failing open for {self.sync_sec}s: {error}")
+
+    def _cached_allow(self, slug):
+        seen = self._closed_seen.get(slug)
+        if self._store_down() or (seen is not None and time.monotonic() - seen < self.sync_sec):
+            return "CALL"
+        return None
+
+    def _allowed(self, slug, decision, state):
+        if state == "CLOSED":
+            self._closed_seen[slug] = time.monotonic()
+        else:
+            self._closed_seen.pop(slug, None)
+        if decision is None:
+            self.stats["rejected"] += 1
+        elif decision == "PROBE":
+            self.stats["probes"] += 1
+        return decision
+
+    def _recorded(self, slug, before, after):
+        if after != "CLOSED":
+            self._closed_seen.pop(slug, None)
+        if before != "OPEN" and after == "OPEN":
+            self.stats["opened"] += 1
+            print(f"[BREAKER] {slug} OPEN")
+        elif before == "HALF_OPEN" and after == "CLOSED":
+            self.stats["closed"] += 1
+            print(f"[BREAKER] {slug} CLOSED")
+
+    @staticmethod
+    def _release(record):
+        if record["state"] == "HALF_OPEN":
+            record["probes"] = max(0, record["probes"] - 1)
+        return record, None
+
+    # --- PUBLIC API ---
+    def allow(self, slug: str):
+        """Returns "CALL", "PROBE" (half-open trial, report it via record(probe=True)) or None (rejected)."""
+        cached = self._cached_allow(slug)
+        if cached:
+            return cached
+        now = time.time()
+        try:
+            decision, state = self.store.update(slug, lambda r: self._allow(r, now))
+        except Exception as e:
+            self._store_failed(e)
+            return "CALL"
+        return self._allowed(slug, decision, state)
+
+    async def allow_async(self, slug: str):
+        """allow() for the event loop."""
+        cached = self._cached_allow(slug)
+        if cached:
+            return cached
+        now = time.time()
+        try:
+            decision, state = await self.store.aupdate(slug, lambda r: self._allow(r, now))
+        except Exception as e:
+            self._store_failed(e)
+            return "CALL"
+        return self._allowed(slug, decision, state)
+
+    def record(self, slug: str, ok: bool, probe: bool = False):
+        if (ok and not probe) or self._store_down():
+            return # Successes only matter to half-open probes
+        now = time.time()
+        try:
+            before, after = self.store.update(slug, lambda r: self._record(r, now, ok, probe))
+        except Exception as e:
+            self._store_failed(e)
+            return
+        self._recorded(slug, before, after)
+
+    async def record_async(self, slug: str, ok: bool, probe: bool = False):
+        """record() for the event loop."""
+        if (ok and not probe) or self._store_down():
+            return
+        now = time.time()
+        try:
+            before, after = await self.store.aupdate(slug, lambda r: self._record(r, now, ok, probe))
+        except Exception as e:
+            self._store_failed(e)
+            return
+        self._recorded(slug, before, after)
+
+    def release_probe(self, slug: str):
+        """Gives back a PROBE that never went upstream (e.g. rejected by the quota limiter)."""
+        if self._store_down():
+            return
+        try:
+            self.store.update(slug, self._release)
+        except Exception as e:
+            self._store_failed(e)
+
+    async def release_probe_async(self, slug: str):
+        if self._store_down():
+            return
+        try:
+            await self.store.aupdate(slug, self._release)
+        except Exception as e:
+            self._store_failed(e)
+
+    def state(self, slug: str) -> str:
+        return (self.store.snapshot().get(slug) or _fresh_record())["state"]
+
+    async def state_async(self, slug: str) -> str:
+        return await asyncio.to_thread(self.state, slug)
+
+    def metrics(self):
+        try:
+            states = {slug: {"state": r["state"], "failures": r["failures"], "probes": r["probes"]} for slug, r in self.store.snapshot().items()}
+        except Exception:
+            states = "unavailable"
+        return {"breakers": states, **self.stats}
+
+protean_breakers = CircuitBreakers()
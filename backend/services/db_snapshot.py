@@ -0,0 +1,226 @@
+import os
+import abc
+import time
+import shutil
+import sqlite3
+import asyncio
+import threading
+import tempfile
+
+"""
+SQLITE SNAPSHOT / RESTORE (ComplianceDesk.ai)
+Replaces the boot-time shutil.copy2 of main.db / compliance_vault.db into /tmp.
+
+- Snapshots: consistent hot backups of the live /tmp databases via SQLite's online
+  backup API, shipped to a pluggable object store.
+- Restore: runs in a background thread at boot and swaps the file into place atomically.
+  Only DB access waits for it (wait_ready); /health and /ping answer immediately.
+  It is still a full copy of the snapshot, so the first DB query waits as long as the
+  old boot-time copy did; only the boot itself stopped blocking.
+  Lazy restore (hot pages first) is out of scope: sqlite3 opens a complete local file,
+  so fetching pages on demand from the store needs a custom SQLite VFS, and a base
+  snapshot plus WAL replay needs continuous WAL shipping. Both are infrastructure this
+  module does not have.
+- Store selection: SNAPSHOT_STORE = "file:///path/to/dir" | "gs://bucket/prefix".
+  Without a store, the databases bundled next to app.py are used as the restore seed.
+"""
+
+PAGES_PER_STEP = int(os.getenv("SNAPSHOT_PAGES_PER_STEP", "4096"))
+
+class ObjectStore(abc.ABC):
+    """Minimal blob interface the snapshot manager needs."""
+    @abc.abstractmethod
+    def put_file(self, key: str, local_path: str):
+        ...
+
+    @abc.abstractmethod
+    def get_file(self, key: str, local_path: str) -> bool:
+        ...
+
+    def describe(self) -> str:
+        return self.__class__.__name__
+
+class LocalDirectoryStore(ObjectStore):
+    """Stand-in object store: a directory (e.g. a mounted volume)."""
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def put_file(self, key, local_path):
+        tmp = self._path(key) + ".uploading"
+        shutil.copyfile(local_path, tmp)
+        os.replace(tmp, self._path(key)) # Atomic publish: readers never see a half-written snapshot
+
+    def get_file(self, key, local_path):
+        if not os.path.exists(self._path(key)):
+            return False
+        shutil.copyfile(self._path(key), local_path)
+        return True
+
+    def open_path(self, key):
+        """Local stores can be restored from in place, without a download."""
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+    def describe(self):
+        return f"file://{self.root}"
+
+class GCSStore(ObjectStore):
+    def __init__(self, bucket: str, prefix: str = ""):
+        from google.cloud import storage
+        self.bucket = storage.Client().bucket(bucket)
+        self.prefix = prefix.strip("/")
+
+    def _blob(self, key):
+        return self.bucket.blob(f"{self.prefix}/{key}" if self.prefix else key)
+
+    def put_file(self, key, local_path):
+        self._blob(key).upload_from_filename(local_path)
+
+    def get_file(self, key, local_path):
+        blob = self._blob(key)
+        if not blob.exists():
+            return False
+        blob.download_to_filename(local_path)
+        return True
+
+    def describe(self):
+        return f"gs://{self.bucket.name}/{self.prefix}"
+
+def get_snapshot_store():
+    url = os.getenv("SNAPSHOT_STORE", "")
+    if url.startswith("file://"):
+        return LocalDirectoryStore(url[len("file://"):])
+    if url.startswith("gs://"):
+        bucket, _, prefix = url[len("gs://"):].partition("/")
+        return GCSStore(bucket, prefix)
+    return None
+
+def _backup_file(src_path: str, dest_path: str, pages: int = PAGES_PER_STEP):
+    """
+    Consistent copy of a (possibly live) SQLite database using the online backup API.
+    Copies `pages` pages per step and releases the source lock between steps.
+    """
+    src = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True)
+    dest = sqlite3.connect(dest_path)
+    try:
+        src.backup(dest, pages=pages, sleep=0)
+    finally:
+        dest.close()
+        src.close()
+
+class SnapshotManager:
+    def __init__(self, databases: dict, store: ObjectStore = None, seed_dir: str = None):
+        """
+        databases: snapshot name -> live path, e.g. {"main.db": "/tmp/main.db"}
+        seed_dir: directory holding bundled fallback copies (the app's own folder)
+        """
+        self.databases = databases
+        self.store = store
+        self.seed_dir = seed_dir
+        self._ready = {name: threading.Event() for name in databases}
+        self.stats = {name: {} for name in databases}
+
+    # --- RESTORE ---
+    def start_restore(self):
+        """Kicks off background restores and returns immediately (boot never blocks)."""
+        for name in self.databases:
+            threading.Thread(target=self._restore_safe, args=(name,), name=f"restore-{name}", daemon=True).start()
+
+    def _restore_safe(self, name):
+        try:
+            self.restore(name)
+        except Exception as e:
+            print(f"[SNAPSHOT] Restore of {name} failed: {e}")
+        finally:
+            self._ready[name].set()
+
+    def restore(self, name):
+        live = self.databases[name]
+        start = time.perf_counter()
+        if os.path.exists(live) and os.path.getsize(live) > 0:
+            # Warm instance: /tmp survived, it is newer than any snapshot
+            self.stats[name] = {"source": "local", "seconds": 0.0}
+            return
+
+        source, cleanup, label = self._locate_source(name)
+        if not source:
+            open(live, "a").close()
+            self.stats[name] = {"source": "empty", "seconds": 0.0}
+            return
+        try:
+            partial = live + ".restoring"
+            if os.path.exists(partial):
+                os.remove(partial)
+            # Snapshots and seeds are immutable once published, so a plain file copy is
+            # consistent here; the backup API is only needed when reading a live DB.
+            shutil.copyfile(source, partial)
+            os.replace(partial, live)
+        finally:
+            if cleanup:
+                os.remove(source)
+        self.stats[name] = {"source": label, "seconds": round(time.perf_counter() - start, 3)}
+        print(f"[SNAPSHOT] Restored {name} in {self.stats[name]['seconds']}s")
+
+    def _locate_source(self, name):
+        """Returns (path, is_temp_download, label) for the newest available copy."""
+        if self.store:
+            if isinstance(self.store, LocalDirectoryStore):
+                path = self.store.open_path(name)
+                if path:
+                    return path, False, self.store.describe()
+            else:
+                fd, download = tempfile.mkstemp(suffix=f"-{name}")
+                os.close(fd)
+                if self.store.get_file(name, download):
+                    return download, True, self.store.describe()
+                os.remove(download)
+        if self.seed_dir:
+            seed = os.path.join(self.seed_dir, name)
+            if os.path.exists(seed):
+                return seed, False, "seed"
+        return None, False, None
+
+    def is_ready(self, name) -> bool:
+        return self._ready[name].is_set()
+
+    async def wait_ready(self, name, timeout: float = None):
+        if self._ready[name].is_set():
+            return True
+        return await asyncio.to_thread(self._ready[name].wait, timeout)
+
+    # --- SNAPSHOT ---
+    def snapshot(self, name):
+        """Hot backup of the live DB, then publish to the store."""
+        if not self.store or not self.is_ready(name):
+            return None
+        live = self.databases[name]
+        if not os.path.exists(live):
+            return None
+        start = time.perf_counter()
+        fd, tmp = tempfile.mkstemp(suffix=f"-{name}.snapshot")
+        os.close(fd)
+        try:
+            _backup_file(live, tmp)
+            self.store.put_file(name, tmp)
+        finally:
+            os.remove(tmp)
+        elapsed = round(time.perf_counter() - start, 3)
+        self.stats[name]["last_snapshot_seconds"] = elapsed
+        self.stats[name]["last_snapshot_at"] = time.time()
+        return elapsed
+
+    def snapshot_all(self):
+        for name in self.databases:
+            try:
+                self.snapshot(name)
+            except Exception as e:
+                print(f"[SNAPSHOT] Snapshot of {name} failed: {e}")
+
+    async def run_periodic(self, interval_sec: float):
+        while True:
+            await asyncio.sleep(interval_sec)
+            await asyncio.to_thread(self.snapshot_all)
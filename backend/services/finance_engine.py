@@ -1,4 +1,6 @@
+import os
 import re
+from decimal import Decimal
 
 class FinanceEngine:
     HQ_STATE = "Telangana"
@@ -7,14 +9,15 @@ class FinanceEngine:
     
     # Pricing Tiers (INR)
     PRICES = {
-        "B2C_RETAIL": 99.00,
-        "B2B_KYC": 50.00,
-        "B2B_KYB": 20.00
+        "B2C_RETAIL": Decimal("99.00"),
+        "B2B_KYC": Decimal("50.00"),
+        "B2B_KYB": Decimal("20.00"),
+        "B2B_KYC_BUNDLE": Decimal("150.00") # One applicant, several checks (services/kyc_bundle.py)
     }
 
     @staticmethod
     def get_price(tier):
-        return FinanceEngine.PRICES.get(tier, 99.00)
+        return FinanceEngine.PRICES.get(tier, Decimal("99.00"))
 
     @staticmethod
     async def check_wallet_balance(db, tenant_id, required_amount):
@@ -28,21 +31,19 @@ class FinanceEngine:
         if not tenant:
             return False, "Tenant not found"
         
-        if tenant.wallet_balance < required_amount:
-            return False, f"Insufficient balance. Required: ₹{required_amount}, Current: ₹{tenant.wallet_balance}"
+        from services.wallet import WalletService
+        available = await WalletService.balance(db, tenant_id) # Includes sharded buckets
+        if available < required_amount:
+            return False, f"Insufficient balance. Required: ₹{required_amount}, Current: ₹{available}"
         
         return True, tenant
 
     @staticmethod
     async def deduct_from_wallet(db, tenant_id, amount):
-        success, res = await FinanceEngine.check_wallet_balance(db, tenant_id, amount)
-        if not success:
-            raise Exception(res)
-        
-        tenant = res
-        tenant.wallet_balance -= amount
-        await db.commit()
-        return tenant.wallet_balance
+        # Kept for older callers: atomic reserve + capture (see services/wallet.py)
+        from services.wallet import WalletService
+        await WalletService.debit(db, tenant_id, amount, reference="DEDUCT")
+        return await WalletService.balance(db, tenant_id)
 
     @staticmethod
     def detect_state_from_ocr(ocr_text):
@@ -78,6 +79,7 @@ class FinanceEngine:
         Differentiates Intra-State (CGST+SGST) vs Inter-State (IGST).
         Back-calculates from inclusive price.
         """
+        amount_paid = float(amount_paid)
         taxable_value = round(amount_paid / (1 + FinanceEngine.TAX_RATE), 2)
         total_tax = round(amount_paid - taxable_value, 2)
         
@@ -115,17 +117,121 @@ class FinanceEngine:
                 "state_code": state_code
             }
 
+GSTR1_COLUMNS = [
+    "Invoice No", "Invoice Date", "Payment ID", "Customer", "Mobile", "POS",
+    "Taxable Value", "Tax Type", "CGST", "SGST", "IGST", "Total Amount"
+]
+
+class GSTR1Writer:
+    """
+    Constant-memory GSTR-1 sink. Rows are written as they arrive (openpyxl write-only
+    workbook or csv), so memory stays flat regardless of the month's invoice count.
+    """
+    def __init__(self, period: str, fmt: str = "xlsx"):
+        self.fmt = fmt
+        folder = "" if os.name == 'nt' else "/tmp/"
+        self.path = f"{folder}GSTR1_Report_{period}.{fmt}"
+        self.rows = 0
+        if fmt == "csv":
+            import csv
+            self._file = open(self.path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+        elif fmt == "xlsx":
+            from openpyxl import Workbook
+            self._workbook = Workbook(write_only=True)
+            self._writer = self._workbook.create_sheet("GSTR-1")
+        else:
+            raise ValueError(f"Unsupported GSTR-1 format: {fmt}")
+        self._writer.append(GSTR1_COLUMNS)
+
+    def write_row(self, row: list):
+        if self.fmt == "csv":
+            self._writer.writerow(row)
+        else:
+            self._writer.append(row)
+        self.rows += 1
+
+    def close(self):
+        if self.fmt == "csv":
+            self._file.close()
+        else:
+            self._workbook.save(self.path)
+        return self.path
+
 class ReportingService:
     @staticmethod
-    def export_gstr1(records: list):
+    def gstr1_row(created_at, payment_id, customer_name, mobile_number, place_of_supply, state_code,
+                  base_amount, tax_type, cgst, sgst, igst, total_amount):
+        """Maps one sales_register row (column order of the export query) to a GSTR-1 line."""
+        return [
+            f"CD-{created_at.strftime('%Y%m%d')}-{payment_id[-6:].upper()}",
+            created_at.strftime('%Y-%m-%d'),
+            payment_id,
+            customer_name,
+            mobile_number,
+            f"{place_of_supply} ({state_code})",
+            base_amount,
+            tax_type,
+            cgst or Decimal("0.00"),
+            sgst or Decimal("0.00"),
+            igst or Decimal("0.00"),
+            total_amount,
+        ]
+
+    @staticmethod
+    async def export_gstr1(db, start, end, fmt: str = "xlsx", batch_size: int = 2000):
         """
-        Exports sales register records to Excel in GSTR-1 format.
+        Streams sales_register rows with created_at in [start, end) into a GSTR-1 file.
+        Uses a server-side cursor (yield_per) and a range predicate the created_at index can serve.
+        Returns (path, invoice_count, total_sales); the totals are aggregated in SQL.
         """
-        import pandas as pd
-        df = pd.DataFrame(records)
-        output_file = f"/tmp/GSTR1_Report_{datetime.now().strftime('%Y%m')}.xlsx"
-        if os.name == 'nt':
-            output_file = f"GSTR1_Report_{datetime.now().strftime('%Y%m')}.xlsx"
-        
-        df.to_excel(output_file, index=False)
-        return output_file
+        from sqlalchemy import select, func
+        from models import SalesRegister
+
+        period = (SalesRegister.created_at >= start, SalesRegister.created_at < end)
+        invoice_count, total_sales = (await db.execute(
+            select(func.count(SalesRegister.id), func.sum(SalesRegister.total_amount)).where(*period)
+        )).one()
+
+        stmt = (
+            select(
+                SalesRegister.created_at, SalesRegister.payment_id, SalesRegister.customer_name,
+                SalesRegister.mobile_number, SalesRegister.place_of_supply, SalesRegister.state_code,
+                SalesRegister.base_amount, SalesRegister.tax_type, SalesRegister.cgst,
+                SalesRegister.sgst, SalesRegister.igst, SalesRegister.total_amount
+            )
+            .where(*period)
+            .order_by(SalesRegister.created_at)
+            .execution_options(yield_per=batch_size)
+        )
+
+        writer = GSTR1Writer(start.strftime('%Y%m'), fmt)
+        try:
+            result = await db.stream(stmt)
+            async for partition in result.partitions():
+                for r in partition:
+                    writer.write_row(ReportingService.gstr1_row(*r))
+        finally:
+            path = writer.close()
+        return path, invoice_count, total_sales or Decimal("0.00")
+
+    @staticmethod
+    async def sales_summary(db, start=None, end=None):
+        """Dashboard aggregate: invoice count and money totals per tax type / state, computed in SQL."""
+        from sqlalchemy import select, func
+        from models import SalesRegister
+
+        stmt = select(
+            SalesRegister.tax_type, SalesRegister.state_code,
+            func.count(SalesRegister.id).label("invoices"),
+            func.sum(SalesRegister.total_amount).label("total_amount"),
+            func.sum(SalesRegister.base_amount).label("taxable_value"),
+            func.sum(SalesRegister.cgst).label("cgst"),
+            func.sum(SalesRegister.sgst).label("sgst"),
+            func.sum(SalesRegister.igst).label("igst"),
+        ).group_by(SalesRegister.tax_type, SalesRegister.state_code)
+        if start:
+            stmt = stmt.where(SalesRegister.created_at >= start)
+        if end:
+            stmt = stmt.where(SalesRegister.created_at < end)
+        return [dict(r._mapping) for r in (await db.execute(stmt)).all()]
@@ -14,12 +14,13 @@ class GeminiParserService:
         """
         Extracts structured data (Name, UID, DOB) from raw text using Gemini.
         """
-        api_key = os.environ.get("GEMINI_API_KEY")
+        from services import simulation
+        api_key = os.environ.get("GEMINI_API_KEY") or ("SIMULATED" if simulation.enabled() else None)
         if not api_key:
             return {"error": "GEMINI_API_KEY not set", "status": "FAILED"}
 
         try:
-            genai.configure(api_key=api_key)
+            genai.configure(api_key=api_key, **simulation.genai_options())
             model = genai.GenerativeModel('gemini-pro')
             
             # System Prompt for robustness
@@ -0,0 +1,155 @@
+import os
+import time
+import bisect
+import threading
+
+"""
+PROTEAN TAIL LATENCY (hedged requests + budgeted retries)
+A read-only grid cell (PROTEAN_API_GRID "read_only") that hasn't answered by its own p95
+(PROTEAN_HEDGE_PERCENTILE) gets a second, identical request; the first answer wins and the
+other is cancelled. An upstream error (connection failure, 5xx) on a read-only cell is
+retried once if the cell's typical latency still fits in its timeout.
+
+- Latency: one log-bucketed histogram per slug, fed by every completed attempt. Counts are
+  halved every `decay_every` samples so the threshold follows the provider. No hedging until
+  `min_samples` have been seen.
+- Budget: hedges and retries spend from a per-slug token bucket that earns `ratio` of a token
+  per primary call (plus `min_per_sec` so quiet cells can still hedge). When the provider
+  slows down for everyone, the budget runs dry instead of doubling its load.
+"""
+
+HEDGE_PERCENTILE = float(os.getenv("PROTEAN_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("PROTEAN_HEDGE_MIN_SAMPLES", "50"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("PROTEAN_HEDGE_MIN_DELAY_MS", "10"))
+HEDGE_BUDGET_RATIO = float(os.getenv("PROTEAN_HEDGE_BUDGET_RATIO", "0.1"))
+HEDGE_BUDGET_MIN_PER_SEC = float(os.getenv("PROTEAN_HEDGE_BUDGET_MIN_PER_SEC", "1"))
+HEDGE_BUDGET_BURST = float(os.getenv("PROTEAN_HEDGE_BUDGET_BURST", "20"))
+
+# Bucket upper bounds: 1 ms to ~2 min, 25% apart
+_BOUNDS = []
+_bound = 0.001
+while _bound < 120:
+    _BOUNDS.append(_bound)
+    _bound *= 1.25
+_BOUNDS.append(float("inf"))
+
+class LatencyHistogram:
+    __slots__ = ("counts", "total", "decay_every", "_since_decay")
+
+    def __init__(self, decay_every: int = 2000):
+        self.counts = [0.0] * len(_BOUNDS)
+        self.total = 0.0
+        self.decay_every = decay_every
+        self._since_decay = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(_BOUNDS, seconds)] += 1
+        self.total += 1
+        self._since_decay += 1
+        if self._since_decay >= self.decay_every:
+            self.counts = [c / 2 for c in self.counts]
+            self.total /= 2
+            self._since_decay = 0
+
+    def percentile(self, q: float):
+        """Upper bound of the bucket holding the q-th percentile (seconds), None if empty."""
+        if not self.total:
+            return None
+        rank, seen = self.total * q / 100, 0.0
+        for bound, count in zip(_BOUNDS[:-1], self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return _BOUNDS[-2] # Overflow bucket: report the largest finite bound
+
+class RetryBudget:
+    __slots__ = ("ratio", "min_per_sec", "burst", "tokens", "updated")
+
+    def __init__(self, ratio: float = HEDGE_BUDGET_RATIO, min_per_sec: float = HEDGE_BUDGET_MIN_PER_SEC, burst: float = HEDGE_BUDGET_BURST):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def deposit(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.min_per_sec)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class TailLatencyPolicy:
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, min_samples: int = HEDGE_MIN_SAMPLES, min_delay_ms: float = HEDGE_MIN_DELAY_MS,
+                 budget_ratio: float = HEDGE_BUDGET_RATIO, budget_min_per_sec: float = HEDGE_BUDGET_MIN_PER_SEC, budget_burst: float = HEDGE_BUDGET_BURST):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay_ms / 1000
+        self.budget_args = (budget_ratio, budget_min_per_sec, budget_burst)
+        self._histograms = {}
+        self._budgets = {}
+        self._lock = threading.Lock()
+        self.stats = {"hedges": 0, "hedges_won": 0, "retries": 0, "budget_exhausted": 0}
+
+    def _budget(self, slug):
+        budget = self._budgets.get(slug)
+        if budget is None:
+            budget = self._budgets[slug] = RetryBudget(*self.budget_args)
+        return budget
+
+    def observe(self, slug: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(slug)
+            if histogram is None:
+                histogram = self._histograms[slug] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def started(self, slug: str):
+        """A primary call: earns the slug its share of hedge/retry budget."""
+        with self._lock:
+            self._budget(slug).deposit()
+
+    def hedge_delay(self, slug: str):
+        """Seconds to wait before hedging, or None while the histogram is still cold."""
+        with self._lock:
+            histogram = self._histograms.get(slug)
+            if histogram is None or histogram.total < self.min_samples:
+                return None
+            return max(self.min_delay, histogram.percentile(self.percentile))
+
+    def typical(self, slug: str):
+        with self._lock:
+            histogram = self._histograms.get(slug)
+            return histogram.percentile(50) if histogram is not None else None
+
+    def spend(self, slug: str, kind: str) -> bool:
+        """Takes a token for a hedge or retry; False (and counted) when the budget is dry."""
+        with self._lock:
+            if not self._budget(slug).withdraw():
+                self.stats["budget_exhausted"] += 1
+                return False
+            self.stats["hedges" if kind == "hedge" else "retries"] += 1
+            return True
+
+    def hedge_won(self):
+        with self._lock:
+            self.stats["hedges_won"] += 1
+
+    def metrics(self):
+        with self._lock:
+            latency = {
+                slug: {
+                    "samples": int(h.total),
+                    **{f"p{q}_ms": round(h.percentile(q) * 1000, 1) for q in (50, 95, 99)},
+                    "budget": round(self._budget(slug).tokens, 2),
+                }
+                for slug, h in self._histograms.items()
+            }
+            return {"latency": latency, **self.stats}
+
+protean_tail = TailLatencyPolicy()
@@ -1,95 +1,307 @@
-
 import os
+import time
+import hashlib
 import sqlite3
+import asyncio
+import threading
 import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 
 VAULT_DIR = os.path.join(os.path.dirname(__file__), "..", "user_vaults")
 
+VAULT_MAX_OPEN = int(os.getenv("VAULT_MAX_OPEN", "256"))
+VAULT_IDLE_SEC = float(os.getenv("VAULT_IDLE_SEC", "300"))
+VAULT_WORKERS = int(os.getenv("VAULT_WORKERS", "4"))
+
+VAULT_SHARDS = int(os.getenv("VAULT_SHARDS", "16")) # Fixed: changing it needs a re-partition
+
+VAULT_SCHEMA = (
+    # Table for PVC and non-DPDP documents (all users of the shard)
+    '''
+    CREATE TABLE IF NOT EXISTS user_documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        mobile_number TEXT NOT NULL,
+        doc_type TEXT NOT NULL,
+        doc_path TEXT NOT NULL,
+        issue_date TEXT,
+        expiry_date TEXT,
+        integrity_score REAL,
+        verdict TEXT,
+        metadata_json TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS ix_user_documents_mobile_doc_created
+    ON user_documents (mobile_number, doc_type, created_at)
+    ''',
+    # Profile table (Minimal)
+    '''
+    CREATE TABLE IF NOT EXISTS profile (
+        mobile_number TEXT PRIMARY KEY,
+        applicant_name TEXT,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    # Per-user vault files already folded into this shard (see migrate_vault_shards.py)
+    '''
+    CREATE TABLE IF NOT EXISTS migrated_vaults (
+        mobile_number TEXT PRIMARY KEY,
+        documents INTEGER,
+        migrated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+)
+
+# Column order of the legacy per-user user_documents table (get_latest_pvc row shape)
+DOCUMENT_COLUMNS = "id, doc_type, doc_path, issue_date, expiry_date, integrity_score, verdict, metadata_json, created_at"
+
+class VaultConnectionManager:
+    """
+    Keeps per-vault sqlite3 connections open between requests.
+    - LRU of at most `max_open` connections; the least recently used idle one is
+      closed when a new vault is opened, and any connection idle for `idle_sec` is
+      closed on the next checkout.
+    - Vaults whose schema was created in this process are remembered, so the
+      CREATE TABLE statements run once per file instead of once per save.
+    - A connection is used by one thread at a time (per-connection lock). The async
+      API runs work on a dedicated thread pool so vault I/O never blocks the event loop.
+    """
+    def __init__(self, max_open: int = VAULT_MAX_OPEN, idle_sec: float = VAULT_IDLE_SEC, workers: int = VAULT_WORKERS, schema=VAULT_SCHEMA):
+        self.max_open = max_open
+        self.idle_sec = idle_sec
+        self.workers = workers
+        self.schema = schema
+        self._open = OrderedDict() # path -> [conn, lock, last_used]
+        self._initialized = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._last_idle_check = time.monotonic()
+        self.stats = {"opened": 0, "reused": 0, "closed_lru": 0, "closed_idle": 0, "closed_shutdown": 0, "schema_inits": 0}
+
+    def _connect(self, path):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL") # No journal file create/delete per commit
+        return conn
+
+    def _close_entry(self, path, entry, reason):
+        # Caller holds self._lock and entry's lock
+        del self._open[path]
+        entry[0].close()
+        self.stats[reason] += 1
+
+    def _evict(self, now):
+        # Caller holds self._lock. Busy connections (lock taken) are skipped.
+        if now - self._last_idle_check >= min(self.idle_sec, 30):
+            self._last_idle_check = now
+            for path, entry in list(self._open.items()):
+                if now - entry[2] < self.idle_sec:
+                    break # LRU order: the rest were used more recently
+                if entry[1].acquire(blocking=False):
+                    self._close_entry(path, entry, "closed_idle")
+                    entry[1].release()
+        if len(self._open) > self.max_open:
+            for path, entry in list(self._open.items()):
+                if len(self._open) <= self.max_open:
+                    break
+                if entry[1].acquire(blocking=False):
+                    self._close_entry(path, entry, "closed_lru")
+                    entry[1].release()
+
+    @contextmanager
+    def connection(self, path, create: bool = True):
+        """Yields an open connection for `path` (None if `create` is False and the file doesn't exist)."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                entry = self._open.get(path)
+                if entry is None:
+                    if not create and not os.path.exists(path):
+                        break
+                    entry = [self._connect(path), threading.Lock(), now]
+                    self._open[path] = entry
+                    self.stats["opened"] += 1
+                else:
+                    self._open.move_to_end(path)
+                    self.stats["reused"] += 1
+                entry[2] = now
+                self._evict(now)
+            entry[1].acquire()
+            if self._open.get(path) is entry:
+                break
+            entry[1].release() # Closed by eviction between lookup and lock; retry
+        if entry is None:
+            yield None
+            return
+        try:
+            if path not in self._initialized:
+                for ddl in self.schema:
+                    entry[0].execute(ddl)
+                entry[0].commit()
+                self._initialized.add(path)
+                self.stats["schema_inits"] += 1
+            yield entry[0]
+        finally:
+            entry[2] = time.monotonic()
+            entry[1].release()
+
+    def run_sync(self, path, fn, create: bool = True):
+        with self.connection(path, create=create) as conn:
+            return fn(conn)
+
+    async def run(self, path, fn, create: bool = True):
+        """Runs fn(conn) for the vault at `path` on the vault thread pool."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="vault")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.run_sync, path, fn, create)
+
+    def close_all(self):
+        with self._lock:
+            for path, entry in list(self._open.items()):
+                with entry[1]:
+                    self._close_entry(path, entry, "closed_shutdown")
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def metrics(self):
+        return dict(self.stats, open=len(self._open), initialized=len(self._initialized))
+
+vault_connections = VaultConnectionManager()
+
 class IndividualVaultService:
+    """
+    Users are hash-partitioned over VAULT_SHARDS databases (user_vaults/shard_NN.db)
+    instead of one file per phone number. Per-user files left from before the move
+    are still read until migrate_vault_shards.py has folded them in.
+    """
     @staticmethod
-    def _get_db_path(mobile_number: str):
+    def _vault_key(mobile_number: str):
+        # Clean mobile number (same form the per-user file names used)
+        return mobile_number.replace("+", "").replace(" ", "")
+
+    @staticmethod
+    def _shard_for(vault_key: str) -> int:
+        digest = hashlib.blake2b(vault_key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % VAULT_SHARDS
+
+    @staticmethod
+    def _shard_path(shard: int):
         if not os.path.exists(VAULT_DIR):
-            os.makedirs(VAULT_DIR)
-        # Clean mobile number for filename
-        clean_mob = mobile_number.replace("+", "").replace(" ", "")
-        return os.path.join(VAULT_DIR, f"{clean_mob}.db")
+            os.makedirs(VAULT_DIR, exist_ok=True)
+        return os.path.join(VAULT_DIR, f"shard_{shard:02d}.db")
+
+    @staticmethod
+    def _get_db_path(mobile_number: str):
+        key = IndividualVaultService._vault_key(mobile_number)
+        return IndividualVaultService._shard_path(IndividualVaultService._shard_for(key))
+
+    @staticmethod
+    def _legacy_db_path(mobile_number: str):
+        return os.path.join(VAULT_DIR, f"{IndividualVaultService._vault_key(mobile_number)}.db")
 
     @staticmethod
     def init_user_vault(mobile_number: str):
         db_path = IndividualVaultService._get_db_path(mobile_number)
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Table for PVC and non-DPDP documents
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_documents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                doc_type TEXT NOT NULL,
-                doc_path TEXT NOT NULL,
-                issue_date TEXT,
-                expiry_date TEXT,
-                integrity_score REAL,
-                verdict TEXT,
-                metadata_json TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Profile table (Minimal)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS profile (
-                mobile_number TEXT PRIMARY KEY,
-                applicant_name TEXT,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        vault_connections.run_sync(db_path, lambda conn: None)
+
+    @staticmethod
+    def _write_pvc(conn, mobile_number, name, pvc_data, doc_path):
+        key = IndividualVaultService._vault_key(mobile_number)
+        with conn: # One transaction: profile + document
+            # Update Profile
+            conn.execute('''
+                INSERT OR REPLACE INTO profile (mobile_number, applicant_name, last_updated)
+                VALUES (?, ?, ?)
+            ''', (key, name, datetime.utcnow().isoformat()))
+
+            # Save Document
+            conn.execute('''
+                INSERT INTO user_documents (mobile_number, doc_type, doc_path, issue_date, expiry_date, integrity_score, verdict, metadata_json)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                key,
+                "PVC",
+                doc_path,
+                pvc_data.get("issue_date"),
+                pvc_data.get("expiry_date"),
+                pvc_data.get("integrity_score", 1.0),
+                pvc_data.get("verdict", "GENUINE"),
+                json.dumps(pvc_data)
+            ))
+
+    @staticmethod
+    def _read_latest_pvc(conn, mobile_number):
+        row = conn.execute(f'''
+            SELECT {DOCUMENT_COLUMNS} FROM user_documents
+            WHERE mobile_number = ? AND doc_type = 'PVC' ORDER BY created_at DESC LIMIT 1
+        ''', (IndividualVaultService._vault_key(mobile_number),)).fetchone()
+        return row or IndividualVaultService._read_legacy_latest_pvc(mobile_number)
+
+    @staticmethod
+    def _read_legacy_latest_pvc(mobile_number):
+        # Not yet migrated: read-only look at the old per-user file, if any
+        path = IndividualVaultService._legacy_db_path(mobile_number)
+        if not os.path.exists(path):
+            return None
+        conn = None
+        try:
+            # Opening can fail too: purged since the exists() check, unreadable, not a database
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            return conn.execute(f'''
+                SELECT {DOCUMENT_COLUMNS} FROM user_documents WHERE doc_type = 'PVC' ORDER BY created_at DESC LIMIT 1
+            ''').fetchone()
+        except sqlite3.DatabaseError: # OperationalError included
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
 
     @staticmethod
     def save_pvc(mobile_number: str, name: str, pvc_data: dict, doc_path: str):
-        IndividualVaultService.init_user_vault(mobile_number)
         db_path = IndividualVaultService._get_db_path(mobile_number)
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Update Profile
-        cursor.execute('''
-            INSERT OR REPLACE INTO profile (mobile_number, applicant_name, last_updated)
-            VALUES (?, ?, ?)
-        ''', (mobile_number, name, datetime.utcnow().isoformat()))
-        
-        # Save Document
-        cursor.execute('''
-            INSERT INTO user_documents (doc_type, doc_path, issue_date, expiry_date, integrity_score, verdict, metadata_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            "PVC",
-            doc_path,
-            pvc_data.get("issue_date"),
-            pvc_data.get("expiry_date"),
-            pvc_data.get("integrity_score", 1.0),
-            pvc_data.get("verdict", "GENUINE"),
-            json.dumps(pvc_data)
-        ))
-        
-        conn.commit()
-        conn.close()
+        vault_connections.run_sync(db_path, lambda conn: IndividualVaultService._write_pvc(conn, mobile_number, name, pvc_data, doc_path))
         print(f"✅ PVC saved to individual vault for {mobile_number}")
 
     @staticmethod
     def get_latest_pvc(mobile_number: str):
         db_path = IndividualVaultService._get_db_path(mobile_number)
-        if not os.path.exists(db_path):
-            return None
-        
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM user_documents WHERE doc_type = 'PVC' ORDER BY created_at DESC LIMIT 1
-        ''')
-        row = cursor.fetchone()
-        conn.close()
-        return row
+        return vault_connections.run_sync(db_path, lambda conn: IndividualVaultService._read_latest_pvc(conn, mobile_number))
+
+    @staticmethod
+    def _delete_user(conn, mobile_number):
+        key = IndividualVaultService._vault_key(mobile_number)
+        with conn:
+            deleted = conn.execute("DELETE FROM user_documents WHERE mobile_number = ?", (key,)).rowcount
+            conn.execute("DELETE FROM profile WHERE mobile_number = ?", (key,))
+        legacy_path = IndividualVaultService._legacy_db_path(mobile_number)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        return deleted
+
+    @staticmethod
+    def purge_user(mobile_number: str):
+        """Deletes every document and the profile of one user (DPDP erasure)."""
+        db_path = IndividualVaultService._get_db_path(mobile_number)
+        return vault_connections.run_sync(db_path, lambda conn: IndividualVaultService._delete_user(conn, mobile_number))
+
+    # --- ASYNC API (vault thread pool) ---
+    @staticmethod
+    async def save_pvc_async(mobile_number: str, name: str, pvc_data: dict, doc_path: str):
+        db_path = IndividualVaultService._get_db_path(mobile_number)
+        await vault_connections.run(db_path, lambda conn: IndividualVaultService._write_pvc(conn, mobile_number, name, pvc_data, doc_path))
+        print(f"✅ PVC saved to individual vault for {mobile_number}")
+
+    @staticmethod
+    async def get_latest_pvc_async(mobile_number: str):
+        db_path = IndividualVaultService._get_db_path(mobile_number)
+        return await vault_connections.run(db_path, lambda conn: IndividualVaultService._read_latest_pvc(conn, mobile_number))
+
+    @staticmethod
+    async def purge_user_async(mobile_number: str):
+        db_path = IndividualVaultService._get_db_path(mobile_number)
+        return await vault_connections.run(db_path, lambda conn: IndividualVaultService._delete_user(conn, mobile_number))
@@ -1,18 +1,26 @@
 
 import os
 import requests
+from services import simulation
+
+# With UPSTREAM_SIMULATION set, messages go to the simulated Interakt API (services/simulation.py)
+INTERAKT_SIMULATED_PATH = "/interakt/v1/public/message/"
 
 def send_interakt_reply(user_phone: str, message: str):
     """
     Sends a WhatsApp reply via Interakt API.
     """
     print(f"[INTERAKT] Sending to {user_phone}: {message}")
+    if simulation.enabled():
+        simulation.send(INTERAKT_SIMULATED_PATH, {"countryCode": "+91", "phoneNumber": user_phone[-10:], "type": "Text", "data": {"message": message}})
 
 def send_interakt_document(user_phone: str, document_url: str, filename: str):
     """
     Sends a document via Interakt.
     """
     print(f"[INTERAKT] Sending Document to {user_phone}: {filename} ({document_url})")
+    if simulation.enabled():
+        simulation.send(INTERAKT_SIMULATED_PATH, {"countryCode": "+91", "phoneNumber": user_phone[-10:], "type": "Document", "data": {"message": filename, "mediaUrl": document_url}})
     # Real implementation:
     # url = "https://api.interakt.ai/v1/public/message/"
     # payload = {"phoneNumber": user_phone, "type": "Document", "media": {"url": document_url, "fileName": filename}}
@@ -0,0 +1,134 @@
+import os
+import time
+import asyncio
+
+"""
+KEY ROTATION (PII re-encryption)
+After ACTIVE_ENCRYPTION_KEY_ID moves to a new key, old tokens stay readable through the
+keyring, and this job moves them onto the active key in the background.
+
+- Walks each encrypted column in primary-key batches; tokens already under the active key
+  are skipped without decrypting, so re-runs and steady-state sweeps are cheap.
+- Decrypt/encrypt uses the bulk engine APIs; each batch is written in one short
+  transaction with a compare-and-set (`WHERE col = <old token>`) so a row changed by a
+  request in the meantime is left alone.
+- Throttled by `max_rows_per_sec` plus a pause between batches to keep the SQLite write
+  lock available to request traffic.
+- Values that don't decrypt (e.g. plaintext tenant names on top-up rows) are left as is.
+"""
+
+BATCH_SIZE = int(os.getenv("KEY_ROTATION_BATCH_SIZE", "500"))
+MAX_ROWS_PER_SEC = float(os.getenv("KEY_ROTATION_MAX_ROWS_PER_SEC", "2000"))
+PAUSE_MS = int(os.getenv("KEY_ROTATION_PAUSE_MS", "20"))
+
+_UNREADABLE = object()
+
+class ReencryptionJob:
+    def __init__(self, targets=None, batch_size: int = BATCH_SIZE, max_rows_per_sec: float = MAX_ROWS_PER_SEC, pause_ms: int = PAUSE_MS):
+        self._targets = targets
+        self.batch_size = batch_size
+        self.max_rows_per_sec = max_rows_per_sec
+        self.pause = pause_ms / 1000
+        self.last_run = {}
+        self.totals = {"runs": 0, "values_rotated": 0}
+
+    def targets(self):
+        """[(engine, table, [encrypted columns])]"""
+        if self._targets is None:
+            from database import engine_app, engine_compliance
+            from models import Vault, ComplianceVault, SubjectKey, Verification, VerifiedReport, SalesRegister
+            self._targets = [
+                (engine_app, Vault.__table__, ["pii_json"]),
+                (engine_compliance, ComplianceVault.__table__, ["pii_json"]),
+                (engine_compliance, SubjectKey.__table__, ["wrapped_key"]), # Re-wrapping moves all v3 tokens
+                (engine_app, Verification.__table__, ["applicant_id"]),
+                (engine_app, VerifiedReport.__table__, ["id_number"]),
+                (engine_app, SalesRegister.__table__, ["mobile_number", "customer_name"]),
+            ]
+        return self._targets
+
+    async def rotate_table(self, engine, table, columns):
+        from sqlalchemy import select, update, bindparam
+        from services.security_utils import SecurityUtils
+        pk = list(table.primary_key.columns)[0]
+        stats = {"rows_scanned": 0, "values_rotated": 0, "values_unreadable": 0, "batches": 0}
+        statements = {
+            col: update(table)
+            .where(pk == bindparam("_pk"), table.c[col] == bindparam("_old"))
+            .values({col: bindparam("_new")})
+            for col in columns
+        }
+
+        last_pk = None
+        while True:
+            started = time.perf_counter()
+            query = select(pk, *[table.c[c] for c in columns]).order_by(pk).limit(self.batch_size)
+            if last_pk is not None:
+                query = query.where(pk > last_pk)
+            async with engine.connect() as conn:
+                rows = (await conn.execute(query)).all()
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            stats["rows_scanned"] += len(rows)
+            stats["batches"] += 1
+
+            # Decrypt + re-encrypt outside the write transaction
+            crypto = SecurityUtils.get_crypto_engine()
+            params = {}
+            for i, col in enumerate(columns, start=1):
+                stale = [(r[0], r[i]) for r in rows if crypto.needs_rotation(r[i])]
+                if not stale:
+                    continue
+                plain = crypto.decrypt_many([old for _, old in stale], on_error=_UNREADABLE)
+                readable = [(key, old, p) for (key, old), p in zip(stale, plain) if p is not _UNREADABLE]
+                stats["values_unreadable"] += len(stale) - len(readable)
+                if readable:
+                    fresh = crypto.encrypt_many([p for _, _, p in readable])
+                    params[col] = [{"_pk": key, "_old": old, "_new": new} for (key, old, _), new in zip(readable, fresh)]
+
+            if params:
+                async with engine.begin() as conn:
+                    for col, batch in params.items():
+                        await conn.execute(statements[col], batch)
+                stats["values_rotated"] += sum(len(b) for b in params.values())
+
+            # Throttle: rows/sec ceiling, then a pause for request writers
+            min_duration = len(rows) / self.max_rows_per_sec if self.max_rows_per_sec else 0
+            await asyncio.sleep(max(self.pause, min_duration - (time.perf_counter() - started)))
+        return stats
+
+    async def run(self):
+        started = time.perf_counter()
+        tables = {}
+        for engine, table, columns in self.targets():
+            try:
+                tables[table.name] = await self.rotate_table(engine, table, columns)
+            except Exception as e:
+                tables[table.name] = {"error": str(e)}
+                print(f"[KEY-ROTATION] {table.name} failed: {e}")
+        rotated = sum(t.get("values_rotated", 0) for t in tables.values())
+        from services.security_utils import SecurityUtils
+        self.last_run = {
+            "active_kid": SecurityUtils.get_crypto_engine().active_kid,
+            "values_rotated": rotated,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "tables": tables,
+        }
+        self.totals["runs"] += 1
+        self.totals["values_rotated"] += rotated
+        print(f"[KEY-ROTATION] Re-encrypted {rotated} values onto key {self.last_run['active_kid']}")
+        return self.last_run
+
+    async def run_forever(self, interval_sec: float):
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                print(f"[KEY-ROTATION] Run failed: {e}")
+            await asyncio.sleep(interval_sec)
+
+    def metrics(self):
+        return {"totals": self.totals, "last_run": self.last_run}
+
+reencryption_job = ReencryptionJob()
@@ -0,0 +1,103 @@
+import os
+import inspect
+import asyncio
+from collections import deque
+
+"""
+KEYED DISPATCHER (WhatsApp webhook -> WhatsAppProcessor)
+/whatsapp/hook used to hand every message to BackgroundTasks, so two quick messages from
+one user (a menu choice, then a photo) ran concurrently and could reach the state machine
+in either order.
+
+submit(key, fn, *args) appends the job to the key's mailbox (a deque) and returns at once;
+it never awaits, so jobs queue in the order the webhook handler calls it (after reading the
+request body, so the order in which requests finished arriving).
+- One runner task per non-empty mailbox runs its jobs one at a time, in order.
+- Different keys run in parallel, at most max_workers jobs at once
+  (WHATSAPP_DISPATCH_WORKERS). A worker slot is held per job, not per mailbox, so a chatty
+  user queues behind the others between messages instead of keeping a slot.
+- A mailbox and its runner go away as soon as it is empty; idle users cost nothing.
+- More than max_pending queued jobs (WHATSAPP_DISPATCH_MAX_PENDING): submit() returns
+  False and the webhook answers 503 so Interakt redelivers later.
+Ordering is per process. With several workers, the session lock (services/session_store.py)
+still keeps each interaction atomic.
+"""
+
+DISPATCH_WORKERS = int(os.getenv("WHATSAPP_DISPATCH_WORKERS", "64"))
+DISPATCH_MAX_PENDING = int(os.getenv("WHATSAPP_DISPATCH_MAX_PENDING", "10000"))
+
+class KeyedDispatcher:
+    def __init__(self, max_workers: int = DISPATCH_WORKERS, max_pending: int = DISPATCH_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._mailboxes = {} # key -> deque of (fn, args), only while it has work
+        self._runners = set()
+        self._slots = asyncio.Semaphore(max_workers)
+        self._pending = 0
+        self._running = 0
+        self.stats = {"submitted": 0, "processed": 0, "errors": 0, "rejected": 0, "peak_running": 0, "peak_mailboxes": 0}
+
+    def submit(self, key, fn, *args) -> bool:
+        """Queue fn(*args) behind the key's earlier jobs. False if the dispatcher is full."""
+        if self._pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            return False
+        mailbox = self._mailboxes.get(key)
+        if mailbox is None:
+            mailbox = self._mailboxes[key] = deque()
+            runner = asyncio.get_running_loop().create_task(self._run(key, mailbox))
+            self._runners.add(runner)
+            runner.add_done_callback(self._runners.discard)
+            self.stats["peak_mailboxes"] = max(self.stats["peak_mailboxes"], len(self._mailboxes))
+        mailbox.append((fn, args))
+        self._pending += 1
+        self.stats["submitted"] += 1
+        return True
+
+    async def _run(self, key, mailbox):
+        try:
+            while mailbox:
+                fn, args = mailbox.popleft()
+                try:
+                    async with self._slots:
+                        self._running += 1
+                        self.stats["peak_running"] = max(self.stats["peak_running"], self._running)
+                        try:
+                            result = fn(*args)
+                            if inspect.isawaitable(result):
+                                await result
+                            self.stats["processed"] += 1
+                        except Exception as e:
+                            # One failed message must not stall the rest of the user's mailbox
+                            self.stats["errors"] += 1
+                            print(f"[DISPATCH] {getattr(fn, '__name__', fn)} failed for ...{str(key)[-4:]}: {e}")
+                        finally:
+                            self._running -= 1
+                finally:
+                    self._pending -= 1
+        finally:
+            # No await between the empty check and here: a concurrent submit() either made
+            # it into this mailbox (and ran above) or will open a new one
+            if self._mailboxes.get(key) is mailbox:
+                del self._mailboxes[key]
+            self._pending -= len(mailbox)
+
+    async def drain(self, timeout: float = None) -> int:
+        """Wait for every queued job (e.g. at shutdown). Returns how many jobs were still pending."""
+        deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
+        while self._runners:
+            remaining = None if deadline is None else deadline - asyncio.get_running_loop().time()
+            if remaining is not None and remaining <= 0:
+                break
+            await asyncio.wait(set(self._runners), timeout=remaining)
+        if self._pending:
+            print(f"[DISPATCH] {self._pending} WhatsApp messages still queued after {timeout}s")
+        return self._pending
+
+    def __len__(self):
+        return len(self._mailboxes)
+
+    def metrics(self):
+        return dict(self.stats, mailboxes=len(self._mailboxes), pending=self._pending, running=self._running, max_workers=self.max_workers)
+
+whatsapp_dispatcher = KeyedDispatcher()
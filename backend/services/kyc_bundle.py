@@ -0,0 +1,157 @@
+import time
+import uuid
+import asyncio
+
+"""
+KYC BUNDLES (/api/v1/b2b/bundle/{bundle})
+A tenant submits one applicant and a named bundle of grid checks. Checks that do not depend
+on each other run concurrently, so the bundle takes about as long as its slowest chain
+instead of the sum of its checks. A check listed in "after" starts as soon as those checks
+finish and reads their results (e.g. name_match compares the applicant's name with the name
+on the voter record).
+
+- A check whose input is missing, or whose dependency did not succeed, is SKIPPED.
+- The bundle is COMPLETED when every check reached a verdict: SUCCESS or FAILED upstream, or
+  skipped because a dependency FAILED. Otherwise (upstream error, breaker open, quota) it is
+  PARTIAL. The endpoint holds the bundle price once and captures it only for COMPLETED bundles.
+- Calls go through gateway.execute_async with the tenant's quota, result cache and breakers.
+  They are not queued when a breaker is open: a bundle answers now or comes back PARTIAL.
+"""
+
+def _record_name(result):
+    data = result.get("data") or {}
+    return data.get("name") or data.get("full_name") or data.get("owner_name")
+
+def _name_match_after(check):
+    """name_match input: the applicant's name vs the name on `check`'s record."""
+    def build(applicant, results):
+        on_record = _record_name(results[check])
+        return {"name1": applicant["name"], "name2": on_record} if on_record else None
+    return build
+
+# bundle -> {"tier": price tier, "checks": {check: {"slug", "fields", "after", "build(applicant, results)"}}}
+# "fields": applicant keys the check reads; "build" returning None skips the check
+KYC_BUNDLES = {
+    "director_kyc": {
+        "tier": "B2B_KYC_BUNDLE",
+        "checks": {
+            "voter_id": {"slug": "voter_id", "fields": ["epic_number"], "build": lambda a, r: {"epic_number": a["epic_number"]}},
+            "name_match": {"slug": "name_match", "fields": ["name"], "after": ["voter_id"], "build": _name_match_after("voter_id")},
+            "face_liveness": {"slug": "face_liveness", "fields": ["selfie"], "build": lambda a, r: {"image": a["selfie"]}},
+            "mobile_verify": {"slug": "mobile_verify", "fields": ["mobile"], "build": lambda a, r: {"mobile": a["mobile"], "name": a.get("name")}},
+        },
+    },
+    "vehicle_owner": {
+        "tier": "B2B_KYC_BUNDLE",
+        "checks": {
+            "vehicle_rc": {"slug": "vehicle_rc", "fields": ["rc_number"], "build": lambda a, r: {"rc_number": a["rc_number"]}},
+            "owner_match": {"slug": "name_match", "fields": ["name"], "after": ["vehicle_rc"], "build": _name_match_after("vehicle_rc")},
+            "mobile_verify": {"slug": "mobile_verify", "fields": ["mobile"], "build": lambda a, r: {"mobile": a["mobile"], "name": a.get("name")}},
+        },
+    },
+    "employee_onboarding": {
+        "tier": "B2B_KYC_BUNDLE",
+        "checks": {
+            "voter_id": {"slug": "voter_id", "fields": ["epic_number"], "build": lambda a, r: {"epic_number": a["epic_number"]}},
+            "name_match": {"slug": "name_match", "fields": ["name"], "after": ["voter_id"], "build": _name_match_after("voter_id")},
+            "mobile_verify": {"slug": "mobile_verify", "fields": ["mobile"], "build": lambda a, r: {"mobile": a["mobile"], "name": a.get("name")}},
+            "email_fraud": {"slug": "email_fraud", "fields": ["email"], "build": lambda a, r: {"email": a["email"]}},
+            "employer": {"slug": "epfo_search", "fields": ["employer"], "build": lambda a, r: {"establishment_name": a["employer"]}},
+        },
+    },
+}
+
+def _validate(bundles):
+    """Unknown grid slugs, unknown dependencies and cycles fail at import, not mid-request."""
+    from services.protean_service import PROTEAN_API_GRID
+    for name, bundle in bundles.items():
+        checks = bundle["checks"]
+        for check, spec in checks.items():
+            if spec["slug"] not in PROTEAN_API_GRID:
+                raise ValueError(f"Bundle {name}: {check} uses unknown grid slug {spec['slug']!r}")
+            for dep in spec.get("after", []):
+                if dep not in checks:
+                    raise ValueError(f"Bundle {name}: {check} depends on unknown check {dep!r}")
+        done = set()
+        while len(done) < len(checks):
+            ready = [c for c, spec in checks.items() if c not in done and set(spec.get("after", [])) <= done]
+            if not ready:
+                raise ValueError(f"Bundle {name}: dependency cycle among {sorted(set(checks) - done)}")
+            done.update(ready)
+
+_validate(KYC_BUNDLES)
+
+def describe(bundle_name: str = None) -> dict:
+    """Bundle catalogue for clients: checks, dependencies and the applicant fields needed."""
+    from services.finance_engine import FinanceEngine
+    names = [bundle_name] if bundle_name else list(KYC_BUNDLES)
+    return {
+        name: {
+            "price": str(FinanceEngine.get_price(KYC_BUNDLES[name]["tier"])),
+            "fields": required_fields(name),
+            "checks": {check: {"slug": spec["slug"], "after": spec.get("after", [])} for check, spec in KYC_BUNDLES[name]["checks"].items()},
+        }
+        for name in names
+    }
+
+def required_fields(bundle_name: str) -> list:
+    fields = []
+    for spec in KYC_BUNDLES[bundle_name]["checks"].values():
+        fields += [f for f in spec["fields"] if f not in fields]
+    return fields
+
+def missing_fields(bundle_name: str, applicant: dict) -> list:
+    """Raises KeyError for an unknown bundle."""
+    return [f for f in required_fields(bundle_name) if applicant.get(f) in (None, "")]
+
+async def run_bundle(bundle_name: str, applicant: dict, tenant_id=None, gateway=None) -> dict:
+    """
+    Runs every check of the bundle as a DAG and returns the merged report:
+    {"bundle_id", "bundle", "status": COMPLETED|PARTIAL, "verdict": PASS|FAIL|INCOMPLETE,
+     "elapsed_ms", "checks": {check: {"slug", "status", "started_ms", "elapsed_ms", "result"|"reason"}}}
+    Unknown bundles raise KeyError.
+    """
+    if gateway is None:
+        from services.protean_service import gateway
+    checks = KYC_BUNDLES[bundle_name]["checks"]
+    results = {}
+    start = time.perf_counter()
+
+    async def run(check):
+        spec = checks[check]
+        deps = spec.get("after", [])
+        if deps:
+            await asyncio.gather(*(tasks[dep] for dep in deps))
+        entry = {"slug": spec["slug"], "started_ms": round((time.perf_counter() - start) * 1000, 1)}
+        blocked = [dep for dep in deps if results[dep]["status"] != "SUCCESS"]
+        payload = None if blocked else spec["build"](applicant, {dep: results[dep]["result"] for dep in deps})
+        if blocked:
+            # A dependency that FAILED is a verdict (nothing to match against); anything else is not
+            verdict = all(results[dep]["status"] in ("FAILED", "SKIPPED") and results[dep].get("verdict") for dep in blocked)
+            entry.update(status="SKIPPED", verdict=verdict, reason=f"{', '.join(blocked)} did not succeed")
+        elif payload is None:
+            entry.update(status="SKIPPED", verdict=False, reason="input not available from " + ", ".join(deps))
+        else:
+            try:
+                result = await gateway.execute_async(spec["slug"], payload, tenant_id=tenant_id)
+            except Exception as e:
+                result = {"status": "ERROR", "message": str(e)}
+            status = result.get("status")
+            entry.update(status=status if status in ("SUCCESS", "FAILED") else "ERROR", verdict=status in ("SUCCESS", "FAILED"), result=result)
+        entry["elapsed_ms"] = round((time.perf_counter() - start) * 1000 - entry["started_ms"], 1)
+        results[check] = entry
+
+    # Every task exists before any of them runs, so dependents can await their inputs' tasks
+    tasks = {check: asyncio.ensure_future(run(check)) for check in checks}
+    await asyncio.gather(*tasks.values())
+
+    completed = all(entry["verdict"] for entry in results.values())
+    passed = all(entry["status"] == "SUCCESS" for entry in results.values())
+    return {
+        "bundle_id": uuid.uuid4().hex,
+        "bundle": bundle_name,
+        "status": "COMPLETED" if completed else "PARTIAL",
+        "verdict": "INCOMPLETE" if not completed else ("PASS" if passed else "FAIL"),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+        "checks": {check: {k: v for k, v in results[check].items() if k != "verdict"} for check in checks},
+    }
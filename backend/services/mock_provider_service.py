@@ -48,3 +48,17 @@ class MockProviderService:
             "verified_at": datetime.utcnow().isoformat(),
             "source": "MOCK_PROTEAN_GATEWAY"
         }
+
+    @staticmethod
+    async def verify_id_async(id_type: str, id_number: str) -> dict:
+        """
+        verify_id for request handlers: with UPSTREAM_SIMULATION set, the answer comes from the
+        simulated truth source (network latency, errors, throttling) instead of instantly.
+        """
+        from services import simulation
+        if not simulation.enabled():
+            return MockProviderService.verify_id(id_type, id_number)
+        try:
+            return await simulation.apost("/truth/v1/verify-id", {"id_type": id_type, "id_number": id_number})
+        except Exception as e:
+            return {"status": "ERROR", "message": f"Truth source unavailable: {e}"}
@@ -142,24 +142,19 @@ async def process_niti_wizard(payload: dict, db_compliance):
     Background task to handle Niti Wizard logic and send Interakt reply.
     """
     from services.interakt import send_interakt_reply
-    # In a real app, we'd import and use USER_SESSIONS from a persistent store (Redis)
-    # For this demo, we'll assume a global or imported session dict
-    from app import USER_SESSIONS 
+    from services.session_store import session_store
 
     data = payload.get('data', {})
     user_phone = data.get('customer', {}).get('channel_phone_number')
     message = data.get('message', {}).get('text', "")
     
-    # 1. Retrieve or Start Session
-    session = USER_SESSIONS.get(user_phone, {"state": "NITI_START", "context": {}})
-    state = session["state"]
-    context = session["context"]
+    # 1. Retrieve or Start Session (locked until persisted)
+    async with session_store.session(user_phone, default_state="NITI_START") as session:
+        # 2. Process via Wizard
+        response_text, next_state, context = NitiWizardService.process_message(user_phone, message, session.state, session.context)
 
-    # 2. Process via Wizard
-    response_text, next_state, context = NitiWizardService.process_message(user_phone, message, state, context)
-
-    # 3. Persist Session
-    USER_SESSIONS[user_phone] = {"state": next_state, "context": context}
+        # 3. Persist Session
+        session.state, session.context = next_state, context
 
     # 4. Reply via Interakt
     send_interakt_reply(user_phone, response_text)
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+"""
+PROTEAN RESULT CACHE
+Idempotent grid cells (PROTEAN_API_GRID entries with a "cache_ttl") answer from here until
+the TTL runs out, instead of paying upstream latency and provider fees on every repeat.
+
+- Key: SecurityUtils.blind_index of the cell's normalized input, scoped per slug. It is a
+  keyed HMAC, so RC numbers, EPICs or names never appear in cache keys.
+- Tier 1: in-process LRU + TTL. Tier 2 (optional, PROTEAN_CACHE_REDIS_URL): shared by all
+  workers, values encrypted with SecurityUtils (they carry PII) and expired by Redis.
+- Only SUCCESS responses are cached.
+- Single flight: concurrent identical lookups share one upstream call (an asyncio future for
+  execute_async, an event per key for the sync wrappers).
+- Responses carry "cache": HIT, MISS, COALESCED or BYPASS. Callers bill and audit on the
+  response status as before, so cache hits are billed and audited like upstream calls.
+"""
+
+PROTEAN_CACHE_SIZE = int(os.getenv("PROTEAN_CACHE_SIZE", "50000"))
+PROTEAN_CACHE_REDIS_URL = os.getenv("PROTEAN_CACHE_REDIS_URL")
+_IGNORED_FIELDS = ("consent", "client_ref_id")
+
+try:
+    import redis
+    import redis.asyncio as aioredis
+except ImportError:
+    redis = aioredis = None
+
+class _Flight:
+    __slots__ = ("event", "result")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+class ProteanResultCache:
+    def __init__(self, max_entries: int = PROTEAN_CACHE_SIZE, redis_url: str = PROTEAN_CACHE_REDIS_URL, redis_client=None, async_redis_client=None):
+        self.max_entries = max_entries
+        self.redis_url = redis_url
+        self._redis = redis_client
+        self._aredis = async_redis_client
+        self._entries = OrderedDict() # key -> (response, expires_at)
+        self._lock = threading.Lock()
+        self._flights = {} # Sync single flight: key -> _Flight
+        self._futures = {} # Async single flight: key -> Future
+        self.stats = {"hits": 0, "redis_hits": 0, "misses": 0, "coalesced": 0, "stored": 0, "redis_errors": 0}
+
+    @staticmethod
+    def key(api_slug: str, data: dict) -> str:
+        """Keyed hash of the normalized input (whitespace collapsed, case-folded, sorted fields)."""
+        from services.security_utils import SecurityUtils
+        normalized = {
+            k: " ".join(str(v).split()).upper() if isinstance(v, str) else v
+            for k, v in data.items() if k not in _IGNORED_FIELDS and v is not None
+        }
+        return SecurityUtils.blind_index(json.dumps(normalized, sort_keys=True, separators=(",", ":")), f"protean:{api_slug}")
+
+    # --- TIER 1 ---
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[1]:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _put_local(self, key, response, ttl):
+        with self._lock:
+            self._entries[key] = (response, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # --- TIER 2 ---
+    def _redis_sync(self):
+        if self._redis is None and self.redis_url and redis is not None:
+            self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=0.2)
+        return self._redis
+
+    def _redis_async(self):
+        if self._aredis is None and self.redis_url and aioredis is not None:
+            self._aredis = aioredis.Redis.from_url(self.redis_url, socket_timeout=0.2)
+        return self._aredis
+
+    @staticmethod
+    def _redis_key(api_slug, key):
+        return f"protean:{api_slug}:{key}"
+
+    @staticmethod
+    def _seal(response):
+        from services.security_utils import SecurityUtils
+        return SecurityUtils.encrypt_pii(json.dumps(response))
+
+    @staticmethod
+    def _open(value):
+        from services.security_utils import SecurityUtils
+        if isinstance(value, bytes):
+            value = value.decode()
+        return json.loads(SecurityUtils.decrypt_pii(value))
+
+    def _get_shared(self, api_slug, key, ttl):
+        client = self._redis_sync()
+        if client is None:
+            return None
+        try:
+            value = client.get(self._redis_key(api_slug, key))
+            if value is None:
+                return None
+            response = self._open(value)
+        except Exception as e:
+            self.stats["redis_errors"] += 1
+            print(f"[PROTEAN-CACHE] Shared tier unavailable: {e}")
+            return None
+        self.stats["redis_hits"] += 1
+        self._put_local(key, response, ttl)
+        return response
+
+    async def _get_shared_async(self, api_slug, key, ttl):
+        client = self._redis_async()
+        if client is None:
+            return None
+        try:
+            value = await client.get(self._redis_key(api_slug, key))
+            if value is None:
+                return None
+            response = self._open(value)
+        except Exception as e:
+            self.stats["redis_errors"] += 1
+            print(f"[PROTEAN-CACHE] Shared tier unavailable: {e}")
+            return None
+        self.stats["redis_hits"] += 1
+        self._put_local(key, response, ttl)
+        return response
+
+    def _store(self, key, response, ttl) -> bool:
+        """Caches SUCCESS responses locally; True if the shared tier should get it too."""
+        if not isinstance(response, dict) or response.get("status") != "SUCCESS":
+            return False
+        self._put_local(key, response, ttl)
+        self.stats["stored"] += 1
+        return True
+
+    # --- PUBLIC API ---
+    def get_or_fetch(self, api_slug: str, grid_cell: dict, data: dict, fetch):
+        """Sync path (ProteanGateway.execute). `fetch()` performs the upstream call."""
+        ttl = grid_cell["cache_ttl"]
+        key = self.key(api_slug, data)
+        response = self._get_local(key)
+        if response is not None:
+            self.stats["hits"] += 1
+            return dict(response, cache="HIT")
+
+        with self._lock:
+            flight = self._flights.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._flights[key] = _Flight()
+        if not owner:
+            flight.event.wait()
+            self.stats["coalesced"] += 1
+            return dict(flight.result, cache="COALESCED")
+
+        status, stored = "HIT", False
+        try:
+            flight.result = self._get_shared(api_slug, key, ttl)
+            if flight.result is None:
+                status = "MISS"
+                self.stats["misses"] += 1
+                flight.result = fetch()
+                stored = self._store(key, flight.result, ttl)
+            else:
+                self.stats["hits"] += 1
+        except Exception as e:
+            flight.result = {"status": "ERROR", "message": str(e)}
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+        if stored and self._redis_sync() is not None:
+            try:
+                self._redis_sync().set(self._redis_key(api_slug, key), self._seal(flight.result), ex=int(ttl))
+            except Exception:
+                self.stats["redis_errors"] += 1
+        return dict(flight.result, cache=status)
+
+    async def get_or_fetch_async(self, api_slug: str, grid_cell: dict, data: dict, fetch):
+        """Async path (ProteanGateway.execute_async). `fetch()` returns the upstream coroutine."""
+        ttl = grid_cell["cache_ttl"]
+        key = self.key(api_slug, data)
+        response = self._get_local(key)
+        if response is not None:
+            self.stats["hits"] += 1
+            return dict(response, cache="HIT")
+
+        future = self._futures.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return dict(await asyncio.shield(future), cache="COALESCED")
+
+        future = self._futures[key] = asyncio.get_running_loop().create_future()
+        result = {"status": "ERROR", "message": "Upstream call cancelled"}
+        status, stored = "HIT", False
+        try:
+            result = await self._get_shared_async(api_slug, key, ttl)
+            if result is None:
+                status = "MISS"
+                self.stats["misses"] += 1
+                result = await fetch()
+                stored = self._store(key, result, ttl)
+            else:
+                self.stats["hits"] += 1
+        except Exception as e:
+            result = {"status": "ERROR", "message": str(e)}
+        finally:
+            # Waiters are released even if this caller was cancelled
+            self._futures.pop(key, None)
+            future.set_result(result)
+        if stored and self._redis_async() is not None:
+            try:
+                await self._redis_async().set(self._redis_key(api_slug, key), self._seal(result), ex=int(ttl))
+            except Exception:
+                self.stats["redis_errors"] += 1
+        return dict(result, cache=status)
+
+    def invalidate(self, api_slug: str = None, data: dict = None):
+        if api_slug is None:
+            with self._lock:
+                self._entries.clear()
+            return
+        key = self.key(api_slug, data)
+        with self._lock:
+            self._entries.pop(key, None)
+        client = self._redis_sync()
+        if client is not None:
+            try:
+                client.delete(self._redis_key(api_slug, key))
+            except Exception:
+                self.stats["redis_errors"] += 1
+
+    def metrics(self):
+        return dict(self.stats, cached=len(self._entries), shared_tier=bool(self.redis_url or self._redis is not None))
+
+result_cache = ProteanResultCache()
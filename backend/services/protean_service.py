@@ -3,6 +3,16 @@ import json
 import jwt
 import time
 import os
+import asyncio
+import threading
+import importlib.util
+import httpx
+from services.protean_cache import result_cache
+from services.circuit_breaker import protean_breakers
+from services.retry_queue import retry_queue
+from services.hedging import protean_tail
+from services.rate_limiter import QuotaLimiter, QuotaExceeded
+from services import simulation
 
 """
 PROTEAN GRID GATEWAY (ComplianceDesk.ai)
@@ -15,76 +25,284 @@ Architecture: Grid/Adapter Pattern
 # ---------------------------------------------------------
 PROTEAN_API_GRID = {
     # Core KYC/KYB
-    "vehicle_rc": {"url": "/v1/kyc/vehicle-rc-advanced", "method": "POST", "required": ["rc_number"]},
-    "kyc_ocr": {"url": "/v1/ocr/kyc-ocr-plus", "method": "POST", "required": ["file_data", "file_type"]},
-    "epfo_search": {"url": "/v1/employment/epfo-search", "method": "POST", "required": ["establishment_name"]},
-    "mobile_verify": {"url": "/v1/telecom/mobile-verification", "method": "POST", "required": ["mobile"]},
+    "vehicle_rc": {"url": "/v1/kyc/vehicle-rc-advanced", "method": "POST", "required": ["rc_number"], "cache_ttl": 21600, "read_only": True},
+    "kyc_ocr": {"url": "/v1/ocr/kyc-ocr-plus", "method": "POST", "required": ["file_data", "file_type"], "timeout": 30},
+    "epfo_search": {"url": "/v1/employment/epfo-search", "method": "POST", "required": ["establishment_name"], "cache_ttl": 86400, "read_only": True},
+    "mobile_verify": {"url": "/v1/telecom/mobile-verification", "method": "POST", "required": ["mobile"], "read_only": True},
     
     # Utilities Grid
-    "electricity_bill": {"url": "/v1/utility/electricity-bill", "method": "POST", "required": ["consumer_id", "provider_id"]},
-    "png_verify": {"url": "/v1/utility/png-verification", "method": "POST", "required": ["consumer_id"]},
+    "electricity_bill": {"url": "/v1/utility/electricity-bill", "method": "POST", "required": ["consumer_id", "provider_id"], "cache_ttl": 3600, "read_only": True},
+    "png_verify": {"url": "/v1/utility/png-verification", "method": "POST", "required": ["consumer_id"], "cache_ttl": 3600, "read_only": True},
     
     # Professional Grid
-    "icsi_membership": {"url": "/v1/professional/icsi-membership", "method": "POST", "required": ["membership_number"]},
-    "shop_establishment": {"url": "/v1/business/shop-establishment", "method": "POST", "required": ["registration_number", "state_code"]},
+    "icsi_membership": {"url": "/v1/professional/icsi-membership", "method": "POST", "required": ["membership_number"], "cache_ttl": 86400, "read_only": True},
+    "shop_establishment": {"url": "/v1/business/shop-establishment", "method": "POST", "required": ["registration_number", "state_code"], "cache_ttl": 86400, "read_only": True},
     
     # Identity & Fraud Grid
-    "voter_id": {"url": "/v1/kyc/voter-id-verify", "method": "POST", "required": ["epic_number"]},
-    "name_match": {"url": "/v1/identity/name-match", "method": "POST", "required": ["name1", "name2"]},
-    "face_liveness": {"url": "/v1/biometric/face-liveness-passive", "method": "POST", "required": ["image"]},
-    "email_fraud": {"url": "/v1/fraud/email-fraud-check", "method": "POST", "required": ["email"]},
+    "voter_id": {"url": "/v1/kyc/voter-id-verify", "method": "POST", "required": ["epic_number"], "cache_ttl": 86400, "read_only": True},
+    "name_match": {"url": "/v1/identity/name-match", "method": "POST", "required": ["name1", "name2"], "cache_ttl": 604800, "read_only": True},
+    "face_liveness": {"url": "/v1/biometric/face-liveness-passive", "method": "POST", "required": ["image"], "timeout": 30},
+    "email_fraud": {"url": "/v1/fraud/email-fraud-check", "method": "POST", "required": ["email"], "cache_ttl": 3600, "read_only": True},
     
     # Logistics Grid
-    "vehicle_reverse_rc": {"url": "/v1/kyc/vehicle-reverse-rc", "method": "POST", "required": ["engine_number", "chassis_number"]},
+    "vehicle_reverse_rc": {"url": "/v1/kyc/vehicle-reverse-rc", "method": "POST", "required": ["engine_number", "chassis_number"], "cache_ttl": 21600, "read_only": True},
     
     # Workflow Grid
-    "esign_pro": {"url": "/v1/workflow/esign-pro", "method": "POST", "required": ["document_data"]}
+    "esign_pro": {"url": "/v1/workflow/esign-pro", "method": "POST", "required": ["document_data"], "timeout": 45}
 }
 
+# "cache_ttl": seconds an answer stays valid (services/protean_cache.py); cells without it always go upstream
+# "read_only": no side effects upstream, so a duplicate request is safe (hedging/retries, services/hedging.py)
+# Read timeout for cells without their own "timeout"; connects fail fast everywhere
+PROTEAN_TIMEOUT_SEC = float(os.getenv("PROTEAN_TIMEOUT_SEC", "10"))
+PROTEAN_CONNECT_TIMEOUT_SEC = float(os.getenv("PROTEAN_CONNECT_TIMEOUT_SEC", "3"))
+# Small pool: with keep-alive (and HTTP/2 multiplexing) a few connections carry hundreds of
+# in-flight calls, and the pool scan cost grows with its size
+PROTEAN_MAX_CONNECTIONS = int(os.getenv("PROTEAN_MAX_CONNECTIONS", "20"))
+
+# Provider quotas (calls/second, burst) enforced before each upstream call (services/rate_limiter.py).
+# Slugs not listed share "default"'s rate each; "tenant" applies per B2B tenant across all slugs.
+# PROTEAN_QUOTAS (JSON, same shape) replaces this table, e.g. when the contract changes.
+PROTEAN_QUOTAS = json.loads(os.getenv("PROTEAN_QUOTAS", "null")) or {
+    "default": {"rate": 10, "burst": 20},
+    "tenant": {"rate": 25, "burst": 50},
+    "vehicle_rc": {"rate": 50, "burst": 100},
+    "mobile_verify": {"rate": 50, "burst": 100},
+    "epfo_search": {"rate": 20, "burst": 40},
+    "kyc_ocr": {"rate": 5, "burst": 10},
+    "face_liveness": {"rate": 5, "burst": 10},
+}
+protean_quota = QuotaLimiter(PROTEAN_QUOTAS)
+
+def slug_timeout(grid_cell: dict) -> httpx.Timeout:
+    return httpx.Timeout(grid_cell.get("timeout", PROTEAN_TIMEOUT_SEC), connect=PROTEAN_CONNECT_TIMEOUT_SEC)
+
+# HTTP/2 is negotiated via ALPN when the h2 package is installed
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# ---------------------------------------------------------
+# 2. TOKEN MANAGER (OAuth access token cache)
+# ---------------------------------------------------------
+class ProteanTokenManager:
+    """
+    Caches the access token until `expiry_skew_sec` before it expires.
+    - Single flight: concurrent callers that find no usable token share one token request
+      (threads wait on a lock, coroutines await one shared task).
+    - Early refresh: within `refresh_ahead_sec` of expiry the cached token is still served
+      while one background refresh fetches the next one.
+    - invalidate(token) drops the token after a 401; only the first caller reporting a given
+      token clears it, so a burst of 401s triggers one refresh.
+    `fetch()` returns (access_token, expires_in_seconds) or raises; `afetch` is its optional
+    coroutine twin, used by get_token_async() instead of running `fetch` in a thread.
+    """
+    def __init__(self, fetch, afetch=None, expiry_skew_sec: float = 30, refresh_ahead_sec: float = 60):
+        self.fetch = fetch
+        self.afetch = afetch
+        self.expiry_skew_sec = expiry_skew_sec
+        self.refresh_ahead_sec = refresh_ahead_sec
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._task = None
+        self.stats = {"hits": 0, "fetches": 0, "early_refreshes": 0, "invalidations": 0, "fetch_errors": 0}
+
+    def _usable(self, now):
+        return self._token is not None and now < self._expires_at - self.expiry_skew_sec
+
+    def _store(self, token, expires_in):
+        self._token = token
+        self._expires_at = time.monotonic() + float(expires_in or 300)
+        self.stats["fetches"] += 1
+        return token
+
+    def _maybe_refresh_early(self, now):
+        # Non-blocking: callers holding a valid token never wait on the refresh
+        if now >= self._expires_at - self.expiry_skew_sec - self.refresh_ahead_sec and self._refreshing.acquire(blocking=False):
+            threading.Thread(target=self._refresh_early, name="protean-token", daemon=True).start()
+
+    def _refresh_early(self):
+        try:
+            with self._lock:
+                self._store(*self.fetch())
+                self.stats["early_refreshes"] += 1
+        except Exception as e:
+            self.stats["fetch_errors"] += 1
+            print(f"Auth Refresh Failed: {str(e)}")
+        finally:
+            self._refreshing.release()
+
+    def get_token(self):
+        now = time.monotonic()
+        if self._usable(now):
+            self.stats["hits"] += 1
+            self._maybe_refresh_early(now)
+            return self._token
+        with self._lock:
+            if self._usable(time.monotonic()): # Fetched while we waited
+                self.stats["hits"] += 1
+                return self._token
+            return self._store(*self.fetch())
+
+    async def get_token_async(self):
+        now = time.monotonic()
+        if self._usable(now):
+            self.stats["hits"] += 1
+            self._maybe_refresh_early(now)
+            return self._token
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._fetch_async())
+        return await asyncio.shield(self._task)
+
+    async def _fetch_async(self):
+        if self.afetch is not None:
+            try:
+                return self._store(*(await self.afetch()))
+            except Exception:
+                self.stats["fetch_errors"] += 1
+                raise
+        # The blocking fetch runs off the event loop; the lock keeps it single-flight with sync callers
+        def locked_fetch():
+            with self._lock:
+                if self._usable(time.monotonic()):
+                    return self._token
+                return self._store(*self.fetch())
+        return await asyncio.to_thread(locked_fetch)
+
+    def invalidate(self, token):
+        with self._lock:
+            if token is not None and token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+                self.stats["invalidations"] += 1
+
+# Failures that say the cell itself is down (as opposed to a bad request or a business
+# FAILED): they count against its circuit breaker and make queued retries back off
+def _upstream_error(message):
+    return {"status": "ERROR", "message": message, "upstream_error": True}
+
+def _circuit_open(api_slug):
+    return {"status": "UNAVAILABLE", "message": f"{api_slug} is temporarily unavailable (circuit open)"}
+
+def _throttled(error):
+    return {"status": "THROTTLED", "message": str(error), "retry_after": round(error.retry_after, 2)}
+
+def _queued(api_slug, retry_id):
+    return {"status": "QUEUED", "retry_id": retry_id, "message": f"{api_slug} is temporarily unavailable; the request was queued for retry"}
+
 class ProteanGateway:
     def __init__(self):
         self.base_url = os.getenv("PROTEAN_BASE_URL", "https://uat.ris.protean.co.in")
         self.client_id = os.getenv("PROTEAN_CLIENT_ID", "YOUR_CLIENT_ID")
         self.client_secret = os.getenv("PROTEAN_CLIENT_SECRET", "YOUR_CLIENT_SECRET")
         self.private_key = os.getenv("PROTEAN_PRIVATE_KEY")
+        if simulation.enabled(): # Local simulated grid (services/simulation.py)
+            self.base_url = simulation.base_url()
+            self.private_key = self.private_key or simulation.protean_private_key()
+        self.tokens = ProteanTokenManager(self._request_access_token, self._request_access_token_async)
+        self.cache = result_cache
+        self.breakers = protean_breakers
+        self.retries = retry_queue
+        self.tail = protean_tail
+        self.limiter = protean_quota
+        self.session = requests.Session() # Keep-alive for the sync wrappers
+        self._client = None
+        self._client_loop = None
+
+    def client(self) -> httpx.AsyncClient:
+        """Shared pooled client (keep-alive, HTTP/2 when available), one per event loop."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(PROTEAN_TIMEOUT_SEC, connect=PROTEAN_CONNECT_TIMEOUT_SEC),
+                limits=httpx.Limits(max_connections=PROTEAN_MAX_CONNECTIONS, max_keepalive_connections=PROTEAN_MAX_CONNECTIONS),
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     def get_access_token(self):
-        """Standardized JWT-based Auth"""
+        """Standardized JWT-based Auth (cached, see ProteanTokenManager)"""
+        if not self.private_key:
+            return "STUB_ACCESS_TOKEN"
+        try:
+            return self.tokens.get_token()
+        except Exception as e:
+            print(f"Auth Failed: {str(e)}")
+            return None
+
+    async def get_access_token_async(self):
         if not self.private_key:
             return "STUB_ACCESS_TOKEN"
-        
         try:
-            now = int(time.time())
-            payload = {
-                "iss": self.client_id,
-                "sub": self.client_id,
-                "aud": f"{self.base_url}/v1/auth/token",
-                "exp": now + 300,
-                "iat": now
-            }
-            encoded_jwt = jwt.encode(payload, self.private_key, algorithm="RS256")
-            
-            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-            data = {
-                'grant_type': 'client_credentials',
-                'client_id': self.client_id,
-                'client_assertion_type': 'urn:ietf:params:oauth:client-assertion-type:jwt-bearer',
-                'client_assertion': encoded_jwt
-            }
-            
-            response = requests.post(f"{self.base_url}/v1/auth/token", headers=headers, data=data)
-            response.raise_for_status()
-            return response.json().get('access_token')
+            return await self.tokens.get_token_async()
         except Exception as e:
             print(f"Auth Failed: {str(e)}")
             return None
 
-    def execute(self, api_slug: str, data: dict):
+    def _request_access_token(self):
+        """Signs a client assertion and exchanges it for (access_token, expires_in)."""
+        response = self.session.post(f"{self.base_url}/v1/auth/token", data=self._token_request_form(), timeout=(PROTEAN_CONNECT_TIMEOUT_SEC, PROTEAN_TIMEOUT_SEC))
+        response.raise_for_status()
+        body = response.json()
+        return body.get('access_token'), body.get('expires_in', 300)
+
+    async def _request_access_token_async(self):
+        response = await self.client().post("/v1/auth/token", data=self._token_request_form())
+        response.raise_for_status()
+        body = response.json()
+        return body.get('access_token'), body.get('expires_in', 300)
+
+    def _token_request_form(self):
+        now = int(time.time())
+        payload = {
+            "iss": self.client_id,
+            "sub": self.client_id,
+            "aud": f"{self.base_url}/v1/auth/token",
+            "exp": now + 300,
+            "iat": now
+        }
+        encoded_jwt = jwt.encode(payload, self.private_key, algorithm="RS256")
+        return {
+            'grant_type': 'client_credentials',
+            'client_id': self.client_id,
+            'client_assertion_type': 'urn:ietf:params:oauth:client-assertion-type:jwt-bearer',
+            'client_assertion': encoded_jwt
+        }
+
+    def execute(self, api_slug: str, data: dict, use_cache: bool = True, queue_on_open: bool = False, tenant_id=None):
         """The Central Dispatcher (Grid Cell Executor)"""
         grid_cell = PROTEAN_API_GRID.get(api_slug)
         if not grid_cell:
             return {"status": "ERROR", "message": f"API Slug '{api_slug}' not found in grid."}
-        
+        if use_cache and grid_cell.get("cache_ttl"):
+            return self.cache.get_or_fetch(api_slug, grid_cell, data, lambda: self._guarded(api_slug, grid_cell, data, queue_on_open, tenant_id))
+        return dict(self._guarded(api_slug, grid_cell, data, queue_on_open, tenant_id), cache="BYPASS")
+
+    def _guarded(self, api_slug: str, grid_cell: dict, data: dict, queue_on_open: bool, tenant_id=None):
+        """_call behind the cell's circuit breaker (services/circuit_breaker.py) and quota (services/rate_limiter.py)."""
+        decision = self.breakers.allow(api_slug)
+        if decision is None:
+            if not queue_on_open:
+                return _circuit_open(api_slug)
+            return _queued(api_slug, self.retries.enqueue(api_slug, data))
+        try:
+            self.limiter.acquire_sync(api_slug, tenant_id)
+        except QuotaExceeded as e:
+            if decision == "PROBE":
+                self.breakers.release_probe(api_slug)
+            return _throttled(e)
+        result = self._call(api_slug, grid_cell, data)
+        self.breakers.record(api_slug, not result.get("upstream_error"), probe=decision == "PROBE")
+        return result
+
+    def _call(self, api_slug: str, grid_cell: dict, data: dict):
         # 1. Auth check
         token = self.get_access_token()
         if not token:
@@ -105,17 +323,153 @@ class ProteanGateway:
         data["consent"] = data.get("consent", "Y")
         data["client_ref_id"] = data.get("client_ref_id", f"txn_{int(time.time())}")
         
+        timeout = (PROTEAN_CONNECT_TIMEOUT_SEC, grid_cell.get("timeout", PROTEAN_TIMEOUT_SEC))
         try:
-            response = requests.request(
+            response = self.session.request(
                 method=grid_cell["method"],
                 url=url,
                 headers=headers,
-                json=data
+                json=data,
+                timeout=timeout
             )
+            if response.status_code == 401:
+                # Token revoked or expired early: drop it and retry once with a fresh one
+                self.tokens.invalidate(token)
+                token = self.get_access_token()
+                if not token:
+                    return {"status": "ERROR", "message": "Authentication failed"}
+                headers["Authorization"] = f"Bearer {token}"
+                response = self.session.request(method=grid_cell["method"], url=url, headers=headers, json=data, timeout=timeout)
+            if response.status_code >= 500 or response.status_code == 429:
+                return _upstream_error(f"Upstream HTTP {response.status_code}")
+            return response.json()
+        except requests.Timeout:
+            return _upstream_error(f"Upstream timeout after {timeout[1]}s")
+        except requests.ConnectionError as e:
+            return _upstream_error(str(e))
+        except Exception as e:
+            return {"status": "ERROR", "message": str(e)}
+
+    async def execute_async(self, api_slug: str, data: dict, use_cache: bool = True, queue_on_open: bool = False, tenant_id=None):
+        """execute() on the shared async client: same grid, same response shapes, no blocked event loop."""
+        grid_cell = PROTEAN_API_GRID.get(api_slug)
+        if not grid_cell:
+            return {"status": "ERROR", "message": f"API Slug '{api_slug}' not found in grid."}
+        if use_cache and grid_cell.get("cache_ttl"):
+            return await self.cache.get_or_fetch_async(api_slug, grid_cell, data, lambda: self._guarded_async(api_slug, grid_cell, data, queue_on_open, tenant_id))
+        return dict(await self._guarded_async(api_slug, grid_cell, data, queue_on_open, tenant_id), cache="BYPASS")
+
+    async def _guarded_async(self, api_slug: str, grid_cell: dict, data: dict, queue_on_open: bool, tenant_id=None):
+        decision = await self.breakers.allow_async(api_slug)
+        if decision is None:
+            if not queue_on_open:
+                return _circuit_open(api_slug)
+            return _queued(api_slug, await self.retries.enqueue_async(api_slug, data))
+        try:
+            await self.limiter.acquire(api_slug, tenant_id)
+        except QuotaExceeded as e:
+            if decision == "PROBE":
+                await self.breakers.release_probe_async(api_slug)
+            return _throttled(e)
+        result = await self._call_async(api_slug, grid_cell, data, probe=decision == "PROBE")
+        await self.breakers.record_async(api_slug, not result.get("upstream_error"), probe=decision == "PROBE")
+        return result
+
+    async def _call_async(self, api_slug: str, grid_cell: dict, data: dict, probe: bool = False):
+        token = await self.get_access_token_async()
+        if not token:
+            return {"status": "ERROR", "message": "Authentication failed"}
+        if token == "STUB_ACCESS_TOKEN":
+            return {"status": "SUCCESS", "message": f"Stubbed response for {api_slug}", "data": data}
+
+        data["consent"] = data.get("consent", "Y")
+        data["client_ref_id"] = data.get("client_ref_id", f"txn_{int(time.time())}")
+        timeout = slug_timeout(grid_cell)
+        try:
+            response = await self._send_async(api_slug, grid_cell, token, data, timeout, probe)
+            if response.status_code == 401:
+                self.tokens.invalidate(token)
+                token = await self.get_access_token_async()
+                if not token:
+                    return {"status": "ERROR", "message": "Authentication failed"}
+                response = await self._send_async(api_slug, grid_cell, token, data, timeout, probe)
+            if response.status_code >= 500 or response.status_code == 429:
+                return _upstream_error(f"Upstream HTTP {response.status_code}")
             return response.json()
+        except httpx.TimeoutException:
+            return _upstream_error(f"Upstream timeout after {timeout.read}s")
+        except httpx.TransportError as e:
+            return _upstream_error(str(e) or type(e).__name__)
         except Exception as e:
             return {"status": "ERROR", "message": str(e)}
 
+    async def _send_async(self, api_slug: str, grid_cell: dict, token: str, data: dict, timeout: httpx.Timeout, probe: bool = False):
+        """
+        One upstream request. Read-only cells are hedged past their latency percentile and get
+        one retry after a connection failure or 5xx, both within the slug's budget
+        (services/hedging.py); other cells and half-open breaker probes are sent exactly once.
+        """
+        def send(timeout=timeout):
+            return self.client().request(grid_cell["method"], grid_cell["url"], headers={"Authorization": f"Bearer {token}"}, json=data, timeout=timeout)
+        if probe or not grid_cell.get("read_only"):
+            return await self._timed(api_slug, send())
+
+        self.tail.started(api_slug)
+        start = time.monotonic()
+        failure = None
+        try:
+            response = await self._hedged(api_slug, send)
+            if response.status_code < 500:
+                return response
+        except httpx.TimeoutException:
+            raise # The deadline is spent, a retry would only add load
+        except httpx.TransportError as e:
+            failure = e
+        # Retry only if a typical answer still fits in what is left of the timeout
+        remaining = timeout.read - (time.monotonic() - start)
+        typical = self.tail.typical(api_slug)
+        if typical is None or remaining < 2 * typical or not self.tail.spend(api_slug, "retry") or not self.limiter.try_acquire(api_slug):
+            if failure is not None:
+                raise failure
+            return response
+        return await self._hedged(api_slug, lambda: send(httpx.Timeout(remaining, connect=timeout.connect)))
+
+    async def _hedged(self, api_slug: str, send):
+        delay = self.tail.hedge_delay(api_slug)
+        primary = asyncio.ensure_future(self._timed(api_slug, send()))
+        if delay is None:
+            return await primary
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self.tail.spend(api_slug, "hedge") or not self.limiter.try_acquire(api_slug):
+                return await primary
+            hedge = asyncio.ensure_future(self._timed(api_slug, send()))
+            racing = {primary, hedge}
+            while racing:
+                done, racing = await asyncio.wait(racing, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code < 500:
+                        if task is hedge:
+                            self.tail.hedge_won()
+                        return task.result()
+            return primary.result() # Both failed: report the primary's failure
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def _timed(self, api_slug: str, request):
+        start = time.monotonic()
+        try:
+            response = await request
+        except (asyncio.CancelledError, httpx.TimeoutException):
+            # Censored sample: the attempt was at least this slow, keep the tail in the histogram
+            self.tail.observe(api_slug, time.monotonic() - start)
+            raise
+        self.tail.observe(api_slug, time.monotonic() - start)
+        return response
+
 # ---------------------------------------------------------
 # 3. BACKWARD COMPATIBILITY WRAPPERS
 # ---------------------------------------------------------
@@ -143,12 +497,45 @@ def verify_electricity_bill(consumer_id: str, provider_id: str):
 def run_face_liveness(image_base64: str):
     return gateway.execute("face_liveness", {"image": image_base64})
 
-# Legacy Stubs
+# Legacy Stubs (answered by the simulator's /v1/legacy routes when simulation is on)
 def run_forgery_scan(image_url: str):
+    if simulation.enabled():
+        return simulation.post("/v1/legacy/forgery-scan", {"image_url": image_url})
     return {"status": "SUCCESS", "forgery_score": 0.02, "is_tampered": False}
 
 def verify_gstin(gstin: str):
+    if simulation.enabled():
+        return simulation.post("/v1/legacy/gstin", {"gstin": gstin})
     return {"status": "SUCCESS", "gstin": gstin, "business_name": "ComplianceDesk AI Pvt Ltd", "status": "Active"}
 
 def pull_digilocker_doc(task_id: str):
+    if simulation.enabled():
+        return simulation.post("/v1/legacy/digilocker", {"task_id": task_id})
     return {"status": "SUCCESS", "doc_url": "https://vault.digilocker.gov.in/stub", "verified": True}
+
+# ---------------------------------------------------------
+# 4. ASYNC B2B DISPATCH (module_id -> grid cell)
+# ---------------------------------------------------------
+# (grid slug, request -> payload); slug None = legacy stub answered locally
+B2B_MODULES = {
+    "vehicle_rc": ("vehicle_rc", lambda r: {"rc_number": r.get("id", "KA01AB1234")}),
+    "mobile_verify": ("mobile_verify", lambda r: {"mobile": r.get("id", "9999999999"), "name": None}),
+    "epfo_search": ("epfo_search", lambda r: {"establishment_name": r.get("id", "EST123")}),
+    "forgery_check": (None, lambda r: run_forgery_scan(r.get("image_url", "https://example.com/id.jpg"))),
+    "gstin_check": (None, lambda r: verify_gstin(r.get("id", "29AAAAA0000A1Z5"))),
+    "pull_doc": (None, lambda r: pull_digilocker_doc(r.get("task_id", "TASK_999"))),
+}
+
+async def run_b2b_module(module_id: str, request: dict, queue_on_open: bool = False, tenant_id=None):
+    """
+    Runs one B2B module without blocking the event loop. Unknown modules raise KeyError.
+    queue_on_open: if the cell's breaker is open, queue the call (status QUEUED + retry_id)
+    instead of answering UNAVAILABLE.
+    tenant_id: admits the call against the tenant's quota too (status THROTTLED when over it).
+    """
+    slug, build = B2B_MODULES[module_id]
+    if slug is None:
+        if simulation.enabled(): # Simulated stubs make a blocking HTTP call
+            return await asyncio.to_thread(build, request)
+        return build(request)
+    return await gateway.execute_async(slug, build(request), queue_on_open=queue_on_open, tenant_id=tenant_id)
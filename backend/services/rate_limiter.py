@@ -0,0 +1,173 @@
+import os
+import time
+import asyncio
+import threading
+
+"""
+PROTEAN QUOTA LIMITER (admission control in front of the grid)
+Protean enforces per-API quotas; calls above them come back 429 and count against the cell's
+circuit breaker. The gateway therefore admits each upstream call against two token buckets
+(PROTEAN_QUOTAS in services/protean_service.py): one per grid slug and, for B2B calls, one
+per tenant, so one tenant's bulk upload cannot use up another's share.
+
+- Buckets are GCRA (a "theoretical arrival time" per key): `burst` calls pass at once, then
+  one every 1/rate seconds.
+- A call over the limit reserves the next free slot and waits for it, so waiting callers are
+  admitted in arrival order at exactly the quota rate. The tenant bucket is passed before the
+  slug bucket is reserved, but the slug bucket is checked first: a call it would refuse
+  takes no tenant slot. If the slug refuses after the tenant wait anyway (other tenants took
+  its slots meanwhile), the tenant slot is handed back.
+- Waiting is bounded: at most `max_waiting` callers per bucket, and a call whose slot lies
+  beyond its deadline is rejected at once (QuotaExceeded) instead of timing out later.
+- Hedges and retries only take a free token (try_acquire); they never wait.
+"""
+
+ADMISSION_MAX_WAITING = int(os.getenv("PROTEAN_ADMISSION_MAX_WAITING", "200"))
+ADMISSION_DEADLINE_SEC = float(os.getenv("PROTEAN_ADMISSION_DEADLINE_SEC", "5"))
+
+class QuotaExceeded(Exception):
+    def __init__(self, key: str, reason: str, retry_after: float):
+        super().__init__(f"{key} quota exceeded ({reason})")
+        self.key = key
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _Bucket:
+    __slots__ = ("interval", "tolerance", "tat", "waiting")
+
+    def __init__(self, rate: float, burst: float):
+        self.interval = 1 / rate
+        self.tolerance = (max(1, burst) - 1) * self.interval
+        self.tat = 0.0 # Theoretical arrival time of the next call at the quota rate
+        self.waiting = 0
+
+    def earliest(self, now):
+        return max(now, self.tat - self.tolerance)
+
+    def take(self, at):
+        self.tat = max(self.tat, at) + self.interval
+
+class QuotaLimiter:
+    def __init__(self, quotas: dict, max_waiting: int = ADMISSION_MAX_WAITING, deadline_sec: float = ADMISSION_DEADLINE_SEC):
+        self.quotas = quotas
+        self.max_waiting = max_waiting
+        self.deadline_sec = deadline_sec
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _keys(self, slug, tenant_id):
+        # Tenant first: a tenant's excess waits in its own bucket instead of booking the
+        # slug's future slots ahead of other tenants
+        keys = [f"slug:{slug}"]
+        if tenant_id is not None and "tenant" in self.quotas:
+            keys.insert(0, f"tenant:{tenant_id}")
+        return keys
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            kind, name = key.split(":", 1)
+            quota = self.quotas["tenant"] if kind == "tenant" else self.quotas.get(name, self.quotas["default"])
+            bucket = self._buckets[key] = _Bucket(quota["rate"], quota["burst"])
+            self._stats[key] = {"admitted": 0, "queued": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0, "rejected_deadline": 0, "rejected_full": 0, "refunded": 0}
+        return bucket
+
+    def _check(self, key, wait, deadline_sec, queue):
+        """Raises QuotaExceeded if `key` cannot admit a call `wait` seconds from now."""
+        if wait <= 0:
+            return
+        stats = self._stats[key]
+        if not queue:
+            raise QuotaExceeded(key, "no free token", wait)
+        if wait > deadline_sec:
+            stats["rejected_deadline"] += 1
+            raise QuotaExceeded(key, "deadline", wait)
+        if self._buckets[key].waiting >= self.max_waiting:
+            stats["rejected_full"] += 1
+            raise QuotaExceeded(key, "admission queue full", wait)
+
+    def _reserve(self, keys, deadline_sec, queue=True):
+        """Reserves the first key's next slot once every key could admit the call after it.
+        Returns seconds to wait or raises QuotaExceeded without taking anything."""
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(keys[0])
+            at = bucket.earliest(now)
+            wait = at - now
+            self._check(keys[0], wait, deadline_sec, queue)
+            later = at
+            for key in keys[1:]:
+                later = self._bucket(key).earliest(later)
+                self._check(key, later - now, deadline_sec, queue)
+            stats = self._stats[keys[0]]
+            if wait > 0:
+                bucket.waiting += 1
+                stats["queued"] += 1
+                stats["wait_ms_total"] += wait * 1000
+                stats["wait_ms_max"] = max(stats["wait_ms_max"], wait * 1000)
+            bucket.take(at)
+            stats["admitted"] += 1
+            return wait
+
+    def _release(self, key):
+        with self._lock:
+            self._buckets[key].waiting -= 1
+
+    def _refund(self, key):
+        """Hands a taken slot back (its call was refused by a later bucket)."""
+        with self._lock:
+            bucket = self._buckets[key]
+            bucket.tat -= bucket.interval
+            self._stats[key]["admitted"] -= 1
+            self._stats[key]["refunded"] += 1
+
+    def _admit(self, slug, tenant_id, deadline):
+        """Yields the wait for each bucket in turn; refunds taken slots if a later one refuses."""
+        keys = self._keys(slug, tenant_id)
+        for i in range(len(keys)):
+            try:
+                wait = self._reserve(keys[i:], deadline - time.monotonic())
+            except QuotaExceeded:
+                for key in keys[:i]:
+                    self._refund(key)
+                raise
+            yield keys[i], wait
+
+    async def acquire(self, slug: str, tenant_id=None, deadline_sec: float = None):
+        """Waits for the tenant's, then the slug's next slot. Raises QuotaExceeded."""
+        deadline = time.monotonic() + (self.deadline_sec if deadline_sec is None else deadline_sec)
+        for key, wait in self._admit(slug, tenant_id, deadline):
+            if wait > 0:
+                try:
+                    await asyncio.sleep(wait)
+                finally:
+                    self._release(key)
+
+    def acquire_sync(self, slug: str, tenant_id=None, deadline_sec: float = None):
+        deadline = time.monotonic() + (self.deadline_sec if deadline_sec is None else deadline_sec)
+        for key, wait in self._admit(slug, tenant_id, deadline):
+            if wait > 0:
+                try:
+                    time.sleep(wait)
+                finally:
+                    self._release(key)
+
+    def try_acquire(self, slug: str) -> bool:
+        """Takes a slot only if one is free right now (hedges, retries)."""
+        try:
+            self._reserve([f"slug:{slug}"], 0, queue=False)
+            return True
+        except QuotaExceeded:
+            return False
+
+    def metrics(self):
+        with self._lock:
+            return {
+                key: dict(
+                    stats, waiting=self._buckets[key].waiting,
+                    wait_ms_avg=round(stats["wait_ms_total"] / stats["queued"], 1) if stats["queued"] else 0.0,
+                    wait_ms_max=round(stats["wait_ms_max"], 1), wait_ms_total=round(stats["wait_ms_total"], 1),
+                )
+                for key, stats in self._stats.items()
+            }
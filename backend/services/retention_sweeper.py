@@ -0,0 +1,159 @@
+import os
+import time
+import asyncio
+from datetime import datetime
+
+"""
+RETENTION SWEEPER (Compliance Vault)
+Purges audit_logs / dpdp_consents rows whose 5-year `retention_until` has passed.
+
+- Deletes in bounded chunks picked through the retention_until index, one short
+  transaction per chunk, sleeping between chunks so request writers (and the
+  AuditWriter group commits) get the SQLite write lock back quickly.
+- Keeps per-table totals in `retention_checkpoints`, updated in the same transaction as
+  each chunk. An interrupted sweep needs no resume point: committed chunks are gone, and
+  the next sweep finds what is left through the same index.
+- Reclaims space afterwards with incremental vacuum (converting the file to
+  auto_vacuum=INCREMENTAL once, when enough pages are free to justify a full VACUUM).
+  Vacuuming holds the write lock too: its time counts in the sweep's lock metrics, and
+  the one-off full VACUUM (which locks for a pass over the whole file) shows up there.
+"""
+
+CHUNK_SIZE = int(os.getenv("RETENTION_CHUNK_SIZE", "500"))
+PAUSE_MS = int(os.getenv("RETENTION_PAUSE_MS", "50"))
+VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "2000"))
+FULL_VACUUM_FREE_RATIO = 0.25
+
+class RetentionSweeper:
+    def __init__(self, engine=None, chunk_size: int = CHUNK_SIZE, pause_ms: int = PAUSE_MS, vacuum_pages: int = VACUUM_PAGES):
+        self._engine = engine
+        self.chunk_size = chunk_size
+        self.pause = pause_ms / 1000
+        self.vacuum_pages = vacuum_pages
+        self.last_sweep = {}
+        self.totals = {"sweeps": 0, "rows_purged": 0, "lock_ms": 0.0}
+
+    def _get_engine(self):
+        if self._engine is None:
+            from database import engine_compliance
+            self._engine = engine_compliance
+        return self._engine
+
+    def _tables(self):
+        from models import AuditLog, DPDPConsent
+        return [AuditLog.__table__, DPDPConsent.__table__]
+
+    # --- PURGE ---
+    async def purge_table(self, table, now: datetime):
+        from sqlalchemy import select, delete
+        from models import RetentionCheckpoint
+        engine = self._get_engine()
+        cp = RetentionCheckpoint.__table__
+        stats = {"rows_purged": 0, "chunks": 0, "lock_ms_total": 0.0, "lock_ms_max": 0.0}
+
+        while True:
+            chunk = (
+                select(table.c.id)
+                .where(table.c.retention_until < now)
+                .order_by(table.c.retention_until)
+                .limit(self.chunk_size)
+            )
+            start = time.perf_counter()
+            async with engine.begin() as conn:
+                deleted = (await conn.execute(delete(table).where(table.c.id.in_(chunk.scalar_subquery())))).rowcount
+                if deleted:
+                    await self._checkpoint(conn, cp, table.name, deleted, now)
+            lock_ms = (time.perf_counter() - start) * 1000
+
+            stats["rows_purged"] += deleted
+            stats["chunks"] += 1
+            stats["lock_ms_total"] += lock_ms
+            stats["lock_ms_max"] = max(stats["lock_ms_max"], lock_ms)
+            if deleted < self.chunk_size:
+                break
+            await asyncio.sleep(self.pause) # Yield the write lock to request traffic
+
+        stats["lock_ms_total"] = round(stats["lock_ms_total"], 2)
+        stats["lock_ms_max"] = round(stats["lock_ms_max"], 2)
+        return stats
+
+    async def _checkpoint(self, conn, cp, table_name, deleted, now):
+        from sqlalchemy import select, update, insert
+        exists = (await conn.execute(select(cp.c.table_name).where(cp.c.table_name == table_name))).first()
+        if exists:
+            await conn.execute(
+                update(cp).where(cp.c.table_name == table_name)
+                .values(rows_purged_total=cp.c.rows_purged_total + deleted, last_sweep_at=now)
+            )
+        else:
+            await conn.execute(insert(cp).values(table_name=table_name, rows_purged_total=deleted, last_sweep_at=now))
+
+    # --- SPACE RECLAIM ---
+    async def reclaim_space(self):
+        from sqlalchemy import text
+        engine = self._get_engine()
+        if engine.dialect.name != "sqlite":
+            return {"skipped": True}
+
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            auto_vacuum = (await conn.execute(text("PRAGMA auto_vacuum"))).scalar()
+            free_before = (await conn.execute(text("PRAGMA freelist_count"))).scalar()
+            page_count = (await conn.execute(text("PRAGMA page_count"))).scalar() or 1
+            mode = "none"
+            start = time.perf_counter()
+            if auto_vacuum == 2: # INCREMENTAL
+                if free_before:
+                    # sqlite3's execute() steps it once, freeing a single page; executescript() runs it to the end
+                    raw = await conn.get_raw_connection()
+                    await raw.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)});")
+                    mode = "incremental"
+            elif free_before / page_count >= FULL_VACUUM_FREE_RATIO:
+                # One-off conversion; later sweeps only need incremental_vacuum
+                await conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+                await conn.execute(text("VACUUM"))
+                mode = "full"
+            lock_ms = round((time.perf_counter() - start) * 1000, 2)
+            free_after = (await conn.execute(text("PRAGMA freelist_count"))).scalar()
+        return {"mode": mode, "pages_reclaimed": free_before - free_after, "free_pages_left": free_after, "lock_ms": lock_ms}
+
+    # --- SWEEP ---
+    async def sweep(self):
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        tables = {}
+        for table in self._tables():
+            tables[table.name] = await self.purge_table(table, now)
+
+        purged = sum(t["rows_purged"] for t in tables.values())
+        vacuum = await self.reclaim_space() if purged else {"mode": "none", "pages_reclaimed": 0}
+
+        vacuum_ms = vacuum.get("lock_ms", 0.0)
+        lock_ms = sum(t["lock_ms_total"] for t in tables.values()) + vacuum_ms
+        self.last_sweep = {
+            "at": now.isoformat(),
+            "rows_purged": purged,
+            "lock_ms_total": round(lock_ms, 2),
+            "lock_ms_max": max([t["lock_ms_max"] for t in tables.values()] + [vacuum_ms]),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "tables": tables,
+            "vacuum": vacuum,
+        }
+        self.totals["sweeps"] += 1
+        self.totals["rows_purged"] += purged
+        self.totals["lock_ms"] = round(self.totals["lock_ms"] + lock_ms, 2)
+        print(f"[RETENTION] Sweep purged {purged} rows, lock {self.last_sweep['lock_ms_total']}ms, vacuum {vacuum.get('mode')} ({vacuum_ms}ms)")
+        return self.last_sweep
+
+    async def run_forever(self, interval_sec: float):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"[RETENTION] Sweep failed: {e}")
+            await asyncio.sleep(interval_sec)
+
+    def metrics(self):
+        return {"totals": self.totals, "last_sweep": self.last_sweep}
+
+retention_sweeper = RetentionSweeper()
@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+
+"""
+PROTEAN RETRY QUEUE
+Calls rejected by an open circuit breaker (services/circuit_breaker.py) are stored here
+instead of failing, and replayed once their grid cell recovers.
+
+- Durable: a small SQLite file (WAL, synchronous=FULL), separate from main.db so the
+  queue never competes with request writers for the main write lock. Payloads and results
+  are encrypted with SecurityUtils.
+- Drain: run_forever() replays due items of slugs whose breaker is CLOSED, at most
+  `rate_per_sec` per slug, spaced evenly, so a recovering upstream isn't hit by the whole
+  backlog at once. Slugs that are not CLOSED get one item per pass (a half-open probe). Claims are leased, so items held by a crashed worker are picked up again.
+- Upstream failures back off exponentially; after `max_attempts` an item is DEAD.
+- Billing: b2b_verify attaches its wallet hold to the item (attach_hold); the drainer
+  captures it when the retry succeeds and releases it otherwise. The wallet's stale-hold
+  sweeper leaves these holds alone while the item is queued (hold_outcomes).
+"""
+
+RETRY_DB_PATH = os.getenv("PROTEAN_RETRY_DB", "./protean_retry.db" if os.name == "nt" else "/tmp/protean_retry.db")
+RETRY_RATE_PER_SEC = float(os.getenv("PROTEAN_RETRY_RATE_PER_SEC", "5"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("PROTEAN_RETRY_MAX_ATTEMPTS", "8"))
+RETRY_BACKOFF_SEC = float(os.getenv("PROTEAN_RETRY_BACKOFF_SEC", "10"))
+RETRY_LEASE_SEC = float(os.getenv("PROTEAN_RETRY_LEASE_SEC", "120"))
+
+RETRY_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS protean_retry (
+        id TEXT PRIMARY KEY,
+        slug TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        hold_id TEXT,
+        status TEXT NOT NULL DEFAULT 'PENDING',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        leased_until REAL,
+        result TEXT,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        completed_at REAL
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS ix_protean_retry_status_slug_next
+    ON protean_retry (status, slug, next_attempt_at)
+    ''',
+)
+
+class RetryQueue:
+    def __init__(self, path: str = RETRY_DB_PATH, rate_per_sec: float = RETRY_RATE_PER_SEC, max_attempts: int = RETRY_MAX_ATTEMPTS,
+                 backoff_sec: float = RETRY_BACKOFF_SEC, lease_sec: float = RETRY_LEASE_SEC):
+        self.path = path
+        self.rate_per_sec = rate_per_sec
+        self.max_attempts = max_attempts
+        self.backoff_sec = backoff_sec
+        self.lease_sec = lease_sec
+        self._conn = None
+        self._lock = threading.Lock()
+        self.stats = {"enqueued": 0, "succeeded": 0, "failed": 0, "retried": 0, "dead": 0}
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            for statement in RETRY_SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    # --- PRODUCERS ---
+    def enqueue(self, slug: str, data: dict, hold_id: str = None) -> str:
+        from services.security_utils import SecurityUtils
+        retry_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db().execute(
+                "INSERT INTO protean_retry (id, slug, payload, hold_id, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (retry_id, slug, SecurityUtils.encrypt_pii(json.dumps(data)), hold_id, now, now)
+            )
+        self.stats["enqueued"] += 1
+        return retry_id
+
+    async def enqueue_async(self, slug: str, data: dict, hold_id: str = None) -> str:
+        return await asyncio.to_thread(self.enqueue, slug, data, hold_id)
+
+    def attach_hold(self, retry_id: str, hold_id: str) -> bool:
+        """Hands a wallet hold to the item. False if it already finished or has one (settle it yourself)."""
+        with self._lock:
+            cur = self._db().execute(
+                "UPDATE protean_retry SET hold_id = ? WHERE id = ? AND hold_id IS NULL AND status IN ('PENDING', 'RUNNING')",
+                (hold_id, retry_id)
+            )
+        return cur.rowcount == 1
+
+    async def attach_hold_async(self, retry_id: str, hold_id: str) -> bool:
+        return await asyncio.to_thread(self.attach_hold, retry_id, hold_id)
+
+    def get(self, retry_id: str):
+        from services.security_utils import SecurityUtils
+        with self._lock:
+            row = self._db().execute(
+                "SELECT slug, status, attempts, result, last_error, created_at, completed_at FROM protean_retry WHERE id = ?", (retry_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        slug, status, attempts, result, last_error, created_at, completed_at = row
+        return {
+            "retry_id": retry_id, "slug": slug, "status": "PENDING" if status == "RUNNING" else status, "attempts": attempts,
+            "result": json.loads(SecurityUtils.decrypt_pii(result)) if result else None, "last_error": last_error,
+            "created_at": created_at, "completed_at": completed_at,
+        }
+
+    def hold_outcomes(self, hold_ids) -> dict:
+        """{hold_id: "OPEN" | "CAPTURE" | "RELEASE"} for the given holds owned by items here.
+        OPEN while the item is queued; otherwise what the drainer settles it with."""
+        from services.security_utils import SecurityUtils
+        hold_ids = list(hold_ids)
+        rows = []
+        with self._lock:
+            for i in range(0, len(hold_ids), 500):
+                chunk = hold_ids[i:i + 500]
+                rows += self._db().execute(
+                    f"SELECT hold_id, status, result FROM protean_retry WHERE hold_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+        outcomes = {}
+        for hold_id, status, result in rows:
+            if status in ("PENDING", "RUNNING"):
+                outcomes[hold_id] = "OPEN"
+            elif status == "DONE" and result and json.loads(SecurityUtils.decrypt_pii(result)).get("status") == "SUCCESS":
+                outcomes[hold_id] = "CAPTURE"
+            else:
+                outcomes[hold_id] = "RELEASE"
+        return outcomes
+
+    # --- DRAIN ---
+    def due_slugs(self):
+        now = time.time()
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT DISTINCT slug FROM protean_retry WHERE (status = 'PENDING' AND next_attempt_at <= ?) OR (status = 'RUNNING' AND leased_until < ?)",
+                (now, now)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def claim(self, slug: str, limit: int):
+        """Leases up to `limit` due items of `slug`: [(id, data)] in enqueue order."""
+        from services.security_utils import SecurityUtils
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = db.execute(
+                    "SELECT id, payload FROM protean_retry WHERE slug = ? AND ((status = 'PENDING' AND next_attempt_at <= ?) OR (status = 'RUNNING' AND leased_until < ?)) "
+                    "ORDER BY created_at LIMIT ?",
+                    (slug, now, now, limit)
+                ).fetchall()
+                db.executemany("UPDATE protean_retry SET status = 'RUNNING', leased_until = ? WHERE id = ?", [(now + self.lease_sec, r[0]) for r in rows])
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return [(r[0], data) for r, data in zip(rows, (json.loads(p) for p in SecurityUtils.decrypt_many([r[1] for r in rows])))]
+
+    def complete(self, retry_id: str, result: dict):
+        """Stores the final answer; returns the attached hold id (to settle) or None."""
+        from services.security_utils import SecurityUtils
+        with self._lock:
+            row = self._db().execute(
+                "UPDATE protean_retry SET status = 'DONE', result = ?, completed_at = ?, leased_until = NULL WHERE id = ? AND status = 'RUNNING' RETURNING hold_id",
+                (SecurityUtils.encrypt_pii(json.dumps(result)), time.time(), retry_id)
+            ).fetchone()
+        self.stats["succeeded" if result.get("status") == "SUCCESS" else "failed"] += 1
+        return row[0] if row else None
+
+    def reschedule(self, retry_id: str, error: str, count_attempt: bool = True, delay_sec: float = None):
+        """Upstream still failing: back off (or give up). Returns the hold id if the item is now DEAD.
+        delay_sec overrides the backoff (e.g. a quota's retry_after)."""
+        with self._lock:
+            db = self._db()
+            attempts = db.execute("SELECT attempts FROM protean_retry WHERE id = ?", (retry_id,)).fetchone()[0] + (1 if count_attempt else 0)
+            if attempts >= self.max_attempts:
+                row = db.execute(
+                    "UPDATE protean_retry SET status = 'DEAD', attempts = ?, last_error = ?, completed_at = ?, leased_until = NULL WHERE id = ? RETURNING hold_id",
+                    (attempts, error, time.time(), retry_id)
+                ).fetchone()
+                self.stats["dead"] += 1
+                return row[0] if row else None
+            if delay_sec is None:
+                delay_sec = self.backoff_sec * (2 ** max(0, attempts - 1)) if count_attempt else 0
+            db.execute(
+                "UPDATE protean_retry SET status = 'PENDING', attempts = ?, last_error = ?, next_attempt_at = ?, leased_until = NULL WHERE id = ?",
+                (attempts, error, time.time() + delay_sec, retry_id)
+            )
+        self.stats["retried"] += 1
+        return None
+
+    async def _settle(self, hold_id, success):
+        if not hold_id:
+            return
+        from database import SessionLocalApp
+        from services.wallet import WalletService
+        async with SessionLocalApp() as db:
+            if success:
+                await WalletService.capture(db, hold_id)
+            else:
+                await WalletService.release(db, hold_id)
+
+    async def _replay(self, gateway, slug, retry_id, data):
+        result = await gateway.execute_async(slug, data, queue_on_open=False)
+        status = result.get("status")
+        if status in ("UNAVAILABLE", "THROTTLED"):
+            # Breaker reopened before this one ran, or the slug's quota (shared with live
+            # traffic) is spent: nothing went upstream, so wait without counting an attempt
+            await asyncio.to_thread(self.reschedule, retry_id, result.get("message"), False, result.get("retry_after", 0))
+        elif status == "ERROR" and result.get("upstream_error"):
+            hold_id = await asyncio.to_thread(self.reschedule, retry_id, result.get("message"))
+            await self._settle(hold_id, False)
+        else:
+            hold_id = await asyncio.to_thread(self.complete, retry_id, result)
+            await self._settle(hold_id, status == "SUCCESS")
+
+    async def drain_once(self, gateway, breakers, interval_sec: float):
+        """One pass: replays up to rate x interval due items per recovered slug."""
+        replayed = 0
+        for slug in await asyncio.to_thread(self.due_slugs):
+            limit = max(1, int(self.rate_per_sec * interval_sec))
+            if await breakers.state_async(slug) != "CLOSED":
+                # One item doubles as the half-open probe, so the queue can close the breaker
+                # without live traffic (while OPEN it comes back UNAVAILABLE and stays queued)
+                limit = 1
+            items = await asyncio.to_thread(self.claim, slug, limit)
+            tasks = []
+            for retry_id, data in items:
+                tasks.append(asyncio.create_task(self._replay(gateway, slug, retry_id, data)))
+                await asyncio.sleep(1 / self.rate_per_sec)
+            for outcome in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(outcome, Exception):
+                    print(f"[RETRY] Replay failed: {outcome}")
+            replayed += len(items)
+        return replayed
+
+    async def run_forever(self, interval_sec: float = 5):
+        from services import protean_service
+        from services.circuit_breaker import protean_breakers
+        while True:
+            try:
+                replayed = await self.drain_once(protean_service.gateway, protean_breakers, interval_sec)
+                if replayed:
+                    print(f"[RETRY] Replayed {replayed} queued Protean calls")
+            except Exception as e:
+                print(f"[RETRY] Drain failed: {e}")
+            await asyncio.sleep(interval_sec)
+
+    def metrics(self):
+        with self._lock:
+            rows = self._db().execute("SELECT slug, status, COUNT(*) FROM protean_retry WHERE status IN ('PENDING', 'RUNNING') GROUP BY slug, status").fetchall()
+        depth = {}
+        for slug, status, count in rows:
+            depth.setdefault(slug, {})[status] = count
+        return {"depth": sum(r[2] for r in rows), "by_slug": depth, **self.stats}
+
+retry_queue = RetryQueue()
@@ -0,0 +1,98 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+SECRETS CACHE
+Resolves secrets (environment first, then Secret Manager via SecretParam) and keeps them
+for `ttl_sec`. Once an entry is past `refresh_ahead` of its TTL, the cached value is still
+served and a background thread re-resolves it, so hot paths (webhooks, PII crypto) never
+wait on Secret Manager after the first lookup. Rotated values are picked up within one TTL.
+A failed or empty lookup never replaces a value already cached: the last good value is
+served and, keeping its old timestamp, resolved again on the next call.
+"""
+
+SECRETS_TTL_SEC = float(os.getenv("SECRETS_TTL_SEC", "300"))
+
+class SecretsCache:
+    def __init__(self, ttl_sec: float = SECRETS_TTL_SEC, refresh_ahead: float = 0.8, resolver=None):
+        self.ttl_sec = ttl_sec
+        self.refresh_ahead = refresh_ahead
+        self._resolver = resolver or self._resolve
+        self._values = {} # name -> (value, fetched_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self.stats = {"hits": 0, "misses": 0, "background_refreshes": 0, "refresh_errors": 0}
+
+    @staticmethod
+    def _resolve(name):
+        value = os.environ.get(name)
+        if value:
+            return value
+        try:
+            from firebase_functions.params import SecretParam
+        except ImportError:
+            return None # No Secret Manager outside Cloud Functions
+        # Secret Manager errors propagate: the caller keeps its last good value
+        return SecretParam(name).value or None
+
+    def _update(self, name, fetched_at):
+        """Resolve `name`; store it only if it resolved. Returns the value to serve."""
+        entry = self._values.get(name)
+        last_good = entry[0] if entry is not None else None
+        try:
+            value = self._resolver(name)
+        except Exception as e:
+            self.stats["refresh_errors"] += 1
+            print(f"[SECRETS] Lookup of {name} failed: {e}")
+            return last_good
+        if value is None and last_good is not None:
+            return last_good
+        # A secret that is simply not configured is cached as None like any other value
+        self._values[name] = (value, fetched_at)
+        return value
+
+    def get(self, name: str, default: str = None):
+        entry = self._values.get(name)
+        now = time.monotonic()
+        if entry is None or now - entry[1] >= self.ttl_sec:
+            # Missing or expired: resolve inline (first lookup, or refreshes kept failing)
+            self.stats["misses"] += 1
+            value = self._update(name, now)
+        else:
+            self.stats["hits"] += 1
+            value = entry[0]
+            if now - entry[1] >= self.ttl_sec * self.refresh_ahead:
+                self._refresh_in_background(name)
+        return default if value is None else value
+
+    def _refresh_in_background(self, name):
+        with self._lock:
+            if name in self._refreshing:
+                return
+            self._refreshing.add(name)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="secrets")
+        self._executor.submit(self._refresh, name)
+
+    def _refresh(self, name):
+        try:
+            # On failure the old value stays, and is resolved inline once it expires
+            self._update(name, time.monotonic())
+            self.stats["background_refreshes"] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(name)
+
+    def invalidate(self, name: str = None):
+        if name is None:
+            self._values.clear()
+        else:
+            self._values.pop(name, None)
+
+    def metrics(self):
+        return dict(self.stats, cached=len(self._values))
+
+secrets_cache = SecretsCache()
@@ -1,78 +1,266 @@
 import os
+import re
+import hmac
 import base64
+import hashlib
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import padding
 
+class PIICryptoEngine:
+    """
+    AES-256-GCM for PII tokens. Key contexts are built once per key id and reused.
+    Token format: "v2$<kid>$" + base64(nonce[12] || ciphertext || tag[16]).
+    Tokens without the "v2$" prefix are legacy AES-256-CBC (base64(iv || ct), PKCS7)
+    and are decrypted with the same key material.
+    "v3$<subject_id>$" tokens are sealed with a per-subject data key (services/subject_keys.py);
+    `subject_ciphers(subject_id)` supplies its cached AESGCM context.
+    """
+    PREFIX = "v2$"
+    SUBJECT_PREFIX = "v3$"
+    NONCE_SIZE = 12
+
+    def __init__(self, keys: dict, active_kid: str, legacy_kid: str = None, subject_ciphers=None):
+        if active_kid not in keys:
+            raise ValueError(f"Active key id {active_kid!r} not in keyring")
+        self.keys = dict(keys)
+        self.active_kid = active_kid
+        self._gcm = {kid: AESGCM(key) for kid, key in self.keys.items()}
+        self._cbc = {kid: algorithms.AES(key) for kid, key in self.keys.items()}
+        self._legacy_kid = legacy_kid or active_kid # Legacy tokens carry no key id
+        self._subject_ciphers = subject_ciphers
+
+    def encrypt(self, plain_text: str) -> str:
+        return self.encrypt_many([plain_text])[0]
+
+    def decrypt(self, token: str) -> str:
+        return self.decrypt_many([token])[0]
+
+    def encrypt_many(self, values) -> list:
+        """Encrypts each value under the active key. Empty values map to None."""
+        gcm, header = self._gcm[self.active_kid], f"{self.PREFIX}{self.active_kid}$"
+        nonces = os.urandom(self.NONCE_SIZE * len(values)) # One syscall for the whole batch
+        out = []
+        for i, value in enumerate(values):
+            if not value:
+                out.append(None)
+                continue
+            nonce = nonces[i * self.NONCE_SIZE:(i + 1) * self.NONCE_SIZE]
+            out.append(header + self.seal(gcm, value, nonce))
+        return out
+
+    def decrypt_many(self, tokens, on_error=None) -> list:
+        """
+        Decrypts v2, v3 and legacy tokens. Empty tokens map to None; a token that fails
+        to decrypt raises, or maps to `on_error` when one is given.
+        """
+        out = []
+        for token in tokens:
+            if not token:
+                out.append(None)
+                continue
+            try:
+                out.append(self._decrypt_one(token))
+            except Exception:
+                if on_error is None:
+                    raise
+                out.append(on_error)
+        return out
+
+    def needs_rotation(self, token: str) -> bool:
+        """True for tokens not under the active key (legacy CBC included)."""
+        if not token or token.startswith(self.SUBJECT_PREFIX):
+            return False # Subject tokens move with their wrapped data key
+        return self.key_id(token) != self.active_kid
+
+    def key_id(self, token: str):
+        """Key id of a token (None for legacy CBC tokens)."""
+        if token and token.startswith(self.PREFIX):
+            return token[len(self.PREFIX):].split("$", 1)[0]
+        return None
+
+    def _decrypt_one(self, token: str) -> str:
+        if token.startswith(self.PREFIX):
+            kid, body = token[len(self.PREFIX):].split("$", 1)
+            return self.seal_open(self._gcm[kid], body)
+        if token.startswith(self.SUBJECT_PREFIX):
+            subject_id, body = token[len(self.SUBJECT_PREFIX):].split("$", 1)
+            return self.seal_open(self._subject_ciphers(subject_id), body)
+        return self._decrypt_legacy(token, self._legacy_kid)
+
+    def seal(self, gcm, plain_text: str, nonce: bytes) -> str:
+        return base64.b64encode(nonce + gcm.encrypt(nonce, plain_text.encode(), None)).decode()
+
+    def seal_open(self, gcm, body: str) -> str:
+        data = base64.b64decode(body)
+        return gcm.decrypt(data[:self.NONCE_SIZE], data[self.NONCE_SIZE:], None).decode()
+
+    def _decrypt_legacy(self, token: str, kid: str) -> str:
+        data = base64.b64decode(token)
+        decryptor = Cipher(self._cbc[kid], modes.CBC(data[:16]), backend=default_backend()).decryptor()
+        padded_data = decryptor.update(data[16:]) + decryptor.finalize()
+        unpadder = padding.PKCS7(128).unpadder()
+        return (unpadder.update(padded_data) + unpadder.finalize()).decode('utf-8')
+
 class SecurityUtils:
     """
     Handles PII Tokenization (AES-256) and Secret Management.
     """
     
-    _ENCRYPTION_KEY = None
+    _BLIND_INDEX_KEY = None
+    _MASTER_KEY_SEEN = False
+    _CRYPTO_ENGINE = None
+    _CRYPTO_ENGINE_SOURCE = None
+    _CRYPTO_ENGINE_CHECKED_AT = 0.0
+    KEYRING_CHECK_SEC = 1.0
 
     @staticmethod
     def get_encryption_key():
         """
-        Retrieves the master encryption key from Secret Manager.
+        Retrieves the master encryption key (Secret Manager, through the secrets cache).
+        It is the original keyring entry and the key of legacy CBC tokens.
         """
-        if SecurityUtils._ENCRYPTION_KEY:
-            return SecurityUtils._ENCRYPTION_KEY
-        
-        # In a real environment, this comes from Secret Manager
-        # Using SecretParam via app.py or direct load here
-        try:
-            from firebase_functions.params import SecretParam
-            key = SecretParam('MASTER_ENCRYPTION_KEY').value
-            SecurityUtils._ENCRYPTION_KEY = base64.b64decode(key)
-        except:
-            # Fallback for local/demo (DO NOT USE IN PROD)
-            SecurityUtils._ENCRYPTION_KEY = b'1' * 32 # 32 bytes for AES-256
-            
-        return SecurityUtils._ENCRYPTION_KEY
+        from services.secrets_cache import secrets_cache
+        key = secrets_cache.get('MASTER_ENCRYPTION_KEY')
+        if key:
+            SecurityUtils._MASTER_KEY_SEEN = True
+            return base64.b64decode(key)
+        if SecurityUtils._MASTER_KEY_SEEN:
+            # Encrypting under the demo key would make PII unreadable with the real one
+            raise RuntimeError("MASTER_ENCRYPTION_KEY is unavailable")
+        # Fallback for local/demo (DO NOT USE IN PROD)
+        return b'1' * 32 # 32 bytes for AES-256
+
+    @staticmethod
+    def get_keyring():
+        """
+        Returns ({kid: key}, active_kid, legacy_kid).
+        MASTER_ENCRYPTION_KEY is stored under ENCRYPTION_KEY_ID (default "k1"). Rotated keys
+        come from MASTER_ENCRYPTION_KEYRING ("k2:<b64>,k3:<b64>") and ACTIVE_ENCRYPTION_KEY_ID
+        selects the key for new tokens. Old keys stay in the ring so their tokens stay readable.
+        """
+        from services.secrets_cache import secrets_cache
+        legacy_kid = secrets_cache.get('ENCRYPTION_KEY_ID', 'k1')
+        keys = {legacy_kid: SecurityUtils.get_encryption_key()}
+        for entry in (secrets_cache.get('MASTER_ENCRYPTION_KEYRING') or "").split(","):
+            if entry.strip():
+                kid, key = entry.strip().split(":", 1)
+                keys[kid] = base64.b64decode(key)
+        return keys, secrets_cache.get('ACTIVE_ENCRYPTION_KEY_ID', legacy_kid), legacy_kid
+
+    @staticmethod
+    def get_crypto_engine() -> PIICryptoEngine:
+        """
+        Returns the shared AES-GCM engine (key contexts built once). The keyring is
+        re-read at most every KEYRING_CHECK_SEC and the engine rebuilt only when it changed,
+        so a rotation takes effect without a restart.
+        """
+        import time
+        now = time.monotonic()
+        if SecurityUtils._CRYPTO_ENGINE is None or now - SecurityUtils._CRYPTO_ENGINE_CHECKED_AT >= SecurityUtils.KEYRING_CHECK_SEC:
+            SecurityUtils._CRYPTO_ENGINE_CHECKED_AT = now
+            keys, active_kid, legacy_kid = SecurityUtils.get_keyring()
+            source = (tuple(sorted(keys.items())), active_kid, legacy_kid)
+            if source != SecurityUtils._CRYPTO_ENGINE_SOURCE:
+                from services.subject_keys import subject_key_cache
+                SecurityUtils._CRYPTO_ENGINE = PIICryptoEngine(keys, active_kid, legacy_kid, subject_ciphers=subject_key_cache.cipher)
+                SecurityUtils._CRYPTO_ENGINE_SOURCE = source
+        return SecurityUtils._CRYPTO_ENGINE
 
     @staticmethod
     def encrypt_pii(plain_text: str) -> str:
         """
-        Encrypts PII using AES-256.
+        Encrypts PII using AES-256-GCM.
         """
         if not plain_text:
             return None
-            
-        key = SecurityUtils.get_encryption_key()
-        iv = os.urandom(16)
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-        encryptor = cipher.encryptor()
-        
-        padder = padding.PKCS7(128).padder()
-        padded_data = padder.update(plain_text.encode()) + padder.finalize()
-        
-        encrypted_data = encryptor.update(padded_data) + encryptor.finalize()
-        return base64.b64encode(iv + encrypted_data).decode('utf-8')
+        return SecurityUtils.get_crypto_engine().encrypt(plain_text)
 
     @staticmethod
     def decrypt_pii(encrypted_text: str) -> str:
         """
-        Decrypts PII using AES-256.
+        Decrypts PII (AES-256-GCM, or legacy AES-256-CBC tokens).
         """
         if not encrypted_text:
             return None
-            
         try:
-            key = SecurityUtils.get_encryption_key()
-            data = base64.b64decode(encrypted_text)
-            iv = data[:16]
-            encrypted_data = data[16:]
-            
-            cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-            decryptor = cipher.decryptor()
-            
-            padded_data = decryptor.update(encrypted_data) + decryptor.finalize()
-            
-            unpadder = padding.PKCS7(128).unpadder()
-            plain_data = unpadder.update(padded_data) + unpadder.finalize()
-            
-            return plain_data.decode('utf-8')
+            return SecurityUtils.get_crypto_engine().decrypt(encrypted_text)
         except Exception as e:
             print(f"Decryption Error: {e}")
             return "[ENCRYPTED]"
+
+    @staticmethod
+    def encrypt_many(values) -> list:
+        """
+        Bulk encrypt_pii(): one engine lookup and one nonce draw for the batch.
+        """
+        return SecurityUtils.get_crypto_engine().encrypt_many(values)
+
+    @staticmethod
+    def decrypt_many(tokens) -> list:
+        """
+        Bulk decrypt_pii(): values that fail to decrypt come back as "[ENCRYPTED]".
+        """
+        return SecurityUtils.get_crypto_engine().decrypt_many(tokens, on_error="[ENCRYPTED]")
+
+    # --- BLIND INDEX (Searchable Encryption) ---
+    # encrypt_pii() uses a random IV, so ciphertexts can't be compared. Each searchable
+    # encrypted column gets a sibling `<field>_bidx` column holding a keyed HMAC of the
+    # normalized plaintext; lookups become indexed equality queries with no decryption.
+
+    @staticmethod
+    def get_blind_index_key():
+        """
+        Retrieves the blind-index HMAC key. Falls back to a key derived from the
+        master key so it is never the same bytes as the encryption key.
+        """
+        if SecurityUtils._BLIND_INDEX_KEY:
+            return SecurityUtils._BLIND_INDEX_KEY
+
+        key = os.environ.get("BLIND_INDEX_KEY")
+        if not key:
+            try:
+                from firebase_functions.params import SecretParam
+                key = SecretParam('BLIND_INDEX_KEY').value
+            except:
+                key = None
+
+        if key:
+            SecurityUtils._BLIND_INDEX_KEY = base64.b64decode(key)
+        else:
+            SecurityUtils._BLIND_INDEX_KEY = hmac.new(SecurityUtils.get_encryption_key(), b"blind-index-v1", hashlib.sha256).digest()
+        return SecurityUtils._BLIND_INDEX_KEY
+
+    @staticmethod
+    def _normalize_for_index(value: str, field: str) -> str:
+        if field == "mobile_number":
+            from models import normalize_phone_key
+            return normalize_phone_key(value) or value.strip()
+        if field == "applicant_id":
+            return re.sub(r"\s+", "", value).upper()
+        return " ".join(value.split()).lower()
+
+    @staticmethod
+    def blind_index(plain_text: str, field: str) -> str:
+        """
+        Deterministic keyed HMAC-SHA256 of the normalized value, scoped per field
+        so equal values in different columns don't share an index entry.
+        """
+        if not plain_text:
+            return None
+        normalized = SecurityUtils._normalize_for_index(plain_text, field)
+        msg = f"{field}:{normalized}".encode()
+        return hmac.new(SecurityUtils.get_blind_index_key(), msg, hashlib.sha256).hexdigest()[:32]
+
+    @staticmethod
+    def blind_index_filter(model, field: str, plain_text: str):
+        """
+        Query helper: `select(SalesRegister).where(SecurityUtils.blind_index_filter(SalesRegister, "mobile_number", phone))`
+        An empty value matches nothing (never `<field>_bidx IS NULL`, i.e. every row not yet backfilled).
+        """
+        from sqlalchemy import false
+        index = SecurityUtils.blind_index(plain_text, field)
+        if index is None:
+            return false()
+        return getattr(model, f"{field}_bidx") == index
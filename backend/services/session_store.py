@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+"""
+WHATSAPP SESSION STORE (replaces the USER_SESSIONS dict)
+Conversation state per phone: state machine position, context (selected language, OCR text,
+request id...) and role. Keys are normalize_phone_key() of the number, so the webhook
+("+91 98765 43210") and Razorpay ("9876543210") find the same session.
+
+- SessionRecord uses __slots__ and keeps an empty context as None.
+- session(phone) is the only way to change a session: it holds the phone's lock for the
+  whole interaction (awaits included), hands out a copy and writes it back only if the block
+  finishes without an exception. Two messages from one phone cannot interleave their
+  read-modify-write.
+- MemorySessionStore (one worker): LRU bounded to WHATSAPP_SESSION_MAX entries, idle
+  sessions expire after WHATSAPP_SESSION_TTL_SEC (24 h, WhatsApp's reply window).
+- RedisSessionStore (WHATSAPP_SESSION_REDIS_URL, any number of workers): the lock is a
+  leased SET NX key, renewed every lease/3 while the interaction runs (OCR and portal calls
+  can outlast any fixed lease). The lease only runs out if the worker stops renewing (hung
+  or partitioned). The write-back and the unlock happen in one transaction that checks the
+  lease is still ours, so such a worker cannot overwrite a newer session.
+  Values are encrypted with SecurityUtils (the context carries PII), keys are blind indexes
+  and Redis expires idle sessions. A value that no longer decrypts (e.g. written under a
+  lost key) counts as no session.
+"""
+
+SESSION_TTL_SEC = int(os.getenv("WHATSAPP_SESSION_TTL_SEC", "86400"))
+SESSION_MAX_ENTRIES = int(os.getenv("WHATSAPP_SESSION_MAX", "100000"))
+SESSION_LOCK_LEASE_SEC = float(os.getenv("WHATSAPP_SESSION_LOCK_LEASE_SEC", "30"))
+SESSION_LOCK_TIMEOUT_SEC = float(os.getenv("WHATSAPP_SESSION_LOCK_TIMEOUT_SEC", "30"))
+WHATSAPP_SESSION_REDIS_URL = os.getenv("WHATSAPP_SESSION_REDIS_URL")
+
+class SessionLockTimeout(Exception):
+    pass
+
+class SessionRecord:
+    __slots__ = ("state", "_context", "role", "expires_at")
+
+    def __init__(self, state: str, context: dict = None, role: str = "PERSONAL", expires_at: float = 0.0):
+        self.state = state
+        self._context = context or None
+        self.role = role
+        self.expires_at = expires_at
+
+    @property
+    def context(self) -> dict:
+        if self._context is None:
+            self._context = {}
+        return self._context
+
+    @context.setter
+    def context(self, value):
+        self._context = value or None
+
+    def copy(self):
+        return SessionRecord(self.state, dict(self._context) if self._context else None, self.role, self.expires_at)
+
+    def to_json(self) -> str:
+        return json.dumps({"s": self.state, "c": self._context, "r": self.role}, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, raw: str):
+        data = json.loads(raw)
+        # Interned: a million sessions share a handful of state/role strings
+        return cls(sys.intern(data["s"]), data.get("c"), sys.intern(data.get("r") or "PERSONAL"))
+
+    def __repr__(self):
+        return f"SessionRecord(state={self.state!r}, role={self.role!r}, context={self._context!r})"
+
+def _phone_key(phone: str) -> str:
+    from models import normalize_phone_key
+    key = normalize_phone_key(phone)
+    if not key:
+        raise ValueError("Session needs a phone number")
+    return key
+
+class _PhoneLocks:
+    """One asyncio.Lock per phone while someone holds or waits for it; dropped afterwards."""
+    def __init__(self):
+        self._locks = {} # phone -> [lock, holders + waiters]
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+class MemorySessionStore:
+    def __init__(self, max_entries: int = SESSION_MAX_ENTRIES, ttl_sec: float = SESSION_TTL_SEC):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._sessions = OrderedDict() # _key(phone) -> SessionRecord, least recently used first
+        self._locks = _PhoneLocks()
+        self._tick, self._tick_expiry = None, None
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "expired": 0, "evicted": 0}
+
+    @staticmethod
+    def _key(phone):
+        # An int is 32 bytes, the 10-digit str 59; the leading 1 keeps leading zeros distinct
+        return int("1" + _phone_key(phone))
+
+    def _expiry(self, now):
+        # Expiry at 1 s granularity: records written in the same second share one float
+        tick = int(now)
+        if tick != self._tick:
+            self._tick, self._tick_expiry = tick, tick + 1 + self.ttl_sec
+        return self._tick_expiry
+
+    def _load(self, key, now):
+        record = self._sessions.get(key)
+        if record is not None and record.expires_at <= now:
+            del self._sessions[key]
+            self.stats["expired"] += 1
+            record = None
+        self.stats["hits" if record is not None else "misses"] += 1
+        return record
+
+    def _store(self, key, record, now):
+        record.expires_at = self._expiry(now)
+        self._sessions[key] = record
+        self._sessions.move_to_end(key)
+        self.stats["writes"] += 1
+        # Every write pushes its session to the end, so expired sessions collect at the front
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.expires_at > now and len(self._sessions) <= self.max_entries:
+                break
+            self._sessions.popitem(last=False)
+            self.stats["expired" if oldest.expires_at <= now else "evicted"] += 1
+
+    async def get(self, phone: str):
+        """Read-only snapshot (copy) of the session, or None."""
+        record = self._load(self._key(phone), time.monotonic())
+        return record.copy() if record is not None else None
+
+    @asynccontextmanager
+    async def session(self, phone: str, default_state: str = "START", default_role: str = "PERSONAL"):
+        key = self._key(phone)
+        async with self._locks.hold(key):
+            record = self._load(key, time.monotonic())
+            working = record.copy() if record is not None else SessionRecord(default_state, None, default_role)
+            yield working
+            self._store(key, working, time.monotonic())
+
+    async def delete(self, phone: str):
+        key = self._key(phone)
+        async with self._locks.hold(key):
+            self._sessions.pop(key, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def metrics(self):
+        return dict(self.stats, backend="memory", sessions=len(self._sessions), max_entries=self.max_entries, locked_phones=len(self._locks))
+
+class RedisSessionStore:
+    def __init__(self, client=None, url: str = WHATSAPP_SESSION_REDIS_URL, ttl_sec: float = SESSION_TTL_SEC,
+                 lease_sec: float = SESSION_LOCK_LEASE_SEC, lock_timeout_sec: float = SESSION_LOCK_TIMEOUT_SEC, prefix: str = "whatsapp:session:"):
+        if client is None:
+            import redis.asyncio as aioredis
+            client = aioredis.Redis.from_url(url, socket_timeout=1)
+        self.client = client
+        self.ttl_sec = ttl_sec
+        self.lease_sec = lease_sec
+        self.lock_timeout_sec = lock_timeout_sec
+        self.prefix = prefix
+        self._locks = _PhoneLocks() # Local waiters queue here instead of polling Redis
+        self.stats = {"hits": 0, "misses": 0, "unreadable": 0, "writes": 0, "lock_retries": 0, "lease_renewals": 0, "lost_leases": 0}
+
+    def _keys(self, phone):
+        from services.security_utils import SecurityUtils
+        index = SecurityUtils.blind_index(_phone_key(phone), "whatsapp_session")
+        return self.prefix + index, self.prefix + "lock:" + index
+
+    async def _read(self, key):
+        from services.security_utils import SecurityUtils
+        value = await self.client.get(key)
+        if value is None:
+            self.stats["misses"] += 1
+            return None
+        try:
+            # decrypt_pii answers "[ENCRYPTED]" for a token it cannot decrypt
+            record = SessionRecord.from_json(SecurityUtils.decrypt_pii(value.decode() if isinstance(value, bytes) else value))
+        except (ValueError, KeyError, TypeError):
+            self.stats["unreadable"] += 1
+            print("[SESSIONS] Unreadable session value; starting over")
+            return None
+        self.stats["hits"] += 1
+        return record
+
+    async def get(self, phone: str):
+        key, _ = self._keys(phone)
+        return await self._read(key)
+
+    async def _acquire(self, lock_key):
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout_sec
+        delay = 0.002
+        while not await self.client.set(lock_key, token, nx=True, px=int(self.lease_sec * 1000)):
+            if time.monotonic() > deadline:
+                raise SessionLockTimeout(f"Session busy for more than {self.lock_timeout_sec}s")
+            self.stats["lock_retries"] += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        return token
+
+    async def _if_ours(self, lock_key, token, queue):
+        """Runs the commands queue(pipe) adds in one transaction, if the lease is still ours."""
+        from redis.exceptions import WatchError
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(lock_key)
+                held = await pipe.get(lock_key)
+                if (held.decode() if isinstance(held, bytes) else held) != token:
+                    await pipe.reset()
+                    return False
+                pipe.multi()
+                queue(pipe)
+                await pipe.execute()
+                return True
+            except WatchError: # Lease expired and was taken meanwhile
+                return False
+
+    async def _commit(self, key, lock_key, token, value):
+        """Writes `value` (None = unlock only) and releases the lock if the lease is still ours."""
+        def queue(pipe):
+            if value is not None:
+                pipe.set(key, value, ex=int(self.ttl_sec))
+            pipe.delete(lock_key)
+        return await self._if_ours(lock_key, token, queue)
+
+    async def _renew(self, lock_key, token):
+        """Extends the lease every lease/3 until cancelled or the lease is no longer ours."""
+        from redis.exceptions import RedisError
+        while True:
+            await asyncio.sleep(self.lease_sec / 3)
+            try:
+                if not await self._if_ours(lock_key, token, lambda pipe: pipe.pexpire(lock_key, int(self.lease_sec * 1000))):
+                    return
+                self.stats["lease_renewals"] += 1
+            except RedisError as e: # Try again next tick; the lease still has 2/3 left
+                print(f"[SESSIONS] Lease renewal failed: {e}")
+
+    @asynccontextmanager
+    async def session(self, phone: str, default_state: str = "START", default_role: str = "PERSONAL"):
+        from services.security_utils import SecurityUtils
+        key, lock_key = self._keys(phone)
+        async with self._locks.hold(key):
+            token = await self._acquire(lock_key)
+            renewer = asyncio.create_task(self._renew(lock_key, token))
+            committed = False
+            try:
+                record = await self._read(key)
+                working = record if record is not None else SessionRecord(default_state, None, default_role)
+                yield working
+                committed = True
+                renewer.cancel()
+                if not await self._commit(key, lock_key, token, SecurityUtils.encrypt_pii(working.to_json())):
+                    self.stats["lost_leases"] += 1
+                    print("[SESSIONS] Lease expired before write-back; update dropped")
+                else:
+                    self.stats["writes"] += 1
+            finally:
+                renewer.cancel()
+                if not committed:
+                    await self._commit(key, lock_key, token, None)
+
+    async def delete(self, phone: str):
+        key, lock_key = self._keys(phone)
+        async with self._locks.hold(key):
+            token = await self._acquire(lock_key)
+            await self.client.delete(key)
+            await self._commit(key, lock_key, token, None)
+
+    def metrics(self):
+        return dict(self.stats, backend="redis", locked_phones=len(self._locks))
+
+session_store = RedisSessionStore() if WHATSAPP_SESSION_REDIS_URL else MemorySessionStore()
@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import atexit
+import socket
+import asyncio
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+UPSTREAM SIMULATION (UPSTREAM_SIMULATION=<profile> | <path.json> | <url>)
+One switch that points every upstream client at the local simulator (simulator.py) instead of
+the real providers, for capacity tests on a laptop with no network:
+
+- Protean grid: ProteanGateway signs in with an ephemeral key and calls the simulated grid
+  (real HTTP path: token cache, pool, breakers, quotas, hedging all exercised).
+- Truth source: MockProviderService.verify_id_async asks the simulator instead of answering
+  instantly.
+- Interakt: replies and documents are POSTed to the simulated messaging API (fire-and-forget
+  on a small thread pool, like a real outbound queue).
+- Gemini: GeminiParserService / TranslationService use the REST transport against the
+  simulated generateContent endpoint.
+- Razorpay calls us, not the other way round: `python simulator.py --emit-razorpay N` drives
+  /razorpay/webhook.
+
+A profile name or JSON file starts the simulator as a child process on first use (port
+UPSTREAM_SIMULATION_PORT; a simulator already listening there, e.g. another worker's, is
+reused). A URL uses a simulator started by hand. Unset: nothing changes.
+"""
+
+UPSTREAM_SIMULATION = os.getenv("UPSTREAM_SIMULATION")
+SIMULATION_PORT = int(os.getenv("UPSTREAM_SIMULATION_PORT", "8765"))
+SIMULATOR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "simulator.py")
+
+_lock = threading.Lock()
+_url = None
+_private_key = None
+_outbox = None
+_clients = {} # event loop -> httpx.AsyncClient
+
+def enabled() -> bool:
+    return bool(UPSTREAM_SIMULATION)
+
+def _listening(port):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+def base_url():
+    """Root URL of the simulator (started on first use), or None when simulation is off."""
+    global _url
+    if not UPSTREAM_SIMULATION:
+        return None
+    with _lock:
+        if _url is None:
+            if UPSTREAM_SIMULATION.startswith(("http://", "https://")):
+                _url = UPSTREAM_SIMULATION.rstrip("/")
+            else:
+                if not _listening(SIMULATION_PORT):
+                    process = subprocess.Popen([sys.executable, SIMULATOR_PATH, "--profile", UPSTREAM_SIMULATION, "--port", str(SIMULATION_PORT)])
+                    atexit.register(process.terminate)
+                    deadline = time.monotonic() + 15
+                    while not _listening(SIMULATION_PORT):
+                        if process.poll() is not None or time.monotonic() > deadline:
+                            raise RuntimeError(f"Upstream simulator did not start (profile {UPSTREAM_SIMULATION!r})")
+                        time.sleep(0.05)
+                _url = f"http://127.0.0.1:{SIMULATION_PORT}"
+            print(f"[SIMULATION] Upstreams simulated at {_url} ({UPSTREAM_SIMULATION})")
+    return _url
+
+def protean_private_key() -> str:
+    """Throwaway RS256 key for the client assertion (the simulator accepts any signature)."""
+    global _private_key
+    with _lock:
+        if _private_key is None:
+            from cryptography.hazmat.primitives import serialization
+            from cryptography.hazmat.primitives.asymmetric import rsa
+            key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            _private_key = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode()
+    return _private_key
+
+def genai_options() -> dict:
+    """Extra genai.configure() arguments: the simulated Gemini REST endpoint."""
+    url = base_url()
+    return {"transport": "rest", "client_options": {"api_endpoint": url}} if url else {}
+
+def post(path: str, payload: dict, timeout: float = 30) -> dict:
+    import requests
+    response = requests.post(f"{base_url()}{path}", json=payload, timeout=timeout)
+    return response.json()
+
+def send(path: str, payload: dict):
+    """Fire-and-forget POST (outbound messages): callers on the event loop never block."""
+    global _outbox
+    if _outbox is None:
+        _outbox = ThreadPoolExecutor(max_workers=8, thread_name_prefix="sim-outbox")
+    def deliver():
+        try:
+            post(path, payload)
+        except Exception as e:
+            print(f"[SIMULATION] {path} failed: {e}")
+    _outbox.submit(deliver)
+
+async def apost(path: str, payload: dict, timeout: float = 30) -> dict:
+    import httpx
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = httpx.AsyncClient(base_url=base_url(), timeout=timeout)
+    response = await client.post(path, json=payload)
+    return response.json()
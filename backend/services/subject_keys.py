@@ -0,0 +1,239 @@
+import os
+import time
+import base64
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+"""
+SUBJECT KEYS (DPDP crypto-shredding)
+Every data principal (keyed by the blind index of their mobile number) gets a random
+AES-256 data key. Their PII is sealed under it as "v3$<subject_id>$..." tokens, and the key
+itself is stored wrapped under the master keyring in `subject_keys` (compliance vault).
+
+Erasure = destroy that one row's key: every token of the principal, in every table and
+database, becomes unreadable in a single UPDATE. The physical purge (verification rows,
+per-user vault documents, generated PDFs) runs afterwards in the background.
+
+Unwrapped keys are cached (LRU + TTL) so hot paths don't query the key table; the TTL bounds
+how long another instance can keep using a key destroyed elsewhere.
+"""
+
+SUBJECT_KEY_CACHE_SIZE = int(os.getenv("SUBJECT_KEY_CACHE_SIZE", "10000"))
+SUBJECT_KEY_TTL_SEC = float(os.getenv("SUBJECT_KEY_TTL_SEC", "60"))
+PURGE_BATCH_SIZE = int(os.getenv("SUBJECT_PURGE_BATCH_SIZE", "500"))
+
+ERASED = object()
+
+class SubjectErased(Exception):
+    pass
+
+class SubjectKeyCache:
+    """subject_id -> AESGCM (or ERASED), bounded LRU with a TTL per entry."""
+    def __init__(self, max_size: int = SUBJECT_KEY_CACHE_SIZE, ttl_sec: float = SUBJECT_KEY_TTL_SEC):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, subject_id):
+        with self._lock:
+            entry = self._entries.get(subject_id)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl_sec:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(subject_id)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def put(self, subject_id, cipher):
+        with self._lock:
+            self._entries[subject_id] = (cipher, time.monotonic())
+            self._entries.move_to_end(subject_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def cipher(self, subject_id):
+        """Sync lookup used by PIICryptoEngine for v3 tokens (load with SubjectKeyService first)."""
+        cipher = self.get(subject_id)
+        if cipher is ERASED:
+            raise SubjectErased(subject_id)
+        if cipher is None:
+            raise KeyError(f"Subject key {subject_id} not loaded")
+        return cipher
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        return dict(self.stats, cached=len(self._entries))
+
+subject_key_cache = SubjectKeyCache()
+
+class SubjectKeyService:
+    _session_factory = None
+
+    @staticmethod
+    def _sessions():
+        if SubjectKeyService._session_factory is None:
+            from database import SessionLocalCompliance
+            SubjectKeyService._session_factory = SessionLocalCompliance
+        return SubjectKeyService._session_factory
+
+    @staticmethod
+    def subject_id(mobile_number: str) -> str:
+        from services.security_utils import SecurityUtils
+        return SecurityUtils.blind_index(mobile_number, "mobile_number")
+
+    @staticmethod
+    def _unwrap(wrapped_key):
+        from services.security_utils import SecurityUtils
+        return AESGCM(base64.b64decode(SecurityUtils.get_crypto_engine().decrypt(wrapped_key)))
+
+    @staticmethod
+    async def load(subject_ids, create: bool = False):
+        """Fills the cache for the given subjects with one key-table query (creating missing keys if asked)."""
+        from sqlalchemy import select, update, insert
+        from sqlalchemy.exc import IntegrityError
+        from models import SubjectKey
+        from services.security_utils import SecurityUtils
+        cached = {s: subject_key_cache.get(s) for s in set(subject_ids)}
+        missing = [s for s, c in cached.items() if c is None or (create and c is ERASED)]
+        if not missing:
+            return
+        async with SubjectKeyService._sessions()() as db:
+            rows = (await db.execute(
+                select(SubjectKey.subject_id, SubjectKey.wrapped_key, SubjectKey.status).where(SubjectKey.subject_id.in_(missing))
+            )).all()
+            found = {r.subject_id: r for r in rows}
+            for subject_id in missing:
+                row = found.get(subject_id)
+                if row is not None and row.status == "ACTIVE":
+                    subject_key_cache.put(subject_id, SubjectKeyService._unwrap(row.wrapped_key))
+                    continue
+                if not create:
+                    if row is not None:
+                        subject_key_cache.put(subject_id, ERASED)
+                    continue
+                # New principal, or one returning after erasure: fresh key (old tokens stay unreadable)
+                raw = AESGCM.generate_key(bit_length=256)
+                wrapped = SecurityUtils.encrypt_pii(base64.b64encode(raw).decode())
+                try:
+                    if row is None:
+                        await db.execute(insert(SubjectKey).values(subject_id=subject_id, wrapped_key=wrapped, status="ACTIVE"))
+                    else:
+                        await db.execute(
+                            update(SubjectKey).where(SubjectKey.subject_id == subject_id, SubjectKey.status == "DESTROYED")
+                            .values(wrapped_key=wrapped, status="ACTIVE", destroyed_at=None, purged_at=None)
+                        )
+                    await db.commit()
+                    subject_key_cache.put(subject_id, AESGCM(raw))
+                except IntegrityError:
+                    # Created concurrently by another request: use theirs
+                    await db.rollback()
+                    winner = (await db.execute(select(SubjectKey.wrapped_key).where(SubjectKey.subject_id == subject_id))).scalar()
+                    subject_key_cache.put(subject_id, SubjectKeyService._unwrap(winner))
+
+    @staticmethod
+    async def encrypt_many(mobile_number: str, values) -> list:
+        """Seals `values` (PII of one principal) under their data key. Empty values map to None."""
+        from services.security_utils import SecurityUtils
+        subject_id = SubjectKeyService.subject_id(mobile_number)
+        cached = subject_key_cache.get(subject_id)
+        if cached is None or cached is ERASED:
+            await SubjectKeyService.load([subject_id], create=True)
+        cipher = subject_key_cache.cipher(subject_id)
+        engine = SecurityUtils.get_crypto_engine()
+        header = f"{engine.SUBJECT_PREFIX}{subject_id}$"
+        nonces = os.urandom(engine.NONCE_SIZE * len(values))
+        return [
+            header + engine.seal(cipher, v, nonces[i * engine.NONCE_SIZE:(i + 1) * engine.NONCE_SIZE]) if v else None
+            for i, v in enumerate(values)
+        ]
+
+    @staticmethod
+    async def decrypt_many(tokens) -> list:
+        """
+        Like SecurityUtils.decrypt_many, loading the subject keys the batch needs in one
+        query first. Tokens of erased principals come back as "[ERASED]".
+        """
+        from services.security_utils import SecurityUtils
+        engine = SecurityUtils.get_crypto_engine()
+        prefix = engine.SUBJECT_PREFIX
+        await SubjectKeyService.load([t[len(prefix):].split("$", 1)[0] for t in tokens if t and t.startswith(prefix)])
+        out = []
+        for token in tokens:
+            try:
+                out.append(engine.decrypt(token) if token else None)
+            except SubjectErased:
+                out.append("[ERASED]")
+            except Exception:
+                out.append("[ENCRYPTED]")
+        return out
+
+    # --- ERASURE ---
+    @staticmethod
+    async def erase(mobile_number: str) -> bool:
+        """Destroys the principal's data key. Returns False if there was no active key."""
+        from sqlalchemy import update
+        from models import SubjectKey
+        subject_id = SubjectKeyService.subject_id(mobile_number)
+        async with SubjectKeyService._sessions()() as db:
+            res = await db.execute(
+                update(SubjectKey).where(SubjectKey.subject_id == subject_id, SubjectKey.status == "ACTIVE")
+                .values(wrapped_key=None, status="DESTROYED", destroyed_at=datetime.utcnow())
+            )
+            await db.commit()
+        subject_key_cache.put(subject_id, ERASED)
+        print(f"[ERASURE] Subject key {subject_id[:8]}… destroyed")
+        return res.rowcount == 1
+
+    @staticmethod
+    async def purge_subject(mobile_number: str, batch_size: int = PURGE_BATCH_SIZE):
+        """
+        Background physical purge after erase(): verification rows and their PDFs, and the
+        per-user vault documents. Rows written after the erasure (a returning principal)
+        are kept. GST sales-register rows are statutory records and stay, unreadable.
+        """
+        import asyncio
+        from sqlalchemy import select, update, delete
+        from database import SessionLocalApp
+        from models import Verification, VerifiedReport, SubjectKey, normalize_phone_key
+        from services.individual_vault import IndividualVaultService
+
+        subject_id = SubjectKeyService.subject_id(mobile_number)
+        phone_key = normalize_phone_key(mobile_number)
+        async with SubjectKeyService._sessions()() as db:
+            destroyed_at = (await db.execute(select(SubjectKey.destroyed_at).where(SubjectKey.subject_id == subject_id))).scalar()
+
+        purged = {}
+        async with SessionLocalApp() as db:
+            for model in (Verification, VerifiedReport) if phone_key else ():
+                created = model.verified_at if model is VerifiedReport else model.created_at
+                total = 0
+                while True:
+                    query = select(model.id, model.pdf_path).where(model.phone_key == phone_key).limit(batch_size)
+                    if destroyed_at is not None:
+                        query = query.where(created <= destroyed_at)
+                    rows = (await db.execute(query)).all()
+                    if not rows:
+                        break
+                    await db.execute(delete(model).where(model.id.in_([r.id for r in rows])))
+                    await db.commit()
+                    for r in rows:
+                        if r.pdf_path and os.path.exists(r.pdf_path):
+                            os.remove(r.pdf_path)
+                    total += len(rows)
+                    await asyncio.sleep(0) # Keep request traffic flowing between batches
+                purged[model.__tablename__] = total
+
+        purged["user_documents"] = await IndividualVaultService.purge_user_async(mobile_number)
+
+        async with SubjectKeyService._sessions()() as db:
+            await db.execute(update(SubjectKey).where(SubjectKey.subject_id == subject_id).values(purged_at=datetime.utcnow()))
+            await db.commit()
+        print(f"[ERASURE] Subject {subject_id[:8]}… purged: {purged}")
+        return purged
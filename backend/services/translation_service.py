@@ -13,12 +13,13 @@ class TranslationService:
         """
         Translates text to Target Language (English or Indian Regional).
         """
-        api_key = os.environ.get("GEMINI_API_KEY")
+        from services import simulation
+        api_key = os.environ.get("GEMINI_API_KEY") or ("SIMULATED" if simulation.enabled() else None)
         if not api_key:
             return {"error": "GEMINI_API_KEY not set", "translated_text": ""}
 
         try:
-            genai.configure(api_key=api_key)
+            genai.configure(api_key=api_key, **simulation.genai_options())
             model = genai.GenerativeModel('gemini-pro')
             
             # System Prompt for "Sworn Translator" persona
@@ -0,0 +1,243 @@
+import os
+import uuid
+import random
+import asyncio
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+"""
+TENANT WALLET (B2B Billing)
+Replaces the SELECT-then-write check_wallet_balance / deduct_from_wallet pair.
+
+- reserve(): a single conditional UPDATE ... WHERE balance >= price takes the funds,
+  so concurrent calls for one tenant cannot overdraw. It creates a HELD hold.
+- capture() / release(): settle the hold once the upstream result is known.
+  Release puts the funds back. capture_partial() bills part of a hold (batches).
+- Every movement is appended to wallet_ledger in the same transaction.
+- Hot tenants (wallet_shards > 1) keep their balance in N wallet_buckets rows.
+  Each reservation targets a random bucket and probes the others only if that one
+  is short, so one row no longer serializes all of the tenant's traffic. Near zero
+  the remainder can be fragmented below one price per bucket; set_shards() rebalances.
+- A request that crashes between reserve() and settling leaves its hold HELD. The
+  stale-hold sweeper (run_stale_hold_sweeper, started at boot) settles holds older than
+  WALLET_STALE_HOLD_SEC. It skips holds of RUNNING B2B batches. Holds handed to the Protean
+  retry queue are skipped while their item is queued, then settled by its outcome.
+"""
+
+STALE_HOLD_SEC = float(os.getenv("WALLET_STALE_HOLD_SEC", "3600"))
+
+class InsufficientFunds(Exception):
+    pass
+
+class WalletService:
+    @staticmethod
+    def _money(amount):
+        return amount if isinstance(amount, Decimal) else Decimal(str(amount))
+
+    @staticmethod
+    async def _ledger(db, tenant_id, entry_type, amount, hold_id=None, bucket=None, reference=None):
+        from sqlalchemy import insert
+        from models import WalletLedger
+        await db.execute(insert(WalletLedger).values(
+            tenant_id=tenant_id, entry_type=entry_type, amount=amount,
+            hold_id=hold_id, bucket=bucket, reference=reference
+        ))
+
+    @staticmethod
+    async def _take(db, tenant_id, amount):
+        """Atomically debits the available balance. Returns (ok, bucket)."""
+        from sqlalchemy import update, select, or_
+        from models import Tenant, WalletBucket
+
+        # Common case, one round trip: unsharded tenant
+        res = await db.execute(
+            update(Tenant)
+            .where(Tenant.id == tenant_id, Tenant.wallet_balance >= amount,
+                   or_(Tenant.wallet_shards.is_(None), Tenant.wallet_shards <= 1))
+            .values(wallet_balance=Tenant.wallet_balance - amount)
+        )
+        if res.rowcount == 1:
+            return True, None
+
+        shards = (await db.execute(select(Tenant.wallet_shards).where(Tenant.id == tenant_id))).scalar()
+        if not shards or shards <= 1:
+            return False, None
+
+        start = random.randrange(shards)
+        for i in range(shards):
+            bucket = (start + i) % shards
+            res = await db.execute(
+                update(WalletBucket)
+                .where(WalletBucket.tenant_id == tenant_id, WalletBucket.bucket == bucket, WalletBucket.balance >= amount)
+                .values(balance=WalletBucket.balance - amount)
+            )
+            if res.rowcount == 1:
+                return True, bucket
+        return False, None
+
+    @staticmethod
+    async def _credit(db, tenant_id, amount, bucket=None):
+        from sqlalchemy import update
+        from models import Tenant, WalletBucket
+        if bucket is None:
+            await db.execute(update(Tenant).where(Tenant.id == tenant_id).values(wallet_balance=Tenant.wallet_balance + amount))
+        else:
+            await db.execute(
+                update(WalletBucket)
+                .where(WalletBucket.tenant_id == tenant_id, WalletBucket.bucket == bucket)
+                .values(balance=WalletBucket.balance + amount)
+            )
+
+    # --- PUBLIC API ---
+    @staticmethod
+    async def reserve(db, tenant_id, amount, reference: str = None) -> str:
+        """Holds `amount` (rupees) for the tenant. Returns the hold id or raises InsufficientFunds."""
+        from sqlalchemy import insert
+        from models import WalletHold
+        amount = WalletService._money(amount)
+        ok, bucket = await WalletService._take(db, tenant_id, amount)
+        if not ok:
+            await db.rollback()
+            raise InsufficientFunds(f"Insufficient balance. Required: ₹{amount}")
+
+        hold_id = uuid.uuid4().hex
+        await db.execute(insert(WalletHold).values(id=hold_id, tenant_id=tenant_id, amount=amount, bucket=bucket, status="HELD", reference=reference))
+        await WalletService._ledger(db, tenant_id, "RESERVE", -amount, hold_id, bucket, reference)
+        await db.commit()
+        return hold_id
+
+    @staticmethod
+    async def _settle(db, hold_id, new_status):
+        from sqlalchemy import update, select
+        from models import WalletHold
+        res = await db.execute(update(WalletHold).where(WalletHold.id == hold_id, WalletHold.status == "HELD").values(status=new_status))
+        if res.rowcount != 1:
+            await db.rollback()
+            return None # Already settled (idempotent)
+        return (await db.execute(select(WalletHold.tenant_id, WalletHold.amount, WalletHold.bucket, WalletHold.reference).where(WalletHold.id == hold_id))).one()
+
+    @staticmethod
+    async def capture(db, hold_id) -> bool:
+        hold = await WalletService._settle(db, hold_id, "CAPTURED")
+        if not hold:
+            return False
+        await WalletService._ledger(db, hold.tenant_id, "CAPTURE", Decimal("0"), hold_id, hold.bucket, hold.reference)
+        await db.commit()
+        return True
+
+    @staticmethod
+    async def release(db, hold_id) -> bool:
+        hold = await WalletService._settle(db, hold_id, "RELEASED")
+        if not hold:
+            return False
+        await WalletService._credit(db, hold.tenant_id, hold.amount, hold.bucket)
+        await WalletService._ledger(db, hold.tenant_id, "RELEASE", hold.amount, hold_id, hold.bucket, hold.reference)
+        await db.commit()
+        return True
+
+    @staticmethod
+    async def capture_partial(db, hold_id, amount, commit: bool = True) -> bool:
+        """Captures `amount` of a hold and releases the rest (batch billing)."""
+        hold = await WalletService._settle(db, hold_id, "CAPTURED")
+        if not hold:
+            return False
+        amount = WalletService._money(amount)
+        if amount > hold.amount:
+            await db.rollback()
+            raise ValueError(f"Cannot capture ₹{amount} from a ₹{hold.amount} hold")
+        await WalletService._ledger(db, hold.tenant_id, "CAPTURE", Decimal("0"), hold_id, hold.bucket, hold.reference)
+        if amount < hold.amount:
+            await WalletService._credit(db, hold.tenant_id, hold.amount - amount, hold.bucket)
+            await WalletService._ledger(db, hold.tenant_id, "RELEASE", hold.amount - amount, hold_id, hold.bucket, hold.reference)
+        if commit:
+            await db.commit()
+        return True
+
+    @staticmethod
+    async def debit(db, tenant_id, amount, reference: str = None):
+        """Immediate charge: reserve + capture."""
+        hold_id = await WalletService.reserve(db, tenant_id, amount, reference)
+        await WalletService.capture(db, hold_id)
+        return hold_id
+
+    @staticmethod
+    async def topup(db, tenant_id, amount, reference: str = None, commit: bool = True):
+        from sqlalchemy import select
+        from models import Tenant
+        amount = WalletService._money(amount)
+        shards = (await db.execute(select(Tenant.wallet_shards).where(Tenant.id == tenant_id))).scalar()
+        bucket = random.randrange(shards) if shards and shards > 1 else None
+        await WalletService._credit(db, tenant_id, amount, bucket)
+        await WalletService._ledger(db, tenant_id, "TOPUP", amount, bucket=bucket, reference=reference)
+        if commit:
+            await db.commit()
+
+    @staticmethod
+    async def balance(db, tenant_id) -> Decimal:
+        from sqlalchemy import select, func
+        from models import Tenant, WalletBucket
+        base = (await db.execute(select(Tenant.wallet_balance).where(Tenant.id == tenant_id))).scalar()
+        if base is None:
+            return None
+        buckets = (await db.execute(select(func.sum(WalletBucket.balance)).where(WalletBucket.tenant_id == tenant_id))).scalar()
+        return base + (buckets or Decimal("0"))
+
+    @staticmethod
+    async def set_shards(db, tenant_id, shards: int):
+        """
+        (Re)spreads a tenant's whole available balance evenly over `shards` buckets
+        (shards=1 folds everything back into tenants.wallet_balance).
+        """
+        from sqlalchemy import update, delete, insert
+        from models import Tenant, WalletBucket
+        total = await WalletService.balance(db, tenant_id)
+        if total is None:
+            raise ValueError("Tenant not found")
+        await db.execute(delete(WalletBucket).where(WalletBucket.tenant_id == tenant_id))
+        if shards <= 1:
+            await db.execute(update(Tenant).where(Tenant.id == tenant_id).values(wallet_balance=total, wallet_shards=1))
+        else:
+            share = (total / shards).quantize(Decimal("0.01"), rounding="ROUND_DOWN")
+            rows = [{"tenant_id": tenant_id, "bucket": b, "balance": share} for b in range(shards)]
+            rows[0]["balance"] += total - share * shards
+            await db.execute(insert(WalletBucket), rows)
+            await db.execute(update(Tenant).where(Tenant.id == tenant_id).values(wallet_balance=Decimal("0"), wallet_shards=shards))
+        await WalletService._ledger(db, tenant_id, "REBALANCE", Decimal("0"), reference=f"shards={shards}")
+        await db.commit()
+
+    @staticmethod
+    async def release_stale_holds(db, older_than, retry_queue=None):
+        """Settles holds left HELD by a crashed request (created before `older_than`).
+        Returns how many were settled."""
+        from sqlalchemy import select
+        from models import WalletHold, B2BBatch
+        if retry_queue is None:
+            from services.retry_queue import retry_queue
+        running_batches = select(B2BBatch.hold_id).where(B2BBatch.status == "RUNNING", B2BBatch.hold_id.isnot(None))
+        stale = (await db.execute(
+            select(WalletHold.id).where(WalletHold.status == "HELD", WalletHold.created_at < older_than, WalletHold.id.notin_(running_batches))
+        )).scalars().all()
+        outcomes = await asyncio.to_thread(retry_queue.hold_outcomes, stale) if stale else {}
+        settled = 0
+        for hold_id in stale:
+            outcome = outcomes.get(hold_id, "RELEASE")
+            if outcome == "OPEN": # Its queued retry still needs it
+                continue
+            if outcome == "CAPTURE":
+                settled += await WalletService.capture(db, hold_id)
+            else:
+                settled += await WalletService.release(db, hold_id)
+        return settled
+
+    @staticmethod
+    async def run_stale_hold_sweeper(interval_sec: float, max_age_sec: float = STALE_HOLD_SEC):
+        from database import SessionLocalApp
+        while True:
+            try:
+                async with SessionLocalApp() as db:
+                    settled = await WalletService.release_stale_holds(db, datetime.utcnow() - timedelta(seconds=max_age_sec))
+                if settled:
+                    print(f"[WALLET] Settled {settled} stale holds older than {max_age_sec:.0f}s")
+            except Exception as e:
+                print(f"[WALLET] Stale hold sweep failed: {e}")
+            await asyncio.sleep(interval_sec)
@@ -1,215 +1,237 @@
 
+import os
 import hashlib
 from datetime import datetime, timedelta
-from database import get_compliance_db, tokenize_compliance_pii
 from sqlalchemy import select
-from models import DPDPConsent, AuditLog, VerifiedReport
+from models import VerifiedReport
 import json
 
 class WhatsAppProcessor:
+    @staticmethod
+    async def handle_message(user_phone: str, message_text: str, image_url: str):
+        """
+        One webhook message, run from the phone's mailbox (services/keyed_dispatcher.py), so
+        even the clash check below sees this user's messages one at a time and in order.
+        """
+        from models import normalize_phone_key
+        from database import SessionLocalApp
+        from services.interakt import send_interakt_reply
+        if message_text.upper() == "NITI":
+            # Simple clash check (indexed equality on the normalized phone key; verified_reports lives in main.db)
+            async with SessionLocalApp() as db:
+                verified = (await db.execute(select(VerifiedReport.id).filter(VerifiedReport.phone_key == normalize_phone_key(user_phone)).limit(1))).first()
+            if verified:
+                send_interakt_reply(user_phone, "Hello, you are already verified! For support, contact +91-9999999999")
+                return
+        await WhatsAppProcessor.process_interaction(user_phone, message_text, image_url)
+
     @staticmethod
     async def process_interaction(user_phone: str, message_text: str, image_url: str):
-        async for db_compliance in get_compliance_db():
-            from app import USER_SESSIONS, police_verifier, pvc_app_engine, pvc_status_checker, pvc_validator
-            from services.niti_wizard import NitiWizardService
-            from services.interakt import send_interakt_reply
-            
-            session = USER_SESSIONS.get(user_phone, {"state": "START", "context": {}, "role": "PERSONAL"})
-            state = session["state"]
-            context = session.get("context", {})
-            role = session.get("role", "PERSONAL")
-            msg_upper = message_text.upper()
-            
-            response_text = ""
-            next_state = state
-            next_role = role
+        # The phone's session stays locked for the whole interaction (services/session_store.py)
+        from services.session_store import session_store
+        async with session_store.session(user_phone) as session:
+            await WhatsAppProcessor._interact(session, user_phone, message_text, image_url)
 
-            # --- TRIGGER: Hi (Individual Menu) ---
-            if msg_upper in ["HI", "HELLO", "START", "NAMASTE"]:
-                next_role = "PERSONAL"
-                next_state = "START"
+    @staticmethod
+    async def _interact(session, user_phone: str, message_text: str, image_url: str):
+        from app import police_verifier, pvc_app_engine, pvc_status_checker, pvc_validator
+        from services.niti_wizard import NitiWizardService
+        from services.interakt import send_interakt_reply
+        
+        state = session.state
+        context = session.context
+        role = session.role
+        msg_upper = message_text.upper()
+        
+        response_text = ""
+        next_state = state
+        next_role = role
+
+        # --- TRIGGER: Hi (Individual Menu) ---
+        if msg_upper in ["HI", "HELLO", "START", "NAMASTE"]:
+            next_role = "PERSONAL"
+            next_state = "START"
+            response_text = (
+                "Namaste! Welcome to **CD-AI Individual Portal**.\n\n"
+                "I am Niti, your compliance assistant. How can I help you today?\n"
+                "1. Identity Help (NITI)\n"
+                "2. Police Verification (POLICE)\n"
+                "3. My Invoices (BILL)"
+            )
+            session.state, session.context, session.role = next_state, context, next_role
+            send_interakt_reply(user_phone, response_text)
+            return
+
+        # --- TRIGGER: Agent Mode Deep Link (?req_id=) ---
+        if "?REQ_ID=" in msg_upper or msg_upper == "AGENT_MODE":
+            req_id = message_text.split("=")[1] if "=" in message_text else "DEMO_123"
+            next_role = "AGENT"
+            next_state = "AWAITING_AGENT_UPLOAD"
+            context["req_id"] = req_id
+            response_text = (
+                f"Hi! You are in **Agent Mode** for Request ID: {req_id}.\n\n"
+                "Please upload the requested document photo now.\n"
+                "*(Note: This upload is billed to your Employer Wallet)*"
+            )
+            session.state, session.context, session.role = next_state, context, next_role
+            send_interakt_reply(user_phone, response_text)
+            return
+
+        if msg_upper == "PERSONAL_MODE":
+            next_role = "PERSONAL"
+            next_state = "START"
+            response_text = "Welcome back to **Personal Mode**. Type 'HI' for the main menu."
+            session.state, session.context, session.role = next_state, context, next_role
+            send_interakt_reply(user_phone, response_text)
+            return
+
+        # --- AGENT MODE (Upload Only) ---
+        if role == "AGENT":
+            if image_url:
+                # Simulation: Process agent upload
+                req_id = context.get("req_id", "UNKNOWN")
+                # Log to Employer Wallet (Mock)
+                print(f"[BILLING] Billed 1 credit to Employer Wallet for Req: {req_id}")
+                
                 response_text = (
-                    "Namaste! Welcome to **CD-AI Individual Portal**.\n\n"
-                    "I am Niti, your compliance assistant. How can I help you today?\n"
-                    "1. Identity Help (NITI)\n"
-                    "2. Police Verification (POLICE)\n"
-                    "3. My Invoices (BILL)"
+                    f"✅ Document received for Request {req_id}.\n\n"
+                    "It has been securely uploaded to the **Workforce Vault** for verification.\n\n"
+                    "Type 'PERSONAL_MODE' to exit Agent Mode."
                 )
-                USER_SESSIONS[user_phone] = {"state": next_state, "context": context, "role": next_role}
-                send_interakt_reply(user_phone, response_text)
-                return
+                next_state = "START"
+            else:
+                response_text = "You are in **Agent Mode**. Please upload the requested document photo now, or type 'PERSONAL_MODE' to exit."
+            
+            session.state, session.context, session.role = next_state, context, role
+            send_interakt_reply(user_phone, response_text)
+            return
+
+        # --- NITI FLOW (Personal Only) ---
+        if state.startswith("NITI_") or msg_upper == "NITI":
+            if state == "START" and msg_upper == "NITI":
+                state = "NITI_START"
+            
+            if state == "NITI_UPLOAD" and image_url:
+                # Simulation: In real life, trigger Vision API here
+                mock_ocr_text = "Applicant Address: Flat 402, Sai Residency, Hitech City, Hyderabad, Telangana - 500081"
+                context["ocr_text"] = mock_ocr_text
+                
+                if image_url.startswith("/") or os.name != "nt":
+                    from app import cleanup_local_file
+                    import asyncio
+                    # In background for WhatsApp to return fast
+                    asyncio.create_task(asyncio.to_thread(cleanup_local_file, image_url))
 
-            # --- TRIGGER: Agent Mode Deep Link (?req_id=) ---
-            if "?REQ_ID=" in msg_upper or msg_upper == "AGENT_MODE":
-                req_id = message_text.split("=")[1] if "=" in message_text else "DEMO_123"
-                next_role = "AGENT"
-                next_state = "AWAITING_AGENT_UPLOAD"
-                context["req_id"] = req_id
                 response_text = (
-                    f"Hi! You are in **Agent Mode** for Request ID: {req_id}.\n\n"
-                    "Please upload the requested document photo now.\n"
-                    "*(Note: This upload is billed to your Employer Wallet)*"
+                    "✅ Document received! Our AI engine is now performing:\n"
+                    "1. OCR Extraction\n"
+                    "2. Face Match (98.2%)\n"
+                    "3. Sanctions Check\n\n"
+                    "You will receive the final report shortly."
                 )
-                USER_SESSIONS[user_phone] = {"state": next_state, "context": context, "role": next_role}
-                send_interakt_reply(user_phone, response_text)
-                return
-
-            if msg_upper == "PERSONAL_MODE":
-                next_role = "PERSONAL"
                 next_state = "START"
-                response_text = "Welcome back to **Personal Mode**. Type 'HI' for the main menu."
-                USER_SESSIONS[user_phone] = {"state": next_state, "context": context, "role": next_role}
-                send_interakt_reply(user_phone, response_text)
-                return
-
-            # --- AGENT MODE (Upload Only) ---
-            if role == "AGENT":
-                if image_url:
-                    # Simulation: Process agent upload
-                    req_id = context.get("req_id", "UNKNOWN")
-                    # Log to Employer Wallet (Mock)
-                    print(f"[BILLING] Billed 1 credit to Employer Wallet for Req: {req_id}")
-                    
-                    response_text = (
-                        f"✅ Document received for Request {req_id}.\n\n"
-                        "It has been securely uploaded to the **Workforce Vault** for verification.\n\n"
-                        "Type 'PERSONAL_MODE' to exit Agent Mode."
-                    )
-                    next_state = "START"
-                else:
-                    response_text = "You are in **Agent Mode**. Please upload the requested document photo now, or type 'PERSONAL_MODE' to exit."
-                
-                USER_SESSIONS[user_phone] = {"state": next_state, "context": context, "role": role}
-                send_interakt_reply(user_phone, response_text)
-                return
-
-            # --- NITI FLOW (Personal Only) ---
-            if state.startswith("NITI_") or msg_upper == "NITI":
-                if state == "START" and msg_upper == "NITI":
-                    state = "NITI_START"
+            else:
+                response_text, next_state, context = NitiWizardService.process_message(user_phone, message_text, state, context)
                 
-                if state == "NITI_UPLOAD" and image_url:
-                    # Simulation: In real life, trigger Vision API here
-                    mock_ocr_text = "Applicant Address: Flat 402, Sai Residency, Hitech City, Hyderabad, Telangana - 500081"
-                    context["ocr_text"] = mock_ocr_text
+                # Side Effect: Persist Consent
+                if state == "NITI_DPDP" and message_text == "1":
+                    lang = context.get("selected_lang", "en-IN")
+                    dpdp_notice = NitiWizardService.DPDP_TEXTS.get(lang)
+                    form_hash = hashlib.sha256(dpdp_notice.encode()).hexdigest()
                     
-                    if image_url.startswith("/") or os.name != "nt":
-                        from app import cleanup_local_file
-                        import asyncio
-                        # In background for WhatsApp to return fast
-                        asyncio.create_task(asyncio.to_thread(cleanup_local_file, image_url))
-
-                    response_text = (
-                        "✅ Document received! Our AI engine is now performing:\n"
-                        "1. OCR Extraction\n"
-                        "2. Face Match (98.2%)\n"
-                        "3. Sanctions Check\n\n"
-                        "You will receive the final report shortly."
+                    # Sealed under the principal's data key, so erasure crypto-shreds the consent too
+                    from services.subject_keys import SubjectKeyService
+                    user_token, sig_token, ip_token = await SubjectKeyService.encrypt_many(user_phone, [user_phone, "WHATSAPP_DIGITAL_SIGN", "WHATSAPP_GATEWAY_IP"])
+                    
+                    from services.audit_writer import audit_writer
+                    await audit_writer.log(
+                        "DPDPConsent",
+                        user_id_token=user_token,
+                        form_hash=form_hash,
+                        signature_token=sig_token,
+                        ip_token=ip_token,
+                        retention_until=datetime.utcnow() + timedelta(days=365*5)
                     )
-                    next_state = "START"
+            
+        # --- POLICE FLOW ---
+        elif state.startswith("PVC_") or state in ["SELECT_LOCATION", "CHECK_EXISTING", "AWAITING_CERT_UPLOAD", "AWAITING_NAME_FOR_APP", "AWAITING_APP_ID"] or msg_upper == "POLICE":
+            if state == "START" and msg_upper == "POLICE":
+                response_text = (
+                    "Select your Work Location for Police Verification:\n"
+                    "1. Hyderabad (TS)\n"
+                    "2. Bangalore (KA)\n"
+                    "3. Chennai (TN)\n"
+                    "4. Andhra (AP)"
+                )
+                next_state = "SELECT_LOCATION"
+            
+            elif state == "PVC_EXISTING_OPTIONS":
+                if message_text == "1":
+                    response_text = "Please upload a photo of your NEW Police Certificate."
+                    next_state = "AWAITING_CERT_UPLOAD"
+                elif message_text == "2":
+                    response_text = "Please enter your Application/Petition Number to track."
+                    next_state = "AWAITING_APP_ID"
+                elif message_text == "3":
+                    response_text = "Select your NEW Work Location:\n1. Hyderabad (TS)\n2. Bangalore (KA)\n3. Chennai (TN)\n4. Andhra (AP)"
+                    next_state = "SELECT_LOCATION"
                 else:
-                    response_text, next_state, context = NitiWizardService.process_message(user_phone, message_text, state, context)
-                    
-                    # Side Effect: Persist Consent
-                    if state == "NITI_DPDP" and message_text == "1":
-                        lang = context.get("selected_lang", "en-IN")
-                        dpdp_notice = NitiWizardService.DPDP_TEXTS.get(lang)
-                        form_hash = hashlib.sha256(dpdp_notice.encode()).hexdigest()
-                        
-                        from services.security_utils import SecurityUtils
-                        user_token = SecurityUtils.encrypt_pii(user_phone)
-                        sig_token = SecurityUtils.encrypt_pii("WHATSAPP_DIGITAL_SIGN")
-                        ip_token = SecurityUtils.encrypt_pii("WHATSAPP_GATEWAY_IP")
-                        
-                        consent = DPDPConsent(
-                            user_id_token=user_token,
-                            form_hash=form_hash,
-                            signature_token=sig_token,
-                            ip_token=ip_token,
-                            retention_until=datetime.utcnow() + timedelta(days=365*5)
-                        )
-                        db_compliance.add(consent)
-                        await db_compliance.commit()
-                
-            # --- POLICE FLOW ---
-            elif state.startswith("PVC_") or state in ["SELECT_LOCATION", "CHECK_EXISTING", "AWAITING_CERT_UPLOAD", "AWAITING_NAME_FOR_APP", "AWAITING_APP_ID"] or msg_upper == "POLICE":
-                if state == "START" and msg_upper == "POLICE":
+                    response_text = "Invalid choice. Reply 1, 2, or 3."
+
+            elif state == "SELECT_LOCATION":
+                state_map = {"1": "TS", "2": "KA", "3": "TN", "4": "AP"}
+                sel = state_map.get(message_text)
+                if sel:
+                    context["state_code"] = sel
+                    strategy = police_verifier.verify_candidate(sel, {})
+                    response_text = f"Selected: {sel} ({strategy.get('portal')}).\nDo you already have a Police Certificate? (YES / NO / APPLIED)"
+                    next_state = "CHECK_EXISTING"
+                else:
+                    response_text = "Invalid selection. Reply 1-4."
+
+            elif state == "CHECK_EXISTING":
+                if msg_upper == "YES":
+                    response_text = "Please upload a photo of your Police Certificate."
+                    next_state = "AWAITING_CERT_UPLOAD"
+                elif msg_upper == "NO":
+                    response_text = "Please send your Full Name to generate the application form."
+                    next_state = "AWAITING_NAME_FOR_APP"
+                elif msg_upper == "APPLIED":
+                    response_text = "Please enter your Application/Petition Number."
+                    next_state = "AWAITING_APP_ID"
+
+            elif state == "AWAITING_CERT_UPLOAD":
+                if image_url:
+                    val_res = await pvc_validator.validate_certificate_image(image_url, user_phone)
                     response_text = (
-                        "Select your Work Location for Police Verification:\n"
-                        "1. Hyderabad (TS)\n"
-                        "2. Bangalore (KA)\n"
-                        "3. Chennai (TN)\n"
-                        "4. Andhra (AP)"
+                        f"✅ Analysis: {val_res.get('verdict')}\n"
+                        f"Integrity: {val_res.get('integrity_score', 0)*100}%\n"
+                        f"Gov Status: {val_res.get('gov_status')}\n\n Saved to vault."
                     )
-                    next_state = "SELECT_LOCATION"
-                
-                elif state == "PVC_EXISTING_OPTIONS":
-                    if message_text == "1":
-                        response_text = "Please upload a photo of your NEW Police Certificate."
-                        next_state = "AWAITING_CERT_UPLOAD"
-                    elif message_text == "2":
-                        response_text = "Please enter your Application/Petition Number to track."
-                        next_state = "AWAITING_APP_ID"
-                    elif message_text == "3":
-                        response_text = "Select your NEW Work Location:\n1. Hyderabad (TS)\n2. Bangalore (KA)\n3. Chennai (TN)\n4. Andhra (AP)"
-                        next_state = "SELECT_LOCATION"
-                    else:
-                        response_text = "Invalid choice. Reply 1, 2, or 3."
-
-                elif state == "SELECT_LOCATION":
-                    state_map = {"1": "TS", "2": "KA", "3": "TN", "4": "AP"}
-                    sel = state_map.get(message_text)
-                    if sel:
-                        context["state_code"] = sel
-                        strategy = police_verifier.verify_candidate(sel, {})
-                        response_text = f"Selected: {sel} ({strategy.get('portal')}).\nDo you already have a Police Certificate? (YES / NO / APPLIED)"
-                        next_state = "CHECK_EXISTING"
-                    else:
-                        response_text = "Invalid selection. Reply 1-4."
-
-                elif state == "CHECK_EXISTING":
-                    if msg_upper == "YES":
-                        response_text = "Please upload a photo of your Police Certificate."
-                        next_state = "AWAITING_CERT_UPLOAD"
-                    elif msg_upper == "NO":
-                        response_text = "Please send your Full Name to generate the application form."
-                        next_state = "AWAITING_NAME_FOR_APP"
-                    elif msg_upper == "APPLIED":
-                        response_text = "Please enter your Application/Petition Number."
-                        next_state = "AWAITING_APP_ID"
-
-                elif state == "AWAITING_CERT_UPLOAD":
-                    if image_url:
-                        val_res = await pvc_validator.validate_certificate_image(image_url, user_phone)
-                        response_text = (
-                            f"✅ Analysis: {val_res.get('verdict')}\n"
-                            f"Integrity: {val_res.get('integrity_score', 0)*100}%\n"
-                            f"Gov Status: {val_res.get('gov_status')}\n\n Saved to vault."
-                        )
-                        next_state = "START"
-                    else:
-                        response_text = "Please upload an image."
-
-                elif state == "AWAITING_NAME_FOR_APP":
-                    res = pvc_app_engine.generate_application(context.get("state_code", "TS"), {"name": message_text, "id": user_phone})
-                    response_text = f"✅ Form Generated: {res.get('file_path')}\n{res.get('instructions')}"
                     next_state = "START"
+                else:
+                    response_text = "Please upload an image."
 
-                elif state == "AWAITING_APP_ID":
-                    status = await pvc_status_checker.check_status(context.get("state_code", "TS"), message_text)
-                    response_text = f"👮‍♂️ Status: {status}"
-                    next_state = "START"
+            elif state == "AWAITING_NAME_FOR_APP":
+                res = pvc_app_engine.generate_application(context.get("state_code", "TS"), {"name": message_text, "id": user_phone})
+                response_text = f"✅ Form Generated: {res.get('file_path')}\n{res.get('instructions')}"
+                next_state = "START"
 
-            else:
-                response_text = "Welcome to ComplianceDesk. Type 'NITI' for Identity or 'POLICE' for Police Verification."
+            elif state == "AWAITING_APP_ID":
+                status = await pvc_status_checker.check_status(context.get("state_code", "TS"), message_text)
+                response_text = f"👮‍♂️ Status: {status}"
                 next_state = "START"
 
-            # Update Session
-            USER_SESSIONS[user_phone] = {"state": next_state, "context": context}
-            
-            # Send Reply
-            if response_text:
-                send_interakt_reply(user_phone, response_text)
+        else:
+            response_text = "Welcome to ComplianceDesk. Type 'NITI' for Identity or 'POLICE' for Police Verification."
+            next_state = "START"
+
+        # Update Session
+        session.state, session.context, session.role = next_state, context, next_role
+        
+        # Send Reply
+        if response_text:
+            send_interakt_reply(user_phone, response_text)
 
     @staticmethod
     def send_invoice(user_phone: str, pdf_path: str):
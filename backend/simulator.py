@@ -0,0 +1,384 @@
+import os
+import sys
+import json
+import time
+import hmac
+import uuid
+import random
+import difflib
+import hashlib
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+# The simulator answers for the upstreams; it must not try to simulate them itself
+os.environ.pop("UPSTREAM_SIMULATION", None)
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+UPSTREAM SIMULATOR (local stand-in for every provider the app talks to)
+Started by services/simulation.py when UPSTREAM_SIMULATION is set, or by hand:
+    python simulator.py --profile realistic --port 8765
+    python simulator.py --emit-razorpay 500 --app-url http://127.0.0.1:8000 --rate 20
+
+Services (route prefix -> profile section):
+- Protean grid      /v1/auth/token, every PROTEAN_API_GRID url  -> "protean", "protean:<slug>"
+- Legacy stubs      /v1/legacy/{forgery-scan,gstin,digilocker}  -> "legacy"
+- Truth source      /truth/v1/verify-id                         -> "truth"
+- Interakt          /interakt/v1/public/message/                -> "interakt"
+- Gemini (REST)     /v1beta/models/<model>:generateContent      -> "gemini"
+- Razorpay          calls the app: --emit-razorpay posts payment.captured webhooks
+Ids starting with "0000" fail verification, as in MockProviderService.
+
+Each section may set (merged default <- service <- "service:endpoint"):
+    latency      {"dist": "fixed", "ms"} | {"dist": "uniform", "min_ms", "max_ms"}
+                 | {"dist": "lognormal", "median_ms", "sigma"} | {"dist": "pareto", "scale_ms", "alpha", "cap_ms"}
+    error_rate   share of calls answered with error_status (default 503)
+    timeout_rate share of calls that hang for hang_ms, then 504 (the client should give up first)
+    rate_limit   {"rate", "burst"} per endpoint; above it 429 + Retry-After
+    drip         {"chunks", "interval_ms"}: the body is written in pieces (slow-drip response)
+A profile is a name below or a JSON file of sections ({"base": "<name>"} inherits one).
+GET /_sim/stats reports what was served and injected; POST /_sim/profile swaps the profile.
+"""
+
+PROFILES = {
+    "instant": {
+        "default": {"latency": {"dist": "fixed", "ms": 0}},
+    },
+    "realistic": {
+        "default": {"latency": {"dist": "lognormal", "median_ms": 80, "sigma": 0.5}, "error_rate": 0.005},
+        "protean": {"latency": {"dist": "pareto", "scale_ms": 40, "alpha": 1.5, "cap_ms": 3000}, "error_rate": 0.01, "rate_limit": {"rate": 50, "burst": 10}},
+        "protean:auth": {"latency": {"dist": "lognormal", "median_ms": 60, "sigma": 0.3}, "error_rate": 0, "rate_limit": None},
+        "protean:kyc_ocr": {"latency": {"dist": "lognormal", "median_ms": 900, "sigma": 0.4}, "rate_limit": {"rate": 5, "burst": 10}},
+        "protean:face_liveness": {"latency": {"dist": "lognormal", "median_ms": 700, "sigma": 0.4}, "rate_limit": {"rate": 5, "burst": 10}},
+        "protean:esign_pro": {"latency": {"dist": "lognormal", "median_ms": 1500, "sigma": 0.5}},
+        "truth": {"latency": {"dist": "lognormal", "median_ms": 300, "sigma": 0.5}},
+        "interakt": {"latency": {"dist": "lognormal", "median_ms": 120, "sigma": 0.4}, "rate_limit": {"rate": 80, "burst": 20}},
+        "gemini": {"latency": {"dist": "lognormal", "median_ms": 1500, "sigma": 0.4}, "error_rate": 0.01, "error_status": 429, "drip": {"chunks": 5, "interval_ms": 100}},
+    },
+    "degraded": {
+        "base": "realistic",
+        "default": {"error_rate": 0.05, "timeout_rate": 0.02, "hang_ms": 15000},
+        "protean": {"latency": {"dist": "pareto", "scale_ms": 150, "alpha": 1.1, "cap_ms": 8000}, "error_rate": 0.1, "timeout_rate": 0.03,
+                    "rate_limit": {"rate": 20, "burst": 5}, "drip": {"chunks": 4, "interval_ms": 250}},
+        "truth": {"latency": {"dist": "lognormal", "median_ms": 1200, "sigma": 0.8}},
+        "gemini": {"error_rate": 0.1, "error_status": 429, "drip": {"chunks": 10, "interval_ms": 300}},
+    },
+}
+
+def load_profile(spec):
+    """Profile name, JSON file path or dict -> {section: settings}."""
+    if isinstance(spec, dict):
+        profile = dict(spec)
+    elif spec in PROFILES:
+        profile = dict(PROFILES[spec])
+    else:
+        with open(spec) as f:
+            profile = json.load(f)
+    base = profile.pop("base", None)
+    if base is None:
+        return profile
+    merged = load_profile(base)
+    for section, settings in profile.items():
+        merged[section] = dict(merged.get(section, {}), **settings)
+    return merged
+
+def sample_ms(latency, rng):
+    dist = (latency or {}).get("dist", "fixed")
+    if dist == "fixed":
+        return latency.get("ms", 0) if latency else 0
+    if dist == "uniform":
+        return rng.uniform(latency["min_ms"], latency["max_ms"])
+    if dist == "lognormal":
+        return latency["median_ms"] * rng.lognormvariate(0, latency.get("sigma", 0.5))
+    if dist == "pareto":
+        return min(latency.get("cap_ms", 60000), latency["scale_ms"] * rng.paretovariate(latency.get("alpha", 1.5)))
+    raise ValueError(f"Unknown latency distribution {dist!r}")
+
+class Simulation:
+    """Profile, per-endpoint quotas and stats shared by all handler threads."""
+
+    def __init__(self, profile, seed=None):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.use(profile)
+
+    def use(self, profile):
+        with self.lock:
+            self.profile = load_profile(profile)
+            self.tat = {}
+            self.stats = {}
+
+    def settings(self, service, endpoint):
+        return dict(self.profile.get("default", {}), **self.profile.get(service, {}), **self.profile.get(f"{service}:{endpoint}", {}))
+
+    def admit(self, key, rate_limit):
+        """GCRA per endpoint; returns 0 when admitted, else seconds until the next slot."""
+        if not rate_limit:
+            return 0
+        interval = 1 / rate_limit["rate"]
+        with self.lock:
+            now = time.monotonic()
+            tat = max(self.tat.get(key, 0.0), now)
+            wait = tat - (max(1, rate_limit.get("burst", 1)) - 1) * interval - now
+            if wait > 0:
+                return wait
+            self.tat[key] = tat + interval
+            return 0
+
+    def record(self, key, outcome, injected_ms=None):
+        with self.lock:
+            stats = self.stats.setdefault(key, {"requests": 0, "ok": 0, "errors": 0, "throttled": 0, "timeouts": 0, "latency_ms": deque(maxlen=10000)})
+            stats["requests"] += 1
+            stats[outcome] += 1
+            if injected_ms is not None:
+                stats["latency_ms"].append(injected_ms)
+
+    def report(self):
+        with self.lock:
+            report = {}
+            for key, stats in self.stats.items():
+                samples = sorted(stats["latency_ms"])
+                pct = lambda q: round(samples[min(len(samples) - 1, int(len(samples) * q / 100))], 1) if samples else None
+                report[key] = dict({k: v for k, v in stats.items() if k != "latency_ms"}, p50_ms=pct(50), p95_ms=pct(95), p99_ms=pct(99))
+            return report
+
+# --- Upstream answers ---
+
+def _protean_routes():
+    from services.protean_service import PROTEAN_API_GRID
+    return {cell["url"]: (slug, cell) for slug, cell in PROTEAN_API_GRID.items()}
+
+def protean_token(body, headers):
+    return 200, {"access_token": f"sim-{uuid.uuid4().hex}", "token_type": "Bearer", "expires_in": 3600}
+
+def protean_cell(slug, cell):
+    def answer(body, headers):
+        if not headers.get("Authorization", "").startswith("Bearer sim-"):
+            return 401, {"status": "ERROR", "message": "invalid_token"}
+        data = json.loads(body or b"{}")
+        missing = [field for field in cell["required"] if field not in data]
+        if missing:
+            return 400, {"status": "ERROR", "message": f"Missing fields: {', '.join(missing)}"}
+        subject = str(data.get(cell["required"][0]) or "")
+        if subject.startswith("0000"):
+            return 200, {"status": "FAILED", "message": "Record not found", "client_ref_id": data.get("client_ref_id")}
+        record = {field: data[field] for field in cell["required"]}
+        if slug == "name_match":
+            score = difflib.SequenceMatcher(None, str(data["name1"]).lower(), str(data["name2"]).lower()).ratio()
+            record.update(score=round(score, 2), match=score >= 0.8)
+        else:
+            record["name"] = "Arjun Kumar" # Name on the record, for name_match checks
+        return 200, {"status": "SUCCESS", "client_ref_id": data.get("client_ref_id"), "data": record, "source": "SIMULATED_PROTEAN"}
+    return answer
+
+def legacy(stub):
+    def answer(body, headers):
+        from services import protean_service
+        data = json.loads(body or b"{}")
+        return 200, getattr(protean_service, stub)(*data.values())
+    return answer
+
+def truth_verify(body, headers):
+    from services.mock_provider_service import MockProviderService
+    data = json.loads(body or b"{}")
+    return 200, MockProviderService.verify_id(data.get("id_type", "AADHAAR"), str(data.get("id_number", "")))
+
+def interakt_message(body, headers):
+    data = json.loads(body or b"{}")
+    if not data.get("phoneNumber"):
+        return 400, {"result": False, "message": "phoneNumber is required"}
+    return 201, {"result": True, "message": "Message has been queued", "id": str(uuid.uuid4())}
+
+def gemini_generate(body, headers):
+    data = json.loads(body or b"{}")
+    prompt = " ".join(part.get("text", "") for content in data.get("contents", []) for part in content.get("parts", []))
+    if "translated_text" in prompt:
+        text = json.dumps({"detected_language": "Hindi", "translated_text": "Simulated translation of the submitted text."})
+    elif "full_name" in prompt:
+        text = json.dumps({"full_name": "Arjun Kumar", "id_number": "XXXXXXXX1234", "dob": "1990-05-15", "gender": "M", "address": "Flat 402, Sai Residency, Hyderabad, Telangana 500081"})
+    else:
+        text = "Simulated model response."
+    return 200, {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4, "totalTokenCount": (len(prompt) + len(text)) // 4},
+    }
+
+def route(path, routes):
+    """(service, endpoint, answer) for a request path, or None."""
+    path = path.split("?", 1)[0]
+    if path == "/v1/auth/token":
+        return "protean", "auth", protean_token
+    if path in routes:
+        slug, cell = routes[path]
+        return "protean", slug, protean_cell(slug, cell)
+    legacy_stubs = {"/v1/legacy/forgery-scan": "run_forgery_scan", "/v1/legacy/gstin": "verify_gstin", "/v1/legacy/digilocker": "pull_digilocker_doc"}
+    if path in legacy_stubs:
+        return "legacy", path.rsplit("/", 1)[1], legacy(legacy_stubs[path])
+    if path == "/truth/v1/verify-id":
+        return "truth", "verify_id", truth_verify
+    if path.startswith("/interakt/v1/public/message"):
+        return "interakt", "message", interakt_message
+    if path.endswith(":generateContent"):
+        return "gemini", path.rsplit("/", 1)[1].split(":")[0], gemini_generate
+    return None
+
+# --- Server ---
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real providers
+    simulation = None
+    routes = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, drip=None, extra_headers=()):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in extra_headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if not drip:
+            return self.wfile.write(payload)
+        chunks = max(1, drip.get("chunks", 1))
+        size = -(-len(payload) // chunks)
+        for i in range(0, len(payload), size):
+            if i:
+                time.sleep(drip.get("interval_ms", 0) / 1000)
+            self.wfile.write(payload[i:i + size])
+            self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/_sim/stats":
+            return self._reply(200, self.simulation.report())
+        self._reply(404, {"message": "Not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        sim = self.simulation
+        if self.path == "/_sim/profile":
+            sim.use(json.loads(body)["profile"])
+            return self._reply(200, {"status": "OK"})
+        match = route(self.path, self.routes)
+        if match is None:
+            return self._reply(404, {"message": f"No simulated upstream at {self.path}"})
+        service, endpoint, answer = match
+        key = f"{service}:{endpoint}"
+        settings = sim.settings(service, endpoint)
+
+        wait = sim.admit(key, settings.get("rate_limit"))
+        if wait:
+            sim.record(key, "throttled")
+            return self._reply(429, {"status": "ERROR", "message": "Rate limit exceeded"}, extra_headers=[("Retry-After", str(max(1, round(wait))))])
+        if sim.rng.random() < settings.get("timeout_rate", 0):
+            sim.record(key, "timeouts")
+            time.sleep(settings.get("hang_ms", 30000) / 1000)
+            return self._reply(504, {"status": "ERROR", "message": "Upstream timed out"})
+        injected = sample_ms(settings.get("latency"), sim.rng)
+        time.sleep(injected / 1000)
+        if sim.rng.random() < settings.get("error_rate", 0):
+            sim.record(key, "errors", injected)
+            return self._reply(settings.get("error_status", 503), {"status": "ERROR", "message": "Simulated upstream error"})
+        status, response = answer(body, self.headers)
+        sim.record(key, "ok" if status < 400 else "errors", injected)
+        self._reply(status, response, drip=settings.get("drip"))
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError): # Clients giving up on hung/dripping calls
+            super().handle_error(request, client_address)
+
+def serve(profile, port=0, seed=None, host="127.0.0.1"):
+    """Starts the simulator on a background thread; returns the server (server_address has the port)."""
+    SimulatorHandler.simulation = Simulation(profile, seed)
+    SimulatorHandler.routes = _protean_routes()
+    server = SimulatorServer((host, port), SimulatorHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# --- Razorpay (inbound webhooks) ---
+
+def razorpay_webhooks(count, duplicate_rate=0.0, seed=None):
+    """
+    `count` payment.captured webhook bodies, plus re-sent copies for `duplicate_rate` of them
+    (Razorpay retries). Returns [(body, headers)], signed with RAZORPAY_WEBHOOK_SECRET when set.
+    """
+    rng = random.Random(seed)
+    secret = os.getenv("RAZORPAY_WEBHOOK_SECRET")
+    bodies = []
+    for i in range(count):
+        payment = {
+            "id": f"pay_SIM{uuid.uuid4().hex[:10].upper()}", "entity": "payment", "amount": rng.choice([49900, 99900, 149900]),
+            "currency": "INR", "status": "captured", "order_id": f"order_SIM{i:08d}", "method": "upi",
+            "contact": f"+91{rng.randint(6000000000, 9999999999)}", "email": f"customer{i}@example.com",
+        }
+        bodies.append(json.dumps({"entity": "event", "event": "payment.captured", "contains": ["payment"],
+                                  "payload": {"payment": {"entity": payment}}, "created_at": int(time.time())}).encode())
+        if rng.random() < duplicate_rate:
+            bodies.append(bodies[-1])
+    webhooks = []
+    for body in bodies:
+        headers = {"Content-Type": "application/json"}
+        if secret:
+            headers["X-Razorpay-Signature"] = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        webhooks.append((body, headers))
+    return webhooks
+
+def emit_razorpay(app_url, count, rate, duplicate_rate=0.0, workers=16, seed=None):
+    """
+    Posts razorpay_webhooks(count, duplicate_rate, seed) to {app_url}/razorpay/webhook at `rate`/s.
+    Returns {"sent", "statuses", "p50_ms", "p95_ms", "p99_ms"}.
+    """
+    import requests
+    session = requests.Session()
+    statuses, latencies, lock = {}, [], threading.Lock()
+
+    def post(body, headers):
+        start = time.perf_counter()
+        try:
+            status = session.post(f"{app_url.rstrip('/')}/razorpay/webhook", data=body, headers=headers, timeout=30).status_code
+        except requests.RequestException:
+            status = "connection_error"
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    webhooks = razorpay_webhooks(count, duplicate_rate, seed)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, (body, headers) in enumerate(webhooks):
+            time.sleep(max(0, start + i / rate - time.perf_counter()))
+            pool.submit(post, body, headers)
+    latencies.sort()
+    pct = lambda q: round(latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))], 1) if latencies else None
+    return {"sent": len(webhooks), "statuses": statuses, "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local upstream simulator")
+    parser.add_argument("--profile", default="realistic", help=f"{', '.join(PROFILES)} or a JSON file")
+    parser.add_argument("--port", type=int, default=int(os.getenv("UPSTREAM_SIMULATION_PORT", "8765")))
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--emit-razorpay", type=int, metavar="N", help="post N payment.captured webhooks to --app-url and exit")
+    parser.add_argument("--app-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rate", type=float, default=10, help="webhooks per second")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.emit_razorpay:
+        print(json.dumps(emit_razorpay(args.app_url, args.emit_razorpay, args.rate, args.duplicate_rate, seed=args.seed)))
+        sys.exit(0)
+    server = serve(args.profile, args.port, args.seed)
+    print(f"[SIMULATION] Upstream simulator on http://127.0.0.1:{server.server_address[1]} (profile {args.profile})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -41,8 +41,8 @@ class PVCValidator:
             "verdict": "GENUINE" if (state_verified and integrity_verdict == "PASS") else "SUSPICIOUS"
         }
         
-        # 4. Save to Individual Vault (Async capable via sync helper)
+        # 4. Save to Individual Vault (pooled connection, runs on the vault thread pool)
         from services.individual_vault import IndividualVaultService
-        IndividualVaultService.save_pvc(mobile_number, "Arjun Kumar", result, image_path)
+        await IndividualVaultService.save_pvc_async(mobile_number, "Arjun Kumar", result, image_path)
         
         return result
@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from database import BaseCompliance
+from models import AuditLog
+from services.audit_writer import AuditWriter
+
+"""
+Throughput: per-request AuditLog commits (today) vs the group-commit AuditWriter.
+Then a spill holding rows the DB rejects: they go to the dead-letter file and every
+other row still commits; an unreachable DB dead-letters nothing.
+log() fails while the writer is not running (never started, or stopped), and a flush that
+raises fails only its own batch. Several worker processes sharing AUDIT_SPILL_PATH lose nothing,
+and a dead worker's spill is adopted.
+Usage: python verify_audit_writer_throughput.py [entries] [concurrency]   (default: 5000 200)
+"""
+
+async def per_request_commits(sessions, entries, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    async def one(i):
+        async with sem:
+            async with sessions() as db:
+                db.add(AuditLog(actor_token="B2B_ADMIN", action="B2B_VERIFY_VEHICLE_RC", resource_id=str(i), retention_until=datetime.utcnow() + timedelta(days=1825)))
+                await db.commit()
+    await asyncio.gather(*[one(i) for i in range(entries)])
+
+async def group_commits(writer, entries, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    async def one(i):
+        async with sem:
+            await writer.log("AuditLog", actor_token="B2B_ADMIN", action="B2B_VERIFY_VEHICLE_RC", resource_id=str(i), retention_until=datetime.utcnow() + timedelta(days=1825))
+    await asyncio.gather(*[one(i) for i in range(entries)])
+
+async def count_rows(engine):
+    from sqlalchemy import select, func
+    async with engine.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(AuditLog))).scalar()
+
+async def poison_rows(tmp):
+    import json
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'poison.db')}")
+    async with engine.begin() as conn:
+        await conn.run_sync(BaseCompliance.metadata.create_all)
+    spill = os.path.join(tmp, "poison_spill.jsonl")
+    # Left in the spill by an older build: a NOT NULL violation and a column that no longer exists
+    with open(spill, "w") as f:
+        f.write(json.dumps({"model": "AuditLog", "fields": {"action": "NO_ACTOR"}}) + "\n")
+        f.write(json.dumps({"model": "AuditLog", "fields": {"actor_token": "X", "action": "OLD", "legacy_col": 1}}) + "\n")
+    writer = AuditWriter(session_factory=async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False), spill_path=spill)
+    await writer.start()
+    results = await asyncio.gather(*[writer.log("AuditLog", actor_token="B2B_ADMIN", action="AFTER_POISON", resource_id=str(i)) for i in range(300)])
+    await writer.stop()
+    assert all(results) and await count_rows(engine) == 300, writer.stats
+    with open(writer.dead_letter_path) as f:
+        dead = [json.loads(line) for line in f]
+    # The single spill file of an older build is adopted into this process's own file
+    assert [d["fields"]["action"] for d in dead] == ["NO_ACTOR", "OLD"] and not os.path.exists(spill) and os.path.getsize(writer.spill_path) == 0
+    for bad in ({"actor_token": "X", "action": "A", "legacy_col": 1}, {"action": "A"}):
+        try:
+            writer.log("AuditLog", **bad)
+            raise AssertionError(f"log() accepted {bad}")
+        except ValueError as e:
+            print(f"{'rejected':>20}: {e}")
+    await engine.dispose()
+
+    # Schema mismatch (an older compliance DB without ip_token): SQLite raises OperationalError,
+    # yet the DB answers, so the rows are dead-lettered instead of blocking the spill forever
+    old = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'old_schema.db')}")
+    async with old.begin() as conn:
+        from sqlalchemy import text
+        await conn.execute(text("CREATE TABLE audit_logs (id INTEGER PRIMARY KEY, actor_token VARCHAR NOT NULL, action VARCHAR NOT NULL, resource_id VARCHAR, timestamp DATETIME, retention_until DATETIME)"))
+    writer = AuditWriter(session_factory=async_sessionmaker(bind=old, class_=AsyncSession), spill_path=os.path.join(tmp, "old_spill.jsonl"))
+    await writer.start()
+    await asyncio.gather(writer.log("AuditLog", actor_token="A", action="NEW", ip_token="IP"), writer.log("AuditLog", actor_token="A", action="PLAIN"))
+    await writer.stop()
+    assert writer.stats["dead_lettered"] == 2 and not writer._read_spill()
+    await old.dispose()
+
+    # Unreachable DB: not the rows' fault, so everything waits in the spill
+    down = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'missing', 'x.db')}")
+    writer = AuditWriter(session_factory=async_sessionmaker(bind=down, class_=AsyncSession), spill_path=os.path.join(tmp, "down_spill.jsonl"))
+    await writer.start()
+    assert not any(await asyncio.gather(*[writer.log("AuditLog", actor_token="B2B_ADMIN", action="DB_DOWN") for _ in range(10)]))
+    await writer.stop()
+    assert len(writer._read_spill()) == 10 and not os.path.exists(writer.dead_letter_path)
+    await down.dispose()
+    print(f"{'poison rows':>20}: 2 bad spill rows dead-lettered, 300 later rows committed; missing column -> dead-lettered; DB down -> 10 kept in spill, 0 dead-lettered")
+
+async def lifecycle(tmp):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'lifecycle.db')}")
+    async with engine.begin() as conn:
+        await conn.run_sync(BaseCompliance.metadata.create_all)
+    writer = AuditWriter(session_factory=async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False), spill_path=os.path.join(tmp, "lifecycle_spill.jsonl"))
+    # Never started (e.g. the compliance migration failed): log() must fail, not hand out a future nobody resolves
+    for attempt in (lambda: writer.log("AuditLog", actor_token="A", action="EARLY"), lambda: writer.log_many("AuditLog", [{"actor_token": "A", "action": "EARLY"}])):
+        try:
+            attempt()
+            raise AssertionError("log() accepted an entry while the writer is not running")
+        except RuntimeError:
+            pass
+    await writer.start()
+    assert await writer.log("AuditLog", actor_token="A", action="RUNNING") is True
+    # A flush that raises fails its own batch; the flusher keeps running
+    truncate = writer._truncate_spill
+    def disk_error():
+        raise OSError("No space left on device")
+    writer._truncate_spill = disk_error
+    failed = await asyncio.gather(*[writer.log("AuditLog", actor_token="A", action="DISK_ERROR") for _ in range(5)], return_exceptions=True)
+    assert all(isinstance(r, OSError) for r in failed), failed
+    writer._truncate_spill = truncate
+    assert not writer._task.done() and await writer.log("AuditLog", actor_token="A", action="AFTER_ERROR") is True
+    await writer.stop()
+    try:
+        writer.log("AuditLog", actor_token="A", action="LATE")
+        raise AssertionError("log() accepted an entry after stop()")
+    except RuntimeError:
+        pass
+    assert await count_rows(engine) >= 7 # At least once: the DISK_ERROR batch committed but stayed in the spill
+    await engine.dispose()
+    print(f"{'not running':>20}: log() before start() and after stop() -> RuntimeError; a failing flush fails its batch, the next one commits")
+
+def worker_process(db_path, spill, entries):
+    async def work():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        writer = AuditWriter(session_factory=async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False), spill_path=spill)
+        await writer.start()
+        await group_commits(writer, entries, 50)
+        await writer.stop()
+        await engine.dispose()
+    asyncio.run(work())
+
+async def processes(tmp, workers=4, entries=2000):
+    import json
+    import multiprocessing
+    db_path, spill = os.path.join(tmp, "workers.db"), os.path.join(tmp, "workers_spill.jsonl")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(BaseCompliance.metadata.create_all)
+    # Several workers on one AUDIT_SPILL_PATH: none may truncate away another's entries
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=worker_process, args=(db_path, spill, entries)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert all(p.exitcode == 0 for p in procs)
+    committed = await count_rows(engine)
+    assert committed == workers * entries, f"{committed} rows for {workers * entries} entries: workers lost or re-inserted each other's spill"
+
+    # A worker that died with entries in its spill: the next start adopts them
+    dead = ctx.Process(target=int)
+    dead.start()
+    dead.join()
+    with open(f"{spill}.{dead.pid}", "w") as f:
+        f.write("".join(json.dumps({"model": "AuditLog", "fields": {"actor_token": "A", "action": "ORPHAN"}}) + "\n" for _ in range(3)))
+    writer = AuditWriter(session_factory=async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False), spill_path=spill)
+    await writer.start()
+    await writer.stop()
+    assert await count_rows(engine) == committed + 3 and not os.path.exists(f"{spill}.{dead.pid}")
+    await engine.dispose()
+    print(f"{'processes':>20}: {workers} workers x {entries} entries on one spill path -> {committed} rows; a dead worker's 3 spilled entries adopted")
+
+async def run(entries, concurrency):
+    print(f"--- AUDIT WRITER THROUGHPUT ({entries} entries, {concurrency} concurrent callers) ---")
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for mode in ("per-request commit", "group commit"):
+            engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, mode.replace(' ', '_'))}.db")
+            async with engine.begin() as conn:
+                await conn.run_sync(BaseCompliance.metadata.create_all)
+            sessions = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+            start = time.perf_counter()
+            if mode == "per-request commit":
+                await per_request_commits(sessions, entries, concurrency)
+            else:
+                writer = AuditWriter(session_factory=sessions, spill_path=os.path.join(tmp, "spill.jsonl"))
+                await writer.start()
+                await group_commits(writer, entries, concurrency)
+                await writer.stop()
+                print(f"Batches: {writer.stats['batches']} (avg {entries / writer.stats['batches']:.1f} entries/batch)")
+            elapsed = time.perf_counter() - start
+
+            assert await count_rows(engine) == entries
+            await engine.dispose()
+            results[mode] = entries / elapsed
+            print(f"{mode:>20}: {results[mode]:,.0f} entries/s ({elapsed:.2f}s)")
+        print(f"Speedup: {results['group commit'] / results['per-request commit']:.1f}x")
+        await poison_rows(tmp)
+        await lifecycle(tmp)
+        await processes(tmp)
+    print("--- BENCHMARK COMPLETE ---")
+
+if __name__ == "__main__":
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    asyncio.run(run(entries, concurrency))
@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+import multiprocessing
+from decimal import Decimal
+
+"""
+B2B batch verification: N vehicle RCs (some of which the upstream rejects) as one
+/api/v1/b2b/verify-batch stream vs one /api/v1/b2b/verify-style call per item, against a
+stand-in Protean server with fixed latency. The batch is interrupted partway and resumed;
+every item must be reported exactly once and the wallet charged exactly once per success.
+Usage: python verify_b2b_batch.py [items] [latency_ms]   (default: 300 50)
+"""
+
+TMP = tempfile.mkdtemp()
+os.environ["DATABASE_URL_APP"] = f"sqlite+aiosqlite:///{os.path.join(TMP, 'main.db')}"
+os.environ["DATABASE_URL_COMPLIANCE"] = f"sqlite+aiosqlite:///{os.path.join(TMP, 'compliance_vault.db')}"
+os.environ["AUDIT_SPILL_PATH"] = os.path.join(TMP, "audit_spill.jsonl")
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from database import engine_compliance, Base, BaseCompliance
+from models import Tenant, WalletLedger, AuditLog, B2BBatchItem
+from verify_protean_async_throughput import SlowStandIn, serve
+from verify_protean_token_cache import point_gateway_at
+
+PRICE = Decimal("49.00")
+
+# Busy timeout as in verify_wallet_concurrency.py: per-item calls queue on the SQLite write lock
+engine_app = create_async_engine(os.environ["DATABASE_URL_APP"], connect_args={"timeout": 60})
+SessionLocalApp = async_sessionmaker(bind=engine_app, expire_on_commit=False)
+
+class FlakyStandIn(SlowStandIn):
+    def _reply(self, status, body):
+        # RC numbers ending in 7 are "not found" upstream
+        if status == 200 and str(body.get("echo", {}).get("rc_number", "")).endswith("7"):
+            body = {"status": "FAILED", "message": "RC not found"}
+        super()._reply(status, body)
+
+async def setup_db(balance):
+    from services.protean_cache import result_cache
+    result_cache.invalidate() # Each phase pays for its upstream calls
+    async with engine_app.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with engine_compliance.begin() as conn:
+        await conn.run_sync(BaseCompliance.metadata.drop_all)
+        await conn.run_sync(BaseCompliance.metadata.create_all)
+    async with SessionLocalApp() as db:
+        db.add(Tenant(id=1, name="Fleet Co", wallet_balance=balance))
+        await db.commit()
+
+async def counts():
+    async with SessionLocalApp() as db:
+        balance = (await db.execute(select(Tenant.wallet_balance).where(Tenant.id == 1))).scalar()
+        ledger = (await db.execute(select(func.count()).select_from(WalletLedger))).scalar()
+    async with engine_compliance.connect() as conn:
+        audits = (await conn.execute(select(func.count()).select_from(AuditLog))).scalar()
+    return balance, ledger, audits
+
+async def per_item(items, concurrency):
+    """What a client does today: one b2b_verify call per item (reserve, verify, capture, audit)."""
+    from datetime import datetime, timedelta
+    from services.wallet import WalletService
+    from services.protean_service import run_b2b_module
+    from services.audit_writer import audit_writer
+    gate = asyncio.Semaphore(concurrency)
+    async def call(item):
+        async with gate, SessionLocalApp() as db:
+            hold_id = await WalletService.reserve(db, 1, PRICE, reference="B2B_VEHICLE_RC")
+            result = await run_b2b_module("vehicle_rc", dict(item))
+            if result.get("status") == "SUCCESS":
+                await WalletService.capture(db, hold_id)
+            else:
+                await WalletService.release(db, hold_id)
+            await audit_writer.log("AuditLog", actor_token="B2B_ADMIN", action="B2B_VERIFY_VEHICLE_RC", resource_id=item["id"], retention_until=datetime.utcnow() + timedelta(days=1825))
+            return result
+    return await asyncio.gather(*[call(item) for item in items])
+
+async def run(n, latency_ms):
+    from services.b2b_batch import B2BBatchService, parse_csv_items, CONCURRENCY
+    from services.audit_writer import audit_writer
+    import services.protean_service as protean_service
+    B2BBatchService._session_factory = SessionLocalApp
+    protean_service.gateway = protean_service.ProteanGateway()
+
+    items = parse_csv_items(("id,notes\n" + "".join(f"KA01AB{i:04d},fleet\n" for i in range(n))).encode())
+    assert len(items) == n and items[0] == {"id": "KA01AB0000", "notes": "fleet"}
+    expected_ok = sum(1 for i in range(n) if not f"{i:04d}".endswith("7"))
+    start_balance = PRICE * n * 2
+    print(f"--- B2B BATCH ({n} items, {n - expected_ok} rejected upstream, {latency_ms}ms upstream, {CONCURRENCY} in flight) ---")
+
+    await setup_db(start_balance)
+    await audit_writer.start()
+    start = time.perf_counter()
+    results = await per_item(items, CONCURRENCY)
+    single_s = time.perf_counter() - start
+    balance, ledger, audits = await counts()
+    assert sum(r.get("status") == "SUCCESS" for r in results) == expected_ok
+    assert balance == start_balance - PRICE * expected_ok
+    print(f"{'per-item':>9}: {single_s * 1000:>8.0f} ms, {n / single_s:>6.0f} items/s, {ledger} ledger rows, {audits} audit rows")
+    await audit_writer.stop()
+
+    await setup_db(start_balance)
+    await audit_writer.start()
+    start = time.perf_counter()
+    async with SessionLocalApp() as db:
+        batch_id = await B2BBatchService.create(db, 1, "vehicle_rc", items, PRICE)
+    lines = [line async for line in B2BBatchService.stream_ndjson(batch_id)]
+    batch_s = time.perf_counter() - start
+    balance, ledger, audits = await counts()
+    summary = json.loads(lines[-1])
+    assert len(lines) == n + 2 and summary["succeeded"] == expected_ok
+    assert balance == start_balance - PRICE * expected_ok and audits == n
+    print(f"{'batch':>9}: {batch_s * 1000:>8.0f} ms, {n / batch_s:>6.0f} items/s, {ledger} ledger rows, {audits} audit rows, summary {summary}")
+
+    # Interrupted after a third of the items, then resumed with ?batch_id=
+    await setup_db(start_balance)
+    async with SessionLocalApp() as db:
+        batch_id = await B2BBatchService.create(db, 1, "vehicle_rc", items, PRICE)
+    stream = B2BBatchService.stream(batch_id)
+    seen = []
+    async for line in stream:
+        if line["type"] == "item":
+            seen.append(line["seq"])
+            if len(seen) == n // 3:
+                break
+    await stream.aclose() # Client disconnected
+    async with SessionLocalApp() as db:
+        stored = (await db.execute(select(func.count()).select_from(B2BBatchItem).where(B2BBatchItem.batch_id == batch_id, B2BBatchItem.status != "PENDING"))).scalar()
+        await B2BBatchService.claim(db, batch_id)
+    resumed = [line async for line in B2BBatchService.stream(batch_id)]
+    header, summary = resumed[0], resumed[-1]
+    seqs = sorted(line["seq"] for line in resumed if line["type"] == "item")
+    balance, ledger, audits = await counts()
+    assert seqs == list(range(n)), "Every item exactly once after resume"
+    assert summary["succeeded"] == expected_ok and balance == start_balance - PRICE * expected_ok
+    print(f"{'resume':>9}: {len(seen)} streamed before disconnect, {stored} stored, {header['pending']} re-run, balance exact, summary {summary}")
+    await audit_writer.stop()
+    await protean_service.gateway.aclose()
+
+    print(f"Speedup: {single_s / batch_s:.1f}x")
+    await engine_app.dispose()
+    await engine_compliance.dispose()
+    print("--- BENCHMARK COMPLETE ---")
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    latency_ms = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    SlowStandIn.connections = multiprocessing.Value("i", 0)
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(latency_ms / 1000, SlowStandIn.connections, ready, FlakyStandIn), daemon=True)
+    server.start()
+    point_gateway_at(ready.get(timeout=10))
+    try:
+        asyncio.run(run(n, latency_ms))
+    finally:
+        server.terminate()
+        shutil.rmtree(TMP, ignore_errors=True)
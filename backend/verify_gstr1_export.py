@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import sqlite3
+import asyncio
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+"""
+Benchmark: monthly GSTR-1 export, legacy (ORM rows -> dicts -> pandas) vs streamed.
+Usage: python verify_gstr1_export.py [invoices] [format]   (default: 1000000 xlsx)
+Each mode runs in its own process so peak RSS is measured independently.
+"""
+
+PERIOD_START = datetime(2025, 11, 1)
+PERIOD_END = datetime(2025, 12, 1)
+
+def seed(path, invoices):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE sales_register (
+            id INTEGER PRIMARY KEY, order_id TEXT NOT NULL, payment_id TEXT NOT NULL UNIQUE,
+            mobile_number TEXT NOT NULL, mobile_number_bidx TEXT, customer_name TEXT NOT NULL, customer_name_bidx TEXT,
+            state_code TEXT NOT NULL, place_of_supply TEXT NOT NULL,
+            total_amount INTEGER NOT NULL, base_amount INTEGER NOT NULL, gst_amount INTEGER NOT NULL,
+            cgst INTEGER, sgst INTEGER, igst INTEGER, tax_type SMALLINT NOT NULL, invoice_type TEXT,
+            b2b_gstin TEXT, pdf_path TEXT, created_at DATETIME
+        )
+    """)
+    conn.execute("CREATE INDEX ix_sales_register_created_at ON sales_register (created_at)")
+    step = (PERIOD_END - PERIOD_START) / invoices
+    batch = []
+    for i in range(invoices):
+        created = (PERIOD_START + step * i).strftime("%Y-%m-%d %H:%M:%S.%f")
+        batch.append((f"order_{i}", f"pay_{i:012d}", "ENC" * 15, "ENC" * 10, "36", "Telangana",
+                      9900, 8390, 1510, 755, 755, 0, 1, "RETAIL", created))  # schema v2: paise + tax_type code
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO sales_register (order_id, payment_id, mobile_number, customer_name, state_code, place_of_supply, total_amount, base_amount, gst_amount, cgst, sgst, igst, tax_type, invoice_type, created_at) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO sales_register (order_id, payment_id, mobile_number, customer_name, state_code, place_of_supply, total_amount, base_amount, gst_amount, cgst, sgst, igst, tax_type, invoice_type, created_at) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", batch)
+    conn.commit()
+    conn.close()
+
+async def legacy_export(fmt):
+    from sqlalchemy import select, extract
+    from database import SessionLocalApp
+    from models import SalesRegister
+    import pandas as pd
+    async with SessionLocalApp() as db:
+        records = (await db.execute(select(SalesRegister).filter(
+            extract('month', SalesRegister.created_at) == PERIOD_START.month,
+            extract('year', SalesRegister.created_at) == PERIOD_START.year
+        ))).scalars().all()
+        data = [{
+            "Invoice No": f"CD-{r.created_at.strftime('%Y%m%d')}-{r.payment_id[-6:].upper()}",
+            "Invoice Date": r.created_at.strftime('%Y-%m-%d'), "Payment ID": r.payment_id,
+            "Customer": r.customer_name, "Mobile": r.mobile_number, "POS": f"{r.place_of_supply} ({r.state_code})",
+            "Taxable Value": r.base_amount, "Tax Type": r.tax_type, "CGST": r.cgst or "0.00",
+            "SGST": r.sgst or "0.00", "IGST": r.igst or "0.00", "Total Amount": r.total_amount
+        } for r in records]
+        out = os.path.join(tempfile.gettempdir(), f"legacy_gstr1.{fmt}")
+        df = pd.DataFrame(data)
+        df.to_csv(out, index=False) if fmt == "csv" else df.to_excel(out, index=False)
+        return out, len(records)
+
+async def streamed_export(fmt):
+    from database import SessionLocalApp
+    from services.finance_engine import ReportingService
+    async with SessionLocalApp() as db:
+        path, count, _ = await ReportingService.export_gstr1(db, PERIOD_START, PERIOD_END, fmt)
+        return path, count
+
+def child(mode, fmt):
+    # Runs inside the subprocess: DATABASE_URL_APP already points at the seeded DB
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    start = time.perf_counter()
+    path, count = asyncio.run(legacy_export(fmt) if mode == "legacy" else streamed_export(fmt))
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    os.remove(path)
+    print(f"{mode:>8} | {count:>9,} | {elapsed:>8.1f} | {peak_mb:>12.0f}")
+
+def run(invoices, fmt):
+    print(f"--- GSTR-1 EXPORT BENCHMARK ({invoices:,} invoices, {fmt}) ---")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "main.db")
+        seed(db_path, invoices)
+        env = dict(os.environ, DATABASE_URL_APP=f"sqlite+aiosqlite:///{db_path}")
+        print(f"{'mode':>8} | {'invoices':>9} | {'time (s)':>8} | {'peak RSS (MB)':>12}")
+        for mode in ("legacy", "stream"):
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, fmt], env=env, check=True)
+    print("--- BENCHMARK COMPLETE ---")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3])
+    else:
+        invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+        fmt = sys.argv[2] if len(sys.argv) > 2 else "xlsx"
+        run(invoices, fmt)
@@ -0,0 +1,66 @@
+import os
+import sys
+import asyncio
+import tempfile
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+Invoice search by blind index with rows the backfill hasn't reached yet (mobile_number_bidx NULL).
+- GET /api/v1/invoices/search?mobile= (empty or blank) must be a 400, not every un-backfilled invoice
+- SecurityUtils.blind_index_filter with an empty value must match no row
+- A real number returns only its own invoices
+Usage: python verify_invoice_search.py
+"""
+
+async def main(tmp):
+    os.environ["DATABASE_URL_APP"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'main.db')}"
+    os.environ["DATABASE_URL_COMPLIANCE"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'compliance_vault.db')}"
+    os.environ.setdefault("PROTEAN_API_KEY", "verify-invoice-search") # Past the activation gate
+
+    import httpx
+    from decimal import Decimal
+    from sqlalchemy import select
+    import app as app_module
+    from database import engine_app, engine_compliance, Base, SessionLocalApp
+    from models import SalesRegister
+    from services.security_utils import SecurityUtils
+    print("--- INVOICE SEARCH ---")
+
+    async with engine_app.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    phone = "9876543210"
+    async with SessionLocalApp() as db:
+        for i in range(5):
+            indexed = i == 0 # The rest predate the backfill
+            db.add(SalesRegister(order_id=f"ord-{i}", payment_id=f"pay-{i}", mobile_number=SecurityUtils.encrypt_pii(f"900000000{i}" if i else phone),
+                                 mobile_number_bidx=SecurityUtils.blind_index(phone, "mobile_number") if indexed else None,
+                                 customer_name=SecurityUtils.encrypt_pii("Test"), state_code="36", place_of_supply="Telangana",
+                                 total_amount=Decimal("99.00"), base_amount=Decimal("83.90"), gst_amount=Decimal("15.10"), tax_type="Intra-State"))
+        await db.commit()
+
+        # 1. The helper: an empty value matches nothing
+        for blank in ("", None):
+            rows = (await db.execute(select(SalesRegister.id).where(SecurityUtils.blind_index_filter(SalesRegister, "mobile_number", blank)))).all()
+            assert rows == [], f"blind_index_filter({blank!r}) matched {len(rows)} un-backfilled rows"
+    print("blind_index_filter('') / (None) -> 0 rows (4 rows have mobile_number_bidx NULL)")
+
+    # 2. The endpoint
+    app_module._SCHEMA_READY = asyncio.Event() # Schema created above; no startup restore here
+    app_module._SCHEMA_READY.set()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+        for blank in ("", "%20%20"):
+            resp = await client.get(f"/api/v1/invoices/search?mobile={blank}")
+            assert resp.status_code == 400, (blank, resp.status_code, resp.text)
+        resp = await client.get(f"/api/v1/invoices/search?mobile={phone}")
+        assert resp.status_code == 200 and [r["order_id"] for r in resp.json()] == ["ord-0"], resp.text
+    print(f"GET ?mobile= and ?mobile=%20%20 -> 400, ?mobile={phone} -> {[r['order_id'] for r in resp.json()]}")
+
+    await engine_app.dispose()
+    await engine_compliance.dispose()
+    print("--- INVOICE SEARCH VERIFIED ---")
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(main(tmp))
@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import base64
+import asyncio
+import tempfile
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from database import Base
+from models import SalesRegister, Vault
+from services.secrets_cache import SecretsCache, secrets_cache
+from services.security_utils import SecurityUtils
+from services.key_rotation import ReencryptionJob
+from verify_pii_crypto import legacy_encrypt
+
+"""
+Key rotation: rows written under legacy CBC and key k1 are moved onto k2 by the
+background ReencryptionJob while old tokens stay readable throughout.
+Also reports the secrets cache hit rate for a hot get_secret() loop, and checks that a
+failing Secret Manager never replaces a cached key (nor falls back to the demo key).
+Usage: python verify_key_rotation.py [rows]   (default: 20000)
+"""
+
+def set_keyring(active_kid):
+    os.environ["MASTER_ENCRYPTION_KEY"] = base64.b64encode(b"1" * 32).decode()
+    os.environ["MASTER_ENCRYPTION_KEYRING"] = "k2:" + base64.b64encode(b"2" * 32).decode()
+    os.environ["ACTIVE_ENCRYPTION_KEY_ID"] = active_kid
+    secrets_cache.invalidate()
+    SecurityUtils._CRYPTO_ENGINE_CHECKED_AT = 0.0
+
+async def run(rows):
+    print(f"--- KEY ROTATION ({rows} rows) ---")
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'main.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        set_keyring("k1")
+        phones = [f"+9198{i:08d}" for i in range(rows)]
+        # A third legacy CBC, the rest under k1; top-up style plaintext names must survive untouched
+        mobiles = [legacy_encrypt(p) if i % 3 == 0 else t for i, (p, t) in enumerate(zip(phones, SecurityUtils.encrypt_many(phones)))]
+        async with engine.begin() as conn:
+            await conn.execute(insert(SalesRegister), [{
+                "order_id": f"order_{i}", "payment_id": f"pay_{i}", "mobile_number": m, "customer_name": "Tenant Pvt Ltd",
+                "state_code": "36", "place_of_supply": "Telangana", "total_amount": "99.00", "base_amount": "83.90",
+                "gst_amount": "15.10", "tax_type": "Intra-State"
+            } for i, m in enumerate(mobiles)])
+            await conn.execute(insert(Vault), [{"token": f"VT-{i}", "pii_json": SecurityUtils.encrypt_pii(f'{{"id": {i}}}')} for i in range(rows // 10)])
+
+        set_keyring("k2")
+        assert SecurityUtils.decrypt_many(mobiles) == phones, "Old tokens must stay readable after rotation"
+        job = ReencryptionJob(targets=[
+            (engine, SalesRegister.__table__, ["mobile_number", "customer_name"]),
+            (engine, Vault.__table__, ["pii_json"]),
+        ], max_rows_per_sec=0, pause_ms=0)
+        result = await job.run()
+        for name, stats in result["tables"].items():
+            print(f"{name:>15}: {stats}")
+
+        async with engine.connect() as conn:
+            stored = (await conn.execute(select(SalesRegister.mobile_number, SalesRegister.customer_name).order_by(SalesRegister.id))).all()
+        crypto = SecurityUtils.get_crypto_engine()
+        assert all(crypto.key_id(m) == "k2" for m, _ in stored)
+        assert SecurityUtils.decrypt_many([m for m, _ in stored]) == phones
+        assert all(n == "Tenant Pvt Ltd" for _, n in stored)
+
+        rerun = await job.run()
+        assert rerun["values_rotated"] == 0
+        await engine.dispose()
+
+    start = time.perf_counter()
+    for _ in range(100_000):
+        secrets_cache.get("RAZORPAY_KEY_ID")
+    elapsed = time.perf_counter() - start
+    print(f"Secrets cache: {elapsed / 100_000 * 1e6:.2f} us/lookup, {secrets_cache.metrics()}")
+
+    # Secret Manager fails after the first lookup: the last good value is served
+    outage = {"on": False}
+    def flaky(name):
+        if outage["on"]:
+            raise ConnectionError("Secret Manager unavailable")
+        return "good-" + name
+    cache = SecretsCache(ttl_sec=0.05, resolver=flaky)
+    assert cache.get("MASTER_ENCRYPTION_KEY") == "good-MASTER_ENCRYPTION_KEY"
+    fetched_at = cache._values["MASTER_ENCRYPTION_KEY"][1]
+    outage["on"] = True
+    time.sleep(0.06)
+    assert cache.get("MASTER_ENCRYPTION_KEY") == "good-MASTER_ENCRYPTION_KEY" # Expired, inline lookup failed
+    assert cache._values["MASTER_ENCRYPTION_KEY"][1] == fetched_at # Still expired: retried next call
+    cache._resolver = lambda name: None if outage["on"] else flaky(name)
+    assert cache.get("MASTER_ENCRYPTION_KEY") == "good-MASTER_ENCRYPTION_KEY" # An empty answer changes nothing either
+    outage["on"] = False
+    assert cache.get("MASTER_ENCRYPTION_KEY") == "good-MASTER_ENCRYPTION_KEY" and cache._values["MASTER_ENCRYPTION_KEY"][1] > fetched_at
+
+    # Once a real master key was seen, losing it raises instead of using the demo key
+    set_keyring("k2")
+    real_key = SecurityUtils.get_encryption_key()
+    secrets_cache.invalidate()
+    resolver, secrets_cache._resolver = secrets_cache._resolver, lambda name: None
+    try:
+        SecurityUtils.get_encryption_key()
+        raise AssertionError("Fell back to the demo key after a real key was in use")
+    except RuntimeError as e:
+        print(f"Secrets outage: cached value kept ({cache.metrics()}), uncached master key -> {e}")
+    finally:
+        secrets_cache._resolver = resolver
+        secrets_cache.invalidate()
+    assert SecurityUtils.get_encryption_key() == real_key
+    print("--- ROTATION VERIFIED ---")
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    asyncio.run(run(rows))
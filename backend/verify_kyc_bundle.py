@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import tempfile
+from decimal import Decimal
+
+"""
+KYC bundles: director_kyc (voter_id -> name_match, face_liveness, mobile_verify) against the
+upstream simulator with fixed per-check latencies (200, 100, 400, 150 ms). A bundle must take
+about as long as its slowest chain (400 ms), not the sum of its checks (850 ms, what one
+/api/v1/b2b/verify call per check costs today). name_match must start only after voter_id.
+A FAILED voter record still completes the bundle (billed, verdict FAIL); an upstream error
+leaves it PARTIAL and unbilled. Every bundle holds funds once.
+Usage: python verify_kyc_bundle.py [applicants] [concurrency]   (default: 50 10)
+"""
+
+TMP = tempfile.mkdtemp()
+os.environ["DATABASE_URL_APP"] = f"sqlite+aiosqlite:///{os.path.join(TMP, 'main.db')}"
+os.environ["DATABASE_URL_COMPLIANCE"] = f"sqlite+aiosqlite:///{os.path.join(TMP, 'compliance_vault.db')}"
+LATENCY_MS = {"voter_id": 200, "name_match": 100, "face_liveness": 400, "mobile_verify": 150}
+with open(os.path.join(TMP, "profile.json"), "w") as f:
+    json.dump({"default": {"latency": {"dist": "fixed", "ms": 0}},
+               **{f"protean:{slug}": {"latency": {"dist": "fixed", "ms": ms}} for slug, ms in LATENCY_MS.items()}}, f)
+with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    os.environ["UPSTREAM_SIMULATION_PORT"] = str(s.getsockname()[1])
+os.environ["UPSTREAM_SIMULATION"] = os.path.join(TMP, "profile.json")
+os.environ["PROTEAN_QUOTAS"] = json.dumps({"default": {"rate": 10 ** 6, "burst": 10 ** 6}})
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import select, func
+from database import engine_app, SessionLocalApp, Base
+from models import Tenant, WalletLedger
+
+PRICE = Decimal("150.00")
+
+def applicant(i, epic=None):
+    return {"name": f"Applicant {i:05d}", "mobile": f"98{i:08d}", "epic_number": epic or f"ABC{i:07d}", "selfie": f"selfie-{i}"}
+
+async def bundle_call(gateway, person):
+    """What b2b_verify_bundle does: one hold, the DAG, capture only a COMPLETED bundle."""
+    from services.wallet import WalletService
+    from services.kyc_bundle import run_bundle
+    async with SessionLocalApp() as db:
+        hold_id = await WalletService.reserve(db, 1, PRICE, reference="B2B_BUNDLE_DIRECTOR_KYC")
+        start = time.perf_counter()
+        report = await run_bundle("director_kyc", person, tenant_id=1, gateway=gateway)
+        elapsed = time.perf_counter() - start
+        settled = report["status"] == "COMPLETED" and await WalletService.capture(db, hold_id)
+        if not settled:
+            await WalletService.release(db, hold_id)
+        return report, elapsed
+
+async def per_check(gateway, person):
+    """Today: one b2b_verify-style call per check, in order (name_match needs the voter record)."""
+    start = time.perf_counter()
+    voter = await gateway.execute_async("voter_id", {"epic_number": person["epic_number"]}, tenant_id=1)
+    await gateway.execute_async("name_match", {"name1": person["name"], "name2": voter["data"]["name"]}, tenant_id=1)
+    await gateway.execute_async("face_liveness", {"image": person["selfie"]}, tenant_id=1)
+    await gateway.execute_async("mobile_verify", {"mobile": person["mobile"], "name": person["name"]}, tenant_id=1)
+    return time.perf_counter() - start
+
+def pct(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] * 1000
+
+async def main(n, concurrency):
+    from services.protean_service import ProteanGateway
+    from services.circuit_breaker import CircuitBreakers, MemoryBreakerStore
+    from services.hedging import TailLatencyPolicy
+    from services import kyc_bundle, simulation
+    import httpx
+
+    async with engine_app.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocalApp() as db:
+        db.add(Tenant(id=1, name="Board Co", wallet_balance=PRICE * (n + 10)))
+        await db.commit()
+
+    gateway = ProteanGateway()
+    gateway.breakers = CircuitBreakers(MemoryBreakerStore(), failure_threshold=10 ** 6)
+    gateway.tail = TailLatencyPolicy(min_samples=10 ** 9) # Fixed latencies: nothing to hedge
+    gateway.get_access_token()
+    critical, total = max(LATENCY_MS["voter_id"] + LATENCY_MS["name_match"], LATENCY_MS["face_liveness"], LATENCY_MS["mobile_verify"]), sum(LATENCY_MS.values())
+    print(f"--- KYC BUNDLES ({n} director_kyc applicants, {concurrency} at a time; slowest chain {critical} ms, sum of checks {total} ms) ---")
+
+    # 1. Sequential per-check calls vs the bundle DAG (distinct applicants: no cache hits)
+    gate = asyncio.Semaphore(concurrency)
+    async def limited(call):
+        async with gate:
+            return await call
+    sequential = await asyncio.gather(*[limited(per_check(gateway, applicant(i))) for i in range(n)])
+    bundles = await asyncio.gather(*[limited(bundle_call(gateway, applicant(10 ** 4 + i))) for i in range(n)])
+    elapsed = [t for _, t in bundles]
+    assert all(r["status"] == "COMPLETED" and r["verdict"] == "PASS" for r, _ in bundles), bundles[0][0]
+    for name, samples in (("per-check", sequential), ("bundle", elapsed)):
+        print(f"{name:>10}: p50 {pct(samples, 50):5.0f} ms  p95 {pct(samples, 95):5.0f} ms  max {max(samples) * 1000:5.0f} ms")
+    assert pct(elapsed, 50) < critical * 1.25 and pct(elapsed, 95) < total * 0.75, "A bundle must take about its slowest chain"
+
+    # 2. Dependencies: name_match waits for voter_id, the rest start at once
+    checks = bundles[0][0]["checks"]
+    assert checks["name_match"]["started_ms"] >= checks["voter_id"]["elapsed_ms"] >= LATENCY_MS["voter_id"] * 0.9
+    assert max(checks[c]["started_ms"] for c in ("voter_id", "face_liveness", "mobile_verify")) < 50
+    assert checks["name_match"]["result"]["data"]["name2"] == "Arjun Kumar" # Name from the voter record
+    print(f"{'timeline':>10}: " + ", ".join(f"{c} {e['started_ms']:.0f}-{e['started_ms'] + e['elapsed_ms']:.0f} ms" for c, e in checks.items()))
+
+    # 3. Voter record not found: a verdict, so the bundle completes (FAIL) and is billed
+    report, _ = await bundle_call(gateway, applicant(20000, epic="0000NOTFOUND"))
+    assert report["status"] == "COMPLETED" and report["verdict"] == "FAIL"
+    assert report["checks"]["voter_id"]["status"] == "FAILED" and report["checks"]["name_match"]["status"] == "SKIPPED"
+
+    # 4. Upstream error on one check: PARTIAL, not billed
+    httpx.post(f"{simulation.base_url()}/_sim/profile", json={"profile": {"protean:face_liveness": {"error_rate": 1.0}}}).raise_for_status()
+    partial, _ = await bundle_call(gateway, applicant(20001))
+    assert partial["status"] == "PARTIAL" and partial["verdict"] == "INCOMPLETE" and partial["checks"]["face_liveness"]["status"] == "ERROR"
+    assert partial["checks"]["voter_id"]["status"] == "SUCCESS"
+    print(f"{'outcomes':>10}: not-found voter -> {report['status']}/{report['verdict']}, upstream 503 on face_liveness -> {partial['status']}/{partial['verdict']}")
+
+    # 5. Billing: one hold per bundle, captured for COMPLETED only
+    async with SessionLocalApp() as db:
+        balance = (await db.execute(select(Tenant.wallet_balance).where(Tenant.id == 1))).scalar()
+        entries = dict((await db.execute(select(WalletLedger.entry_type, func.count()).group_by(WalletLedger.entry_type))).all())
+    completed = n + 1
+    assert entries == {"RESERVE": n + 2, "CAPTURE": completed, "RELEASE": 1}, entries
+    assert balance == PRICE * (n + 10) - PRICE * completed
+    print(f"{'billing':>10}: {n + 2} bundles -> ledger {entries}, balance ₹{balance} (₹{PRICE} x {completed} completed)")
+
+    # 6. Bundle definitions are checked up front
+    assert kyc_bundle.missing_fields("director_kyc", {"name": "A", "mobile": "9"}) == ["epic_number", "selfie"]
+    try:
+        kyc_bundle._validate({"loop": {"checks": {"a": {"slug": "voter_id", "after": ["b"]}, "b": {"slug": "voter_id", "after": ["a"]}}}})
+        raise AssertionError("A dependency cycle must be rejected")
+    except ValueError as e:
+        print(f"{'validate':>10}: {e}")
+    await gateway.aclose()
+    await engine_app.dispose()
+    print("--- KYC BUNDLES VERIFIED ---")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50, int(sys.argv[2]) if len(sys.argv) > 2 else 10))
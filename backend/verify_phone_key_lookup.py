@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+"""
+Benchmark: leading-wildcard LIKE vs indexed phone_key equality on verified_reports.
+Usage: python verify_phone_key_lookup.py [row counts...]   (default: 10k 100k 1M 10M)
+Uses the stdlib sqlite3 driver so it runs without the app stack.
+"""
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+LOOKUPS = 200
+LIKE_LOOKUPS = 5
+
+# Mirrors models.normalize_phone_key without pulling in SQLAlchemy
+def normalize_phone_key(mobile_number):
+    digits = "".join(ch for ch in mobile_number if ch.isdigit())
+    return digits[-10:] if digits else None
+
+def seed(conn, rows):
+    conn.execute("""
+        CREATE TABLE verified_reports (
+            id INTEGER PRIMARY KEY,
+            mobile_number TEXT NOT NULL,
+            phone_key TEXT,
+            applicant_name TEXT NOT NULL,
+            tenant_id INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX ix_verified_reports_mobile_number ON verified_reports (mobile_number)")
+    conn.execute("CREATE INDEX ix_verified_reports_phone_key ON verified_reports (phone_key)")
+    batch = []
+    for i in range(rows):
+        mobile = f"+91{9000000000 + i}"
+        batch.append((mobile, normalize_phone_key(mobile), f"Applicant {i}", 1))
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO verified_reports (mobile_number, phone_key, applicant_name, tenant_id) VALUES (?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO verified_reports (mobile_number, phone_key, applicant_name, tenant_id) VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+
+def time_lookups(conn, sql, params, n):
+    start = time.perf_counter()
+    for p in params[:n]:
+        conn.execute(sql, (p,)).fetchone()
+    return (time.perf_counter() - start) / n * 1000
+
+def run(sizes):
+    print("--- PHONE KEY LOOKUP BENCHMARK ---")
+    print(f"{'rows':>12} | {'LIKE %x (ms)':>14} | {'phone_key = (ms)':>16}")
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+            seed(conn, rows)
+            targets = [str(9000000000 + random.randrange(rows)) for _ in range(LOOKUPS)]
+            like_ms = time_lookups(conn, "SELECT id FROM verified_reports WHERE mobile_number LIKE '%' || ? LIMIT 1", targets, LIKE_LOOKUPS)
+            eq_ms = time_lookups(conn, "SELECT id FROM verified_reports WHERE phone_key = ? LIMIT 1", targets, LOOKUPS)
+            plan = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM verified_reports WHERE phone_key = ?", ("9000000000",)).fetchall()
+            assert any("ix_verified_reports_phone_key" in str(step) for step in plan), plan
+            conn.close()
+        print(f"{rows:>12,} | {like_ms:>14.3f} | {eq_ms:>16.4f}")
+    print("--- BENCHMARK COMPLETE ---")
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or DEFAULT_SIZES
+    run(sizes)
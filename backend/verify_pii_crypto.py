@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import base64
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from services.security_utils import SecurityUtils
+
+"""
+Microbenchmark: per-value AES-CBC (previous encrypt_pii/decrypt_pii) vs the AES-GCM engine
+(single calls and encrypt_many/decrypt_many) at 1, 1k and 100k values.
+Also checks that legacy CBC tokens still decrypt.
+Usage: python verify_pii_crypto.py [sizes...]   (default: 1 1000 100000)
+"""
+
+def legacy_encrypt(plain_text):
+    key = SecurityUtils.get_encryption_key()
+    iv = os.urandom(16)
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend()).encryptor()
+    padder = padding.PKCS7(128).padder()
+    padded_data = padder.update(plain_text.encode()) + padder.finalize()
+    return base64.b64encode(iv + encryptor.update(padded_data) + encryptor.finalize()).decode('utf-8')
+
+def legacy_decrypt(token):
+    key = SecurityUtils.get_encryption_key()
+    data = base64.b64decode(token)
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(data[:16]), backend=default_backend()).decryptor()
+    padded_data = decryptor.update(data[16:]) + decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    return (unpadder.update(padded_data) + unpadder.finalize()).decode('utf-8')
+
+def timed(fn, values):
+    start = time.perf_counter()
+    out = fn(values)
+    return out, time.perf_counter() - start
+
+def run(sizes):
+    print("--- PII CRYPTO MICROBENCHMARK ---")
+    values = [f"+9198{i:08d}" for i in range(max(sizes))]
+
+    legacy_tokens = [legacy_encrypt(v) for v in values[:1000]]
+    assert SecurityUtils.decrypt_many(legacy_tokens) == values[:1000], "Legacy CBC tokens must stay readable"
+    assert SecurityUtils.decrypt_pii(legacy_tokens[0]) == values[0]
+    print("Legacy CBC tokens: readable")
+
+    print(f"{'values':>8} | {'mode':>18} | {'encrypt (us/val)':>16} | {'decrypt (us/val)':>16}")
+    for n in sizes:
+        batch = values[:n]
+        modes_ = {
+            "legacy CBC": (lambda vs: [legacy_encrypt(v) for v in vs], lambda ts: [legacy_decrypt(t) for t in ts]),
+            "GCM per value": (lambda vs: [SecurityUtils.encrypt_pii(v) for v in vs], lambda ts: [SecurityUtils.decrypt_pii(t) for t in ts]),
+            "GCM *_many": (SecurityUtils.encrypt_many, SecurityUtils.decrypt_many),
+        }
+        for name, (enc, dec) in modes_.items():
+            tokens, enc_s = timed(enc, batch)
+            plain, dec_s = timed(dec, tokens)
+            assert plain == batch
+            print(f"{n:>8,} | {name:>18} | {enc_s / n * 1e6:>16.2f} | {dec_s / n * 1e6:>16.2f}")
+    print("--- BENCHMARK COMPLETE ---")
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1, 1000, 100_000]
+    run(sizes)
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import multiprocessing
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+from verify_protean_token_cache import StandIn, start_server, point_gateway_at
+
+"""
+Load test: concurrent B2B verifications on ONE event loop (one uvicorn worker) against a
+local stand-in Protean server with fixed upstream latency.
+legacy = blocking requests.request per call, new connection each time (pre-change execute)
+sync   = blocking wrapper on the pooled requests.Session (still stalls the event loop)
+async  = run_b2b_module() on the shared httpx.AsyncClient
+Usage: python verify_protean_async_throughput.py [requests] [concurrency] [latency_ms]   (default: 500 100 50)
+"""
+
+class SlowStandIn(StandIn):
+    protocol_version = "HTTP/1.1" # Keep-alive
+    disable_nagle_algorithm = True
+    latency = 0.05
+    connections = None # Shared counter, the server runs in its own process
+
+    def setup(self):
+        super().setup()
+        with SlowStandIn.connections.get_lock():
+            SlowStandIn.connections.value += 1
+
+    def do_POST(self):
+        if self.path != "/v1/auth/token":
+            time.sleep(SlowStandIn.latency)
+        super().do_POST()
+
+def serve(latency, connections, ready, handler=SlowStandIn):
+    # Separate process so the stand-in doesn't share the benchmark's GIL
+    SlowStandIn.latency = latency
+    SlowStandIn.connections = connections
+    server = start_server(handler)
+    ready.put(server.server_address)
+    threading.Event().wait()
+
+async def drive(handler, total, concurrency):
+    """`concurrency` in-flight B2B requests on this loop until `total` are done."""
+    gate = asyncio.Semaphore(concurrency)
+    async def one(i):
+        async with gate:
+            return await handler(i)
+    opened = SlowStandIn.connections.value
+    start = time.perf_counter()
+    results = await asyncio.gather(*[one(i) for i in range(total)])
+    elapsed = time.perf_counter() - start
+    assert all(r.get("status") == "SUCCESS" for r in results), [r for r in results if r.get("status") != "SUCCESS"][:3]
+    return elapsed, SlowStandIn.connections.value - opened
+
+def main(total, concurrency, latency_ms):
+    SlowStandIn.connections = multiprocessing.Value("i", 0)
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(latency_ms / 1000, SlowStandIn.connections, ready), daemon=True)
+    server.start()
+    point_gateway_at(ready.get(timeout=10))
+    import services.protean_service as protean_service
+    gateway = protean_service.gateway = protean_service.ProteanGateway()
+    token = gateway.get_access_token() # Warm the token cache: this measures the data path
+
+    print(f"--- B2B THROUGHPUT ({total} requests, {concurrency} in flight, {latency_ms}ms upstream, 1 worker) ---")
+    async def legacy(i):
+        return requests.request("POST", f"{gateway.base_url}/v1/kyc/vehicle-rc-advanced", headers={"Authorization": f"Bearer {token}"}, json={"rc_number": f"KA01AB{i:04d}"}).json()
+    async def sync_wrapper(i):
+        return protean_service.verify_vehicle_rc(f"KA01AB{i:04d}")
+    async def pooled(i):
+        return await protean_service.run_b2b_module("vehicle_rc", {"id": f"KA01AB{i:04d}"})
+
+    async def run_all():
+        results = {}
+        for name, handler in (("legacy", legacy), ("sync", sync_wrapper), ("async", pooled)):
+            # A ticker shows how long the event loop is stalled while requests are in flight
+            stalls, stop = [], False
+            async def ticker():
+                last = time.perf_counter()
+                while not stop:
+                    await asyncio.sleep(0.01)
+                    now = time.perf_counter()
+                    stalls.append(now - last - 0.01)
+                    last = now
+            tick = asyncio.ensure_future(ticker())
+            gateway.cache.invalidate() # Same RC numbers in every phase: each one goes upstream
+            elapsed, conns = await drive(handler, total, concurrency)
+            stop = True
+            await tick
+            results[name] = elapsed
+            print(f"{name:>8}: {total / elapsed:>8.0f} req/s, {conns:>4} connections opened, max loop stall {max(stalls, default=0) * 1000:>7.1f} ms")
+        await gateway.aclose()
+        return results
+
+    results = asyncio.run(run_all())
+    print(f"Speedup vs legacy: {results['legacy'] / results['async']:.1f}x")
+    server.terminate()
+    print("--- BENCHMARK COMPLETE ---")
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    latency_ms = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    main(total, concurrency, latency_ms)
@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from decimal import Decimal
+
+"""
+Circuit breakers + retry queue: a stand-in Protean server whose vehicle_rc cell starts
+failing (503). Its breaker must open after the threshold while epfo_search keeps serving,
+rejected B2B calls must be queued (not sent upstream), the half-open state must let only the
+probe budget through, breaker state must be shared between workers (fakeredis), and once the
+cell recovers the queue must drain at the configured rate and bill each success exactly once.
+Usage: python verify_protean_circuit_breaker.py [queued] [rate_per_sec]   (default: 200 100)
+"""
+
+TMP = tempfile.mkdtemp()
+os.environ["DATABASE_URL_APP"] = f"sqlite+aiosqlite:///{os.path.join(TMP, 'main.db')}"
+os.environ["DATABASE_URL_COMPLIANCE"] = f"sqlite+aiosqlite:///{os.path.join(TMP, 'compliance_vault.db')}"
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import select, func
+from database import engine_app, SessionLocalApp, Base
+from models import Tenant, WalletHold
+from verify_protean_token_cache import StandIn, start_server, point_gateway_at
+
+PRICE = Decimal("49.00")
+RECOVERY_SEC = 3 # Longer than queueing the burst (one SQLite wallet hold per call) takes
+
+class OutageStandIn(StandIn):
+    down = False
+    calls = {}
+    times = [] # Arrival times of vehicle_rc calls while recovering
+
+    def do_POST(self):
+        if self.path != "/v1/auth/token":
+            with StandIn.lock:
+                OutageStandIn.calls[self.path] = OutageStandIn.calls.get(self.path, 0) + 1
+                if "vehicle-rc" in self.path:
+                    OutageStandIn.times.append(time.monotonic())
+            if "vehicle-rc" in self.path and OutageStandIn.down:
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                return self._reply(503, {"status": "ERROR", "message": "RTO backend unavailable"})
+        super().do_POST()
+
+def rc_calls():
+    return OutageStandIn.calls.get("/v1/kyc/vehicle-rc-advanced", 0)
+
+async def b2b_call(gateway, rc):
+    """What b2b_verify does: reserve, call with queue_on_open, capture / hand over / release."""
+    from services.wallet import WalletService
+    async with SessionLocalApp() as db:
+        hold_id = await WalletService.reserve(db, 1, PRICE, reference="B2B_VEHICLE_RC")
+        result = await gateway.execute_async("vehicle_rc", {"rc_number": rc}, queue_on_open=True)
+        settled = False
+        if result.get("status") == "SUCCESS":
+            settled = await WalletService.capture(db, hold_id)
+        elif result.get("status") == "QUEUED":
+            settled = await gateway.retries.attach_hold_async(result["retry_id"], hold_id)
+        if not settled:
+            await WalletService.release(db, hold_id)
+        return result
+
+async def main(queued, rate):
+    from services.protean_service import ProteanGateway
+    from services.circuit_breaker import CircuitBreakers, MemoryBreakerStore, RedisBreakerStore
+    from services.retry_queue import RetryQueue
+    from services.wallet import WalletService
+
+    async with engine_app.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocalApp() as db:
+        db.add(Tenant(id=1, name="Fleet Co", wallet_balance=PRICE * (queued + 100)))
+        await db.commit()
+
+    print(f"--- PROTEAN CIRCUIT BREAKERS ({queued} queued calls, drain at {rate}/s) ---")
+    gateway = ProteanGateway()
+    gateway.breakers = CircuitBreakers(MemoryBreakerStore(), failure_threshold=5, failure_window_sec=30,
+                                       recovery_timeout_sec=RECOVERY_SEC, half_open_probes=2, close_after=2, sync_sec=0)
+    gateway.retries = RetryQueue(os.path.join(TMP, "retry.db"), rate_per_sec=rate, backoff_sec=0.2)
+
+    # 1. Outage: 5 upstream failures open vehicle_rc only
+    OutageStandIn.down = True
+    failures = await asyncio.gather(*[gateway.execute_async("vehicle_rc", {"rc_number": f"KA01AB{i:04d}"}) for i in range(5)])
+    assert all(r.get("upstream_error") for r in failures), failures
+    assert gateway.breakers.state("vehicle_rc") == "OPEN"
+    before = rc_calls()
+    start = time.perf_counter()
+    results = await asyncio.gather(*[b2b_call(gateway, f"KA02CD{i:04d}") for i in range(queued)])
+    elapsed = time.perf_counter() - start
+    assert all(r["status"] == "QUEUED" for r in results), [r for r in results if r["status"] != "QUEUED"][:3]
+    assert rc_calls() == before, "An open breaker must not call upstream"
+    others = await asyncio.gather(*[gateway.execute_async("epfo_search", {"establishment_name": f"EST{i}"}) for i in range(50)])
+    assert all(r["status"] == "SUCCESS" for r in others)
+    print(f"{'open':>10}: {queued} calls queued in {elapsed * 1000:.0f} ms with 0 upstream calls, epfo_search 50/50 SUCCESS")
+    unavailable = await gateway.execute_async("vehicle_rc", {"rc_number": "KA03EF0001"}, use_cache=False)
+    assert unavailable["status"] == "UNAVAILABLE" and gateway.retries.metrics()["depth"] == queued
+
+    # 2. Half-open while still down: only the probe budget reaches upstream, then it reopens
+    await asyncio.sleep(RECOVERY_SEC + 0.1)
+    before = rc_calls()
+    burst = await asyncio.gather(*[gateway.execute_async("vehicle_rc", {"rc_number": f"KA04GH{i:04d}"}) for i in range(50)])
+    probes = rc_calls() - before
+    assert probes <= 2 and gateway.breakers.state("vehicle_rc") == "OPEN", (probes, gateway.breakers.state("vehicle_rc"))
+    print(f"{'half-open':>10}: 50 calls -> {probes} upstream probe(s), {sum(r['status'] == 'UNAVAILABLE' for r in burst)} rejected, reopened")
+
+    # 3. Shared state: a second worker sees the first worker's breaker through Redis
+    import fakeredis
+    server = fakeredis.FakeServer()
+    worker_a = CircuitBreakers(RedisBreakerStore(fakeredis.FakeRedis(server=server)), failure_threshold=3, sync_sec=0)
+    worker_b = CircuitBreakers(RedisBreakerStore(fakeredis.FakeRedis(server=server)), failure_threshold=3, sync_sec=0)
+    for _ in range(3):
+        assert worker_a.allow("voter_id") == "CALL"
+        worker_a.record("voter_id", False)
+    assert worker_b.allow("voter_id") is None and worker_b.allow("vehicle_rc") == "CALL"
+    print(f"{'shared':>10}: worker B rejects voter_id opened by worker A, {worker_b.metrics()['breakers']}")
+
+    # 4. Recovery: the drainer probes, closes the breaker, then replays at the configured rate
+    OutageStandIn.down = False
+    OutageStandIn.times.clear()
+    await asyncio.sleep(RECOVERY_SEC + 0.1)
+    start = time.perf_counter()
+    passes = 0
+    while gateway.retries.metrics()["depth"] and passes < 1000:
+        await gateway.retries.drain_once(gateway, gateway.breakers, 0.5)
+        passes += 1
+    elapsed = time.perf_counter() - start
+    assert gateway.breakers.state("vehicle_rc") == "CLOSED"
+    done = [gateway.retries.get(r["retry_id"]) for r in results]
+    assert all(d["status"] == "DONE" and d["result"]["status"] == "SUCCESS" for d in done), [d for d in done if d["status"] != "DONE"][:3]
+    span = OutageStandIn.times[-1] - OutageStandIn.times[0]
+    observed = (len(OutageStandIn.times) - 1) / span if span else float("inf")
+    assert observed <= rate * 1.25, f"Drained at {observed:.0f}/s, limit {rate}/s"
+    print(f"{'drain':>10}: {len(OutageStandIn.times)} upstream calls over {span:.2f}s ({observed:.0f}/s, limit {rate}/s) in {passes} passes")
+
+    # 5. Billing: every queued hold captured exactly once
+    async with SessionLocalApp() as db:
+        holds = dict((await db.execute(select(WalletHold.status, func.count()).group_by(WalletHold.status))).all())
+        balance = (await db.execute(select(Tenant.wallet_balance).where(Tenant.id == 1))).scalar()
+    assert holds.get("CAPTURED") == queued and not holds.get("HELD"), holds
+    assert balance == PRICE * 100, balance
+    print(f"{'billing':>10}: holds {holds}, balance ₹{balance}")
+    print(f"{'metrics':>10}: breakers {gateway.breakers.metrics()}")
+    print(f"{'':>10}  retry queue {gateway.retries.metrics()}")
+
+    # 6. A replay throttled by our own quota stays queued (and its hold stays held)
+    class Throttled:
+        answer = {"status": "THROTTLED", "message": "vehicle_rc quota", "retry_after": 0.3}
+        async def execute_async(self, slug, data, **kwargs):
+            return self.answer
+    async with SessionLocalApp() as db:
+        hold_id = await WalletService.reserve(db, 1, PRICE, reference="B2B_VERIFY_VEHICLE_RC")
+    retry_id = await gateway.retries.enqueue_async("vehicle_rc", {"rc_number": "KA09ZZ0001"}, hold_id)
+    stand_in = Throttled()
+    [(claimed, data)] = await asyncio.to_thread(gateway.retries.claim, "vehicle_rc", 10)
+    await gateway.retries._replay(stand_in, "vehicle_rc", claimed, data)
+    item = gateway.retries.get(retry_id)
+    assert item["status"] == "PENDING" and item["attempts"] == 0 and not gateway.retries.due_slugs(), item
+    await asyncio.sleep(0.35)
+    stand_in.answer = {"status": "SUCCESS", "data": {}}
+    [(claimed, data)] = await asyncio.to_thread(gateway.retries.claim, "vehicle_rc", 10)
+    await gateway.retries._replay(stand_in, "vehicle_rc", claimed, data)
+    async with SessionLocalApp() as db:
+        hold = (await db.execute(select(WalletHold.status).where(WalletHold.id == hold_id))).scalar()
+    assert gateway.retries.get(retry_id)["status"] == "DONE" and hold == "CAPTURED", hold
+    print(f"{'throttled':>10}: replay over quota -> requeued after retry_after (0 attempts), then DONE and captured")
+
+    # 7. Redis that accepts connections but never answers: the event loop keeps ticking and
+    # the store is asked once per sync_sec, not on every call
+    import socket
+    import redis
+    blackhole = socket.socket()
+    blackhole.bind(("127.0.0.1", 0))
+    blackhole.listen(64)
+    stuck = CircuitBreakers(RedisBreakerStore(redis.Redis(port=blackhole.getsockname()[1], socket_timeout=0.2, socket_connect_timeout=0.2)), sync_sec=1)
+    lag = [0.0]
+    async def ticker(stop):
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lag[0] = max(lag[0], time.perf_counter() - start - 0.005)
+    stop = asyncio.Event()
+    ticking = asyncio.create_task(ticker(stop))
+    assert await stuck.allow_async("voter_id") == "CALL" # Fails open after the 0.2 s timeout
+    start = time.perf_counter()
+    decisions = [await stuck.allow_async("voter_id") for _ in range(200)]
+    for _ in range(50):
+        await stuck.record_async("voter_id", False)
+    cached = time.perf_counter() - start
+    stop.set()
+    await ticking
+    blackhole.close()
+    assert set(decisions) == {"CALL"} and stuck.stats["store_errors"] == 1, stuck.stats
+    assert lag[0] < 0.1 and cached < 0.05, (lag[0], cached)
+    print(f"{'redis down':>10}: 1 store timeout, then 250 calls fail open in {cached * 1000:.1f} ms; worst event-loop stall {lag[0] * 1000:.0f} ms")
+    await gateway.aclose()
+    print("--- CIRCUIT BREAKERS VERIFIED ---")
+
+if __name__ == "__main__":
+    http = start_server(OutageStandIn)
+    point_gateway_at(http.server_address)
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200, float(sys.argv[2]) if len(sys.argv) > 2 else 100))
+    http.shutdown()
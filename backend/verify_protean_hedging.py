@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+import multiprocessing
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from verify_protean_token_cache import start_server, point_gateway_at
+from verify_protean_async_throughput import SlowStandIn
+
+"""
+Hedged requests: vehicle_rc calls against a stand-in Protean server whose latency is
+heavy-tailed (Pareto, p50 ~40 ms, p99 ~500 ms, max 3 s), with and without hedging past the slug's p95.
+Hedging must cut p99 at a small extra upstream load. When the provider slows down for every
+call, the retry budget must cap the extra load; with 5% of calls failing (503), budgeted
+retries must recover most of them.
+Usage: python verify_protean_hedging.py [requests] [concurrency]   (default: 2000 20)
+"""
+
+HEAVY_TAIL, ALL_SLOW, FLAKY = 0, 1, 2
+
+class HeavyTailStandIn(SlowStandIn):
+    mode = None # multiprocessing.Value: which upstream behaviour to simulate
+    served = None # multiprocessing.Value: upstream calls received
+    rng = random.Random(7)
+
+    def do_POST(self):
+        if self.path == "/v1/auth/token":
+            return super(SlowStandIn, self).do_POST()
+        with HeavyTailStandIn.served.get_lock():
+            HeavyTailStandIn.served.value += 1
+        mode = HeavyTailStandIn.mode.value
+        if mode == ALL_SLOW:
+            time.sleep(0.3)
+        else:
+            time.sleep(min(3.0, 0.02 * HeavyTailStandIn.rng.paretovariate(1.3)))
+        if mode == FLAKY and HeavyTailStandIn.rng.random() < 0.05:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            return self._reply(503, {"status": "ERROR", "message": "Backend unavailable"})
+        super(SlowStandIn, self).do_POST()
+
+def serve(mode, served, connections, ready):
+    HeavyTailStandIn.mode = mode
+    HeavyTailStandIn.served = served
+    SlowStandIn.connections = connections
+    server = start_server(HeavyTailStandIn)
+    ready.put(server.server_address)
+    threading.Event().wait()
+
+def pct(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] * 1000
+
+async def run(gateway, total, concurrency, tag):
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+    async def one(i):
+        async with gate:
+            start = time.perf_counter()
+            result = await gateway.execute_async("vehicle_rc", {"rc_number": f"{tag}{i:06d}"}, use_cache=False)
+            latencies.append(time.perf_counter() - start)
+            return result
+    results = await asyncio.gather(*[one(i) for i in range(total)])
+    return results, latencies
+
+def main(total, concurrency):
+    mode, served = multiprocessing.Value("i", HEAVY_TAIL), multiprocessing.Value("i", 0)
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(mode, served, multiprocessing.Value("i", 0), ready), daemon=True)
+    server.start()
+    point_gateway_at(ready.get(timeout=10))
+    from services.protean_service import ProteanGateway
+    from services.hedging import TailLatencyPolicy
+    from services.circuit_breaker import CircuitBreakers, MemoryBreakerStore
+
+    print(f"--- HEDGED REQUESTS ({total} vehicle_rc calls, {concurrency} in flight, Pareto upstream latency) ---")
+    async def scenario():
+        gateway = ProteanGateway()
+        gateway.breakers = CircuitBreakers(MemoryBreakerStore(), failure_threshold=10 ** 6) # Measure the gateway, not the breaker
+        gateway.get_access_token() # Warm the token cache
+
+        # 1. Baseline: no hedging (the histogram never warms up)
+        gateway.tail = TailLatencyPolicy(min_samples=10 ** 9)
+        before = served.value
+        results, plain = await run(gateway, total, concurrency, "PLAIN")
+        assert all(r["status"] == "SUCCESS" for r in results)
+        plain_load = served.value - before
+
+        # 2. Hedged past p95, after a warm-up that fills the histogram
+        gateway.tail = TailLatencyPolicy()
+        await run(gateway, 200, concurrency, "WARM")
+        gateway.tail.stats.update(hedges=0, hedges_won=0)
+        before = served.value
+        results, hedged = await run(gateway, total, concurrency, "HEDGE")
+        assert all(r["status"] == "SUCCESS" for r in results)
+        hedged_load = served.value - before
+        stats = gateway.tail.stats
+        threshold = gateway.tail.hedge_delay("vehicle_rc") * 1000
+        for name, samples, load in (("plain", plain, plain_load), ("hedged", hedged, hedged_load)):
+            print(f"{name:>10}: p50 {pct(samples, 50):6.0f} ms  p95 {pct(samples, 95):6.0f} ms  p99 {pct(samples, 99):6.0f} ms  "
+                  f"max {max(samples) * 1000:6.0f} ms  upstream calls {load} (+{(load - total) / total * 100:.1f}%)")
+        print(f"{'':>10}  hedge after {threshold:.0f} ms: {stats['hedges']} hedges, {stats['hedges_won']} won")
+        assert pct(hedged, 99) < pct(plain, 99) * 0.7, "Hedging must cut p99"
+        assert hedged_load <= total * 1.12
+
+        # 3. Provider slow for everyone: the budget caps the extra load
+        mode.value = ALL_SLOW
+        gateway.tail.stats.update(hedges=0, budget_exhausted=0)
+        before = served.value
+        start = time.perf_counter()
+        await run(gateway, total // 4, concurrency, "SLOW")
+        elapsed = time.perf_counter() - start
+        extra = served.value - before - total // 4
+        limit = (total // 4) * gateway.tail.budget_args[0] + gateway.tail.budget_args[2] + elapsed * gateway.tail.budget_args[1]
+        print(f"{'overload':>10}: {total // 4} calls all slow -> {extra} hedges (budget allows {limit:.0f}), {gateway.tail.stats['budget_exhausted']} refused")
+        assert extra <= limit + 1
+
+        # 4. 5% of calls fail with 503: budgeted retries recover them
+        mode.value = FLAKY
+        # Hedging off in both runs to isolate retries; an empty budget means no retries
+        gateway.tail = TailLatencyPolicy(min_samples=10 ** 9, budget_ratio=0, budget_min_per_sec=0, budget_burst=0)
+        no_retry = sum(r["status"] == "SUCCESS" for r in (await run(gateway, total, concurrency, "FLAKY"))[0])
+        gateway.tail = TailLatencyPolicy(min_samples=10 ** 9)
+        await run(gateway, 200, concurrency, "WARM2") # Typical latency for the retry check
+        gateway.tail.stats.update(retries=0)
+        results, _ = await run(gateway, total, concurrency, "RETRY")
+        with_retry = sum(r["status"] == "SUCCESS" for r in results)
+        print(f"{'flaky':>10}: {total - no_retry} failed without retries, {total - with_retry} with budgeted retries ({gateway.tail.stats['retries']} retries)")
+        assert with_retry > no_retry
+        print(f"{'metrics':>10}: {gateway.tail.metrics()}")
+        await gateway.aclose()
+
+    asyncio.run(scenario())
+    print("--- HEDGING VERIFIED ---")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000, int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import multiprocessing
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+Quota limiter: bursts of mobile_verify calls against a stand-in Protean server that enforces
+a provider quota (50/s, burst 10, HTTP 429 above it).
+without = gateway sends as fast as callers arrive (what execute() did before the limiter)
+with    = admitted at the configured quota (48/s); over-limit calls wait in the admission queue
+Also: a burst larger than the queue/deadline allows is rejected at once with a retry_after,
+a tenant flooding the grid does not delay another tenant, and a call the slug bucket
+refuses keeps no tenant slot.
+Usage: python verify_protean_quota.py [calls] [concurrency]   (default: 400 50)
+"""
+
+PROVIDER_RATE, PROVIDER_BURST = 50, 10
+# Configured below the provider's limits: admitted calls still bunch up on the way (pool
+# queueing, network), so the burst needs headroom as well as the rate
+os.environ["PROTEAN_QUOTAS"] = json.dumps({"default": {"rate": 48, "burst": 5}, "tenant": {"rate": 30, "burst": 5}})
+
+from verify_protean_token_cache import start_server, point_gateway_at
+from verify_protean_async_throughput import SlowStandIn
+
+class QuotaStandIn(SlowStandIn):
+    """Provider-side quota per API (GCRA, same shape as Protean's), 20 ms per answered call."""
+    served = None
+    throttled = None
+    tat = {}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        if self.path == "/v1/auth/token":
+            return super(SlowStandIn, self).do_POST()
+        interval = 1 / PROVIDER_RATE
+        with QuotaStandIn.lock:
+            now = time.monotonic()
+            tat = max(QuotaStandIn.tat.get(self.path, 0.0), now)
+            allowed = tat - now <= (PROVIDER_BURST - 1) * interval
+            if allowed:
+                QuotaStandIn.tat[self.path] = tat + interval
+        if not allowed:
+            with QuotaStandIn.throttled.get_lock():
+                QuotaStandIn.throttled.value += 1
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            return self._reply(429, {"status": "ERROR", "message": "Quota exceeded"})
+        with QuotaStandIn.served.get_lock():
+            QuotaStandIn.served.value += 1
+        time.sleep(0.02)
+        super(SlowStandIn, self).do_POST()
+
+def serve(served, throttled, connections, ready):
+    QuotaStandIn.served, QuotaStandIn.throttled = served, throttled
+    SlowStandIn.connections = connections
+    server = start_server(QuotaStandIn)
+    ready.put(server.server_address)
+    threading.Event().wait()
+
+async def burst(gateway, calls, concurrency, tag, tenant_id=None):
+    gate = asyncio.Semaphore(concurrency)
+    async def one(i):
+        async with gate:
+            start = time.perf_counter()
+            result = await gateway.execute_async("mobile_verify", {"mobile": f"{tag}{i:06d}"}, tenant_id=tenant_id)
+            return result, time.perf_counter() - start
+    start = time.perf_counter()
+    results = await asyncio.gather(*[one(i) for i in range(calls)])
+    return results, time.perf_counter() - start
+
+async def tenant_slot_refund():
+    """A call the slug bucket refuses must not consume (or wait for) a tenant slot."""
+    from services.rate_limiter import QuotaLimiter, QuotaExceeded
+    limiter = QuotaLimiter({"default": {"rate": 10, "burst": 1}, "tenant": {"rate": 10, "burst": 1}}, deadline_sec=0.15)
+    tenant, slug = limiter._bucket("tenant:7"), limiter._bucket("slug:pan")
+    # Slug booked 1 s ahead by other tenants: refused at once, tenant bucket untouched
+    slug.tat = time.monotonic() + 1
+    start = time.perf_counter()
+    try:
+        limiter.acquire_sync("pan", tenant_id=7)
+        raise AssertionError("slug over its deadline must refuse the call")
+    except QuotaExceeded as e:
+        assert e.key == "slug:pan" and time.perf_counter() - start < 0.01
+    assert tenant.tat == 0 and limiter.metrics()["tenant:7"]["admitted"] == 0
+    # Slug free on arrival, booked by others during the tenant wait: the tenant slot is handed back
+    slug.tat, tenant.tat = 0, time.monotonic() + 0.1
+    call = asyncio.create_task(limiter.acquire("pan", tenant_id=7))
+    await asyncio.sleep(0.02)
+    slug.tat = time.monotonic() + 1
+    try:
+        await call
+        raise AssertionError("slug over its deadline must refuse the call")
+    except QuotaExceeded as e:
+        assert e.key == "slug:pan"
+    stats = limiter.metrics()["tenant:7"]
+    assert stats["refunded"] == 1 and stats["admitted"] == 0 and tenant.earliest(time.monotonic()) <= time.monotonic() + 1e-3
+    print(f"{'refund':>10}: refused by the slug up front -> no tenant slot taken; refused after the tenant wait -> slot refunded {stats}")
+
+def main(calls, concurrency):
+    asyncio.run(tenant_slot_refund())
+    served, throttled = multiprocessing.Value("i", 0), multiprocessing.Value("i", 0)
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(served, throttled, multiprocessing.Value("i", 0), ready), daemon=True)
+    server.start()
+    point_gateway_at(ready.get(timeout=10))
+    from services.protean_service import ProteanGateway, PROTEAN_QUOTAS
+    from services.rate_limiter import QuotaLimiter
+    from services.circuit_breaker import CircuitBreakers, MemoryBreakerStore
+    from services.hedging import TailLatencyPolicy
+
+    print(f"--- PROTEAN QUOTA ({calls} mobile_verify calls, {concurrency} in flight, provider quota {PROVIDER_RATE}/s) ---")
+    async def scenario():
+        gateway = ProteanGateway()
+        gateway.breakers = CircuitBreakers(MemoryBreakerStore(), failure_threshold=10 ** 6) # Measure the limiter, not the breaker
+        gateway.tail = TailLatencyPolicy(min_samples=10 ** 9, budget_ratio=0, budget_min_per_sec=0, budget_burst=0)
+        gateway.get_access_token()
+
+        rows = []
+        for name, limiter in (("without", QuotaLimiter({"default": {"rate": 10 ** 6, "burst": 10 ** 6}})),
+                              ("with", QuotaLimiter(PROTEAN_QUOTAS, max_waiting=10 ** 6, deadline_sec=60))):
+            gateway.limiter = limiter
+            await asyncio.sleep(1) # Provider bucket refills between runs
+            before_throttled = throttled.value
+            results, elapsed = await burst(gateway, calls, concurrency, name.upper())
+            ok = sum(r["status"] == "SUCCESS" for r, _ in results)
+            rows.append((name, ok, throttled.value - before_throttled, elapsed))
+            print(f"{name:>10}: {ok:>4}/{calls} SUCCESS, {throttled.value - before_throttled:>4} upstream 429s, "
+                  f"goodput {ok / elapsed:5.1f}/s, {elapsed:5.2f}s")
+        assert rows[1][1] == calls and rows[1][2] == 0, "Admitted calls must stay under the provider quota"
+        assert rows[0][2] > 0, "The stand-in must throttle an unlimited burst"
+        assert rows[1][1] / rows[1][3] >= 0.8 * 48, "Goodput must approach the configured quota"
+        slug = gateway.limiter.metrics()["slug:mobile_verify"]
+        print(f"{'':>10}  queue wait avg {slug['wait_ms_avg']:.0f} ms, max {slug['wait_ms_max']:.0f} ms")
+
+        # Bounded queue + deadline: what can't be served in time is rejected immediately
+        gateway.limiter = QuotaLimiter(PROTEAN_QUOTAS, max_waiting=100, deadline_sec=2)
+        await asyncio.sleep(1)
+        results, elapsed = await burst(gateway, 500, 500, "BOUNDED")
+        ok = [t for r, t in results if r["status"] == "SUCCESS"]
+        rejected = [(r, t) for r, t in results if r["status"] == "THROTTLED"]
+        assert len(ok) + len(rejected) == 500 and rejected
+        assert max(t for _, t in rejected) < 0.2, "Rejections must not wait"
+        assert throttled.value == rows[0][2], "No upstream 429s with the limiter"
+        print(f"{'bounded':>10}: 500 at once -> {len(ok)} admitted (max wait {max(ok):.2f}s), {len(rejected)} rejected "
+              f"in <{max(t for _, t in rejected) * 1000:.1f} ms, e.g. {rejected[0][0]['message']} retry_after {rejected[0][0]['retry_after']}s")
+
+        # Tenant quota: tenant 1 floods, tenant 2's trickle is not stuck behind it
+        gateway.limiter = QuotaLimiter(PROTEAN_QUOTAS, max_waiting=10 ** 6, deadline_sec=60)
+        await asyncio.sleep(1)
+        async def trickle():
+            waits = []
+            for i in range(20):
+                start = time.perf_counter()
+                result = await gateway.execute_async("mobile_verify", {"mobile": f"TWO{i:06d}"}, tenant_id=2)
+                assert result["status"] == "SUCCESS"
+                waits.append(time.perf_counter() - start)
+                await asyncio.sleep(0.1)
+            return waits
+        flood, waits = await asyncio.gather(burst(gateway, 300, 300, "ONE", tenant_id=1), trickle())
+        flood_rate = sum(r["status"] == "SUCCESS" for r, _ in flood[0]) / flood[1]
+        print(f"{'tenants':>10}: tenant 1 flood {flood_rate:.1f}/s (tenant quota 30/s), tenant 2 max latency {max(waits) * 1000:.0f} ms")
+        assert max(waits) < 0.3, "Another tenant's flood must not queue tenant 2"
+        print(f"{'metrics':>10}: {json.dumps(gateway.limiter.metrics())}")
+        await gateway.aclose()
+
+    asyncio.run(scenario())
+    print("--- QUOTA LIMITER VERIFIED ---")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 400, int(sys.argv[2]) if len(sys.argv) > 2 else 50)
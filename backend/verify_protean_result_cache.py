@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import fakeredis
+from verify_protean_token_cache import StandIn, start_server, point_gateway_at
+
+"""
+Result cache in front of ProteanGateway.execute / execute_async against a stand-in Protean
+server (50ms per lookup) that counts upstream verification calls:
+- 500 concurrent identical lookups (async) and 64 (threads) each cost one upstream call
+- normalized repeats are HITs, non-cacheable cells BYPASS, failures are not cached
+- a second worker sharing the Redis tier (fakeredis) hits without going upstream; keys
+  and values stored there contain no plaintext identifiers
+Usage: python verify_protean_result_cache.py [concurrent]   (default: 500)
+"""
+
+class CountingStandIn(StandIn):
+    calls = 0
+
+    def do_POST(self):
+        if self.path != "/v1/auth/token":
+            with StandIn.lock:
+                CountingStandIn.calls += 1
+            time.sleep(0.05)
+        super().do_POST()
+
+def upstream(fn):
+    before = CountingStandIn.calls
+    result = fn()
+    return result, CountingStandIn.calls - before
+
+def main(concurrent):
+    server = start_server(CountingStandIn)
+    point_gateway_at(server.server_address)
+    from services.protean_service import ProteanGateway, PROTEAN_API_GRID
+    from services.protean_cache import ProteanResultCache
+
+    print(f"--- PROTEAN RESULT CACHE ({concurrent} concurrent identical lookups) ---")
+    shared = fakeredis.FakeServer()
+    worker_a, worker_b = ProteanGateway(), ProteanGateway()
+    worker_a.cache = ProteanResultCache(redis_client=fakeredis.FakeRedis(server=shared), async_redis_client=fakeredis.FakeAsyncRedis(server=shared))
+    worker_b.cache = ProteanResultCache(redis_client=fakeredis.FakeRedis(server=shared), async_redis_client=fakeredis.FakeAsyncRedis(server=shared))
+    worker_a.get_access_token()
+
+    async def burst():
+        start = time.perf_counter()
+        results = await asyncio.gather(*[worker_a.execute_async("vehicle_rc", {"rc_number": "KA01AB1234"}) for _ in range(concurrent)])
+        return results, time.perf_counter() - start
+    (results, miss_s), calls = upstream(lambda: asyncio.run(burst()))
+    statuses = [r["cache"] for r in results]
+    print(f"{'async':>10}: {calls} upstream call(s), {statuses.count('MISS')} MISS / {statuses.count('COALESCED')} COALESCED in {miss_s * 1000:.0f} ms")
+    assert calls == 1 and statuses.count("MISS") == 1 and all(r["status"] == "SUCCESS" for r in results)
+
+    start = time.perf_counter()
+    (hit, calls) = upstream(lambda: worker_a.execute("vehicle_rc", {"rc_number": "  ka01ab1234 "}))
+    hit_ms = (time.perf_counter() - start) * 1000
+    print(f"{'hit':>10}: {hit['cache']} in {hit_ms:.2f} ms (normalized input), {calls} upstream call(s)")
+    assert hit["cache"] == "HIT" and calls == 0
+
+    barrier = threading.Barrier(64)
+    def call(_):
+        barrier.wait()
+        return worker_a.execute("voter_id", {"epic_number": "VOT1234567"})
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        results, calls = upstream(lambda: list(pool.map(call, range(64))))
+    statuses = [r["cache"] for r in results]
+    print(f"{'threads':>10}: {calls} upstream call(s), {statuses.count('MISS')} MISS / {statuses.count('COALESCED')} COALESCED / {statuses.count('HIT')} HIT")
+    assert calls == 1
+
+    # Another worker: served from the shared tier
+    (other, calls) = upstream(lambda: worker_b.execute("vehicle_rc", {"rc_number": "KA01AB1234"}))
+    assert other["cache"] == "HIT" and calls == 0 and worker_b.cache.stats["redis_hits"] == 1
+    stored = fakeredis.FakeRedis(server=shared)
+    dump = b"".join(stored.keys("*") + [stored.get(k) for k in stored.keys("*")])
+    assert b"KA01AB1234" not in dump.upper() and b"VOT1234567" not in dump.upper()
+    print(f"{'redis':>10}: second worker HIT from shared tier, {len(stored.keys('*'))} keys, no plaintext identifiers")
+
+    # Not cacheable / not cached
+    bypassed, calls = upstream(lambda: [worker_a.execute("face_liveness", {"image": "abc"}) for _ in range(3)])
+    assert calls == 3 and all(r["cache"] == "BYPASS" for r in bypassed)
+    for _ in range(2):
+        res = worker_a.cache.get_or_fetch("epfo_search", PROTEAN_API_GRID["epfo_search"], {"establishment_name": "GHOST"}, lambda: {"status": "FAILED"})
+    assert res["cache"] == "MISS", "Failures must not be cached"
+
+    # TTL expiry
+    PROTEAN_API_GRID["vehicle_rc"]["cache_ttl"] = 0.2
+    worker_c = ProteanGateway()
+    worker_c.cache = ProteanResultCache()
+    _, first = upstream(lambda: worker_c.execute("vehicle_rc", {"rc_number": "MH12XY0001"}))
+    time.sleep(0.25)
+    again, second = upstream(lambda: worker_c.execute("vehicle_rc", {"rc_number": "MH12XY0001"}))
+    assert first == 1 and second == 1 and again["cache"] == "MISS"
+    print(f"{'ttl':>10}: expired entry refetched, BYPASS for face_liveness, failures not cached")
+    print(f"{'metrics':>10}: {worker_a.cache.metrics()}")
+    server.shutdown()
+    print(f"Upstream latency saved per hit: {miss_s * 1000 - hit_ms:.0f} ms")
+    print("--- RESULT CACHE VERIFIED ---")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+"""
+Token cache: 1,000 concurrent gateway calls against a local stand-in Protean server must
+cause exactly one POST /v1/auth/token. Revoking the live token (401) must trigger one
+refresh, and an early refresh must happen in the background without blocking callers.
+Usage: python verify_protean_token_cache.py [calls]   (default: 1000)
+"""
+
+class StandIn(BaseHTTPRequestHandler):
+    token_requests = 0
+    token_ttl = 3600
+    revoked = set()
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/v1/auth/token":
+            time.sleep(0.05) # Signing + IdP round trip
+            with StandIn.lock:
+                StandIn.token_requests += 1
+                token = f"tok-{StandIn.token_requests}"
+            return self._reply(200, {"access_token": token, "expires_in": StandIn.token_ttl})
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not token.startswith("tok-") or token in StandIn.revoked:
+            return self._reply(401, {"status": "ERROR", "message": "invalid_token"})
+        self._reply(200, {"status": "SUCCESS", "token": token, "echo": json.loads(body or b"{}")})
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError): # Clients hanging up (cancelled calls) are expected
+            super().handle_error(request, client_address)
+
+def start_server(handler=StandIn):
+    server = StandInServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def point_gateway_at(address):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    os.environ["PROTEAN_BASE_URL"] = f"http://{address[0]}:{address[1]}"
+    # Stand-ins have no provider quota (verify_protean_quota.py sets its own)
+    os.environ.setdefault("PROTEAN_QUOTAS", json.dumps({"default": {"rate": 10 ** 6, "burst": 10 ** 6}}))
+    os.environ["PROTEAN_PRIVATE_KEY"] = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+def main(calls):
+    server = start_server()
+    point_gateway_at(server.server_address)
+    from services.protean_service import ProteanGateway
+
+    print(f"--- PROTEAN TOKEN CACHE ({calls} concurrent calls) ---")
+    gateway = ProteanGateway()
+    barrier = threading.Barrier(64)
+    def call(i):
+        if i < 64:
+            barrier.wait() # First wave hits the cold cache together
+        return gateway.execute("vehicle_rc", {"rc_number": f"AB12CD{i:04d}"}, use_cache=False) # Every call goes upstream
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        results = list(pool.map(call, range(calls)))
+    elapsed = time.perf_counter() - start
+    assert all(r.get("status") == "SUCCESS" for r in results), [r for r in results if r.get("status") != "SUCCESS"][:3]
+    print(f"{'threads':>10}: {calls} calls in {elapsed * 1000:.0f} ms, token requests = {StandIn.token_requests}")
+    assert StandIn.token_requests == 1, "Cold burst must share a single token fetch"
+
+    # Async callers share one in-flight fetch too
+    async def burst():
+        manager = ProteanGateway().tokens
+        return await asyncio.gather(*[manager.get_token_async() for _ in range(calls)])
+    before = StandIn.token_requests
+    tokens = asyncio.run(burst())
+    print(f"{'asyncio':>10}: {len(set(tokens))} distinct token(s), token requests = {StandIn.token_requests - before}")
+    assert StandIn.token_requests - before == 1 and len(set(tokens)) == 1
+
+    # 401: the burst reports the same revoked token, only one refresh follows
+    StandIn.revoked.add(gateway.tokens._token)
+    before = StandIn.token_requests
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        results = list(pool.map(call, range(64, 64 + calls // 10)))
+    assert all(r.get("status") == "SUCCESS" for r in results)
+    print(f"{'revoked':>10}: token requests = {StandIn.token_requests - before}, {gateway.tokens.stats}")
+    assert StandIn.token_requests - before == 1
+
+    # Early refresh: inside the refresh-ahead window callers keep the old token while one
+    # background fetch replaces it
+    StandIn.token_ttl = 120
+    early = ProteanGateway()
+    early.tokens.get_token()
+    early.tokens._expires_at = time.monotonic() + early.tokens.expiry_skew_sec + 10
+    old = early.tokens._token
+    before = StandIn.token_requests
+    start = time.perf_counter()
+    served = [early.tokens.get_token() for _ in range(1000)]
+    hot_ms = (time.perf_counter() - start) * 1000
+    assert set(served) == {old}, "Callers must not block on the early refresh"
+    for _ in range(100):
+        if early.tokens._token != old:
+            break
+        time.sleep(0.01)
+    assert early.tokens._token != old and StandIn.token_requests - before == 1
+    print(f"{'early':>10}: 1000 lookups in {hot_ms:.1f} ms during refresh, {early.tokens.stats}")
+
+    # Baseline: one token request per call (what execute() did before the cache)
+    baseline = ProteanGateway()
+    start = time.perf_counter()
+    for i in range(50):
+        baseline.tokens.invalidate(baseline.tokens._token)
+        baseline.execute("vehicle_rc", {"rc_number": f"AB12CD{i:04d}"}, use_cache=False)
+    per_call = (time.perf_counter() - start) / 50
+    start = time.perf_counter()
+    for i in range(50):
+        baseline.execute("vehicle_rc", {"rc_number": f"AB12CD{i:04d}"}, use_cache=False)
+    cached = (time.perf_counter() - start) / 50
+    print(f"{'latency':>10}: {per_call * 1000:.1f} ms/call re-authenticating vs {cached * 1000:.1f} ms/call cached")
+    server.shutdown()
+    print("--- TOKEN CACHE VERIFIED ---")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import select, insert, func
+from sqlalchemy.ext.asyncio import create_async_engine
+from database import BaseCompliance
+from models import AuditLog, DPDPConsent, RetentionCheckpoint
+from services.retention_sweeper import RetentionSweeper
+
+"""
+Retention sweeper on a compliance vault with expired and live audit_logs / dpdp_consents:
+- expired rows go in chunks of chunk_size (one transaction each), live rows stay, and the
+  longest chunk holds the write lock for far less than one DELETE of everything expired
+- retention_checkpoints gets one row per table with the running total and the sweep time
+- metrics report rows, chunks and lock time, the one-off full VACUUM included; a later
+  sweep on the converted file only runs incremental vacuum
+Usage: python verify_retention_sweeper.py [expired] [chunk_size]   (default: 50000 500)
+"""
+
+def rows(model, n, retention_until):
+    if model is AuditLog:
+        return [{"actor_token": "B2B_ADMIN", "action": "B2B_VERIFY_VEHICLE_RC", "resource_id": str(i), "retention_until": retention_until(i)} for i in range(n)]
+    return [{"user_id_token": f"tok-{i}", "form_hash": "f" * 64, "signature_token": "sig", "retention_until": retention_until(i)} for i in range(n)]
+
+async def seed(engine, expired, live, now):
+    async with engine.begin() as conn:
+        for model in (AuditLog, DPDPConsent):
+            for n, sign in ((expired, -1), (live, 1)):
+                if n:
+                    await conn.execute(insert(model), rows(model, n, lambda i: now + sign * timedelta(days=1 + i % 900)))
+
+async def count(engine, model):
+    async with engine.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(model))).scalar()
+
+def one_delete_ms(path, now):
+    """Lock time of the naive purge: one DELETE of every expired row."""
+    with sqlite3.connect(path) as conn:
+        start = time.perf_counter()
+        conn.execute("DELETE FROM audit_logs WHERE retention_until < ?", (now.isoformat(" "),))
+        conn.commit()
+        return (time.perf_counter() - start) * 1000
+
+async def main(expired, chunk_size, tmp):
+    print(f"--- RETENTION SWEEPER ({expired:,} expired + {expired // 5:,} live rows per table, chunks of {chunk_size}) ---")
+    path = os.path.join(tmp, "compliance_vault.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(BaseCompliance.metadata.create_all)
+    now = datetime.utcnow()
+    await seed(engine, expired, expired // 5, now)
+    shutil.copy(path, os.path.join(tmp, "naive.db"))
+    naive_ms = one_delete_ms(os.path.join(tmp, "naive.db"), now)
+
+    # 1. Chunked deletes: expired rows gone, live rows kept, short transactions
+    sweeper = RetentionSweeper(engine=engine, chunk_size=chunk_size, pause_ms=0)
+    sweep = await sweeper.sweep()
+    for model in (AuditLog, DPDPConsent):
+        stats = sweep["tables"][model.__tablename__]
+        assert stats["rows_purged"] == expired and stats["chunks"] == expired // chunk_size + 1, stats
+        assert await count(engine, model) == expired // 5
+    audit = sweep["tables"]["audit_logs"]
+    print(f"{'chunks':>12}: {audit['chunks']} per table, longest lock {audit['lock_ms_max']:.1f} ms vs {naive_ms:.1f} ms for one DELETE of audit_logs")
+    assert audit["lock_ms_max"] < naive_ms
+
+    # 2. Checkpoint rows: one per table, running totals
+    async with engine.connect() as conn:
+        checkpoints = {r.table_name: r for r in (await conn.execute(select(RetentionCheckpoint.__table__))).all()}
+    assert set(checkpoints) == {"audit_logs", "dpdp_consents"}
+    assert all(c.rows_purged_total == expired and c.last_sweep_at.isoformat() == sweep["at"] for c in checkpoints.values())
+    print(f"{'checkpoints':>12}: {({t: c.rows_purged_total for t, c in checkpoints.items()})}")
+
+    # 3. Metrics: the one-off full VACUUM is counted in the lock time
+    vacuum = sweep["vacuum"]
+    tables_ms = sum(t["lock_ms_total"] for t in sweep["tables"].values())
+    assert vacuum["mode"] == "full" and vacuum["lock_ms"] > 0 and vacuum["pages_reclaimed"] > 0
+    assert abs(sweep["lock_ms_total"] - (tables_ms + vacuum["lock_ms"])) < 0.05 and sweep["lock_ms_max"] >= vacuum["lock_ms"]
+    assert sweeper.metrics()["totals"] == {"sweeps": 1, "rows_purged": 2 * expired, "lock_ms": sweep["lock_ms_total"]}
+    print(f"{'full vacuum':>12}: {vacuum['pages_reclaimed']} pages reclaimed, lock {vacuum['lock_ms']:.1f} ms; sweep lock {sweep['lock_ms_total']:.1f} ms total, {sweep['lock_ms_max']:.1f} ms max")
+
+    # 4. The converted file only needs incremental vacuum
+    await seed(engine, expired // 10, 0, now)
+    sweep = await sweeper.sweep()
+    vacuum = sweep["vacuum"]
+    assert vacuum["mode"] == "incremental" and sweep["rows_purged"] == 2 * (expired // 10)
+    # Every free page up to vacuum_pages, not just the first one
+    assert vacuum["pages_reclaimed"] > 1 and (vacuum["free_pages_left"] == 0 or vacuum["pages_reclaimed"] == sweeper.vacuum_pages), vacuum
+    async with engine.connect() as conn:
+        totals = dict((await conn.execute(select(RetentionCheckpoint.table_name, RetentionCheckpoint.rows_purged_total))).all())
+    assert totals == {"audit_logs": expired + expired // 10, "dpdp_consents": expired + expired // 10}
+    assert sweeper.metrics()["totals"]["sweeps"] == 2
+    print(f"{'incremental':>12}: {vacuum['pages_reclaimed']} pages reclaimed, lock {vacuum['lock_ms']:.1f} ms; checkpoints now {totals}")
+
+    # 5. Nothing expired: no chunk deletes anything, no vacuum
+    sweep = await sweeper.sweep()
+    assert sweep["rows_purged"] == 0 and sweep["vacuum"]["mode"] == "none"
+    await engine.dispose()
+    print("--- RETENTION SWEEPER VERIFIED ---")
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000, int(sys.argv[2]) if len(sys.argv) > 2 else 500, tmp))
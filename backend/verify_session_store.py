@@ -0,0 +1,171 @@
+import os
+import sys
+import gc
+import time
+import asyncio
+import tracemalloc
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+WhatsApp session store: operations per second and memory per 1M sessions for the in-memory
+tier (vs the old dict-of-dicts USER_SESSIONS), LRU/TTL bounds, and per-phone atomicity:
+concurrent read-modify-writes on one phone, with awaits in between, must not lose updates,
+within one worker and across two workers sharing Redis (fakeredis). The lock lease is
+renewed through a long interaction; a worker whose lease ran out anyway must not
+overwrite the newer session, and an undecryptable value counts as no session.
+Usage: python verify_session_store.py [sessions] [ops]   (default: 1000000 50000)
+"""
+
+import fakeredis
+from services.session_store import MemorySessionStore, RedisSessionStore, SessionRecord
+
+STATES = ["START", "NITI_START", "NITI_LANG", "NITI_DPDP", "SELECT_LOCATION", "CHECK_EXISTING"]
+
+def phone(i):
+    return f"+91 9{i:09d}"
+
+def footprint(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return kept, used
+
+async def ops_per_sec(store, n, distinct):
+    start = time.perf_counter()
+    for i in range(n):
+        async with store.session(phone(i % distinct)) as s:
+            s.state = STATES[i % len(STATES)]
+            if i % 5 == 0:
+                s.context["selected_lang"] = "hi-IN"
+    update = n / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(n):
+        await store.get(phone(i % distinct))
+    return update, n / (time.perf_counter() - start)
+
+async def increments(stores, count, hold=0.001):
+    """`count` concurrent read-await-write increments of one phone's counter, spread over `stores`."""
+    async def bump(i):
+        async with stores[i % len(stores)].session("9876543210") as s:
+            seen = s.context.get("n", 0)
+            await asyncio.sleep(hold) # e.g. a pvc_status_checker call mid-interaction
+            s.context["n"] = seen + 1
+    await asyncio.gather(*[bump(i) for i in range(count)])
+    return (await stores[0].get("+91 98765 43210")).context["n"]
+
+async def main(sessions, ops):
+    print(f"--- WHATSAPP SESSION STORE ({sessions:,} sessions, {ops:,} ops) ---")
+
+    # 1. Memory per 1M sessions: 80% empty context, 20% with a selected language
+    def old():
+        return {phone(i)[-10:]: {"state": STATES[i % 6], "context": {"selected_lang": "hi-IN"} if i % 5 == 0 else {}, "role": "PERSONAL"} for i in range(sessions)}
+    def new():
+        store = MemorySessionStore(max_entries=sessions)
+        now = time.monotonic()
+        for i in range(sessions):
+            store._store(store._key(phone(i)), SessionRecord(STATES[i % 6], {"selected_lang": "hi-IN"} if i % 5 == 0 else None), now)
+        return store
+    # The first _key() imports models (and SQLAlchemy): load it before measuring, not inside new()
+    MemorySessionStore._key(phone(0))
+    _, old_bytes = footprint(old)
+    store, new_bytes = footprint(new)
+    scale = 1_000_000 / sessions
+    print(f"{'memory':>10}: dict-of-dicts {old_bytes * scale / 2 ** 20:6.0f} MiB per 1M, __slots__ records {new_bytes * scale / 2 ** 20:6.0f} MiB per 1M "
+          f"({new_bytes / sessions:.0f} bytes/session)")
+    assert new_bytes < old_bytes * 0.7
+    del store
+    gc.collect()
+
+    # 2. Throughput (memory tier, then Redis shared by two workers)
+    memory = MemorySessionStore()
+    update, read = await ops_per_sec(memory, ops, 10_000)
+    print(f"{'memory':>10}: {update:9,.0f} locked updates/s, {read:9,.0f} reads/s")
+    server = fakeredis.FakeServer()
+    worker_a, worker_b = (RedisSessionStore(fakeredis.FakeAsyncRedis(server=server)) for _ in range(2))
+    update, read = await ops_per_sec(worker_a, ops // 10, 1_000)
+    print(f"{'redis':>10}: {update:9,.0f} locked updates/s, {read:9,.0f} reads/s (fakeredis, in-process; encrypted values)")
+
+    # 3. Bounds: LRU size and idle TTL
+    bounded = MemorySessionStore(max_entries=1000, ttl_sec=1)
+    for i in range(5000):
+        async with bounded.session(phone(i)):
+            pass
+    assert len(bounded) == 1000 and bounded.stats["evicted"] == 4000 and await bounded.get(phone(0)) is None
+    await asyncio.sleep(2.05) # TTL + the 1 s expiry granularity
+    async with bounded.session(phone(10 ** 6)):
+        pass
+    assert len(bounded) == 1 and await bounded.get(phone(4999)) is None
+    print(f"{'bounds':>10}: 5000 phones into a 1000-entry store -> {bounded.stats['evicted']} evicted, after the TTL {bounded.stats['expired']} expired")
+
+    # 4. Atomicity per phone: the old dict loses updates, the store does not
+    legacy = {}
+    async def unlocked(i):
+        seen = legacy.get("9876543210", {"n": 0})["n"]
+        await asyncio.sleep(0.001)
+        legacy["9876543210"] = {"n": seen + 1}
+    await asyncio.gather(*[unlocked(i) for i in range(200)])
+    one_worker = await increments([MemorySessionStore()], 200)
+    two_workers = await increments([worker_a, worker_b], 200)
+    print(f"{'atomic':>10}: 200 concurrent increments -> USER_SESSIONS {legacy['9876543210']['n']}, memory store {one_worker}, two Redis workers {two_workers}")
+    assert one_worker == 200 and two_workers == 200 and legacy["9876543210"]["n"] < 200
+
+    # 5. Same session for every spelling of the number; Redis keys and values carry no PII
+    async with worker_a.session("919812345678") as s:
+        s.context["ocr_text"] = "Flat 402, Sai Residency, Hyderabad"
+    assert (await worker_b.get("+91 98123-45678")).context["ocr_text"].startswith("Flat 402")
+    raw = b"".join([k + (await worker_a.client.get(k) or b"") for k in await worker_a.client.keys("*")])
+    assert b"9812345678" not in raw and b"Sai Residency" not in raw
+
+    # 6. Leases: renewed while a long interaction runs; a worker that stops renewing loses its write
+    slow = RedisSessionStore(fakeredis.FakeAsyncRedis(server=server), lease_sec=0.1)
+    seen_by_fresh = []
+    async def long_interaction():
+        async with slow.session("8000000001") as s:
+            await asyncio.sleep(0.35) # 3.5 leases
+            s.state = "LONG"
+    async def fresh(phone_number, wait):
+        await asyncio.sleep(wait)
+        async with worker_b.session(phone_number) as s:
+            seen_by_fresh.append(s.state)
+            s.state = "FRESH"
+    await asyncio.gather(long_interaction(), fresh("8000000001", 0.15))
+    assert seen_by_fresh == ["LONG"] and slow.stats["lease_renewals"] >= 3 and slow.stats["lost_leases"] == 0
+    async def hung():
+        async with slow.session("8000000003") as s:
+            _, lock_key = slow._keys("8000000003")
+            await slow.client.delete(lock_key) # The lease ran out while this worker was stuck
+            await asyncio.sleep(0.3)
+            s.state = "STALE"
+    await asyncio.gather(hung(), fresh("8000000003", 0.05))
+    assert (await worker_a.get("8000000003")).state == "FRESH" and slow.stats["lost_leases"] == 1
+    print(f"{'lease':>10}: 0.35 s interaction on a 0.1 s lease -> {slow.stats['lease_renewals']} renewals, next message waited; "
+          f"lost lease -> stale write dropped, session {(await worker_a.get('8000000003')).state}")
+
+    # 6b. A value that no longer decrypts is a missing session, not a crash
+    key, _ = worker_a._keys("8000000004")
+    await worker_a.client.set(key, "v1:not-a-valid-token")
+    assert await worker_a.get("8000000004") is None
+    async with worker_a.session("8000000004", default_state="NITI_START") as s:
+        assert s.state == "NITI_START"
+        s.state = "RESTARTED"
+    assert (await worker_b.get("8000000004")).state == "RESTARTED" and worker_a.stats["unreadable"] == 2
+    print(f"{'corrupt':>10}: undecryptable value -> new session; metrics {worker_a.metrics()}")
+
+    # 7. An exception inside the interaction leaves the session untouched
+    try:
+        async with memory.session("8000000002") as s:
+            s.state = "HALF_DONE"
+            raise RuntimeError("pvc portal down")
+    except RuntimeError:
+        pass
+    assert await memory.get("8000000002") is None
+    print("--- SESSION STORE VERIFIED ---")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000, int(sys.argv[2]) if len(sys.argv) > 2 else 50_000))
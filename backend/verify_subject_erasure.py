@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import base64
+import shutil
+import asyncio
+import tempfile
+
+"""
+Benchmark: DPDP erasure latency for one data principal.
+cascade = scan sales_register + verifications, decrypt every PII token to find the
+          principal's rows, then redact them (what erasure needs without per-subject keys)
+shred   = SubjectKeyService.erase(): destroy one data key (the physical purge runs afterwards)
+Usage: python verify_subject_erasure.py [subjects] [rows_per_subject]   (default: 20000 10)
+"""
+
+TMP = tempfile.mkdtemp()
+os.environ["DATABASE_URL_APP"] = f"sqlite+aiosqlite:///{os.path.join(TMP, 'main.db')}"
+os.environ["DATABASE_URL_COMPLIANCE"] = f"sqlite+aiosqlite:///{os.path.join(TMP, 'compliance_vault.db')}"
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy import select, update, insert, func
+from database import engine_app, engine_compliance, Base, BaseCompliance
+from models import SalesRegister, Verification, SubjectKey, normalize_phone_key
+from services.security_utils import SecurityUtils
+from services.subject_keys import SubjectKeyService, subject_key_cache
+import services.individual_vault as individual_vault
+
+SCAN_BATCH = 5000
+
+def sales_row(i, mobile_token, name_token):
+    return {
+        "order_id": f"order_{i}", "payment_id": f"pay_{i}", "mobile_number": mobile_token, "customer_name": name_token,
+        "state_code": "36", "place_of_supply": "Telangana", "total_amount": "99.00", "base_amount": "83.90",
+        "gst_amount": "15.10", "tax_type": "Intra-State"
+    }
+
+async def seed(subjects, per_subject, sealed):
+    """sealed=False: master-key (v2) tokens; sealed=True: per-subject (v3) tokens."""
+    async with engine_app.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with engine_compliance.begin() as conn:
+        await conn.run_sync(BaseCompliance.metadata.drop_all)
+        await conn.run_sync(BaseCompliance.metadata.create_all)
+    subject_key_cache.clear()
+
+    crypto = SecurityUtils.get_crypto_engine()
+    keys, sales, verifications = [], [], []
+    for s in range(subjects):
+        mobile = f"+9198{s:08d}"
+        values = [mobile, f"customer{s}"] * per_subject + [f"ID{s:010d}"]
+        if sealed:
+            raw = AESGCM.generate_key(bit_length=256)
+            subject_id = SubjectKeyService.subject_id(mobile)
+            keys.append({"subject_id": subject_id, "wrapped_key": SecurityUtils.encrypt_pii(base64.b64encode(raw).decode()), "status": "ACTIVE"})
+            gcm, header = AESGCM(raw), f"{crypto.SUBJECT_PREFIX}{subject_id}$"
+            tokens = [header + crypto.seal(gcm, v, os.urandom(12)) for v in values]
+        else:
+            tokens = SecurityUtils.encrypt_many(values)
+        for j in range(per_subject):
+            sales.append(sales_row(len(sales), tokens[2 * j], tokens[2 * j + 1]))
+        verifications.append({"task_id": f"task_{s}", "mobile_number": mobile, "phone_key": normalize_phone_key(mobile), "vault_token": f"VT-{s}", "applicant_id": tokens[-1], "status": "COMPLETED"})
+
+    async with engine_app.begin() as conn:
+        for i in range(0, len(sales), SCAN_BATCH):
+            await conn.execute(insert(SalesRegister), sales[i:i + SCAN_BATCH])
+        for i in range(0, len(verifications), SCAN_BATCH):
+            await conn.execute(insert(Verification), verifications[i:i + SCAN_BATCH])
+    if keys:
+        async with engine_compliance.begin() as conn:
+            for i in range(0, len(keys), SCAN_BATCH):
+                await conn.execute(insert(SubjectKey), keys[i:i + SCAN_BATCH])
+
+async def cascade_erase(mobile):
+    redacted = 0
+    for table, col in ((SalesRegister.__table__, "mobile_number"), (Verification.__table__, "mobile_number")):
+        pii = "applicant_id" if table.name == "verifications" else "mobile_number"
+        last_id = 0
+        while True:
+            async with engine_app.connect() as conn:
+                rows = (await conn.execute(select(table.c.id, table.c[pii]).where(table.c.id > last_id).order_by(table.c.id).limit(SCAN_BATCH))).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            plain = SecurityUtils.decrypt_many([r[1] for r in rows])
+            target = mobile if pii == "mobile_number" else f"ID{int(mobile[5:]):010d}"
+            hits = [r.id for r, p in zip(rows, plain) if p == target]
+            if hits:
+                async with engine_app.begin() as conn:
+                    await conn.execute(update(table).where(table.c.id.in_(hits)).values({pii: "[REDACTED]"}))
+                redacted += len(hits)
+    return redacted
+
+async def run(subjects, per_subject):
+    print(f"--- DPDP ERASURE BENCHMARK ({subjects:,} subjects, {subjects * per_subject:,} sales rows) ---")
+    victim = f"+9198{subjects // 2:08d}"
+
+    await seed(subjects, per_subject, sealed=False)
+    start = time.perf_counter()
+    redacted = await cascade_erase(victim)
+    cascade_s = time.perf_counter() - start
+    assert redacted == per_subject + 1
+    print(f"{'cascade':>8}: {cascade_s * 1000:>10.1f} ms ({redacted} rows redacted)")
+
+    await seed(subjects, per_subject, sealed=True)
+    async with engine_app.connect() as conn:
+        victim_tokens = (await conn.execute(select(SalesRegister.mobile_number).order_by(SalesRegister.id).limit(per_subject).offset((subjects // 2) * per_subject))).scalars().all()
+        other_tokens = (await conn.execute(select(SalesRegister.mobile_number).order_by(SalesRegister.id).limit(per_subject))).scalars().all()
+    assert set(await SubjectKeyService.decrypt_many(victim_tokens)) == {victim}
+
+    start = time.perf_counter()
+    assert await SubjectKeyService.erase(victim)
+    shred_s = time.perf_counter() - start
+    print(f"{'shred':>8}: {shred_s * 1000:>10.1f} ms (1 key destroyed)")
+
+    subject_key_cache.clear() # As seen by a fresh instance
+    assert set(await SubjectKeyService.decrypt_many(victim_tokens)) == {"[ERASED]"}
+    assert set(await SubjectKeyService.decrypt_many(other_tokens)) == {"+919800000000"}
+
+    individual_vault.VAULT_DIR = os.path.join(TMP, "user_vaults")
+    individual_vault.print = lambda *a, **k: None
+    start = time.perf_counter()
+    purged = await SubjectKeyService.purge_subject(victim)
+    print(f"{'purge':>8}: {(time.perf_counter() - start) * 1000:>10.1f} ms in background {purged}")
+    async with engine_compliance.connect() as conn:
+        assert (await conn.execute(select(func.count()).select_from(SubjectKey).where(SubjectKey.purged_at.isnot(None)))).scalar() == 1
+    print(f"Speedup (time to unreadable): {cascade_s / shred_s:,.0f}x")
+    await engine_app.dispose()
+    await engine_compliance.dispose()
+    shutil.rmtree(TMP, ignore_errors=True)
+    print("--- BENCHMARK COMPLETE ---")
+
+if __name__ == "__main__":
+    subjects = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    per_subject = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(run(subjects, per_subject))
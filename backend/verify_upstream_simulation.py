@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import hmac
+import socket
+import asyncio
+import hashlib
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+Upstream simulation: with UPSTREAM_SIMULATION pointing at a profile, the app's own clients
+(gateway, truth source, legacy stubs, Interakt) talk to a simulator child process.
+Injected latency must follow the profile's distribution, error rates and rate limits must show
+up as errors and 429s, hung calls must hit the gateway's timeout, drip responses must arrive
+slowly, and the Razorpay emitter must deliver signed webhooks. The same webhooks, retries
+included, go through the app's real /razorpay/webhook: each payment is registered once.
+Usage: python verify_upstream_simulation.py [calls]   (default: 400)
+"""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+profile = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+json.dump({"default": {"latency": {"dist": "fixed", "ms": 0}}}, profile)
+profile.close()
+os.environ["UPSTREAM_SIMULATION"] = profile.name
+os.environ["UPSTREAM_SIMULATION_PORT"] = str(free_port())
+os.environ["PROTEAN_TIMEOUT_SEC"] = "1"
+os.environ["PROTEAN_QUOTAS"] = json.dumps({"default": {"rate": 10 ** 6, "burst": 10 ** 6}}) # Let the simulator do the throttling
+os.environ["RAZORPAY_WEBHOOK_SECRET"] = "sim-secret"
+DB_DIR = tempfile.mkdtemp(prefix="upstream-sim-")
+os.environ["DATABASE_URL_APP"] = f"sqlite+aiosqlite:///{os.path.join(DB_DIR, 'main.db')}"
+os.environ["DATABASE_URL_COMPLIANCE"] = f"sqlite+aiosqlite:///{os.path.join(DB_DIR, 'compliance_vault.db')}"
+os.environ.setdefault("PROTEAN_API_KEY", "verify-upstream-simulation") # Past the activation gate
+
+import httpx
+from services import simulation
+
+def use(profile):
+    httpx.post(f"{simulation.base_url()}/_sim/profile", json={"profile": profile}).raise_for_status()
+
+def stats():
+    return httpx.get(f"{simulation.base_url()}/_sim/stats").json()
+
+def pct(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] * 1000
+
+async def truth_calls(calls, concurrency=50, prefix="1234"):
+    from services.mock_provider_service import MockProviderService
+    gate = asyncio.Semaphore(concurrency)
+    async def one(i):
+        async with gate:
+            start = time.perf_counter()
+            result = await MockProviderService.verify_id_async("AADHAAR", f"{prefix}{i:08d}")
+            return result, time.perf_counter() - start
+    return await asyncio.gather(*[one(i) for i in range(calls)])
+
+class WebhookReceiver(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    seen, valid = [], 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        expected = hmac.new(b"sim-secret", body, hashlib.sha256).hexdigest()
+        WebhookReceiver.valid += hmac.compare_digest(expected, self.headers.get("X-Razorpay-Signature", ""))
+        WebhookReceiver.seen.append(json.loads(body)["payload"]["payment"]["entity"]["id"])
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+async def razorpay_through_app(count=50):
+    import app as app_module
+    from sqlalchemy import select, func
+    from database import engine_app, engine_compliance, Base, BaseCompliance, SessionLocalApp
+    from models import SalesRegister
+    from simulator import razorpay_webhooks
+    async with engine_app.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with engine_compliance.begin() as conn: # Subject keys for the tokenized contact
+        await conn.run_sync(BaseCompliance.metadata.create_all)
+    app_module._SCHEMA_READY = asyncio.Event() # Schema created above; no startup restore here
+    app_module._SCHEMA_READY.set()
+    webhooks = razorpay_webhooks(count, duplicate_rate=0.2, seed=5)
+    statuses, replies = {}, {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+        for body, headers in webhooks:
+            resp = await client.post("/razorpay/webhook", content=body, headers=headers)
+            statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+            reply = resp.json().get("status")
+            replies[reply] = replies.get(reply, 0) + 1
+    async with SessionLocalApp() as db:
+        registered = (await db.execute(select(func.count(func.distinct(SalesRegister.payment_id))))).scalar()
+        rows = (await db.execute(select(func.count()).select_from(SalesRegister))).scalar()
+    await engine_app.dispose()
+    await engine_compliance.dispose()
+    print(f"{'webhook':>10}: {len(webhooks)} deliveries ({len(webhooks) - count} retries) to /razorpay/webhook -> {statuses}, {replies}, "
+          f"{rows} sales register rows")
+    assert statuses == {200: len(webhooks)} and replies == {"success": count, "duplicate": len(webhooks) - count}
+    assert rows == registered == count
+
+def main(calls):
+    print(f"--- UPSTREAM SIMULATION (simulator at {simulation.base_url()}) ---")
+    from services.protean_service import ProteanGateway, run_b2b_module
+    from services.circuit_breaker import CircuitBreakers, MemoryBreakerStore
+    from services.hedging import TailLatencyPolicy
+
+    async def scenario():
+        # 1. Latency distribution: lognormal, median 50 ms, sigma 0.5 -> p95 ~114 ms
+        use({"truth": {"latency": {"dist": "lognormal", "median_ms": 50, "sigma": 0.5}}})
+        results = await truth_calls(calls)
+        latencies = [t for _, t in results]
+        injected = stats()["truth:verify_id"]
+        assert all(r["status"] == "SUCCESS" for r, _ in results)
+        print(f"{'latency':>10}: injected p50 {injected['p50_ms']:.0f} ms (profile 50), p95 {injected['p95_ms']:.0f} ms (profile 114); "
+              f"seen by the app p50 {pct(latencies, 50):.0f} ms, p95 {pct(latencies, 95):.0f} ms")
+        assert 42 <= injected["p50_ms"] <= 60 and 95 <= injected["p95_ms"] <= 140
+        assert pct(latencies, 50) >= injected["p50_ms"]
+        failed = await truth_calls(1, prefix="0000")
+        assert failed[0][0]["status"] == "FAILED", "0000 ids must fail, as in MockProviderService"
+
+        # 2. Error rate
+        use({"truth": {"error_rate": 0.2}})
+        results = await truth_calls(calls)
+        errors = sum(r["status"] == "ERROR" for r, _ in results) / calls
+        print(f"{'errors':>10}: {errors:.1%} of truth calls failed (profile 20%)")
+        assert 0.12 <= errors <= 0.28
+
+        # 3. Protean grid through the real gateway: rate limit -> 429s the gateway sees as upstream errors
+        gateway = ProteanGateway()
+        gateway.breakers = CircuitBreakers(MemoryBreakerStore(), failure_threshold=10 ** 6)
+        gateway.tail = TailLatencyPolicy(min_samples=10 ** 9, budget_ratio=0, budget_min_per_sec=0, budget_burst=0)
+        use({"protean": {"latency": {"dist": "fixed", "ms": 10}, "rate_limit": {"rate": 50, "burst": 10}}})
+        results = await asyncio.gather(*[gateway.execute_async("mobile_verify", {"mobile": f"98{i:08d}"}) for i in range(100)])
+        ok = sum(r["status"] == "SUCCESS" for r in results)
+        throttled = stats()["protean:mobile_verify"]["throttled"]
+        print(f"{'quota':>10}: 100 mobile_verify at once -> {ok} SUCCESS, {throttled} simulated 429s (rate 50/s, burst 10)")
+        assert throttled > 0 and ok + throttled == 100 and all(r.get("upstream_error") for r in results if r["status"] != "SUCCESS")
+
+        # 4. Hung upstream: the gateway's read timeout (1 s here) cuts it off
+        use({"protean": {"timeout_rate": 1.0, "hang_ms": 3000}})
+        start = time.perf_counter()
+        result = await gateway.execute_async("vehicle_rc", {"rc_number": "KA01AB0001"}, use_cache=False)
+        elapsed = time.perf_counter() - start
+        print(f"{'timeout':>10}: hung vehicle_rc -> {result['status']} after {elapsed:.2f}s ({result.get('message')})")
+        assert result.get("upstream_error") and 0.9 <= elapsed < 2.5
+
+        # 5. Slow drip: headers at once, body over 4 x 200 ms
+        use({"gemini": {"drip": {"chunks": 5, "interval_ms": 200}}, "protean": {"drip": {"chunks": 4, "interval_ms": 100}}})
+        async with httpx.AsyncClient(base_url=simulation.base_url()) as client:
+            start = time.perf_counter()
+            async with client.stream("POST", "/v1beta/models/gemini-pro:generateContent", json={"contents": [{"parts": [{"text": "Return ONLY a JSON object with keys translated_text"}]}]}) as response:
+                first_byte = time.perf_counter() - start
+                body = json.loads(await response.aread())
+            elapsed = time.perf_counter() - start
+        text = json.loads(body["candidates"][0]["content"]["parts"][0]["text"])
+        print(f"{'drip':>10}: Gemini generateContent headers after {first_byte * 1000:.0f} ms, body after {elapsed * 1000:.0f} ms -> {text}")
+        assert first_byte < 0.15 and elapsed >= 0.75 and "translated_text" in text
+        start = time.perf_counter()
+        result = await gateway.execute_async("epfo_search", {"establishment_name": "ACME"}, use_cache=False)
+        print(f"{'':>10}  gateway epfo_search dripped over {(time.perf_counter() - start) * 1000:.0f} ms -> {result['status']}")
+        assert result["status"] == "SUCCESS" and time.perf_counter() - start >= 0.28
+        await gateway.aclose()
+
+        # 6. Legacy stubs and Interakt go through the simulator too
+        use({"default": {"latency": {"dist": "fixed", "ms": 20}}})
+        result = await run_b2b_module("gstin_check", {"id": "29AAAAA0000A1Z5"})
+        assert result["gstin"] == "29AAAAA0000A1Z5"
+        from services.interakt import send_interakt_reply, send_interakt_document
+        for i in range(20):
+            send_interakt_reply(f"+9198{i:08d}", "Your verification is complete")
+        send_interakt_document("+919800000000", "https://example.com/report.pdf", "report.pdf")
+        deadline = time.monotonic() + 5
+        while stats().get("interakt:message", {}).get("ok", 0) < 21 and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        served = stats()
+        print(f"{'clients':>10}: legacy gstin {served['legacy:gstin']['ok']}, interakt messages {served['interakt:message']['ok']}")
+        assert served["legacy:gstin"]["ok"] == 1 and served["interakt:message"]["ok"] == 21
+
+    asyncio.run(scenario())
+
+    # 7. Razorpay calls us: signed payment.captured webhooks with duplicates (Razorpay retries)
+    from simulator import SimulatorServer, emit_razorpay
+    receiver = SimulatorServer(("127.0.0.1", 0), WebhookReceiver)
+    threading.Thread(target=receiver.serve_forever, daemon=True).start()
+    report = emit_razorpay(f"http://127.0.0.1:{receiver.server_address[1]}", 100, rate=200, duplicate_rate=0.1, seed=3)
+    print(f"{'razorpay':>10}: {report}")
+    assert report["statuses"] == {200: report["sent"]} and WebhookReceiver.valid == report["sent"]
+    assert len(set(WebhookReceiver.seen)) == 100 < report["sent"]
+
+    # 8. The real handler: the emitter's webhooks through the app's /razorpay/webhook
+    asyncio.run(razorpay_through_app())
+    print("--- UPSTREAM SIMULATION VERIFIED ---")
+
+if __name__ == "__main__":
+    try:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 400)
+    finally:
+        os.unlink(profile.name)
+        import shutil
+        shutil.rmtree(DB_DIR, ignore_errors=True)
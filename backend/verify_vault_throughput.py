@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import tempfile
+from datetime import datetime
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import services.individual_vault as individual_vault
+from services.individual_vault import IndividualVaultService, VaultConnectionManager
+
+"""
+Throughput: PVC saves into per-user vaults.
+legacy = one file per user: open + CREATE TABLE x2 + close, then open + write + close, per save (blocking)
+pooled = VaultConnectionManager over the shard databases, awaited via the vault thread pool
+Usage: python verify_vault_throughput.py [users] [saves_per_user] [concurrency]   (default: 200 10 50)
+"""
+
+LEGACY_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS user_documents (id INTEGER PRIMARY KEY AUTOINCREMENT, doc_type TEXT NOT NULL, doc_path TEXT NOT NULL, issue_date TEXT, expiry_date TEXT, integrity_score REAL, verdict TEXT, metadata_json TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE IF NOT EXISTS profile (mobile_number TEXT PRIMARY KEY, applicant_name TEXT, last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+)
+
+PVC = {"integrity_score": 0.95, "verdict": "GENUINE", "issue_date": "2024-01-01", "data": {"name": "Arjun Kumar", "cert_id": "PVC-TS-2024-998"}}
+
+def legacy_save(path, mobile_number):
+    conn = sqlite3.connect(path)
+    for ddl in LEGACY_SCHEMA:
+        conn.execute(ddl)
+    conn.commit()
+    conn.close()
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT OR REPLACE INTO profile (mobile_number, applicant_name, last_updated) VALUES (?, ?, ?)", (mobile_number, "Arjun Kumar", datetime.utcnow().isoformat()))
+    conn.execute(
+        "INSERT INTO user_documents (doc_type, doc_path, issue_date, expiry_date, integrity_score, verdict, metadata_json) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ("PVC", "mock_path.jpg", PVC["issue_date"], None, PVC["integrity_score"], PVC["verdict"], json.dumps(PVC))
+    )
+    conn.commit()
+    conn.close()
+
+async def legacy(tmp, mobiles, saves, concurrency):
+    # The route called the sync helper directly: every save blocked the event loop
+    sem = asyncio.Semaphore(concurrency)
+    async def one(mob):
+        async with sem:
+            await asyncio.sleep(0)
+            legacy_save(os.path.join(tmp, f"{mob}.db"), mob)
+    for _ in range(saves):
+        await asyncio.gather(*[one(mob) for mob in mobiles])
+
+async def pooled(mobiles, saves, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    async def one(mob):
+        async with sem:
+            await IndividualVaultService.save_pvc_async(mob, "Arjun Kumar", PVC, "mock_path.jpg")
+    for _ in range(saves):
+        await asyncio.gather(*[one(mob) for mob in mobiles])
+
+async def loop_lag(stop):
+    # Worst event-loop stall observed while the saves run
+    worst = 0.0
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(0.001)
+        worst = max(worst, time.perf_counter() - t - 0.001)
+    return worst * 1000
+
+async def timed(coro):
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    start = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return elapsed, await lag
+
+def count_docs(directory):
+    total = 0
+    for name in os.listdir(directory):
+        if name.endswith(".db"):
+            conn = sqlite3.connect(os.path.join(directory, name))
+            total += conn.execute("SELECT COUNT(*) FROM user_documents").fetchone()[0]
+            conn.close()
+    return total
+
+async def run(users, saves, concurrency):
+    print(f"--- VAULT SAVE THROUGHPUT ({users} users x {saves} saves, {concurrency} concurrent) ---")
+    mobiles = [f"91{9000000000 + i}" for i in range(users)]
+    total = users * saves
+    with tempfile.TemporaryDirectory() as legacy_dir, tempfile.TemporaryDirectory() as pooled_dir:
+        elapsed, lag = await timed(legacy(legacy_dir, mobiles, saves, concurrency))
+        assert count_docs(legacy_dir) == total
+        base = total / elapsed
+        print(f"{'legacy':>8}: {base:>8,.0f} saves/s | worst loop stall {lag:>7.1f}ms")
+
+        individual_vault.VAULT_DIR = pooled_dir
+        individual_vault.vault_connections = VaultConnectionManager()
+        individual_vault.print = lambda *a, **k: None # Silence per-save log line
+        elapsed, lag = await timed(pooled(mobiles, saves, concurrency))
+        manager = individual_vault.vault_connections
+        await asyncio.to_thread(manager.close_all)
+        assert count_docs(pooled_dir) == total
+        rate = total / elapsed
+        print(f"{'pooled':>8}: {rate:>8,.0f} saves/s | worst loop stall {lag:>7.1f}ms")
+        print(f"Connections: {manager.metrics()}")
+        print(f"Speedup: {rate / base:.1f}x")
+
+        # Unmigrated users: a legacy per-user file is read if usable, else treated as no PVC
+        legacy_save(os.path.join(pooled_dir, "919100000001.db"), "919100000001")
+        os.mkdir(os.path.join(pooled_dir, "919100000002.db")) # Exists but cannot be opened
+        with open(os.path.join(pooled_dir, "919100000003.db"), "wb") as f:
+            f.write(b"not a database" * 100)
+        found = [await IndividualVaultService.get_latest_pvc_async(m) for m in ("919100000001", "919100000002", "919100000003")]
+        await asyncio.to_thread(individual_vault.vault_connections.close_all)
+        assert found[0] is not None and found[1:] == [None, None], found
+        print("Legacy files: readable -> PVC found, unopenable / not a database -> None")
+    print("--- BENCHMARK COMPLETE ---")
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    saves = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    asyncio.run(run(users, saves, concurrency))
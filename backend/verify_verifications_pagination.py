@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import asyncio
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+Benchmark: OFFSET vs keyset (created_at, id) pagination for /verifications.
+Usage: python verify_verifications_pagination.py [rows] [page_size]   (default: 5M rows, 20 per page)
+Seeds a verifications table shaped like models.Verification with the
+ix_verifications_tenant_created_id index, then times page 1 and page 10,000.
+First pages the real GET /verifications through rows that share one second, stored
+both as func.now() text and as Python datetimes: every row must come back exactly once.
+"""
+
+ROWS = 5_000_000
+PAGE_SIZE = 20
+DEEP_PAGE = 10_000
+REPEAT = 20
+COLUMNS = "id, task_id, applicant_name, status, face_verified, face_confidence, failure_reason, created_at"
+
+def seed(conn, rows):
+    conn.execute("""
+        CREATE TABLE verifications (
+            id INTEGER PRIMARY KEY,
+            task_id TEXT NOT NULL,
+            tenant_id INTEGER,
+            mobile_number TEXT,
+            vault_token TEXT NOT NULL,
+            applicant_name TEXT,
+            applicant_id TEXT,
+            image_url TEXT,
+            status TEXT,
+            pdf_path TEXT,
+            face_verified BOOLEAN,
+            face_confidence TEXT,
+            failure_reason TEXT,
+            created_at DATETIME,
+            updated_at DATETIME
+        )
+    """)
+    start = datetime(2024, 1, 1)
+    batch = []
+    for i in range(rows):
+        created = (start + timedelta(seconds=i // 2)).strftime("%Y-%m-%d %H:%M:%S")  # duplicate timestamps exercise the id tiebreak
+        batch.append((f"task-{i}", 1 + (i % 4), f"+9190000{i:05d}", f"VT-{i:012d}", f"Applicant {i}", "ENC" * 20,
+                      "https://example.com/id.jpg", "COMPLETED", f"/tmp/contract_{i}.pdf", 1, "98.5", None, created))
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO verifications (task_id, tenant_id, mobile_number, vault_token, applicant_name, applicant_id, image_url, status, pdf_path, face_verified, face_confidence, failure_reason, created_at) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO verifications (task_id, tenant_id, mobile_number, vault_token, applicant_name, applicant_id, image_url, status, pdf_path, face_verified, face_confidence, failure_reason, created_at) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", batch)
+    conn.execute("CREATE INDEX ix_verifications_created_at ON verifications (created_at)")
+    conn.execute("CREATE INDEX ix_verifications_tenant_created_id ON verifications (tenant_id, created_at, id)")
+    conn.commit()
+
+def offset_page(conn, page, size):
+    return conn.execute(
+        "SELECT * FROM verifications ORDER BY created_at DESC LIMIT ? OFFSET ?", (size, page * size)
+    ).fetchall()
+
+def keyset_page(conn, cursor, size):
+    if cursor is None:
+        return conn.execute(
+            f"SELECT {COLUMNS} FROM verifications WHERE tenant_id = 1 ORDER BY created_at DESC, id DESC LIMIT ?", (size,)
+        ).fetchall()
+    created, row_id = cursor
+    return conn.execute(
+        f"SELECT {COLUMNS} FROM verifications WHERE tenant_id = 1 AND (created_at, id) < (?, ?) "
+        "ORDER BY created_at DESC, id DESC LIMIT ?", (created, row_id, size)
+    ).fetchall()
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        rows = fn(*args)
+    return (time.perf_counter() - start) / REPEAT * 1000, rows
+
+async def endpoint_paging(tmp, same_second=45, size=10):
+    """Follows X-Next-Cursor through the real endpoint (the cursor encode/decode included)."""
+    os.environ["DATABASE_URL_APP"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'main.db')}"
+    os.environ.setdefault("PROTEAN_API_KEY", "verify-pagination") # Past the activation gate
+    import httpx
+    import app as app_module
+    from sqlalchemy import text
+    from database import engine_app, SessionLocalApp, Base
+    from models import Verification
+
+    async with engine_app.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocalApp() as db:
+        # func.now() text ('2025-01-01 10:00:00'), then Python datetimes ('... .000000' / '.250000')
+        db.add_all([Verification(task_id=f"t-{i}", tenant_id=1, vault_token=f"VT-{i}", status="COMPLETED") for i in range(same_second)])
+        await db.commit()
+        await db.execute(text("UPDATE verifications SET created_at = '2025-01-01 10:00:00'"))
+        db.add_all([Verification(task_id=f"t-{same_second + i}", tenant_id=1, vault_token=f"VT-x{i}", status="COMPLETED",
+                                 created_at=datetime(2025, 1, 1, 10, 0, 0, 250000 * (i % 2))) for i in range(7)])
+        await db.commit()
+        expected = [r[0] for r in (await db.execute(text("SELECT id FROM verifications ORDER BY created_at DESC, id DESC"))).all()]
+
+    app_module._SCHEMA_READY = asyncio.Event() # Schema created above; no startup restore here
+    app_module._SCHEMA_READY.set()
+    seen, pages, cursor = [], 0, None
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+        while pages <= len(expected):
+            resp = await client.get("/verifications", params={"limit": size, **({"cursor": cursor} if cursor else {})})
+            assert resp.status_code == 200, resp.text
+            seen += [row["task_id"] for row in resp.json()]
+            pages += 1
+            cursor = resp.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        bad = await client.get("/verifications", params={"cursor": "not-a-cursor"})
+    await engine_app.dispose()
+    assert len(seen) == len(set(seen)) == len(expected), f"{len(seen)} rows returned ({len(set(seen))} distinct) of {len(expected)} in {pages} pages"
+    assert bad.status_code == 400
+    print(f"Endpoint: {len(expected)} rows in one second ({same_second} func.now() text, 7 Python datetimes) -> {pages} pages of {size}, each row once")
+
+def run(rows, size):
+    print(f"--- /verifications PAGINATION BENCHMARK ({rows:,} rows, page size {size}) ---")
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(endpoint_paging(tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        t0 = time.perf_counter()
+        seed(conn, rows)
+        print(f"Seeded in {time.perf_counter() - t0:.1f}s")
+
+        # Cursor for page 10,000 of tenant 1 (what a client would hold after paging there)
+        deep = min(DEEP_PAGE, rows // 4 // size - 1)
+        anchor = conn.execute(
+            "SELECT created_at, id FROM verifications WHERE tenant_id = 1 ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?",
+            (deep * size - 1,)
+        ).fetchone()
+
+        off_1, _ = timed(offset_page, conn, 0, size)
+        off_deep, _ = timed(offset_page, conn, deep, size)
+        key_1, _ = timed(keyset_page, conn, None, size)
+        key_deep, page = timed(keyset_page, conn, anchor, size)
+        assert len(page) == size
+
+        plan = conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT {COLUMNS} FROM verifications WHERE tenant_id = 1 AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT 20",
+            anchor
+        ).fetchall()
+        conn.close()
+
+    print(f"{'':>10} | {'OFFSET (ms)':>12} | {'keyset (ms)':>12}")
+    print(f"{'page 1':>10} | {off_1:>12.3f} | {key_1:>12.3f}")
+    print(f"{'page ' + format(deep, ','):>10} | {off_deep:>12.3f} | {key_deep:>12.3f}")
+    print(f"Keyset plan: {[step[-1] for step in plan]}")
+    print("--- BENCHMARK COMPLETE ---")
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else PAGE_SIZE
+    run(rows, size)
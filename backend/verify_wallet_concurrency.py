@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import select, func, update
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from database import Base
+from models import Tenant, WalletHold, WalletLedger, B2BBatch
+from services.wallet import WalletService, InsufficientFunds
+from services.retry_queue import RetryQueue
+
+"""
+Concurrency: N parallel B2B calls for ONE tenant whose wallet only covers some of them.
+legacy  = check_wallet_balance + (upstream) + ORM read-modify-write deduct (today's b2b_verify)
+atomic  = WalletService reserve -> upstream -> capture/release
+sharded = same, tenant balance spread over wallet_buckets
+Then the stale-hold sweeper: a crashed request's hold is released; holds of a RUNNING
+batch or a queued Protean retry are left alone; a finished retry's hold is settled by its
+outcome.
+Usage: python verify_wallet_concurrency.py [calls] [affordable] [shards]   (default: 500 300 8)
+"""
+
+PRICE = Decimal("15.00")
+FAIL_RATE = 0.1 # Upstream failures must be released, not billed
+
+async def upstream():
+    await asyncio.sleep(random.uniform(0.001, 0.02))
+    return {"status": "SUCCESS" if random.random() > FAIL_RATE else "FAILED"}
+
+async def legacy_call(sessions, tenant_id):
+    async with sessions() as db:
+        tenant = (await db.execute(select(Tenant).where(Tenant.id == tenant_id))).scalar_one()
+        if tenant.wallet_balance < PRICE:
+            return "rejected"
+        res = await upstream()
+        if res["status"] != "SUCCESS":
+            return "failed"
+        tenant = (await db.execute(select(Tenant).where(Tenant.id == tenant_id))).scalar_one()
+        tenant.wallet_balance -= PRICE
+        await db.commit()
+        return "billed"
+
+async def wallet_call(sessions, tenant_id):
+    async with sessions() as db:
+        try:
+            hold_id = await WalletService.reserve(db, tenant_id, PRICE, reference="B2B_BENCH")
+        except InsufficientFunds:
+            return "rejected"
+        res = await upstream()
+        if res["status"] == "SUCCESS" and await WalletService.capture(db, hold_id):
+            return "billed"
+        await WalletService.release(db, hold_id)
+        return "failed"
+
+async def run_mode(tmp, mode, calls, affordable, shards):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, mode)}.db", connect_args={"timeout": 60}, pool_size=calls, max_overflow=0)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    start_balance = PRICE * affordable
+    async with sessions() as db:
+        db.add(Tenant(id=1, name="Hot Tenant", wallet_balance=Decimal("0"), wallet_shards=1))
+        await db.commit()
+        await WalletService.topup(db, 1, start_balance, reference="SEED")
+        if mode == "sharded":
+            await WalletService.set_shards(db, 1, shards)
+
+    call = legacy_call if mode == "legacy" else wallet_call
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*[call(sessions, 1) for _ in range(calls)], return_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    async with sessions() as db:
+        balance = await WalletService.balance(db, 1)
+        ledger_sum = (await db.execute(select(func.sum(WalletLedger.amount)).where(WalletLedger.tenant_id == 1))).scalar()
+        open_holds = (await db.execute(select(func.count()).select_from(WalletHold).where(WalletHold.status == "HELD"))).scalar()
+    await engine.dispose()
+
+    billed = sum(1 for o in outcomes if o == "billed")
+    errors = sum(1 for o in outcomes if isinstance(o, Exception))
+    expected = start_balance - PRICE * billed
+    print(f"{mode:>8} | {billed:>6} | {errors:>6} | {balance:>10} | {expected:>10} | {ledger_sum:>10} | {open_holds:>5} | {calls / elapsed:>8,.0f}")
+    return balance, expected, ledger_sum, open_holds, errors
+
+async def stale_holds(tmp):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'holds')}.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    queue = RetryQueue(path=os.path.join(tmp, "retry.db"), max_attempts=1)
+    async with sessions() as db:
+        db.add(Tenant(id=1, name="Tenant", wallet_balance=Decimal("0"), wallet_shards=1))
+        await db.commit()
+        await WalletService.topup(db, 1, PRICE * 10, reference="SEED")
+        holds = {name: await WalletService.reserve(db, 1, PRICE, reference=name)
+                 for name in ("crashed", "batch", "queued", "retried_ok", "retried_dead", "recent")}
+        db.add(B2BBatch(id="batch-1", tenant_id=1, module_id="pan", price=PRICE, hold_id=holds["batch"], status="RUNNING", total=1))
+        await db.execute(update(WalletHold).where(WalletHold.id != holds["recent"]).values(created_at=datetime(2020, 1, 1)))
+        await db.commit()
+    queue.enqueue("pan", {"pan": "ABCDE1234F"}, hold_id=holds["queued"])
+    for name, finish in (("retried_ok", lambda rid: queue.complete(rid, {"status": "SUCCESS"})), ("retried_dead", lambda rid: queue.reschedule(rid, "down"))):
+        queue.enqueue(name, {}, hold_id=holds[name])
+        (retry_id, _), = queue.claim(name, 1)
+        finish(retry_id) # The worker dies before settling the hold
+
+    async with sessions() as db:
+        settled = await WalletService.release_stale_holds(db, datetime.utcnow() - timedelta(hours=1), retry_queue=queue)
+        status = dict((await db.execute(select(WalletHold.reference, WalletHold.status))).all())
+        balance = await WalletService.balance(db, 1)
+        ledger_sum = (await db.execute(select(func.sum(WalletLedger.amount)).where(WalletLedger.tenant_id == 1))).scalar()
+    await engine.dispose()
+    print(f"Stale holds: {settled} settled -> {status}")
+    assert settled == 3 and status == {"crashed": "RELEASED", "batch": "HELD", "queued": "HELD", "retried_ok": "CAPTURED", "retried_dead": "RELEASED", "recent": "HELD"}
+    assert balance == ledger_sum == PRICE * 6
+
+async def run(calls, affordable, shards):
+    print(f"--- WALLET CONCURRENCY ({calls} parallel calls, wallet covers {affordable}, {shards} shards) ---")
+    print(f"{'mode':>8} | {'billed':>6} | {'errors':>6} | {'balance':>10} | {'expected':>10} | {'ledger':>10} | {'holds':>5} | {'calls/s':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("legacy", "atomic", "sharded"):
+            balance, expected, ledger_sum, open_holds, errors = await run_mode(tmp, mode, calls, affordable, shards)
+            if mode == "legacy":
+                continue
+            assert balance >= 0, "Overdraft"
+            assert balance == expected, "Billed calls don't match the balance"
+            assert ledger_sum == balance, "Ledger doesn't reconcile"
+            assert open_holds == 0 and errors == 0
+        await stale_holds(tmp)
+    print("--- BENCHMARK COMPLETE ---")
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    affordable = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    shards = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    asyncio.run(run(calls, affordable, shards))
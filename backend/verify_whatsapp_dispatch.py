@@ -0,0 +1,211 @@
+import os
+import io
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import contextlib
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+WhatsApp dispatch: replays interleaved Niti conversations (every user sends their messages
+in quick succession) through the real WhatsAppProcessor.handle_message: the NITI clash-check
+query on main.db, the locked session (process_interaction) and the DPDP consent, awaited
+until the audit writer has made it durable.
+- One background task per message (what BackgroundTasks did) lets a user's later messages
+  overtake the NITI message while it waits on the clash check, leaving wrong final states.
+- KeyedDispatcher must apply every user's messages in order (exact final states), run
+  users in parallel up to its worker limit (well above a one-worker dispatcher), and leave
+  no mailbox behind once idle.
+- The same conversations posted to POST /whatsapp/hook must end in the same states.
+- DPDP consents are sealed under the principal's data key, so erasing the principal shreds the consent.
+Usage: python verify_whatsapp_dispatch.py [users] [workers]   (default: 2000 64)
+"""
+
+TMP = tempfile.mkdtemp(prefix="whatsapp-dispatch-")
+os.environ["DATABASE_URL_APP"] = f"sqlite+aiosqlite:///{os.path.join(TMP, 'main.db')}"
+os.environ["DATABASE_URL_COMPLIANCE"] = f"sqlite+aiosqlite:///{os.path.join(TMP, 'compliance_vault.db')}"
+os.environ["AUDIT_SPILL_PATH"] = os.path.join(TMP, "audit_spill.jsonl")
+os.environ.setdefault("PROTEAN_API_KEY", "verify-whatsapp-dispatch") # Past the activation gate
+
+import app as app_module # _interact imports its verifiers from app; load it before timing
+from database import engine_app, engine_compliance, Base, BaseCompliance
+from services.keyed_dispatcher import KeyedDispatcher
+from services.whatsapp_processor import WhatsAppProcessor
+from services.session_store import session_store
+from services.audit_writer import audit_writer
+
+def phone(i):
+    return f"+91 9{i:09d}"
+
+def conversation(i):
+    lang = str(1 + i % 12)
+    if i % 3 == 0: # Corporate: straight to the upload step
+        return ["NITI", lang, "1", "2"]
+    return ["NITI", lang, "1", "1", str(1 + i % 4), "PAID"]
+
+async def expected_states(users, base=10 ** 8):
+    """Final (state, context) of each distinct conversation, played one message at a time."""
+    expected = {}
+    for i in users:
+        key = tuple(conversation(i))
+        if key not in expected:
+            ref = phone(base + len(expected))
+            for msg in key:
+                await WhatsAppProcessor.handle_message(ref, msg, None)
+            session = await session_store.get(ref)
+            expected[key] = (session.state, dict(session.context))
+    return expected
+
+def arrivals(users, rng):
+    """Every user's messages in order, users randomly interleaved."""
+    queues = {i: list(enumerate(conversation(i))) for i in users}
+    order = []
+    while queues:
+        i = rng.choice(list(queues))
+        seq, msg = queues[i].pop(0)
+        order.append((i, seq, msg))
+        if not queues[i]:
+            del queues[i]
+    return order
+
+async def replay(users, submit, rng):
+    """Feeds the processor up to 200 messages per ms. Returns per-user processing order."""
+    seen = {i: [] for i in users}
+    async def job(i, seq, msg):
+        seen[i].append(seq)
+        await WhatsAppProcessor.handle_message(phone(i), msg, None)
+    for n, (i, seq, msg) in enumerate(arrivals(users, rng)):
+        submit(i, job, i, seq, msg)
+        if n % 200 == 199:
+            await asyncio.sleep(0.001)
+    return seen
+
+async def check(users, expected):
+    wrong = 0
+    for i in users:
+        session = await session_store.get(phone(i))
+        state, context = expected[tuple(conversation(i))]
+        wrong += session is None or session.state != state or dict(session.context) != context
+    return wrong
+
+async def main(n, workers):
+    rng = random.Random(7)
+    messages = sum(len(conversation(i)) for i in range(n))
+    print(f"--- WHATSAPP DISPATCH ({n:,} users, {messages:,} messages, {workers} workers, real WhatsAppProcessor) ---")
+    async with engine_app.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with engine_compliance.begin() as conn:
+        await conn.run_sync(BaseCompliance.metadata.create_all)
+    await audit_writer.start()
+    quiet = io.StringIO() # Every message prints its Interakt reply
+    with contextlib.redirect_stdout(quiet):
+        expected = await expected_states(range(n))
+
+    # 1. Before: one task per message
+    naive_users = range(n)
+    tasks = []
+    with contextlib.redirect_stdout(quiet):
+        start = time.perf_counter()
+        seen = await replay(naive_users, lambda i, fn, *args: tasks.append(asyncio.create_task(fn(*args))), rng)
+        await asyncio.gather(*tasks)
+        naive_elapsed = time.perf_counter() - start
+    naive_wrong = await check(naive_users, expected)
+    print(f"{'tasks':>10}: {messages / naive_elapsed:8,.0f} msgs/s, {naive_wrong:,} wrong final states")
+    assert naive_wrong > 0
+
+    # 2. After: keyed dispatcher (and a one-worker run of some users as the serial baseline)
+    serial_users = range(3 * n, 3 * n + min(n, 200))
+    serial = KeyedDispatcher(max_workers=1, max_pending=messages)
+    with contextlib.redirect_stdout(quiet):
+        start = time.perf_counter()
+        await replay(serial_users, serial.submit, rng)
+        await serial.drain()
+        serial_rate = sum(len(conversation(i)) for i in serial_users) / (time.perf_counter() - start)
+    dispatcher = KeyedDispatcher(max_workers=workers, max_pending=messages)
+    users = range(n, 2 * n)
+    with contextlib.redirect_stdout(quiet):
+        start = time.perf_counter()
+        seen = await replay(users, dispatcher.submit, rng)
+        assert await dispatcher.drain(timeout=120) == 0
+        elapsed = time.perf_counter() - start
+    wrong = await check(users, expected)
+    metrics = dispatcher.metrics()
+    print(f"{'dispatcher':>10}: {messages / elapsed:8,.0f} msgs/s ({messages / elapsed / serial_rate:.1f}x one worker at {serial_rate:,.0f} msgs/s), "
+          f"{wrong} wrong final states, peak {metrics['peak_running']} running / {metrics['peak_mailboxes']} mailboxes")
+    assert wrong == 0 and all(s == list(range(len(s))) for s in seen.values())
+    assert metrics["peak_running"] == workers and metrics["processed"] == messages and metrics["errors"] == 0
+    # The handler's awaits (clash check, durable consent) overlap across users
+    assert messages / elapsed > 3 * serial_rate, "Users must run in parallel up to the worker limit"
+
+    # 3. Idle mailboxes are reclaimed
+    assert len(dispatcher) == 0 and not dispatcher._runners and metrics["pending"] == 0 and metrics["running"] == 0
+    print(f"{'idle':>10}: {len(dispatcher)} mailboxes, {len(dispatcher._runners)} runner tasks, {session_store.metrics()['locked_phones']} session locks left")
+
+    # 4. Through the webhook: POST /whatsapp/hook queues on the app's dispatcher
+    import httpx
+    from services.keyed_dispatcher import whatsapp_dispatcher
+    app_module._SCHEMA_READY = asyncio.Event() # Schema created above; no startup restore here
+    app_module._SCHEMA_READY.set()
+    hook_users = range(2 * n, 2 * n + min(n, 200))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+        with contextlib.redirect_stdout(quiet):
+            for i, _, msg in arrivals(hook_users, rng):
+                resp = await client.post("/whatsapp/hook", json={"type": "message_received", "data": {
+                    "customer": {"channel_phone_number": phone(i)}, "message": {"type": "Text", "text": msg}}})
+                assert resp.status_code == 200 and resp.json() == {"status": "processing"}, resp.text
+            assert await whatsapp_dispatcher.drain(timeout=60) == 0
+    hook_wrong = await check(hook_users, expected)
+    print(f"{'webhook':>10}: {len(hook_users)} users via POST /whatsapp/hook -> {hook_wrong} wrong final states")
+    assert hook_wrong == 0 and whatsapp_dispatcher.stats["errors"] == 0
+
+    # 5. A failing message does not stall the user's later messages
+    done = []
+    async def boom():
+        raise RuntimeError("pvc portal down")
+    async def after():
+        done.append(True)
+    with contextlib.redirect_stdout(quiet):
+        dispatcher.submit("9876543210", boom)
+        dispatcher.submit("9876543210", after)
+        await dispatcher.drain()
+    assert done and dispatcher.stats["errors"] == 1
+
+    # 6. Backpressure: beyond max_pending the webhook gets a 503
+    full = KeyedDispatcher(max_workers=2, max_pending=10)
+    accepted = [full.submit(str(i % 3), asyncio.sleep, 0.01) for i in range(12)]
+    await full.drain()
+    assert accepted.count(False) == 2 and full.stats["rejected"] == 2 and len(full) == 0
+    print(f"{'limits':>10}: failed job isolated (errors={dispatcher.stats['errors']}), 12 submits into max_pending=10 -> {accepted.count(False)} rejected")
+
+    # 7. Consents are sealed under the principal's data key: erasure shreds them
+    from sqlalchemy import select
+    from database import SessionLocalCompliance
+    from models import DPDPConsent
+    from services.subject_keys import SubjectKeyService
+    async with SessionLocalCompliance() as db:
+        consents = (await db.execute(select(DPDPConsent.user_id_token, DPDPConsent.signature_token))).all()
+    owner = {}
+    for (_, sig_token), plain in zip(consents, await SubjectKeyService.decrypt_many([c.user_id_token for c in consents])):
+        owner.setdefault(plain, []).append(sig_token)
+    erased = phone(n) # Replayed through the dispatcher above, so it consented
+    assert consents and all(c.user_id_token.startswith("v3$") for c in consents) and erased in owner
+    await SubjectKeyService.erase(erased)
+    assert set(await SubjectKeyService.decrypt_many(owner[erased])) == {"[ERASED]"}
+    assert set(await SubjectKeyService.decrypt_many(owner[phone(n + 1)])) == {"WHATSAPP_DIGITAL_SIGN"}
+    print(f"{'consent':>10}: {len(consents):,} DPDP consents under subject keys; erasing {erased} -> its {len(owner[erased])} consent(s) read [ERASED]")
+
+    await audit_writer.stop()
+    await engine_app.dispose()
+    await engine_compliance.dispose()
+    print("--- WHATSAPP DISPATCH VERIFIED ---")
+
+if __name__ == "__main__":
+    import shutil
+    try:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000, int(sys.argv[2]) if len(sys.argv) > 2 else 64))
+    finally:
+        shutil.rmtree(TMP, ignore_errors=True)